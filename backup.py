@@ -1,55 +1,186 @@
 import asyncio
+import contextlib
 import logging
 import os
 import pathlib
+import shutil
+import tarfile
 from asyncio.exceptions import CancelledError, TimeoutError
-from datetime import datetime
-from typing import List
+from datetime import datetime, timedelta
+from typing import List, NamedTuple, Tuple
 
 import aioshutil
+from botocore.exceptions import ClientError, EndpointConnectionError
 
 import core.models as core_models
 from conf import settings
-from core import aws, utils
+from core import aws, catalog, compression, delta, history, metrics, replication, scheduling, tracing, utils
 from core.analyze import analyze_backup_result, analyze_s3_result
 from core.cluster import utils as cluster_utils
 from core.exceptions import SubprocessException, V8Exception
-from core.process import execute_subprocess_command, execute_v8_command
+from core.process import execute_subprocess_command, execute_subprocess_command_streaming, execute_v8_command
 from utils import postgres
-from utils.asyncio import initialize_event_loop, initialize_semaphore
+from utils.asyncio import JobsBudget, initialize_event_loop, initialize_semaphore
+from utils.common import sizeof_fmt
 from utils.log import configure_logging
 from utils.notification import make_html_table, send_notification
 
 log = logging.getLogger(__name__)
 log_prefix = "Backup"
 
+PG_FORMAT_CUSTOM = "custom"
+PG_FORMAT_DIRECTORY = "directory"
 
-async def replicate_backup(backup_fullpath: str, replication_paths: List[str]):
+_pg_jobs_budget: JobsBudget = None
+_pg_jobs_budget_loop: asyncio.AbstractEventLoop = None
+
+
+def get_pg_jobs_budget() -> JobsBudget:
+    """
+    Бюджет заданий pg_dump, общий для всех одновременно выполняемых резервных копий
+    """
+    global _pg_jobs_budget, _pg_jobs_budget_loop
+    # Бюджет привязан к событийному циклу, поэтому для нового цикла создаётся заново
+    loop = asyncio.get_running_loop()
+    if _pg_jobs_budget is None or _pg_jobs_budget_loop is not loop:
+        _pg_jobs_budget = JobsBudget(settings.BACKUP_PG_JOBS_BUDGET, log_prefix, "pg_dump")
+        _pg_jobs_budget_loop = loop
+    return _pg_jobs_budget
+
+
+class BackupJob(NamedTuple):
+    """
+    Всё, что нужно для создания резервной копии ИБ. Формируется до захвата семафора,
+    чтобы места в семафоре не простаивали, пока из кластера и настроек получаются параметры ИБ
+    """
+
+    ib_name: str
+    # Резервная копия создаётся средствами pg_dump, а не выгрузкой в *.dt файл
+    use_pgdump: bool = False
+    v8_service_path: str = None
+    info_base_user: str = None
+    info_base_pwd: str = None
+    db_host: str = None
+    db_port: str = None
+    db_name: str = None
+    db_user: str = None
+    db_pwd: str = None
+
+
+def _pack_directory(directory: str, archive_filename: str):
+    # Данные в каталоге уже сжаты pg_dump, поэтому архив не сжимается повторно
+    with tarfile.open(archive_filename, "w") as tar:
+        tar.add(directory, arcname=utils.path_leaf(directory))
+    shutil.rmtree(directory)
+
+
+async def replicate_backup(backup_fullpath: str, replication_paths: List[str]) -> List[str]:
+    """
+    Копирует резервную копию во все каталоги репликации одновременно, читая её с диска один раз.
+    Если включен BACKUP_DELTA_ENABLED, выгрузки `*.dt` копируются разностным способом
+    :return: полные пути к успешно созданным репликам или их манифестам
+    """
     backup_filename = utils.path_leaf(backup_fullpath)
+    replication_fullpaths = dict()
     for path in replication_paths:
         try:
             pathlib.Path(path).mkdir(parents=True, exist_ok=True)
             replication_fullpath = os.path.join(path, backup_filename)
             log.info(f"Replicating {backup_fullpath} to {replication_fullpath}")
-            await aioshutil.copyfile(backup_fullpath, replication_fullpath)
+            replication_fullpaths[replication_fullpath] = path
         except Exception as e:
             log.exception(f"Problems while replicating to {path}: {e}")
+    if not replication_fullpaths:
+        return []
+    replicas = []
+    try:
+        if delta.is_delta_candidate(backup_fullpath):
+            results = await delta.replicate_file_delta(backup_fullpath, list(replication_fullpaths.values()))
+            for path, result in results.items():
+                if isinstance(result, BaseException):
+                    log.error(f"Problems while replicating to {path}: {result}", exc_info=result)
+                else:
+                    replicas.append(result)
+            return replicas
+        results = await replication.replicate_file(backup_fullpath, list(replication_fullpaths))
+    except Exception as e:
+        log.exception(f"Problems while replicating {backup_fullpath}: {e}")
+        return []
+    for replication_fullpath, e in results.items():
+        if e is not None:
+            log.error(f"Problems while replicating to {replication_fullpaths[replication_fullpath]}: {e}", exc_info=e)
+        else:
+            replicas.append(replication_fullpath)
+    return replicas
+
+
+async def _index_old_backups(rotation_path: str, infobases_prefixes, backup_retention_days: int) -> List[str]:
+    log.info(f"<{log_prefix}> Removing backups older than {backup_retention_days} days from {rotation_path}")
+    try:
+        index = await asyncio.to_thread(
+            utils.index_old_files_by_infobase, rotation_path, infobases_prefixes, backup_retention_days
+        )
+    except OSError as e:
+        log.error(f"<{log_prefix}> Unable to scan {rotation_path}: {e}")
+        return []
+    files = []
+    for ib_name, ib_files in index.items():
+        log.debug(f"<{ib_name}> {len(ib_files)} expired backups found in {rotation_path}")
+        files += ib_files
+    return files
 
 
-async def rotate_backups(ib_name):
+async def rotate_backups(infobases: List[str], backup_catalog: catalog.BackupCatalog = None):
+    """
+    Удаляет резервные копии указанных ИБ старше BACKUP_RETENTION_DAYS из каталога резервных копий
+    и из путей репликации. Каждый каталог просматривается один раз для всех ИБ,
+    старые копии удаляются параллельно, не более BACKUP_ROTATION_CONCURRENCY одновременно.
+    Если передан каталог резервных копий, к найденным файлам добавляются старые копии из него,
+    а удалённые файлы удаляются из каталога
+    """
     backup_retention_days = settings.BACKUP_RETENTION_DAYS
-    filename_pattern = utils.get_infobase_glob_pattern(ib_name)
+    infobases_prefixes = utils.get_infobases_prefixes(infobases)
     rotate_paths = [settings.BACKUP_PATH]
     if settings.BACKUP_REPLICATION:
         rotate_paths += settings.BACKUP_REPLICATION_PATHS
-    # Удаляет старые резервные копии
-    for rotation_path in rotate_paths:
-        log.info(f"<{ib_name}> Removing backups older than {backup_retention_days} days from {rotation_path}")
-        path = os.path.join(rotation_path, filename_pattern)
-        await utils.remove_old_files_by_pattern(path, backup_retention_days)
+    # Каталоги просматриваются и при включенном каталоге резервных копий: в нём нет копий, созданных
+    # до его включения, и копий, которые не удалось в него записать
+    indexes = await asyncio.gather(
+        *[_index_old_backups(path, infobases_prefixes, backup_retention_days) for path in rotate_paths]
+    )
+    files_to_remove = [f for files in indexes for f in files]
+    if backup_catalog is not None:
+        expiration_datetime = datetime.now() - timedelta(days=backup_retention_days)
+        # Реплики из путей, которые больше не указаны в настройках, находятся только по каталогу
+        cataloged_files = backup_catalog.get_expired_files(infobases, expiration_datetime)
+        scanned_files = {os.path.abspath(f) for f in files_to_remove}
+        files_to_remove += [f for f in cataloged_files if os.path.abspath(f) not in scanned_files]
+    removed = await utils.remove_files(files_to_remove, settings.BACKUP_ROTATION_CONCURRENCY)
+    if backup_catalog is not None:
+        backup_catalog.forget_files(removed)
+    log.info(f"<{log_prefix}> {len(removed)} expired backups removed")
+
+
+async def _collect_delta_garbage(path: str):
+    try:
+        removed_count, removed_size = await asyncio.to_thread(delta.collect_garbage, path)
+    except OSError as e:
+        log.error(f"<{log_prefix}> Unable to remove unreferenced chunks from {path}: {e}")
+        return
+    log.info(
+        f"<{log_prefix}> Removed {removed_count} unreferenced chunks from {path}, {sizeof_fmt(removed_size)} freed"
+    )
 
 
-async def _backup_v8(ib_name: str, *args, **kwargs) -> core_models.InfoBaseBackupTaskResult:
+async def collect_delta_garbage():
+    """
+    Удаляет из путей репликации блоки разностных копий, на которые после ротации не ссылается ни один манифест.
+    Выполняется после завершения репликации, чтобы не удалить блоки копии, манифест которой ещё не записан
+    """
+    await asyncio.gather(*[_collect_delta_garbage(path) for path in settings.BACKUP_REPLICATION_PATHS])
+
+
+async def _backup_v8(ib_name: str, job: BackupJob, **kwargs) -> core_models.InfoBaseBackupTaskResult:
     """
     1. Блокирует фоновые задания и новые сеансы
     2. Принудительно завершает текущие сеансы
@@ -69,7 +200,6 @@ async def _backup_v8(ib_name: str, *args, **kwargs) -> core_models.InfoBaseBacku
     # Код блокировки новых сеансов
     permission_code = settings.V8_PERMISSION_CODE
     # Формирует команду для выгрузки
-    info_base_user, info_base_pwd = utils.get_info_base_credentials(ib_name)
     ib_and_time_str = utils.get_ib_and_time_string(ib_name)
     dt_filename = os.path.join(
         settings.BACKUP_PATH,
@@ -78,9 +208,9 @@ async def _backup_v8(ib_name: str, *args, **kwargs) -> core_models.InfoBaseBacku
     log_filename = os.path.join(settings.LOG_PATH, utils.append_file_extension_to_string(ib_and_time_str, "log"))
     # https://its.1c.ru/db/v838doc#bookmark:adm:TI000000526
     v8_command = (
-        rf'"{utils.get_1cv8_service_full_path()}" '
+        rf'"{job.v8_service_path}" '
         rf"DESIGNER /S {cluster_utils.get_server_agent_address()}\{ib_name} "
-        rf'/N"{info_base_user}" /P"{info_base_pwd}" '
+        rf'/N"{job.info_base_user}" /P"{job.info_base_pwd}" '
         rf"/Out {log_filename} -NoTruncate "
         rf'/UC "{permission_code}" '
         rf"/DumpIB {dt_filename}"
@@ -110,24 +240,48 @@ async def _backup_v8(ib_name: str, *args, **kwargs) -> core_models.InfoBaseBacku
     return core_models.InfoBaseBackupTaskResult(ib_name, True, dt_filename)
 
 
-async def _backup_pgdump(
-    ib_name: str, db_server: str, db_name: str, db_user: str, *args, **kwargs
-) -> core_models.InfoBaseBackupTaskResult:
+def _build_pgdump_command(
+    pg_dump_path: str,
+    db_host: str,
+    db_port: str,
+    db_user: str,
+    db_name: str,
+    blobs: str,
+    dump_path: str,
+    log_filename: str,
+    jobs: int = None,
+) -> str:
+    """
+    Формирует команду pg_dump. Если `dump_path` не указан, копия выводится в stdout, а в лог-файл пишется только stderr
+    """
+    if jobs is None:
+        format_args = f"--format={PG_FORMAT_CUSTOM}"
+    else:
+        format_args = f"--format={PG_FORMAT_DIRECTORY} --jobs={jobs}"
+    if dump_path is None:
+        output_args = f"--dbname={db_name} 2> {log_filename}"
+    else:
+        output_args = f"--file={dump_path} --dbname={db_name} > {log_filename} 2>&1"
+    return (
+        rf'"{pg_dump_path}" '
+        rf"--host={db_host} --port={db_port} --username={db_user} "
+        rf"{format_args} --{blobs} --verbose "
+        rf"{output_args}"
+    )
+
+
+async def _backup_pgdump(job: BackupJob, s3c=None) -> core_models.InfoBaseBackupTaskResult:
     """
     Выполняет резервное копирование ИБ средствами СУБД PostgreSQL при помощи утилиты pg_dump
-    1. Проверяет, использует ли ИБ СУБД PostgreSQL
-    2. Проверяет, есть ли подходящие учетные данные для подключения к базе данных
-    3. Подключается к СУБД, чтобы узнать версию
-    4. Создаёт резервную копию средствами pg_dump
-    :param ib_name:
+    1. Подключается к СУБД, чтобы узнать версию
+    2. Создаёт резервную копию средствами pg_dump
+    :param job: параметры резервного копирования, подготовленные в `resolve_backup_job`
+    :param s3c: клиент S3. Если передан и включен BACKUP_PG_STREAM_TO_S3, копия загружается в S3 по мере создания
     :return:
     """
+    ib_name = job.ib_name
+    db_host, db_port, db_name, db_user, db_pwd = job.db_host, job.db_port, job.db_name, job.db_user, job.db_pwd
     log.info(f"<{ib_name}> Start pgdump")
-    try:
-        db_host, db_port, db_pwd = postgres.prepare_postgres_connection_vars(db_server, db_user)
-    except (ValueError, KeyError) as e:
-        log.error(f"<{ib_name}> {str(e)}")
-        return core_models.InfoBaseBackupTaskResult(ib_name, False)
     backup_retries = settings.BACKUP_RETRIES_PG
     for i in range(0, backup_retries + 1):
         try:
@@ -141,81 +295,243 @@ async def _backup_pgdump(
                 log.error(f"<{ib_name}> Postgres version check failed, retrying")
 
     ib_and_time_str = utils.get_ib_and_time_string(ib_name)
-    backup_filename = os.path.join(
-        settings.BACKUP_PATH,
-        utils.append_file_extension_to_string(ib_and_time_str, "pgdump"),
-    )
+    is_directory_format = settings.BACKUP_PG_FORMAT == PG_FORMAT_DIRECTORY
+    if is_directory_format:
+        # Каталог не должен попадать под шаблон имени файлов резервных копий, поэтому в его имени нет точки
+        dump_path = os.path.join(settings.BACKUP_PATH, f"{ib_and_time_str}_pgdump")
+        backup_filename = os.path.join(
+            settings.BACKUP_PATH,
+            utils.append_file_extension_to_string(ib_and_time_str, "pgdump.tar"),
+        )
+    else:
+        dump_path = backup_filename = os.path.join(
+            settings.BACKUP_PATH,
+            utils.append_file_extension_to_string(ib_and_time_str, "pgdump"),
+        )
     log_filename = os.path.join(settings.LOG_PATH, utils.append_file_extension_to_string(ib_and_time_str, "log"))
     pg_dump_path = os.path.join(settings.PG_BIN_PATH, "pg_dump.exe")
-    pgdump_command = (
-        rf'"{pg_dump_path}" '
-        rf"--host={db_host} --port={db_port} --username={db_user} "
-        rf"--format=custom --{blobs} --verbose "
-        rf"--file={backup_filename} --dbname={db_name} > {log_filename} 2>&1"
-    )
     pgdump_env = os.environ.copy()
     pgdump_env["PGPASSWORD"] = db_pwd
-    log.debug(f"<{ib_name}> Created pgdump command [{pgdump_command}]")
+    # Каталог pg_dump создаёт только на диске, поэтому в S3 может выводиться только копия в формате custom
+    is_streaming = s3c is not None and settings.BACKUP_PG_STREAM_TO_S3 and not is_directory_format
+    # Локальная копия нужна для хранения на диске и для репликации
+    keep_local = not is_streaming or settings.BACKUP_PG_STREAM_KEEP_LOCAL or settings.BACKUP_REPLICATION
+    aws_result = None
     # Делает резервную копию базы данных в *.pgdump файл
     # Добавляет 1 к количеству повторных попыток, потому что одну попытку всегда нужно делать
     for i in range(0, backup_retries + 1):
         try:
-            await execute_subprocess_command(ib_name, pgdump_command, log_filename, env=pgdump_env)
+            if is_streaming:
+                pgdump_command = _build_pgdump_command(
+                    pg_dump_path, db_host, db_port, db_user, db_name, blobs, None, log_filename
+                )
+                log.debug(f"<{ib_name}> Created pgdump command [{pgdump_command}]")
+
+                async def upload_pgdump_output(stdout, wait_pgdump):
+                    return await aws.upload_stream_to_s3(
+                        ib_name,
+                        stdout,
+                        utils.path_leaf(backup_filename),
+                        s3c,
+                        backup_filename if keep_local else None,
+                        wait_pgdump,
+                    )
+
+                aws_result = await execute_subprocess_command_streaming(
+                    ib_name, pgdump_command, log_filename, upload_pgdump_output, env=pgdump_env
+                )
+            elif is_directory_format:
+                # Количество заданий выделяется из бюджета, общего для всех одновременно создаваемых копий
+                async with get_pg_jobs_budget().reserve(settings.BACKUP_PG_JOBS) as jobs:
+                    # pg_dump не создаёт копию в существующий каталог, он мог остаться от предыдущей попытки
+                    await aioshutil.rmtree(dump_path, ignore_errors=True)
+                    pgdump_command = _build_pgdump_command(
+                        pg_dump_path, db_host, db_port, db_user, db_name, blobs, dump_path, log_filename, jobs
+                    )
+                    log.debug(f"<{ib_name}> Created pgdump command [{pgdump_command}]")
+                    await execute_subprocess_command(ib_name, pgdump_command, log_filename, env=pgdump_env)
+            else:
+                pgdump_command = _build_pgdump_command(
+                    pg_dump_path, db_host, db_port, db_user, db_name, blobs, dump_path, log_filename
+                )
+                log.debug(f"<{ib_name}> Created pgdump command [{pgdump_command}]")
+                await execute_subprocess_command(ib_name, pgdump_command, log_filename, env=pgdump_env)
             break
-        except SubprocessException:
+        except (SubprocessException, ClientError, EndpointConnectionError):
             # Если количество попыток исчерпано, но ошибка по прежнему присутствует
             if i == backup_retries:
                 log.error(f"<{ib_name}> Backup failed, retries exceeded")
                 return core_models.InfoBaseBackupTaskResult(ib_name, False)
             else:
                 log.error(f"<{ib_name}> Backup failed, retrying")
-    return core_models.InfoBaseBackupTaskResult(ib_name, True, backup_filename)
+    if is_directory_format:
+        # Каталог упаковывается в один файл для репликации и загрузки в S3
+        log.info(f"<{ib_name}> Packing {dump_path} to {backup_filename}")
+        await asyncio.to_thread(_pack_directory, dump_path, backup_filename)
+    return core_models.InfoBaseBackupTaskResult(
+        ib_name, True, backup_filename if keep_local else "", aws_result=aws_result
+    )
+
+
+async def compress_backup_result(backup_result: core_models.InfoBaseBackupTaskResult):
+    """
+    Сжимает резервную копию перед репликацией и загрузкой в S3.
+    Если копия сжата, в результате резервного копирования подменяется имя файла
+    """
+    if not compression.is_compression_available():
+        log.error(f"<{backup_result.infobase_name}> Compression is enabled, but `zstandard` package is not installed")
+        return
+    compression_result = await compression.compress_backup(backup_result.infobase_name, backup_result.backup_filename)
+    if compression_result is not None:
+        backup_result.backup_filename = compression_result.compressed_filename
+        backup_result.compression = compression_result
 
 
-async def _backup_info_base(ib_name: str) -> core_models.InfoBaseBackupTaskResult:
-    cci = cluster_utils.get_cluster_controller_class()()
-    ib_info = cci.get_info_base(ib_name)
-    if settings.BACKUP_PG and postgres.dbms_is_postgres(ib_info.dbms):
-        result = await _backup_pgdump(ib_name, ib_info.db_server, ib_info.db_name, ib_info.db_user)
+async def resolve_backup_job(ib_name: str) -> BackupJob:
+    """
+    Получает параметры ИБ из кластера и учётные данные из настроек.
+    Если ИБ настроена неправильно, выбрасывает исключение, и резервное копирование ИБ не выполняется
+    """
+    if settings.BACKUP_PG:
+        cci = cluster_utils.get_cluster_controller_class()()
+        ib_info = await cci.aget_info_base(ib_name)
+        if postgres.dbms_is_postgres(ib_info.dbms):
+            db_host, db_port, db_pwd = postgres.prepare_postgres_connection_vars(ib_info.db_server, ib_info.db_user)
+            return BackupJob(
+                ib_name,
+                use_pgdump=True,
+                db_host=db_host,
+                db_port=db_port,
+                db_name=ib_info.db_name,
+                db_user=ib_info.db_user,
+                db_pwd=db_pwd,
+            )
+    info_base_user, info_base_pwd = utils.get_info_base_credentials(ib_name)
+    return BackupJob(ib_name, info_base_user=info_base_user, info_base_pwd=info_base_pwd)
+
+
+async def preflight_backups(
+    infobases: List[str],
+) -> Tuple[List[BackupJob], List[core_models.InfoBaseBackupTaskResult]]:
+    """
+    Одновременно готовит параметры резервного копирования всех ИБ до захвата семафора.
+    Путь к 1cv8 ищется один раз для всех ИБ
+    :return: готовые к выполнению задания в порядке `infobases` и неуспешные результаты для отклонённых ИБ
+    """
+    with tracing.span("preflight"):
+        v8_service_path, *resolved = await asyncio.gather(
+            asyncio.to_thread(utils.get_1cv8_service_full_path),
+            *[resolve_backup_job(ib_name) for ib_name in infobases],
+            return_exceptions=True,
+        )
+    jobs = []
+    rejected = []
+    for ib_name, job in zip(infobases, resolved, strict=True):
+        if not isinstance(job, Exception) and not job.use_pgdump:
+            # Без пути к 1cv8 выгрузка в *.dt файл невозможна
+            if isinstance(v8_service_path, Exception):
+                job = v8_service_path
+            else:
+                job = job._replace(v8_service_path=v8_service_path)
+        if isinstance(job, Exception):
+            log.error(f"<{ib_name}> Backup rejected by preflight check: {job!r}")
+            rejected.append(core_models.InfoBaseBackupTaskResult(ib_name, False))
+        else:
+            jobs.append(job)
+    log.info(f"<{log_prefix}> Preflight check passed for {len(jobs)} of {len(infobases)} infobases")
+    return jobs, rejected
+
+
+async def _backup_info_base(job: BackupJob, s3c=None) -> core_models.InfoBaseBackupTaskResult:
+    if job.use_pgdump:
+        result = await _backup_pgdump(job, s3c=s3c)
     else:
-        result = await cluster_utils.com_func_wrapper(_backup_v8, ib_name)
+        result = await cluster_utils.com_func_wrapper(_backup_v8, job.ib_name, job=job)
     return result
 
 
-async def backup_info_base(ib_name: str, semaphore: asyncio.Semaphore) -> core_models.InfoBaseBackupTaskResult:
-    async with semaphore:
-        try:
-            result = await _backup_info_base(ib_name)
-        except Exception:
-            log.exception(f"<{ib_name}> Unknown exception occurred in `_backup_info_base` coroutine")
-            return core_models.InfoBaseBackupTaskResult(ib_name, False)
-        try:
-            # Ротация бэкапов, удаляет старые
-            await rotate_backups(ib_name)
-        except Exception:
-            log.exception(f"<{ib_name}> Unknown exception occurred in `rotate_backups` coroutine")
-        return result
+async def backup_info_base(
+    job: BackupJob, semaphore: asyncio.Semaphore, s3c=None
+) -> core_models.InfoBaseBackupTaskResult:
+    ib_name = job.ib_name
+    with tracing.span("backup", ib_name):
+        async with tracing.wait(semaphore) as waited:
+            datetime_start = datetime.now()
+            try:
+                result = await _backup_info_base(job, s3c)
+            except Exception:
+                log.exception(f"<{ib_name}> Unknown exception occurred in `_backup_info_base` coroutine")
+                return core_models.InfoBaseBackupTaskResult(ib_name, False, wait_duration=waited.duration)
+            result.duration = (datetime.now() - datetime_start).total_seconds()
+            result.wait_duration = waited.duration
+            return result
+
+
+async def compress_info_base(
+    backup_result: core_models.InfoBaseBackupTaskResult, semaphore: asyncio.Semaphore
+) -> core_models.InfoBaseBackupTaskResult:
+    if not (settings.BACKUP_COMPRESSION and backup_result.succeeded and backup_result.backup_filename):
+        return backup_result
+    # Копия, загруженная в S3 во время создания, не сжимается, чтобы в S3, на диске, в репликах
+    # и в каталоге резервных копий был один и тот же файл
+    if backup_result.aws_result is not None:
+        log.info(f"<{backup_result.infobase_name}> Backup was streamed to S3 uncompressed, skipping compression")
+        return backup_result
+    with tracing.span("compression", backup_result.infobase_name):
+        async with tracing.wait(semaphore):
+            try:
+                await compress_backup_result(backup_result)
+            except Exception:
+                log.exception(
+                    f"<{backup_result.infobase_name}> Unknown exception occurred in `compress_backup_result` coroutine"
+                )
+    return backup_result
+
+
+async def backup_and_compress_info_base(
+    job: BackupJob,
+    backup_semaphore: asyncio.Semaphore,
+    compression_semaphore: asyncio.Semaphore = None,
+    s3c=None,
+) -> core_models.InfoBaseBackupTaskResult:
+    """
+    Создаёт резервную копию ИБ и сжимает её.
+    Место в семафоре резервного копирования освобождается до начала сжатия,
+    сжатие ограничивается собственным семафором
+    """
+    backup_result = await backup_info_base(job, backup_semaphore, s3c)
+    if compression_semaphore is not None:
+        await compress_info_base(backup_result, compression_semaphore)
+    return backup_result
 
 
 async def replicate_info_base(backup_result: core_models.InfoBaseBackupTaskResult, semaphore: asyncio.Semaphore):
-    async with semaphore:
-        try:
-            if settings.BACKUP_REPLICATION and backup_result.succeeded:
-                await replicate_backup(backup_result.backup_filename, settings.BACKUP_REPLICATION_PATHS)
-        except Exception:
-            log.exception(f"<{backup_result.infobase_name}> Unknown exception occurred in `replicate_backup` coroutine")
+    with tracing.span("replication", backup_result.infobase_name):
+        async with tracing.wait(semaphore):
+            try:
+                if settings.BACKUP_REPLICATION and backup_result.succeeded:
+                    backup_result.replicas = await replicate_backup(
+                        backup_result.backup_filename, settings.BACKUP_REPLICATION_PATHS
+                    )
+            except Exception:
+                log.exception(
+                    f"<{backup_result.infobase_name}> Unknown exception occurred in `replicate_backup` coroutine"
+                )
 
 
 def create_aws_upload_task(
     backup_result: core_models.InfoBaseBackupTaskResult,
     aws_semaphore: asyncio.Semaphore,
+    s3c=None,
 ):
-    if settings.AWS_ENABLED and backup_result.succeeded:
+    # Копия, загруженная в S3 во время создания, повторно не загружается
+    if settings.AWS_ENABLED and backup_result.succeeded and backup_result.aws_result is None:
         return asyncio.create_task(
             aws.upload_infobase_to_s3(
                 backup_result.infobase_name,
                 backup_result.backup_filename,
                 aws_semaphore,
+                s3c,
             ),
             name=f"Task :: Upload {backup_result.infobase_name} to S3",
         )
@@ -232,6 +548,51 @@ def create_backup_replication_task(
         )
 
 
+async def record_to_catalog(
+    backup_catalog: catalog.BackupCatalog,
+    backup_result: core_models.InfoBaseBackupTaskResult,
+    aws_upload_task: asyncio.Task = None,
+    backup_replication_task: asyncio.Task = None,
+) -> bool:
+    """
+    Записывает резервную копию ИБ в каталог, как только завершены её загрузка в S3 и репликация,
+    чтобы при аварийном завершении работы в каталоге остались все уже созданные копии
+    :return: True, если резервная копия записана в каталог
+    """
+    pending = [t for t in (aws_upload_task, backup_replication_task) if t is not None]
+    if pending:
+        await asyncio.wait(pending)
+    aws_result = backup_result.aws_result
+    if aws_upload_task is not None and not aws_upload_task.cancelled() and aws_upload_task.exception() is None:
+        aws_result = aws_upload_task.result()
+    return await catalog.record_backup(backup_catalog, backup_result, aws_result)
+
+
+def plan_backups(infobases: List[str], backup_catalog: catalog.BackupCatalog = None) -> scheduling.BackupSchedule:
+    """
+    Составляет расписание резервного копирования по длительности предыдущих копий из истории запусков,
+    а если история не ведётся, то из каталога резервных копий.
+    Если не используется ни то, ни другое, ИБ упорядочиваются только по приоритету и ограничениям по времени
+    """
+    durations = dict()
+    if settings.HISTORY_ENABLED:
+        try:
+            with history.open_history() as run_history:
+                durations = run_history.get_average_durations(
+                    infobases, history.PHASE_BACKUP, settings.BACKUP_SCHEDULE_HISTORY_SIZE
+                )
+        except Exception:
+            log.exception(f"<{log_prefix}> Unable to get backup durations from run history")
+    elif backup_catalog is not None:
+        try:
+            durations = backup_catalog.get_average_durations(infobases, settings.BACKUP_SCHEDULE_HISTORY_SIZE)
+        except Exception:
+            log.exception(f"<{log_prefix}> Unable to get backup durations from catalog")
+    schedule = scheduling.plan_backups(infobases, durations, settings.BACKUP_CONCURRENCY)
+    scheduling.log_schedule(schedule, log_prefix)
+    return schedule
+
+
 def analyze_results(
     infobases: List[str],
     backup_result: List[core_models.InfoBaseBackupTaskResult],
@@ -260,12 +621,19 @@ def send_email_notification(
 
 
 async def main():
+    tracing.start_tracing()
+    metrics.start_run(log_prefix)
     try:
-        info_bases = utils.get_info_bases()
+        info_bases = await utils.aget_info_bases()
         backup_semaphore = initialize_semaphore(settings.BACKUP_CONCURRENCY, log_prefix, "backup")
         aws_semaphore = (
             initialize_semaphore(settings.AWS_CONCURRENCY, log_prefix, "AWS") if settings.AWS_ENABLED else None
         )
+        compression_semaphore = (
+            initialize_semaphore(settings.BACKUP_COMPRESSION_CONCURRENCY, log_prefix, "backup compression")
+            if settings.BACKUP_COMPRESSION
+            else None
+        )
         backup_replication_semaphore = (
             initialize_semaphore(
                 settings.BACKUP_REPLICATION_CONCURRENCY,
@@ -276,34 +644,93 @@ async def main():
             else None
         )
 
-        backup_results = []
-        aws_results = []
-
-        backup_coroutines = [backup_info_base(ib_name, backup_semaphore) for ib_name in info_bases]
-        backup_datetime_start = datetime.now()
-        aws_tasks = []
-        aws_datetime_start = None
-        backup_replication_tasks = []
-        for backup_coro in asyncio.as_completed(backup_coroutines):
-            backup_result = await backup_coro
-            backup_results.append(backup_result)
-            if aws_datetime_start is None:
-                aws_datetime_start = datetime.now()
-            aws_upload_task = create_aws_upload_task(backup_result, aws_semaphore)
-            if aws_upload_task:
-                aws_tasks.append(aws_upload_task)
-            backup_replication_task = create_backup_replication_task(backup_result, backup_replication_semaphore)
-            if backup_replication_task:
-                backup_replication_tasks.append(backup_replication_task)
-        backup_datetime_finish = datetime.now()
-
-        if aws_tasks:
-            await asyncio.wait(aws_tasks)
-            aws_results = [task.result() for task in aws_tasks]
-        aws_datetime_finish = datetime.now()
-
-        if backup_replication_tasks:
-            await asyncio.wait(backup_replication_tasks)
+        # Каталог резервных копий открывается на всё время работы: ротация и очистка бакета выполняются
+        # запросами к нему, а каждая резервная копия записывается в него после завершения загрузки и репликации
+        with catalog.open_catalog() if settings.BACKUP_CATALOG_ENABLED else contextlib.nullcontext() as backup_catalog:
+            # Один клиент S3 с общим пулом соединений используется всеми загрузками и очисткой бакета,
+            # закрывается после их завершения
+            async with aws.s3_client() if settings.AWS_ENABLED else contextlib.nullcontext() as s3c:
+                aws_results = []
+
+                backup_schedule = plan_backups(info_bases, backup_catalog)
+                backup_datetime_start = datetime.now()
+                # Неправильно настроенные ИБ отклоняются до того, как займут место в семафоре
+                backup_jobs, backup_results = await preflight_backups(backup_schedule.infobases)
+                # Задачи создаются в порядке расписания, в этом же порядке они получают место в семафоре.
+                # Загрузка и репликация начинаются после сжатия копии
+                backup_tasks = [
+                    asyncio.create_task(
+                        backup_and_compress_info_base(job, backup_semaphore, compression_semaphore, s3c)
+                    )
+                    for job in backup_jobs
+                ]
+                backup_finish = dict()
+                aws_tasks = []
+                aws_datetime_start = None
+                backup_replication_tasks = []
+                catalog_tasks = []
+                for backup_coro in asyncio.as_completed(backup_tasks):
+                    backup_result = await backup_coro
+                    backup_results.append(backup_result)
+                    backup_finish[backup_result.infobase_name] = datetime.now()
+                    if aws_datetime_start is None:
+                        aws_datetime_start = datetime.now()
+                    aws_upload_task = create_aws_upload_task(backup_result, aws_semaphore, s3c)
+                    if aws_upload_task:
+                        aws_tasks.append(aws_upload_task)
+                    backup_replication_task = create_backup_replication_task(
+                        backup_result, backup_replication_semaphore
+                    )
+                    if backup_replication_task:
+                        backup_replication_tasks.append(backup_replication_task)
+                    if backup_catalog is not None:
+                        catalog_tasks.append(
+                            asyncio.create_task(
+                                record_to_catalog(
+                                    backup_catalog, backup_result, aws_upload_task, backup_replication_task
+                                ),
+                                name=f"Task :: Record backup {backup_result.infobase_name} to catalog",
+                            )
+                        )
+                backup_datetime_finish = datetime.now()
+                scheduling.log_schedule_result(backup_schedule, backup_finish, backup_datetime_start, log_prefix)
+                # Ротация бэкапов, удаляет старые.
+                # Выполняется один раз для всех ИБ одновременно с загрузкой и репликацией
+                rotation_task = asyncio.create_task(
+                    rotate_backups(info_bases, backup_catalog), name="Task :: Rotate backups"
+                )
+
+                aws_results = [r.aws_result for r in backup_results if r.aws_result is not None]
+                if aws_tasks:
+                    await asyncio.wait(aws_tasks)
+                    aws_results += [task.result() for task in aws_tasks]
+                aws_datetime_finish = datetime.now()
+
+                if settings.AWS_ENABLED:
+                    # Старые копии удаляются только для тех ИБ, новые копии которых успешно загружены
+                    await aws.remove_old_backups_from_s3(
+                        [r.infobase_name for r in aws_results if r.succeeded], s3c, backup_catalog
+                    )
+                    if settings.BACKUP_DELTA_ENABLED:
+                        await aws.remove_unreferenced_chunks_from_s3(s3c)
+
+            if backup_replication_tasks:
+                await asyncio.wait(backup_replication_tasks)
+
+            try:
+                await rotation_task
+            except Exception:
+                log.exception(f"<{log_prefix}> Unknown exception occurred in `rotate_backups` coroutine")
+
+            if settings.BACKUP_DELTA_ENABLED and settings.BACKUP_REPLICATION:
+                await collect_delta_garbage()
+
+            if catalog_tasks:
+                recorded = await asyncio.gather(*catalog_tasks, return_exceptions=True)
+                for e in recorded:
+                    if isinstance(e, Exception):
+                        log.error(f"<{log_prefix}> Unknown exception occurred in `record_to_catalog` coroutine: {e!r}")
+                log.info(f"<{log_prefix}> {recorded.count(True)} backups recorded to {backup_catalog.filename}")
 
         analyze_results(
             info_bases,
@@ -317,9 +744,15 @@ async def main():
 
         send_email_notification(backup_results, aws_results)
 
+        cluster_utils.get_cluster_controller_class().log_statistics()
+
         log.info(f"<{log_prefix}> Done")
     except Exception:
         log.exception(f"<{log_prefix}> Unknown exception occurred in main coroutine")
+    finally:
+        cluster_utils.get_cluster_controller_class().shutdown()
+        tracing.write_trace(log_prefix)
+        metrics.write_textfile()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,87 @@
+"""
+Замер скорости разбора вывода `rac session list` на 10000 сеансов.
+
+Запуск из корня репозитория:
+    python -m benchmarks.rac_parse
+"""
+
+import os
+import timeit
+
+os.environ.setdefault("1CV8MGMT_SETTINGS_MODULE", "tests.settings")
+
+from core.cluster.models import V8CSession  # noqa: E402
+from core.cluster.rac import ClusterRACControler  # noqa: E402
+
+SESSIONS_COUNT = 10000
+REPEAT = 5
+
+SESSION_TEMPLATE = """session                          : 0c1d6b5e-0000-4000-8000-{i:012d}
+session-id                       : {i}
+infobase                         : 8a0d2b1c-0000-4000-8000-{ib:012d}
+connection                       : 00000000-0000-0000-0000-000000000000
+process                          : 7a2c4e8f-1b3d-4f5a-9c8e-0d1f2a3b4c5d
+user-name                        : Пользователь {i}
+host                             : workstation-{i}
+app-id                           : 1CV8C
+locale                           : ru_RU
+started-at                       : 2024-01-15T09:12:33
+last-active-at                   : 2024-01-15T11:45:02
+hibernate                        : no
+passive-session-hibernate-time   : 1200
+hibernate-session-terminate-time : 86400
+blocked-by-dbms                  : 0
+blocked-by-ls                    : 0
+bytes-all                        : 1048576
+bytes-last-5min                  : 4096
+calls-all                        : 2048
+calls-last-5min                  : 12
+dbms-bytes-all                   : 524288
+dbms-bytes-last-5min             : 0
+db-proc-info                     :
+db-proc-took                     : 0
+db-proc-took-at                  :
+duration-all                     : 35000
+duration-all-dbms                : 12000
+duration-current                 : 0
+duration-current-dbms            : 0
+duration-last-5min               : 150
+duration-last-5min-dbms          : 40
+memory-current                   : 0
+memory-last-5min                 : 65536
+memory-total                     : 8388608
+read-current                     : 0
+read-last-5min                   : 0
+read-total                       : 16384
+write-current                    : 0
+write-last-5min                  : 0
+write-total                      : 8192
+duration-current-service         : 0
+duration-last-5min-service       : 0
+duration-all-service             : 120
+current-service-name             :
+cpu-time-current                 : 0
+cpu-time-last-5min               : 30
+cpu-time-total                   : 9000
+data-separation                  : ''
+client-ip                        : 10.0.0.{ip}
+
+"""
+
+
+def build_output(sessions_count: int) -> str:
+    return "".join(SESSION_TEMPLATE.format(i=i, ib=i % 50, ip=i % 250) for i in range(sessions_count))
+
+
+def main():
+    output = build_output(SESSIONS_COUNT)
+    rac = ClusterRACControler()
+    sessions = rac._rac_output_to_objects(output, V8CSession)
+    assert len(sessions) == SESSIONS_COUNT
+    timings = timeit.repeat(lambda: rac._rac_output_to_objects(output, V8CSession), number=1, repeat=REPEAT)
+    print(f"Parsed {SESSIONS_COUNT} sessions ({len(output) / 1024 / 1024:.1f} MiB of rac output)")
+    print(f"best: {min(timings) * 1000:.1f} ms; mean: {sum(timings) / len(timings) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
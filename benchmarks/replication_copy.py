@@ -0,0 +1,113 @@
+"""
+Сравнение способов копирования резервной копии при репликации на файлах размером в несколько ГБ.
+
+Запуск из корня репозитория:
+    python -m benchmarks.replication_copy --size 4 --path /mnt/replica
+
+Исходный файл создаётся в каталоге `--path`, поэтому reflink и `copy_file_range` работают только если
+файловая система каталога их поддерживает. Для честного сравнения между замерами стоит сбрасывать
+страничный кэш (`echo 3 > /proc/sys/vm/drop_caches`), иначе исходный файл читается из памяти
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+
+os.environ.setdefault("1CV8MGMT_SETTINGS_MODULE", "tests.settings")
+
+import aioshutil  # noqa: E402
+
+from conf import settings  # noqa: E402
+from core import replication  # noqa: E402
+from utils.common import sizeof_fmt  # noqa: E402
+
+GiB = 1024 * 1024 * 1024
+WRITE_BLOCK_SIZE = 64 * 1024 * 1024
+
+
+def create_source(filename: str, size: int):
+    block = os.urandom(WRITE_BLOCK_SIZE)
+    with open(filename, "wb") as f:
+        written = 0
+        while written < size:
+            written += f.write(block[: size - written])
+
+
+def buffered_copy(source: str, destinations: list):
+    for destination in destinations:
+        with open(source, "rb") as src, open(destination, "wb") as dst:
+            shutil.copyfileobj(src, dst, settings.BACKUP_REPLICATION_BLOCK_SIZE)
+
+
+def aioshutil_copy(source: str, destinations: list):
+    async def copy():
+        for destination in destinations:
+            await aioshutil.copyfile(source, destination)
+
+    asyncio.run(copy())
+
+
+def fan_out_copy(source: str, destinations: list):
+    asyncio.run(replication.fan_out_copy(source, destinations))
+
+
+def zero_copy(strategy_name: str):
+    strategy = dict(replication.ZERO_COPY_STRATEGIES).get(strategy_name)
+    if strategy is None:
+        return None
+
+    def copy(source: str, destinations: list):
+        with mock.patch.object(replication, "ZERO_COPY_STRATEGIES", [(strategy_name, strategy)]):
+            for destination in destinations:
+                if replication._zero_copy_file(source, destination) is None:
+                    raise OSError(f"{strategy_name} is not supported")
+
+    return copy
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=float, default=2, help="размер исходного файла, ГБ")
+    parser.add_argument("--replicas", type=int, default=2, help="количество путей репликации")
+    parser.add_argument("--path", default=None, help="каталог для файлов, по умолчанию временный каталог")
+    args = parser.parse_args()
+
+    size = int(args.size * GiB)
+    strategies = [
+        ("buffered", buffered_copy),
+        ("aioshutil.copyfile", aioshutil_copy),
+        ("fan_out_copy", fan_out_copy),
+        ("reflink", zero_copy("reflink")),
+        ("copy_file_range", zero_copy("copy_file_range")),
+        ("sendfile", zero_copy("sendfile")),
+    ]
+    with tempfile.TemporaryDirectory(dir=args.path) as directory:
+        source = os.path.join(directory, "source.dt")
+        print(f"Creating {sizeof_fmt(size)} source file in {directory}")
+        create_source(source, size)
+        destinations = [os.path.join(directory, f"replica_{i}.dt") for i in range(args.replicas)]
+        print(f"Copying to {args.replicas} replicas")
+        for name, copy in strategies:
+            if copy is None:
+                print(f"{name:>20}: not available")
+                continue
+            try:
+                start = time.perf_counter()
+                copy(source, destinations)
+                elapsed = time.perf_counter() - start
+            except OSError as e:
+                print(f"{name:>20}: failed ({e})")
+                continue
+            finally:
+                for destination in destinations:
+                    if os.path.exists(destination):
+                        os.remove(destination)
+            print(f"{name:>20}: {elapsed:.2f} s; {sizeof_fmt(size * args.replicas / elapsed)}/s")
+
+
+if __name__ == "__main__":
+    main()
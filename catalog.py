@@ -0,0 +1,75 @@
+import argparse
+import asyncio
+import logging
+from typing import List, Tuple
+
+from conf import settings
+from core import aws
+from core import catalog as core_catalog
+from utils.asyncio import initialize_event_loop
+from utils.common import sizeof_fmt
+from utils.log import configure_logging
+
+log = logging.getLogger(__name__)
+log_prefix = "Catalog"
+
+
+async def _scan_paths(paths: List[str]) -> List[Tuple[str, float, int]]:
+    files = []
+    for path in paths:
+        try:
+            files += await asyncio.to_thread(core_catalog.scan_backup_files, path)
+        except OSError as e:
+            log.error(f"<{log_prefix}> Unable to scan {path}: {e}")
+    return files
+
+
+async def reconcile(backup_catalog: core_catalog.BackupCatalog):
+    """
+    Перестраивает каталог резервных копий по файлам в каталоге резервных копий, путях репликации и в бакете S3
+    """
+    log.info(f"<{log_prefix}> Reconciling {backup_catalog.filename}")
+    backup_files = await _scan_paths([settings.BACKUP_PATH])
+    replica_files = await _scan_paths(settings.BACKUP_REPLICATION_PATHS) if settings.BACKUP_REPLICATION else []
+    s3_objects = []
+    if settings.AWS_ENABLED:
+        s3_objects = [
+            (settings.AWS_BUCKET_NAME, o["Key"], o["LastModified"].timestamp(), o["Size"])
+            for o in await aws.list_bucket_objects()
+        ]
+    count = backup_catalog.reconcile(backup_files, replica_files, s3_objects)
+    log.info(
+        f"<{log_prefix}> {count} backups found: {len(backup_files)} files, {len(replica_files)} replicas, "
+        f"{len(s3_objects)} objects in S3"
+    )
+
+
+def report(backup_catalog: core_catalog.BackupCatalog):
+    """
+    Выводит сводку по каталогу резервных копий для каждой ИБ
+    """
+    for summary in backup_catalog.get_summary():
+        last_backup = summary.last_backup.strftime(settings.DATETIME_FORMAT) if summary.last_backup else "-"
+        print(
+            f"{summary.infobase}: {summary.artifacts_count} backups, {sizeof_fmt(summary.total_size)}, "
+            f"last {last_backup}, {summary.replicas_count} replicas, {summary.s3_objects_count} objects in S3"
+        )
+
+
+async def main(command: str):
+    try:
+        with core_catalog.open_catalog() as backup_catalog:
+            if command == "reconcile":
+                await reconcile(backup_catalog)
+            elif command == "report":
+                report(backup_catalog)
+    except Exception:
+        log.exception(f"<{log_prefix}> Unknown exception occurred in main coroutine")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Каталог резервных копий")
+    parser.add_argument("command", choices=["reconcile", "report"])
+    args = parser.parse_args()
+    configure_logging(settings.LOG_LEVEL)
+    initialize_event_loop(main(args.command))
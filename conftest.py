@@ -228,7 +228,7 @@ def mock_get_1cv8_service_full_path(mocker: MockerFixture):
 
 @pytest.fixture
 def mock_cluster_com_controller(mocker: MockerFixture):
-    return mocker.patch("core.cluster.comcntr.ClusterCOMControler")
+    return mocker.patch("core.cluster.comcntr.ClusterCOMControler", autospec=True)
 
 
 @pytest.fixture
@@ -242,7 +242,7 @@ def mock_cluster_postgres_infobase(mocker: MockerFixture, mock_cluster_com_contr
         db_name=db_name,
         db_user=db_user,
     )
-    mock_cluster_com_controller.return_value.get_info_base.return_value = ib
+    mock_cluster_com_controller.return_value.aget_info_base.return_value = ib
     return db_server, db_name, db_user
 
 
@@ -257,7 +257,7 @@ def mock_cluster_mssql_infobase(mocker: MockerFixture, mock_cluster_com_controll
         db_name=db_name,
         db_user=db_user,
     )
-    mock_cluster_com_controller.return_value.get_info_base.return_value = ib
+    mock_cluster_com_controller.return_value.aget_info_base.return_value = ib
     return db_server, db_name, db_user
 
 
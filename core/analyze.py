@@ -4,6 +4,7 @@ from datetime import datetime
 from typing import Callable, List
 
 import core.models as core_models
+from core import history, metrics
 from utils.common import sizeof_fmt
 
 log = logging.getLogger(__name__)
@@ -106,6 +107,34 @@ def analyze_s3_result(
         )
 
     _analyze_result(resultset, workload, datetime_start, datetime_finish, log_message, log_subprefix)
+    records = list(history.iter_upload_records(resultset))
+    history.record_run(records, history.PHASE_UPLOAD)
+    metrics.collect_records(records, workload, history.PHASE_UPLOAD, datetime_finish.timestamp())
+    metrics.collect_task_results(resultset, history.PHASE_UPLOAD)
+    metrics.collect_upload_results(resultset)
+
+
+def _analyze_compression_result(resultset: List[core_models.InfoBaseBackupTaskResult], log_subprefix: str):
+    log_subprefix = _wrap_log_subprefix(log_subprefix)
+    original_size = 0
+    compressed_size = 0
+    duration = 0
+    for task_result in resultset:
+        compression = task_result.compression
+        if compression is None:
+            continue
+        log.info(
+            f"<{log_prefix}{log_subprefix}> [{task_result.infobase_name}] "
+            f"Compression ratio {compression.ratio:.2f}; Avg. speed {sizeof_fmt(compression.throughput)}/s"
+        )
+        original_size += compression.original_size
+        compressed_size += compression.compressed_size
+        duration += compression.duration
+    if original_size:
+        log.info(
+            f"<{log_prefix}{log_subprefix}> Compressed {sizeof_fmt(original_size)} to {sizeof_fmt(compressed_size)}; "
+            f"Ratio {original_size / (compressed_size or 1):.2f}; Avg. speed {sizeof_fmt(original_size / (duration or 1))}/s"
+        )
 
 
 def analyze_backup_result(
@@ -116,6 +145,12 @@ def analyze_backup_result(
 ):
     log_subprefix = "Backup"
     analyze_result(resultset, workload, datetime_start, datetime_finish, log_subprefix)
+    _analyze_compression_result(resultset, log_subprefix)
+    records = list(history.iter_backup_records(resultset))
+    history.record_run(records, history.PHASE_BACKUP)
+    metrics.collect_records(records, workload, history.PHASE_BACKUP, datetime_finish.timestamp())
+    metrics.collect_task_results(resultset, history.PHASE_BACKUP)
+    metrics.collect_replication_results(resultset, history.PHASE_REPLICATION)
 
 
 def analyze_maintenance_result(
@@ -126,6 +161,10 @@ def analyze_maintenance_result(
 ):
     log_subprefix = "Maintenance"
     analyze_result(resultset, workload, datetime_start, datetime_finish, log_subprefix)
+    records = list(history.iter_task_records(resultset, history.PHASE_MAINTENANCE))
+    history.record_run(records, history.PHASE_MAINTENANCE)
+    metrics.collect_records(records, workload, history.PHASE_MAINTENANCE, datetime_finish.timestamp())
+    metrics.collect_task_results(resultset, history.PHASE_MAINTENANCE)
 
 
 def analyze_update_result(
@@ -136,3 +175,7 @@ def analyze_update_result(
 ):
     log_subprefix = "Update"
     analyze_result(resultset, workload, datetime_start, datetime_finish, log_subprefix)
+    records = list(history.iter_task_records(resultset, history.PHASE_UPDATE))
+    history.record_run(records, history.PHASE_UPDATE)
+    metrics.collect_records(records, workload, history.PHASE_UPDATE, datetime_finish.timestamp())
+    metrics.collect_task_results(resultset, history.PHASE_UPDATE)
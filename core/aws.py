@@ -1,22 +1,33 @@
 import asyncio
+import json
 import logging
+import math
 import os
+from collections import defaultdict
+from contextlib import asynccontextmanager, nullcontext
 from datetime import datetime, timedelta, timezone
-from typing import Dict
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
 
 import aioboto3
-import boto3
-from botocore.exceptions import EndpointConnectionError
+import aiofiles
+from botocore.config import Config
+from botocore.exceptions import ClientError, EndpointConnectionError
 
 import core.models as core_models
 from conf import settings
-from core import utils
+from core import delta, tracing, utils
 from core.analyze import analyze_s3_result
 from utils.common import sizeof_fmt
 
 log = logging.getLogger(__name__)
 log_prefix = "AWS"
 
+UPLOAD_STATE_FILE_EXTENSION = "s3upload.json"
+S3_DELETE_OBJECTS_BATCH_SIZE = 1000
+
+_inflight_parts_semaphore: asyncio.Semaphore = None
+_inflight_parts_semaphore_loop: asyncio.AbstractEventLoop = None
+
 
 def _get_aws_endpoint_url_parameter() -> Dict[str, str]:
     url = settings.AWS_ENDPOINT_URL
@@ -26,6 +37,44 @@ def _get_aws_endpoint_url_parameter() -> Dict[str, str]:
         return dict()
 
 
+def _get_max_pool_connections() -> int:
+    max_pool_connections = settings.AWS_MAX_POOL_CONNECTIONS
+    if max_pool_connections:
+        return max_pool_connections
+    # Каждая загрузка может одновременно отправлять до AWS_MULTIPART_CONCURRENCY частей
+    return settings.AWS_CONCURRENCY * settings.AWS_MULTIPART_CONCURRENCY
+
+
+@asynccontextmanager
+async def s3_client():
+    """
+    Создаёт клиент S3 с пулом соединений размером AWS_MAX_POOL_CONNECTIONS.
+    Клиент рассчитан на использование всеми загрузками в течение одного запуска
+    и закрывается при выходе из контекста
+    """
+    session = aioboto3.Session(
+        aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+        **_get_aws_region_parameter(),
+    )
+    max_pool_connections = _get_max_pool_connections()
+    async with session.client(
+        service_name="s3",
+        config=Config(max_pool_connections=max_pool_connections),
+        **_get_aws_endpoint_url_parameter(),
+    ) as s3c:
+        log.debug(f"<{log_prefix}> S3 client initialized: {max_pool_connections} pooled connections")
+        yield s3c
+
+
+def _use_s3_client(s3c=None):
+    """
+    Возвращает контекст с переданным клиентом S3, не закрывая его при выходе,
+    либо с новым клиентом, если клиент не передан
+    """
+    return nullcontext(s3c) if s3c is not None else s3_client()
+
+
 def _get_aws_region_parameter() -> Dict[str, str]:
     region = settings.AWS_REGION_NAME
     if region:
@@ -34,68 +83,552 @@ def _get_aws_region_parameter() -> Dict[str, str]:
         return dict()
 
 
+def _get_inflight_parts_semaphore() -> asyncio.Semaphore:
+    """
+    Ограничивает объём данных, одновременно загружаемых в S3 всеми загрузками, значением AWS_MAX_INFLIGHT_BYTES
+    """
+    global _inflight_parts_semaphore, _inflight_parts_semaphore_loop
+    # Семафор привязан к событийному циклу, поэтому для нового цикла создаётся заново
+    loop = asyncio.get_running_loop()
+    if _inflight_parts_semaphore is None or _inflight_parts_semaphore_loop is not loop:
+        inflight_parts = max(settings.AWS_MAX_INFLIGHT_BYTES // settings.AWS_MULTIPART_CHUNK_SIZE, 1)
+        _inflight_parts_semaphore = asyncio.Semaphore(inflight_parts)
+        _inflight_parts_semaphore_loop = loop
+    return _inflight_parts_semaphore
+
+
+def _get_upload_state_filename(full_backup_path: str) -> str:
+    return utils.append_file_extension_to_string(full_backup_path, UPLOAD_STATE_FILE_EXTENSION)
+
+
+def _load_upload_state(state_filename: str, key: str, source_size: int, source_mtime: float) -> Optional[Dict]:
+    """
+    Загружает состояние незавершённой multipart-загрузки.
+    Состояние используется только если оно относится к тому же файлу и размер частей не изменился
+    """
+    try:
+        with open(state_filename, "r") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (
+        state.get("bucket") != settings.AWS_BUCKET_NAME
+        or state.get("key") != key
+        or state.get("size") != source_size
+        or state.get("mtime") != source_mtime
+        or state.get("part_size") != settings.AWS_MULTIPART_CHUNK_SIZE
+    ):
+        return None
+    return state
+
+
+def _save_upload_state(state_filename: str, state: Dict):
+    # Состояние записывается во временный файл и подменяется атомарно, чтобы прерванная запись не испортила его
+    tmp_filename = f"{state_filename}.tmp"
+    with open(tmp_filename, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_filename, state_filename)
+
+
+async def _abort_saved_upload(ib_name: str, full_backup_path: str, s3c=None):
+    """
+    Отменяет multipart-загрузку, сохранённую в файле состояния, и удаляет файл состояния.
+    Вызывается, когда попытки загрузки исчерпаны, чтобы загруженные части не оставались в бакете
+    """
+    state_filename = _get_upload_state_filename(full_backup_path)
+    try:
+        with open(state_filename, "r") as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return
+    except (OSError, ValueError):
+        state = None
+    if state is not None:
+        try:
+            async with _use_s3_client(s3c) as s3c:
+                await s3c.abort_multipart_upload(Bucket=state["bucket"], Key=state["key"], UploadId=state["upload_id"])
+            log.info(f"<{ib_name}> Multipart upload of {state['key']} aborted")
+        except Exception:
+            log.exception(f"<{ib_name}> Unable to abort multipart upload of {state.get('key')}")
+    for filename in (state_filename, f"{state_filename}.tmp"):
+        try:
+            os.remove(filename)
+        except FileNotFoundError:
+            pass
+
+
+async def _list_uploaded_parts(s3c, key: str, upload_id: str) -> Optional[Dict[int, str]]:
+    """
+    Получает из S3 список уже загруженных частей
+    :return: словарь номер части - ETag, или None, если загрузка не найдена
+    """
+    parts = dict()
+    kwargs = dict(Bucket=settings.AWS_BUCKET_NAME, Key=key, UploadId=upload_id)
+    try:
+        while True:
+            response = await s3c.list_parts(**kwargs)
+            for part in response.get("Parts", []):
+                parts[part["PartNumber"]] = part["ETag"]
+            if not response.get("IsTruncated"):
+                return parts
+            kwargs["PartNumberMarker"] = response["NextPartNumberMarker"]
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") == "NoSuchUpload":
+            return None
+        raise
+
+
+async def _upload_file_multipart(ib_name: str, s3c, full_backup_path: str, key: str, source_size: int):
+    """
+    Загружает файл в S3 по частям. Номера загруженных частей сохраняются в файл рядом с резервной копией,
+    поэтому повторная попытка загрузки этой копии загружает только недостающие части.
+    Каждый запуск создаёт копию с новым именем, поэтому части между запусками не переиспользуются
+    """
+    part_size = settings.AWS_MULTIPART_CHUNK_SIZE
+    parts_count = math.ceil(source_size / part_size)
+    source_mtime = os.stat(full_backup_path).st_mtime
+    state_filename = _get_upload_state_filename(full_backup_path)
+    state = _load_upload_state(state_filename, key, source_size, source_mtime)
+    if state is not None:
+        uploaded_parts = await _list_uploaded_parts(s3c, key, state["upload_id"])
+        if uploaded_parts is None:
+            state = None
+        else:
+            state["parts"] = {str(number): etag for number, etag in uploaded_parts.items()}
+            log.info(f"<{ib_name}> Resuming upload, {len(uploaded_parts)} of {parts_count} parts already uploaded")
+    if state is None:
+        response = await s3c.create_multipart_upload(Bucket=settings.AWS_BUCKET_NAME, Key=key)
+        state = dict(
+            bucket=settings.AWS_BUCKET_NAME,
+            key=key,
+            upload_id=response["UploadId"],
+            size=source_size,
+            mtime=source_mtime,
+            part_size=part_size,
+            parts=dict(),
+        )
+    _save_upload_state(state_filename, state)
+
+    file_semaphore = asyncio.Semaphore(settings.AWS_MULTIPART_CONCURRENCY)
+    inflight_semaphore = _get_inflight_parts_semaphore()
+
+    async def upload_part(part_number: int):
+        async with tracing.wait(file_semaphore, "part slot wait"), tracing.wait(inflight_semaphore, "inflight wait"):
+            with tracing.span("upload part", category="s3", part=part_number):
+                async with aiofiles.open(full_backup_path, "rb") as f:
+                    await f.seek((part_number - 1) * part_size)
+                    data = await f.read(part_size)
+                response = await s3c.upload_part(
+                    Bucket=settings.AWS_BUCKET_NAME,
+                    Key=key,
+                    UploadId=state["upload_id"],
+                    PartNumber=part_number,
+                    Body=data,
+                )
+        state["parts"][str(part_number)] = response["ETag"]
+        _save_upload_state(state_filename, state)
+
+    missing_parts = [n for n in range(1, parts_count + 1) if str(n) not in state["parts"]]
+    tasks = [asyncio.create_task(upload_part(n)) for n in missing_parts]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        # Если загрузка одной из частей не удалась, остальные части загружаются при следующей попытке
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    await s3c.complete_multipart_upload(
+        Bucket=settings.AWS_BUCKET_NAME,
+        Key=key,
+        UploadId=state["upload_id"],
+        MultipartUpload=dict(
+            Parts=[dict(ETag=state["parts"][str(n)], PartNumber=n) for n in range(1, parts_count + 1)]
+        ),
+    )
+    os.remove(state_filename)
+
+
+async def _read_chunk(stream: asyncio.StreamReader, size: int) -> bytes:
+    try:
+        return await stream.readexactly(size)
+    except asyncio.IncompleteReadError as e:
+        # Поток закончился, возвращаются оставшиеся данные
+        return e.partial
+
+
+async def upload_stream_to_s3(
+    ib_name: str,
+    stream: asyncio.StreamReader,
+    key: str,
+    s3c,
+    tee_filename: str = None,
+    before_complete: Callable[[], Awaitable[None]] = None,
+) -> core_models.InfoBaseAWSUploadTaskResult:
+    """
+    Загружает в S3 данные из потока по частям размером AWS_MULTIPART_CHUNK_SIZE по мере их поступления.
+    Следующая часть читается из потока только когда для неё есть место в AWS_MAX_INFLIGHT_BYTES,
+    поэтому при медленной загрузке источник данных приостанавливается на записи в поток.
+    Поток нельзя перечитать, поэтому при ошибке загрузка отменяется целиком, а не возобновляется
+    :param ib_name: имя ИБ
+    :param stream: поток, из которого читаются данные до его окончания
+    :param key: ключ объекта в бакете
+    :param s3c: клиент S3
+    :param tee_filename: если указан, данные из потока дополнительно записываются в этот файл
+    :param before_complete: корутинная функция, вызываемая после окончания потока перед завершением загрузки.
+        Если она выбрасывает исключение, загрузка отменяется и объект в бакете не создаётся
+    """
+    log.info(f"<{ib_name}> Start streaming upload of {key} to Amazon S3")
+    part_size = settings.AWS_MULTIPART_CHUNK_SIZE
+    file_semaphore = asyncio.Semaphore(settings.AWS_MULTIPART_CONCURRENCY)
+    inflight_semaphore = _get_inflight_parts_semaphore()
+    datetime_start = datetime.now()
+    response = await s3c.create_multipart_upload(Bucket=settings.AWS_BUCKET_NAME, Key=key)
+    upload_id = response["UploadId"]
+    parts = dict()
+    tasks = []
+
+    async def upload_part(part_number: int, data: bytes):
+        try:
+            response = await s3c.upload_part(
+                Bucket=settings.AWS_BUCKET_NAME,
+                Key=key,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                Body=data,
+            )
+        finally:
+            inflight_semaphore.release()
+            file_semaphore.release()
+        parts[part_number] = response["ETag"]
+
+    source_size = 0
+    tee = None
+    try:
+        if tee_filename:
+            tee = await aiofiles.open(tee_filename, "wb")
+        part_number = 0
+        while True:
+            await file_semaphore.acquire()
+            try:
+                await inflight_semaphore.acquire()
+            except BaseException:
+                file_semaphore.release()
+                raise
+            # Если загрузка одной из частей уже не удалась, читать поток дальше нет смысла
+            failed = next((t for t in tasks if t.done() and t.exception() is not None), None)
+            data = b"" if failed is not None else await _read_chunk(stream, part_size)
+            # Последняя часть может быть пустой, только если поток пуст целиком
+            if failed is not None or (not data and part_number > 0):
+                inflight_semaphore.release()
+                file_semaphore.release()
+                break
+            part_number += 1
+            source_size += len(data)
+            if tee is not None:
+                await tee.write(data)
+            tasks.append(asyncio.create_task(upload_part(part_number, data)))
+            if len(data) < part_size:
+                break
+        await asyncio.gather(*tasks)
+        if tee is not None:
+            await tee.close()
+            tee = None
+        if before_complete is not None:
+            await before_complete()
+        await s3c.complete_multipart_upload(
+            Bucket=settings.AWS_BUCKET_NAME,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload=dict(Parts=[dict(ETag=parts[n], PartNumber=n) for n in range(1, part_number + 1)]),
+        )
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        try:
+            await s3c.abort_multipart_upload(Bucket=settings.AWS_BUCKET_NAME, Key=key, UploadId=upload_id)
+        except Exception:
+            log.exception(f"<{ib_name}> Unable to abort multipart upload {upload_id}")
+        if tee is not None:
+            await tee.close()
+        if tee_filename and os.path.exists(tee_filename):
+            os.remove(tee_filename)
+        raise
+    datetime_finish = datetime.now()
+    diff = (datetime_finish - datetime_start).total_seconds() or 1
+    log.info(
+        f"<{ib_name}> Streamed {sizeof_fmt(source_size)} in {diff:.1f}s. Avg. speed {sizeof_fmt(source_size / diff)}/s"
+    )
+    return core_models.InfoBaseAWSUploadTaskResult(ib_name, True, source_size, key)
+
+
 async def upload_infobase_to_s3(
-    ib_name: str, full_backup_path: str, semaphore: asyncio.Semaphore
+    ib_name: str, full_backup_path: str, semaphore: asyncio.Semaphore, s3c=None
 ) -> core_models.InfoBaseAWSUploadTaskResult:
     aws_retries = settings.AWS_RETRIES
     aws_upload_timeout = settings.AWS_UPLOAD_TIMEOUT
-    async with semaphore:
-        try:
-            # Добавляет 1 к количеству повторных попыток, потому что одну попытку всегда нужно делать
-            for i in range(0, aws_retries + 1):
-                try:
-                    # Changed in version 3.11: Raises TimeoutError instead of asyncio.TimeoutError
-                    return await asyncio.wait_for(
-                        _upload_infobase_to_s3(ib_name, full_backup_path), timeout=aws_upload_timeout
-                    )
-                except (EndpointConnectionError, asyncio.TimeoutError, TimeoutError) as e:
-                    # Если количество попыток исчерпано, но ошибка по прежнему присутствует
-                    if i == aws_retries:
-                        raise e
-                    else:
-                        log.debug(f"<{ib_name}> AWS upload failed, retrying")
-                        aws_retry_pause = settings.AWS_RETRY_PAUSE
-                        log.debug(f"<{ib_name}> wait for {aws_retry_pause} seconds")
-                        await asyncio.sleep(aws_retry_pause)
-        except Exception:
-            log.exception(f"<{ib_name}> Unknown exception occurred in AWS coroutine")
-    return core_models.InfoBaseAWSUploadTaskResult(ib_name, False)
+    with tracing.span("upload", ib_name):
+        async with tracing.wait(semaphore) as waited:
+            retries = 0
+            try:
+                datetime_start = datetime.now()
+                # Добавляет 1 к количеству повторных попыток, потому что одну попытку всегда нужно делать
+                for i in range(0, aws_retries + 1):
+                    try:
+                        # Changed in version 3.11: Raises TimeoutError instead of asyncio.TimeoutError
+                        result = await asyncio.wait_for(
+                            _upload_infobase_to_s3(ib_name, full_backup_path, s3c), timeout=aws_upload_timeout
+                        )
+                        result.duration = (datetime.now() - datetime_start).total_seconds()
+                        result.wait_duration = waited.duration
+                        result.retries = retries
+                        return result
+                    except (EndpointConnectionError, asyncio.TimeoutError, TimeoutError) as e:
+                        # Если количество попыток исчерпано, но ошибка по прежнему присутствует
+                        if i == aws_retries:
+                            raise e
+                        else:
+                            log.debug(f"<{ib_name}> AWS upload failed, retrying")
+                            retries += 1
+                            aws_retry_pause = settings.AWS_RETRY_PAUSE
+                            log.debug(f"<{ib_name}> wait for {aws_retry_pause} seconds")
+                            with tracing.span("retry pause", category="wait"):
+                                await asyncio.sleep(aws_retry_pause)
+            except Exception:
+                log.exception(f"<{ib_name}> Unknown exception occurred in AWS coroutine")
+            # Попытки исчерпаны, незавершённая загрузка больше не возобновится
+            await _abort_saved_upload(ib_name, full_backup_path, s3c)
+            result = core_models.InfoBaseAWSUploadTaskResult(ib_name, False, wait_duration=waited.duration)
+            result.retries = retries
+    return result
 
 
-async def _upload_infobase_to_s3(ib_name: str, full_backup_path: str) -> core_models.InfoBaseAWSUploadTaskResult:
+async def _upload_infobase_to_s3(
+    ib_name: str, full_backup_path: str, s3c=None
+) -> core_models.InfoBaseAWSUploadTaskResult:
     log.info(f"<{ib_name}> Start upload {full_backup_path} to Amazon S3")
-    session = aioboto3.Session(
-        aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-        **_get_aws_region_parameter(),
-    )
     filename = utils.path_leaf(full_backup_path)
+    if delta.is_delta_candidate(full_backup_path):
+        async with _use_s3_client(s3c) as s3c:
+            return await _upload_delta_to_s3(ib_name, full_backup_path, s3c)
     # Собирает инфу чтобы вывод в лог был полезным
     filestat = os.stat(full_backup_path)
     source_size = filestat.st_size
     datetime_start = datetime.now()
-    async with session.client(service_name="s3", **_get_aws_endpoint_url_parameter()) as s3c:
-        await s3c.upload_file(Filename=full_backup_path, Bucket=settings.AWS_BUCKET_NAME, Key=filename)
+    async with _use_s3_client(s3c) as s3c:
+        if source_size > settings.AWS_MULTIPART_CHUNK_SIZE:
+            await _upload_file_multipart(ib_name, s3c, full_backup_path, filename, source_size)
+        else:
+            await s3c.upload_file(Filename=full_backup_path, Bucket=settings.AWS_BUCKET_NAME, Key=filename)
     datetime_finish = datetime.now()
     diff = (datetime_finish - datetime_start).total_seconds() or 1
     log.info(
         f"<{ib_name}> Uploaded {sizeof_fmt(source_size)} in {diff:.1f}s. Avg. speed {sizeof_fmt(source_size / diff)}/s"
     )
-    await _remove_old_infobase_backups_from_s3(ib_name, session)
-    return core_models.InfoBaseAWSUploadTaskResult(ib_name, True, source_size)
+    return core_models.InfoBaseAWSUploadTaskResult(ib_name, True, source_size, filename)
+
+
+def _get_delta_target() -> str:
+    return f"s3://{settings.AWS_BUCKET_NAME}"
+
+
+async def _upload_delta_to_s3(ib_name: str, full_backup_path: str, s3c) -> core_models.InfoBaseAWSUploadTaskResult:
+    """
+    Загружает в S3 только те блоки резервной копии, которых ещё нет в бакете, и манифест `*.manifest`.
+    Наличие блоков в бакете определяется по локальному списку блоков, без обращения к бакету.
+    Одновременно загружается не более AWS_MULTIPART_CONCURRENCY блоков
+    """
+    datetime_start = datetime.now()
+    manifest = await delta.get_manifest(full_backup_path)
+    index = await asyncio.to_thread(delta.get_chunk_index, _get_delta_target(), False)
+    semaphore = asyncio.Semaphore(settings.AWS_MULTIPART_CONCURRENCY)
+    uploaded_digests = []
+    uploaded_size = 0
+    tasks = []
+
+    async def put_chunk(digest: str, data: bytes):
+        nonlocal uploaded_size
+        try:
+            await s3c.put_object(Bucket=settings.AWS_BUCKET_NAME, Key=delta.get_chunk_relative_path(digest), Body=data)
+        finally:
+            semaphore.release()
+        uploaded_digests.append(digest)
+        uploaded_size += len(data)
+
+    chunks = delta.iter_missing_chunks(full_backup_path, manifest, index)
+    try:
+        while True:
+            await semaphore.acquire()
+            # Следующий блок читается только когда для его загрузки есть место
+            chunk = await asyncio.to_thread(next, chunks, None)
+            if chunk is None:
+                semaphore.release()
+                break
+            tasks.append(asyncio.create_task(put_chunk(*chunk)))
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    finally:
+        chunks.close()
+        # Загруженные блоки попадают в список, даже если загрузка остальных не удалась
+        await asyncio.to_thread(index.add, uploaded_digests)
+    manifest_key = delta.get_manifest_filename(manifest["filename"])
+    manifest_body = json.dumps(manifest).encode("utf-8")
+    # Манифест загружается последним, поэтому он появляется в бакете только когда все его блоки уже загружены
+    await s3c.put_object(Bucket=settings.AWS_BUCKET_NAME, Key=manifest_key, Body=manifest_body)
+    uploaded_size += len(manifest_body)
+    diff = (datetime.now() - datetime_start).total_seconds() or 1
+    log.info(
+        f"<{ib_name}> Uploaded {len(uploaded_digests)} new chunks of {len(manifest['chunks'])}, "
+        f"{sizeof_fmt(uploaded_size)} of {sizeof_fmt(manifest['size'])} in {diff:.1f}s"
+    )
+    return core_models.InfoBaseAWSUploadTaskResult(ib_name, True, uploaded_size, manifest_key)
 
 
-async def _remove_old_infobase_backups_from_s3(ib_name: str, session: boto3.Session):
-    # Имена файлов обязательно должны быть в формате ИмяИБ_ДатаСоздания
-    # `get_ib_name_with_separator` используется вместо имени ИБ, чтобы по ошибке не получить файлы от другой ИБ
-    # при наличии имён вида infobase и infobase2
-    async with session.resource(service_name="s3", **_get_aws_endpoint_url_parameter()) as s3_resource:
-        bucket = await s3_resource.Bucket(settings.AWS_BUCKET_NAME)
-        async for o in bucket.objects.filter(Prefix=f"{utils.get_ib_name_with_separator(ib_name)}"):
-            if await o.last_modified < (datetime.now() - timedelta(days=settings.AWS_RETENTION_DAYS)).replace(
-                tzinfo=timezone.utc
-            ):
-                await o.delete()
+async def _delete_objects(s3c, objects: List[Dict]) -> List[Dict]:
+    """
+    Удаляет объекты одним запросом DeleteObjects
+    :return: удалённые объекты
+    """
+    response = await s3c.delete_objects(
+        Bucket=settings.AWS_BUCKET_NAME,
+        Delete=dict(Objects=[dict(Key=o["Key"]) for o in objects], Quiet=True),
+    )
+    failed_keys = set()
+    for error in response.get("Errors", []):
+        failed_keys.add(error["Key"])
+        log.error(f"<{log_prefix}> Failed to remove {error['Key']}: {error.get('Message')}")
+    return [o for o in objects if o["Key"] not in failed_keys]
+
+
+async def _iterate_expired_objects(
+    s3c, infobases: List[str], expiration_datetime: datetime, catalog=None
+) -> AsyncIterator[Tuple[str, Dict]]:
+    """
+    Перебирает объекты указанных ИБ, загруженные в бакет раньше `expiration_datetime`.
+    Бакет просматривается целиком. Если передан каталог резервных копий, сначала перебираются объекты из него
+    :return: пары имя ИБ - объект с ключами `Key` и `Size`
+    """
+    cataloged_keys = set()
+    if catalog is not None:
+        for ib_name in infobases:
+            for o in catalog.get_expired_s3_objects([ib_name], settings.AWS_BUCKET_NAME, expiration_datetime):
+                cataloged_keys.add(o["Key"])
+                yield ib_name, o
+    # Бакет просматривается и при включенном каталоге резервных копий: в нём нет объектов, загруженных
+    # до его включения, и объектов, которые не удалось в него записать
+    infobases_prefixes = utils.get_infobases_prefixes(infobases)
+    paginator = s3c.get_paginator("list_objects_v2")
+    async for page in paginator.paginate(Bucket=settings.AWS_BUCKET_NAME):
+        for o in page.get("Contents", []):
+            if o["LastModified"] >= expiration_datetime or o["Key"] in cataloged_keys:
+                continue
+            ib_name = utils.get_infobase_by_filename(o["Key"], infobases_prefixes)
+            if ib_name is not None:
+                yield ib_name, o
+
+
+async def list_bucket_objects(s3c=None) -> List[Dict]:
+    """
+    Получает список всех объектов в бакете
+    :return: объекты в формате ответа ListObjectsV2
+    """
+    objects = []
+    async with _use_s3_client(s3c) as s3c:
+        paginator = s3c.get_paginator("list_objects_v2")
+        async for page in paginator.paginate(Bucket=settings.AWS_BUCKET_NAME):
+            objects += page.get("Contents", [])
+    return objects
+
+
+async def remove_old_backups_from_s3(infobases: List[str], s3c=None, catalog=None):
+    """
+    Удаляет из бакета резервные копии указанных ИБ старше AWS_RETENTION_DAYS.
+    Бакет просматривается один раз для всех ИБ, объекты удаляются пакетами по 1000 ключей
+    одновременно с продолжением просмотра бакета
+    :param infobases: имена ИБ, старые копии которых необходимо удалить
+    :param s3c: клиент S3, если не передан, создаётся новый
+    :param catalog: каталог резервных копий, если передан, к найденным в бакете объектам добавляются
+        старые объекты из него, а удалённые объекты удаляются из каталога
+    """
+    if not infobases:
+        return
+    expiration_datetime = datetime.now(tz=timezone.utc) - timedelta(days=settings.AWS_RETENTION_DAYS)
+    log.info(f"<{log_prefix}> Removing backups older than {settings.AWS_RETENTION_DAYS} days from S3")
+    try:
+        expired_by_infobase = defaultdict(int)
+        delete_tasks = []
+        async with _use_s3_client(s3c) as s3c:
+            batch = []
+            async for ib_name, o in _iterate_expired_objects(s3c, infobases, expiration_datetime, catalog):
+                expired_by_infobase[ib_name] += 1
+                batch.append(o)
+                if len(batch) == S3_DELETE_OBJECTS_BATCH_SIZE:
+                    delete_tasks.append(asyncio.create_task(_delete_objects(s3c, batch)))
+                    batch = []
+            if batch:
+                delete_tasks.append(asyncio.create_task(_delete_objects(s3c, batch)))
+            results = await asyncio.gather(*delete_tasks)
+        for ib_name, count in expired_by_infobase.items():
+            log.debug(f"<{ib_name}> {count} expired backups found in S3")
+        removed = [o for deleted in results for o in deleted]
+        if catalog is not None:
+            catalog.forget_s3_objects(settings.AWS_BUCKET_NAME, [o["Key"] for o in removed])
+    except Exception:
+        log.exception(f"<{log_prefix}> Unknown exception occurred in S3 retention coroutine")
+        return
+    removed_size = sum(o["Size"] for o in removed)
+    log.info(f"<{log_prefix}> Removed {len(removed)} objects from S3, {sizeof_fmt(removed_size)} freed")
+
+
+async def _read_manifest_digests(s3c, key: str, semaphore: asyncio.Semaphore) -> Set[str]:
+    async with semaphore:
+        response = await s3c.get_object(Bucket=settings.AWS_BUCKET_NAME, Key=key)
+        async with response["Body"] as body:
+            return delta.get_manifest_digests(json.loads(await body.read()))
+
+
+async def remove_unreferenced_chunks_from_s3(s3c=None):
+    """
+    Удаляет из бакета блоки разностных копий, на которые не ссылается ни один манифест,
+    например, после удаления старых копий, и обновляет локальный список блоков бакета
+    :param s3c: клиент S3, если не передан, создаётся новый
+    """
+    try:
+        async with _use_s3_client(s3c) as s3c:
+            objects = await list_bucket_objects(s3c)
+            chunks = [o for o in objects if o["Key"].startswith(f"{delta.CHUNKS_DIRECTORY}/")]
+            semaphore = asyncio.Semaphore(settings.AWS_MULTIPART_CONCURRENCY)
+            manifests_digests = await asyncio.gather(
+                *[
+                    _read_manifest_digests(s3c, o["Key"], semaphore)
+                    for o in objects
+                    if o["Key"].endswith(f".{delta.MANIFEST_FILE_EXTENSION}")
+                ]
+            )
+            referenced = set().union(*manifests_digests)
+            unreferenced = [o for o in chunks if utils.path_leaf(o["Key"]) not in referenced]
+            results = await asyncio.gather(
+                *[
+                    _delete_objects(s3c, unreferenced[i : i + S3_DELETE_OBJECTS_BATCH_SIZE])
+                    for i in range(0, len(unreferenced), S3_DELETE_OBJECTS_BATCH_SIZE)
+                ]
+            )
+        removed = [o for deleted in results for o in deleted]
+        removed_keys = {o["Key"] for o in removed}
+        index = await asyncio.to_thread(delta.get_chunk_index, _get_delta_target(), False)
+        await asyncio.to_thread(
+            index.replace, {utils.path_leaf(o["Key"]) for o in chunks if o["Key"] not in removed_keys}
+        )
+    except Exception:
+        log.exception(f"<{log_prefix}> Unknown exception occurred in S3 chunks garbage collection coroutine")
+        return
+    removed_size = sum(o["Size"] for o in removed)
+    log.info(f"<{log_prefix}> Removed {len(removed)} unreferenced chunks from S3, {sizeof_fmt(removed_size)} freed")
 
 
 async def upload_to_s3(backup_results: core_models.InfoBaseBackupTaskResult):
@@ -107,19 +640,22 @@ async def upload_to_s3(backup_results: core_models.InfoBaseBackupTaskResult):
         concurrency = settings.AWS_CONCURRENCY
         semaphore = asyncio.Semaphore(concurrency)
         log.info(f"<{log_prefix}> Asyncio semaphore initialized: {concurrency} concurrent tasks")
-        datetime_start = datetime.now()
-        result = await asyncio.gather(
-            *[
-                upload_infobase_to_s3(
-                    backup_result.infobase_name,
-                    backup_result.backup_filename,
-                    semaphore,
-                )
-                for backup_result in backup_results
-                if backup_result.succeeded
-            ]
-        )
-        datetime_finish = datetime.now()
+        async with s3_client() as s3c:
+            datetime_start = datetime.now()
+            result = await asyncio.gather(
+                *[
+                    upload_infobase_to_s3(
+                        backup_result.infobase_name,
+                        backup_result.backup_filename,
+                        semaphore,
+                        s3c,
+                    )
+                    for backup_result in backup_results
+                    if backup_result.succeeded
+                ]
+            )
+            datetime_finish = datetime.now()
+            await remove_old_backups_from_s3([r.infobase_name for r in result if r.succeeded], s3c)
         analyze_s3_result(
             result,
             [e.infobase_name for e in backup_results],
@@ -0,0 +1,426 @@
+import asyncio
+import contextlib
+import hashlib
+import logging
+import os
+import sqlite3
+from datetime import datetime
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import core.models as core_models
+from conf import settings
+from core import utils
+
+log = logging.getLogger(__name__)
+log_prefix = "Catalog"
+
+BACKUP_TYPE_DT = "dt"
+BACKUP_TYPE_PGDUMP = "pgdump"
+BACKUP_TYPES = (BACKUP_TYPE_DT, BACKUP_TYPE_PGDUMP)
+# Расширения, которые могут следовать за типом резервной копии: архив каталога pg_dump, сжатие zstd
+# и манифест разностной копии
+BACKUP_EXTRA_EXTENSIONS = frozenset({"tar", "zst", "manifest"})
+CHECKSUM_READ_SIZE = 4 * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    id INTEGER PRIMARY KEY,
+    infobase TEXT NOT NULL,
+    backup_type TEXT NOT NULL,
+    filename TEXT NOT NULL UNIQUE,
+    path TEXT,
+    size INTEGER,
+    checksum TEXT,
+    duration REAL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS artifacts_infobase_created_at ON artifacts (infobase, created_at);
+CREATE TABLE IF NOT EXISTS replicas (
+    id INTEGER PRIMARY KEY,
+    artifact_id INTEGER NOT NULL REFERENCES artifacts (id) ON DELETE CASCADE,
+    path TEXT NOT NULL UNIQUE
+);
+CREATE INDEX IF NOT EXISTS replicas_artifact_id ON replicas (artifact_id);
+CREATE TABLE IF NOT EXISTS s3_objects (
+    id INTEGER PRIMARY KEY,
+    artifact_id INTEGER NOT NULL REFERENCES artifacts (id) ON DELETE CASCADE,
+    infobase TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    key TEXT NOT NULL,
+    size INTEGER,
+    created_at REAL NOT NULL,
+    UNIQUE (bucket, key)
+);
+CREATE INDEX IF NOT EXISTS s3_objects_bucket_infobase_created_at ON s3_objects (bucket, infobase, created_at);
+"""
+
+
+class BackupFileInfo(NamedTuple):
+    infobase: str
+    backup_type: str
+    created_at: datetime
+
+
+class InfoBaseCatalogSummary(NamedTuple):
+    infobase: str
+    artifacts_count: int
+    total_size: int
+    last_backup: Optional[datetime]
+    replicas_count: int
+    s3_objects_count: int
+
+
+def parse_backup_filename(filename: str) -> Optional[BackupFileInfo]:
+    """
+    Разбирает имя файла резервной копии вида ИмяИБ_ДатаСоздания.тип[.tar][.zst]
+    :return: имя ИБ, тип резервной копии и дата из имени файла, или None, если файл не является резервной копией
+    """
+    # Имя ИБ может содержать точки, поэтому расширения отделяются с конца имени файла
+    stem = filename
+    while True:
+        stem, dot, extension = stem.rpartition(".")
+        if not dot or (extension not in BACKUP_TYPES and extension not in BACKUP_EXTRA_EXTENSIONS):
+            return None
+        if extension in BACKUP_TYPES:
+            backup_type = extension
+            break
+    ib_name, separator, datetime_string = stem.rpartition(settings.FILENAME_SEPARATOR)
+    if not ib_name or not separator:
+        return None
+    try:
+        created_at = datetime.strptime(datetime_string, settings.DATETIME_FORMAT)
+    except ValueError:
+        return None
+    return BackupFileInfo(ib_name, backup_type, created_at)
+
+
+def calculate_checksum(filename: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(filename, "rb") as f:
+        while block := f.read(CHECKSUM_READ_SIZE):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def _placeholders(values: List) -> str:
+    return ", ".join("?" * len(values))
+
+
+class BackupCatalog:
+    """
+    Каталог резервных копий в базе SQLite: файлы резервных копий, их реплики и объекты в бакете S3.
+    Ротация, очистка бакета и отчёты выполняются запросами к каталогу вместо просмотра каталогов и бакета
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def add_artifact(
+        self,
+        infobase: str,
+        backup_type: str,
+        filename: str,
+        created_at: float,
+        path: str = None,
+        size: int = None,
+        checksum: str = None,
+        duration: float = None,
+    ) -> int:
+        """
+        Добавляет резервную копию в каталог. Если копия с таким именем файла уже есть, обновляет её,
+        сохраняя контрольную сумму и длительность, если они не переданы
+        :return: идентификатор резервной копии в каталоге
+        """
+        with self.connection:
+            cursor = self.connection.execute(
+                """
+                INSERT INTO artifacts (infobase, backup_type, filename, path, size, checksum, duration, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (filename) DO UPDATE SET
+                    path = COALESCE(excluded.path, path),
+                    size = COALESCE(excluded.size, size),
+                    checksum = COALESCE(excluded.checksum, checksum),
+                    duration = COALESCE(excluded.duration, duration)
+                RETURNING id
+                """,
+                (infobase, backup_type, filename, path, size, checksum, duration, created_at),
+            )
+            return cursor.fetchone()[0]
+
+    def add_replica(self, artifact_id: int, path: str):
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO replicas (artifact_id, path) VALUES (?, ?)", (artifact_id, path)
+            )
+
+    def add_s3_object(self, artifact_id: int, infobase: str, bucket: str, key: str, size: int, created_at: float):
+        with self.connection:
+            self.connection.execute(
+                """
+                INSERT OR REPLACE INTO s3_objects (artifact_id, infobase, bucket, key, size, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (artifact_id, infobase, bucket, key, size, created_at),
+            )
+
+    def record_backup_result(
+        self,
+        backup_result: core_models.InfoBaseBackupTaskResult,
+        aws_result: core_models.InfoBaseAWSUploadTaskResult = None,
+        checksum: str = None,
+    ) -> Optional[int]:
+        """
+        Записывает в каталог результат резервного копирования ИБ вместе с репликами и объектом в бакете
+        :return: идентификатор резервной копии в каталоге, или None, если записывать нечего
+        """
+        uploaded = aws_result is not None and aws_result.succeeded and aws_result.s3_key
+        if not backup_result.succeeded or not (backup_result.backup_filename or uploaded):
+            return None
+        filename = utils.path_leaf(backup_result.backup_filename) if backup_result.backup_filename else uploaded
+        file_info = parse_backup_filename(filename)
+        backup_type = file_info.backup_type if file_info else filename.partition(".")[2]
+        created_at = datetime.now().timestamp()
+        path, size = None, None
+        if backup_result.backup_filename:
+            path = os.path.abspath(backup_result.backup_filename)
+            size = os.path.getsize(path)
+        artifact_id = self.add_artifact(
+            backup_result.infobase_name,
+            backup_type,
+            filename,
+            created_at,
+            path=path,
+            size=size,
+            checksum=checksum,
+            duration=backup_result.duration,
+        )
+        for replica in backup_result.replicas:
+            self.add_replica(artifact_id, os.path.abspath(replica))
+        if uploaded:
+            self.add_s3_object(
+                artifact_id,
+                backup_result.infobase_name,
+                settings.AWS_BUCKET_NAME,
+                aws_result.s3_key,
+                aws_result.upload_size,
+                created_at,
+            )
+        return artifact_id
+
+    def get_expired_files(self, infobases: List[str], before: datetime) -> List[str]:
+        """
+        Находит файлы резервных копий и их реплик для указанных ИБ, созданные раньше `before`
+        :return: полные пути к файлам
+        """
+        if not infobases:
+            return []
+        placeholders = _placeholders(infobases)
+        params = (*infobases, before.timestamp())
+        rows = self.connection.execute(
+            f"""
+            SELECT path FROM artifacts
+            WHERE infobase IN ({placeholders}) AND created_at < ? AND path IS NOT NULL
+            UNION ALL
+            SELECT replicas.path FROM replicas JOIN artifacts ON artifacts.id = replicas.artifact_id
+            WHERE artifacts.infobase IN ({placeholders}) AND artifacts.created_at < ?
+            """,
+            params + params,
+        )
+        return [row[0] for row in rows]
+
+    def get_expired_s3_objects(self, infobases: List[str], bucket: str, before: datetime) -> List[Dict]:
+        """
+        Находит объекты в бакете для указанных ИБ, загруженные раньше `before`
+        :return: объекты в формате ответа ListObjectsV2 с ключами `Key` и `Size`
+        """
+        if not infobases:
+            return []
+        rows = self.connection.execute(
+            f"""
+            SELECT key, size FROM s3_objects
+            WHERE bucket = ? AND infobase IN ({_placeholders(infobases)}) AND created_at < ?
+            """,
+            (bucket, *infobases, before.timestamp()),
+        )
+        return [dict(Key=key, Size=size or 0) for key, size in rows]
+
+    def forget_files(self, paths: Iterable[str]):
+        """
+        Удаляет из каталога сведения об удалённых файлах резервных копий и реплик
+        """
+        paths = list(paths)
+        with self.connection:
+            self.connection.executemany("UPDATE artifacts SET path = NULL WHERE path = ?", ((p,) for p in paths))
+            self.connection.executemany("DELETE FROM replicas WHERE path = ?", ((p,) for p in paths))
+            self._remove_orphaned_artifacts()
+
+    def forget_s3_objects(self, bucket: str, keys: Iterable[str]):
+        """
+        Удаляет из каталога сведения об удалённых объектах в бакете
+        """
+        with self.connection:
+            self.connection.executemany(
+                "DELETE FROM s3_objects WHERE bucket = ? AND key = ?", ((bucket, k) for k in keys)
+            )
+            self._remove_orphaned_artifacts()
+
+    def _remove_orphaned_artifacts(self):
+        # Резервная копия, от которой не осталось ни файла, ни реплик, ни объектов в бакете, больше не нужна
+        self.connection.execute(
+            """
+            DELETE FROM artifacts
+            WHERE path IS NULL
+                AND NOT EXISTS (SELECT 1 FROM replicas WHERE replicas.artifact_id = artifacts.id)
+                AND NOT EXISTS (SELECT 1 FROM s3_objects WHERE s3_objects.artifact_id = artifacts.id)
+            """
+        )
+
+    def get_average_durations(self, infobases: List[str], last: int) -> Dict[str, float]:
+        """
+        Средняя длительность создания последних резервных копий указанных ИБ
+        :param last: сколько последних резервных копий каждой ИБ учитывается
+        :return: словарь имя ИБ - средняя длительность в секундах, ИБ без истории в словарь не попадают
+        """
+        if not infobases:
+            return dict()
+        rows = self.connection.execute(
+            f"""
+            SELECT infobase, AVG(duration) FROM (
+                SELECT
+                    infobase,
+                    duration,
+                    ROW_NUMBER() OVER (PARTITION BY infobase ORDER BY created_at DESC) AS n
+                FROM artifacts
+                WHERE infobase IN ({_placeholders(infobases)}) AND duration IS NOT NULL
+            )
+            WHERE n <= ?
+            GROUP BY infobase
+            """,
+            (*infobases, last),
+        )
+        return {ib_name: duration for ib_name, duration in rows}
+
+    def get_summary(self) -> List[InfoBaseCatalogSummary]:
+        """
+        Сводка по каталогу для каждой ИБ: количество и размер резервных копий, дата последней копии,
+        количество реплик и объектов в бакете
+        """
+        rows = self.connection.execute(
+            """
+            SELECT
+                artifacts.infobase,
+                COUNT(artifacts.id),
+                COALESCE(SUM(artifacts.size), 0),
+                MAX(artifacts.created_at),
+                (SELECT COUNT(*) FROM replicas JOIN artifacts a ON a.id = replicas.artifact_id
+                    WHERE a.infobase = artifacts.infobase),
+                (SELECT COUNT(*) FROM s3_objects WHERE s3_objects.infobase = artifacts.infobase)
+            FROM artifacts
+            GROUP BY artifacts.infobase
+            ORDER BY artifacts.infobase
+            """
+        )
+        return [
+            InfoBaseCatalogSummary(
+                ib_name, count, size, datetime.fromtimestamp(last) if last else None, replicas_count, s3_count
+            )
+            for ib_name, count, size, last, replicas_count, s3_count in rows
+        ]
+
+    def reconcile(
+        self,
+        backup_files: List[Tuple[str, float, int]],
+        replica_files: List[Tuple[str, float, int]],
+        s3_objects: List[Tuple[str, str, float, int]],
+    ) -> int:
+        """
+        Перестраивает каталог по фактически существующим файлам и объектам в бакете.
+        Контрольные суммы и длительность создания сохраняются для копий, которые уже были в каталоге
+        :param backup_files: полный путь, дата изменения и размер файлов в каталоге резервных копий
+        :param replica_files: полный путь, дата изменения и размер файлов в путях репликации
+        :param s3_objects: бакет, ключ, дата изменения и размер объектов в бакете
+        :return: количество резервных копий в каталоге
+        """
+        with self.connection:
+            self.connection.execute("UPDATE artifacts SET path = NULL")
+            self.connection.execute("DELETE FROM replicas")
+            self.connection.execute("DELETE FROM s3_objects")
+        for path, mtime, size in backup_files:
+            filename = utils.path_leaf(path)
+            file_info = parse_backup_filename(filename)
+            if file_info is not None:
+                self.add_artifact(file_info.infobase, file_info.backup_type, filename, mtime, path=path, size=size)
+        for path, mtime, size in replica_files:
+            filename = utils.path_leaf(path)
+            file_info = parse_backup_filename(filename)
+            if file_info is not None:
+                artifact_id = self.add_artifact(file_info.infobase, file_info.backup_type, filename, mtime, size=size)
+                self.add_replica(artifact_id, path)
+        for bucket, key, mtime, size in s3_objects:
+            file_info = parse_backup_filename(key)
+            if file_info is not None:
+                artifact_id = self.add_artifact(file_info.infobase, file_info.backup_type, key, mtime, size=size)
+                self.add_s3_object(artifact_id, file_info.infobase, bucket, key, size, mtime)
+        with self.connection:
+            self._remove_orphaned_artifacts()
+        return self.connection.execute("SELECT COUNT(*) FROM artifacts").fetchone()[0]
+
+
+@contextlib.contextmanager
+def open_catalog(filename: str = None):
+    catalog = BackupCatalog(filename or settings.BACKUP_CATALOG_PATH)
+    try:
+        yield catalog
+    finally:
+        catalog.close()
+
+
+def scan_backup_files(path: str) -> List[Tuple[str, float, int]]:
+    """
+    Находит файлы резервных копий в каталоге
+    :return: полный путь, дата изменения и размер каждого файла
+    """
+    files = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_file() and parse_backup_filename(entry.name) is not None:
+                stat = entry.stat()
+                files.append((os.path.abspath(entry.path), stat.st_mtime, stat.st_size))
+    return files
+
+
+async def record_backup(
+    catalog: BackupCatalog,
+    backup_result: core_models.InfoBaseBackupTaskResult,
+    aws_result: core_models.InfoBaseAWSUploadTaskResult = None,
+) -> bool:
+    """
+    Записывает в каталог результат резервного копирования ИБ. Если включен BACKUP_CATALOG_CHECKSUMS,
+    для резервной копии вычисляется контрольная сумма SHA-256
+    :return: True, если резервная копия записана в каталог
+    """
+    if not backup_result.succeeded:
+        return False
+    ib_name = backup_result.infobase_name
+    checksum = None
+    if settings.BACKUP_CATALOG_CHECKSUMS and backup_result.backup_filename:
+        try:
+            checksum = await asyncio.to_thread(calculate_checksum, backup_result.backup_filename)
+        except OSError as e:
+            log.error(f"<{ib_name}> Unable to calculate checksum of {backup_result.backup_filename}: {e}")
+    if aws_result is not None and not aws_result.succeeded:
+        aws_result = None
+    try:
+        recorded = catalog.record_backup_result(backup_result, aws_result, checksum) is not None
+    except Exception:
+        log.exception(f"<{ib_name}> Unable to record backup to catalog")
+        return False
+    if recorded:
+        log.debug(f"<{ib_name}> Backup recorded to {catalog.filename}")
+    return recorded
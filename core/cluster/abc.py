@@ -39,6 +39,14 @@ class ClusterControler(ABC):
         """
         ...
 
+    @abstractmethod
+    def get_info_base_background_jobs_count(self, infobase: str) -> int:
+        """
+        Получает количество выполняющихся фоновых заданий информационной базы
+        :param infobase: имя информационной базы
+        """
+        ...
+
     @abstractmethod
     def get_info_base(self, infobase: str) -> V8CInfobase:
         """
@@ -47,13 +55,41 @@ class ClusterControler(ABC):
         """
         ...
 
-    def get_info_bases(self) -> List[str]:
+    @classmethod
+    def log_statistics(cls):
         """
-        Получает имена всех ИБ, кроме указанных в списке V8_INFOBASES_EXCLUDE
-        Если список V8_INFOBASES_ONLY не пустой, получает список ИБ, указанных в этом списке и присутствующих в кластере
-        :return: массив с именами ИБ
+        Выводит в лог накопленную за время работы статистику контроллера, если она есть
         """
-        info_bases_obj = self.get_cluster_info_bases()
+        return None
+
+    @classmethod
+    def shutdown(cls):
+        """
+        Освобождает общие для всех экземпляров ресурсы контроллера перед завершением работы
+        """
+        return None
+
+    # Асинхронные версии методов по умолчанию выполняют синхронные методы.
+    # Контроллеры, которые умеют работать с кластером без блокировки событийного цикла, переопределяют их
+    async def aget_cluster_info_bases(self) -> List[V8CInfobaseShort]:
+        return self.get_cluster_info_bases()
+
+    async def alock_info_base(self, infobase: str, *args, **kwargs):
+        return self.lock_info_base(infobase, *args, **kwargs)
+
+    async def aunlock_info_base(self, infobase: str):
+        return self.unlock_info_base(infobase)
+
+    async def aterminate_info_base_sessions(self, infobase: str):
+        return self.terminate_info_base_sessions(infobase)
+
+    async def aget_info_base_background_jobs_count(self, infobase: str) -> int:
+        return self.get_info_base_background_jobs_count(infobase)
+
+    async def aget_info_base(self, infobase: str) -> V8CInfobase:
+        return self.get_info_base(infobase)
+
+    def _filter_info_bases(self, info_bases_obj: List[V8CInfobaseShort]) -> List[str]:
         info_bases_raw = [ib.name for ib in info_bases_obj]
         if settings.V8_INFOBASES_ONLY:
             info_bases = list(
@@ -70,3 +106,14 @@ class ClusterControler(ABC):
                 )
             )
         return info_bases
+
+    def get_info_bases(self) -> List[str]:
+        """
+        Получает имена всех ИБ, кроме указанных в списке V8_INFOBASES_EXCLUDE
+        Если список V8_INFOBASES_ONLY не пустой, получает список ИБ, указанных в этом списке и присутствующих в кластере
+        :return: массив с именами ИБ
+        """
+        return self._filter_info_bases(self.get_cluster_info_bases())
+
+    async def aget_info_bases(self) -> List[str]:
+        return self._filter_info_bases(await self.aget_cluster_info_bases())
@@ -1,11 +1,22 @@
+import asyncio
+import functools
 import logging
-from typing import List
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
 
 from core.cluster.abc import ClusterControler
 from core.cluster.models import V8CInfobase, V8CInfobaseShort
-from core.cluster.utils import get_server_agent_address, get_server_agent_port
+from core.cluster.utils import (
+    BACKGROUND_JOB_APP_ID,
+    SessionsSnapshot,
+    get_server_agent_address,
+    get_server_agent_port,
+)
 
 try:
+    import pythoncom
     import pywintypes
     import win32com.client as win32com_client
 except ImportError:
@@ -13,11 +24,15 @@ except ImportError:
 
     surrogate("win32com.client").prepare()
     surrogate("pywintypes").prepare()
+    surrogate("pythoncom").prepare()
+    import pythoncom
     import pywintypes
     import win32com.client as win32com_client
 
     pywintypes.com_error = Exception
     win32com_client.Dispatch = lambda i: None
+    pythoncom.CoInitialize = lambda: None
+    pythoncom.CoUninitialize = lambda: None
 
 from conf import settings
 
@@ -35,6 +50,43 @@ r"""
 
 log = logging.getLogger(__name__)
 
+# HRESULT ошибок, означающих потерю соединения с COM-сервером: RPC_E_SERVER_DIED, RPC_E_SERVER_DIED_DNE,
+# RPC_E_DISCONNECTED, CO_E_OBJNOTCONNECTED, RPC_S_SERVER_UNAVAILABLE, RPC_S_CALL_FAILED, RPC_S_CALL_FAILED_DNE
+CONNECTION_LOST_HRESULTS = frozenset(
+    {0x80010007, 0x80010012, 0x80010108, 0x800401FD, 0x800706BA, 0x800706BE, 0x800706BF}
+)
+
+
+def is_connection_lost(e: Exception) -> bool:
+    """
+    Проверяет, что ошибка COM означает потерю соединения, а не ошибку, возвращённую самим вызовом
+    """
+    hresult = getattr(e, "hresult", e.args[0] if e.args else None)
+    # pywintypes возвращает HRESULT как знаковое целое
+    return isinstance(hresult, int) and (hresult & 0xFFFFFFFF) in CONNECTION_LOST_HRESULTS
+
+
+class COMConnectionPool(threading.local):
+    """
+    Соединения с кластером и снимок сеансов, общие для всех экземпляров ClusterCOMControler.
+    COM-объекты нельзя передавать между потоками, поэтому у каждого потока свой набор соединений
+    и свой снимок сеансов, полученных через соединение этого потока
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.v8_com_connector = None
+        self.agent_connection = None
+        self.cluster = None
+        self.cluster_with_auth = None
+        self.working_process_connection = None
+        self.checked_at = dict()
+        # Ключ - имя ИБ в нижнем регистре. Сеансы принадлежат соединению с агентом сервера,
+        # поэтому снимок сбрасывается вместе с соединениями
+        self.sessions = SessionsSnapshot()
+
 
 class ClusterCOMControler(ClusterControler):
     """
@@ -42,21 +94,61 @@ class ClusterCOMControler(ClusterControler):
     и должны использоваться только в потоке, в котоорм были созданы
     """
 
+    # Соединения и снимок сеансов переиспользуются всеми экземплярами, т.к. контроллер создаётся заново
+    # для каждой операции
+    connections = COMConnectionPool()
+
     def __init__(self):
-        try:
-            self.V8COMConnector = win32com_client.Dispatch("V83.COMConnector")
-        except pywintypes.com_error as e:
-            raise e
         self.server = get_server_agent_address()
         self.agentPort = get_server_agent_port()
         self.clusterAdminName = settings.V8_CLUSTER_ADMIN_CREDENTIALS[0]
         self.clusterAdminPwd = settings.V8_CLUSTER_ADMIN_CREDENTIALS[1]
         self.infoBasesCredentials = settings.V8_INFOBASES_CREDENTIALS
 
+    @property
+    def V8COMConnector(self):
+        # COMConnector создаётся при первом обращении, т.е. в том потоке, который будет с ним работать
+        if self.connections.v8_com_connector is None:
+            try:
+                self.connections.v8_com_connector = win32com_client.Dispatch("V83.COMConnector")
+            except pywintypes.com_error as e:
+                raise e
+        return self.connections.v8_com_connector
+
+    def _check_connection(self, name: str, check: Callable):
+        """
+        Проверяет, что соединение из пула не разорвано, если с момента последней проверки
+        прошло больше V8_COM_CONNECTION_CHECK_INTERVAL секунд. Разорванное соединение удаляется из пула
+        вместе со всеми зависящими от него объектами
+        """
+        connection = getattr(self.connections, name)
+        if connection is None:
+            return
+        now = time.monotonic()
+        if now - self.connections.checked_at.get(name, now) < settings.V8_COM_CONNECTION_CHECK_INTERVAL:
+            return
+        try:
+            check(connection)
+            self.connections.checked_at[name] = now
+        except pywintypes.com_error as e:
+            log.warning(f"COM connection {name} is broken, reconnecting: {e}")
+            self.reset_connections()
+
+    @classmethod
+    def reset_connections(cls):
+        """
+        Удаляет из пула все соединения текущего потока, при следующем обращении они будут созданы заново
+        """
+        v8_com_connector = cls.connections.v8_com_connector
+        cls.connections.clear()
+        cls.connections.v8_com_connector = v8_com_connector
+
     def get_agent_connection(self):
-        if getattr(self, "agent_connection", None) is None:
-            self.agent_connection = self.V8COMConnector.ConnectAgent(f"{self.server}:{self.agentPort}")
-        return self.agent_connection
+        self._check_connection("agent_connection", lambda c: c.GetClusters())
+        if self.connections.agent_connection is None:
+            self.connections.agent_connection = self.V8COMConnector.ConnectAgent(f"{self.server}:{self.agentPort}")
+            self.connections.checked_at["agent_connection"] = time.monotonic()
+        return self.connections.agent_connection
 
     def get_cluster(self):
         """
@@ -65,9 +157,9 @@ class ClusterCOMControler(ClusterControler):
         :return: Объект IClusterInfo
         """
         agent_connection = self.get_agent_connection()
-        if getattr(self, "cluster", None) is None:
-            self.cluster = agent_connection.GetClusters()[0]
-        return self.cluster
+        if self.connections.cluster is None:
+            self.connections.cluster = agent_connection.GetClusters()[0]
+        return self.connections.cluster
 
     def cluster_auth(self):
         """
@@ -82,16 +174,28 @@ class ClusterCOMControler(ClusterControler):
         return cluster
 
     def get_cluster_with_auth(self):
-        if getattr(self, "cluster_with_auth", None) is None:
-            self.cluster_with_auth = self.cluster_auth()
-        return self.cluster_with_auth
+        self.get_agent_connection()
+        if self.connections.cluster_with_auth is None:
+            self.connections.cluster_with_auth = self.cluster_auth()
+        return self.connections.cluster_with_auth
+
+    def _select_working_process(self, working_processes: List):
+        """
+        Выбирает наименее нагруженный рабочий процесс: среди запущенных процессов
+        с наибольшей доступной производительностью, а при равной производительности - с наименьшим числом соединений
+        :param working_processes: массив объектов IWorkingProcessInfo
+        :return: Объект IWorkingProcessInfo
+        """
+        running_processes = [wp for wp in working_processes if wp.Running == 1] or list(working_processes)
+        return max(running_processes, key=lambda wp: (wp.AvailablePerformance, -wp.Connections))
 
     def get_working_process_connection(self):
         agent_connection = self.get_agent_connection()
         cluster = self.get_cluster_with_auth()
 
-        working_process_0 = agent_connection.GetWorkingProcesses(cluster)[0]
-        working_process_port = str(working_process_0.MainPort)
+        working_process = self._select_working_process(agent_connection.GetWorkingProcesses(cluster))
+        working_process_port = str(working_process.MainPort)
+        log.debug(f"Connecting to working process on port {working_process_port}")
         working_process_connection = self.V8COMConnector.ConnectWorkingProcess(
             f"tcp://{self.server}:{working_process_port}"
         )
@@ -101,12 +205,20 @@ class ClusterCOMControler(ClusterControler):
         return working_process_connection
 
     def get_working_process_connection_with_info_base_auth(self):
-        working_process_connection = self.get_working_process_connection()
-        # Административный доступ разрешен только к тем информационным базам,
-        # в которых зарегистрирован пользователь с таким именем и он имеет право "Администратор".
-        for c in self.infoBasesCredentials.values():
-            working_process_connection.AddAuthentication(c[0], c[1])
-        return working_process_connection
+        """
+        Получает соединение с рабочим процессом, авторизованное для всех ИБ из V8_INFOBASES_CREDENTIALS.
+        Соединение создаётся один раз и переиспользуется, пока не будет разорвано
+        """
+        self._check_connection("working_process_connection", lambda c: c.GetInfoBases())
+        if self.connections.working_process_connection is None:
+            working_process_connection = self.get_working_process_connection()
+            # Административный доступ разрешен только к тем информационным базам,
+            # в которых зарегистрирован пользователь с таким именем и он имеет право "Администратор".
+            for c in self.infoBasesCredentials.values():
+                working_process_connection.AddAuthentication(c[0], c[1])
+            self.connections.working_process_connection = working_process_connection
+            self.connections.checked_at["working_process_connection"] = time.monotonic()
+        return self.connections.working_process_connection
 
     def _filter_infobase(self, info_bases: List, name: str):
         for ib in info_bases:
@@ -184,6 +296,7 @@ class ClusterCOMControler(ClusterControler):
         working_process_connection = self.get_working_process_connection_with_info_base_auth()
         working_process_connection.UpdateInfoBase(infobase_com_obj)
         log.debug(f"<{infobase_com_obj.Name}> Lock info base successfully")
+        self.connections.sessions.mark_locked(infobase.lower())
         return infobase_com_obj
 
     def unlock_info_base(self, infobase: str):
@@ -200,14 +313,145 @@ class ClusterCOMControler(ClusterControler):
         log.debug(f"<{infobase_com_obj.Name}> Unlock info base successfully")
         return infobase_com_obj
 
+    def _get_infobase_sessions(self, agent_connection, cluster, infobase: str) -> List:
+        """
+        Получает сеансы информационной базы из снимка сеансов всего кластера.
+        Снимок обновляется одним вызовом `GetSessions`, если он устарел
+        """
+        info_base_sessions = self.connections.sessions.take(infobase.lower())
+        if info_base_sessions is None:
+            started_at = self.connections.sessions.start_update()
+            self.connections.sessions.update(
+                agent_connection.GetSessions(cluster), key=lambda s: s.infoBase.Name.lower(), started_at=started_at
+            )
+            info_base_sessions = self.connections.sessions.take(infobase.lower())
+        return info_base_sessions
+
     def terminate_info_base_sessions(self, infobase: str):
         """
         Принудительно завершает текущие сеансы информационной базы
         :param infobase: имя информационной базы
+        :return: количество завершенных сеансов
         """
         agent_connection = self.get_agent_connection()
         cluster_with_auth = self.get_cluster_with_auth()
-        info_base_short = self._get_info_base_short(agent_connection, cluster_with_auth, infobase)
-        info_base_sessions = agent_connection.GetInfoBaseSessions(cluster_with_auth, info_base_short)
+        time_start = time.monotonic()
+        info_base_sessions = self._get_infobase_sessions(agent_connection, cluster_with_auth, infobase)
+        terminated = 0
         for session in info_base_sessions:
-            agent_connection.TerminateSession(cluster_with_auth, session)
+            try:
+                agent_connection.TerminateSession(cluster_with_auth, session)
+                terminated += 1
+            except pywintypes.com_error as e:
+                # Сеанс мог завершиться самостоятельно после получения снимка
+                log.debug(f"<{infobase}> Session was not terminated: {e}")
+        log.info(
+            f"<{infobase}> Terminated {terminated} of {len(info_base_sessions)} sessions "
+            f"in {time.monotonic() - time_start:.2f}s"
+        )
+        return terminated
+
+    def get_info_base_background_jobs_count(self, infobase: str) -> int:
+        """
+        Получает количество выполняющихся фоновых заданий информационной базы.
+        Сеансы запрашиваются у кластера каждый раз, минуя снимок сеансов, т.к. нужно актуальное состояние
+        :param infobase: имя информационной базы
+        """
+        agent_connection = self.get_agent_connection()
+        cluster_with_auth = self.get_cluster_with_auth()
+        info_base_short = self._get_info_base_short(agent_connection, cluster_with_auth, infobase)
+        sessions = agent_connection.GetInfoBaseSessions(cluster_with_auth, info_base_short)
+        return sum(1 for session in sessions if session.AppID == BACKGROUND_JOB_APP_ID)
+
+    @classmethod
+    def shutdown(cls):
+        COMWorker.shutdown()
+
+    # Асинхронные методы выполняются в потоке COMWorker, чтобы не блокировать событийный цикл
+    async def aget_cluster_info_bases(self) -> List[V8CInfobaseShort]:
+        return await COMWorker.get_instance().call("get_cluster_info_bases")
+
+    async def alock_info_base(self, infobase: str, *args, **kwargs):
+        return await COMWorker.get_instance().call("lock_info_base", infobase, *args, **kwargs)
+
+    async def aunlock_info_base(self, infobase: str):
+        return await COMWorker.get_instance().call("unlock_info_base", infobase)
+
+    async def aterminate_info_base_sessions(self, infobase: str):
+        return await COMWorker.get_instance().call("terminate_info_base_sessions", infobase)
+
+    async def aget_info_base_background_jobs_count(self, infobase: str) -> int:
+        return await COMWorker.get_instance().call("get_info_base_background_jobs_count", infobase)
+
+    async def aget_info_base(self, infobase: str) -> V8CInfobase:
+        return await COMWorker.get_instance().call("get_info_base", infobase)
+
+    async def aget_info_base_metadata(self, infobase: str, infobase_user: str, infobase_pwd: str):
+        return await COMWorker.get_instance().call("get_info_base_metadata", infobase, infobase_user, infobase_pwd)
+
+
+class COMWorker:
+    """
+    Отдельный поток, который владеет COMConnector и соединением с агентом сервера.
+    Запросы из событийного цикла ставятся в очередь и выполняются в этом потоке последовательно,
+    поэтому COM-объекты не передаются между потоками, а событийный цикл не блокируется COM-вызовами
+    """
+
+    _instance: "COMWorker" = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="com-worker", initializer=pythoncom.CoInitialize
+        )
+        self._controler: ClusterCOMControler = None
+
+    @classmethod
+    def get_instance(cls) -> "COMWorker":
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    @classmethod
+    def shutdown(cls):
+        """
+        Освобождает COM-объекты и завершает поток COMWorker
+        """
+        with cls._instance_lock:
+            if cls._instance is not None:
+                cls._instance._executor.submit(cls._instance._release)
+                cls._instance._executor.shutdown(wait=True)
+                cls._instance = None
+
+    def _release(self):
+        # COM-объекты освобождаются в потоке, в котором созданы, до завершения работы COM в этом потоке
+        self._controler = None
+        ClusterCOMControler.connections.clear()
+        pythoncom.CoUninitialize()
+
+    def _get_controler(self) -> ClusterCOMControler:
+        if self._controler is None:
+            self._controler = ClusterCOMControler()
+        return self._controler
+
+    def _call(self, method_name: str, *args, **kwargs):
+        try:
+            return getattr(self._get_controler(), method_name)(*args, **kwargs)
+        except pywintypes.com_error as e:
+            # Ошибки, возвращённые самим вызовом, не повторяются: вызов может быть дорогим или неидемпотентным
+            if not is_connection_lost(e):
+                raise
+            # Соединение разорвано кластером, поэтому повторяет вызов один раз с новым соединением
+            log.warning(f"COM call {method_name} failed, reconnecting: {e}")
+            ClusterCOMControler.reset_connections()
+            return getattr(self._get_controler(), method_name)(*args, **kwargs)
+
+    async def call(self, method_name: str, *args, **kwargs):
+        """
+        Выполняет метод ClusterCOMControler в потоке COMWorker
+        :param method_name: имя синхронного метода ClusterCOMControler
+        :return: результат выполнения метода
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(self._call, method_name, *args, **kwargs))
@@ -1,18 +1,65 @@
 from abc import ABC, abstractmethod
-from typing import List
+from datetime import datetime
+from typing import Any, Callable, Dict, FrozenSet, Tuple
+
+BOOL_VALUES = {
+    "on": True,
+    "yes": True,
+    "off": False,
+    "no": False,
+}
+
+
+def _to_bool(value: str) -> bool:
+    return BOOL_VALUES[value]
 
 
 class V8CModel(ABC):
-    @property
-    @abstractmethod
-    def keys(self) -> List[str]: ...
+    """
+    Объект кластера 1С. Значения полей хранятся в слотах, набор полей определяется атрибутом класса `keys`.
+    Строковые значения полей из `int_keys`, `bool_keys` и `datetime_keys` приводятся к типу при создании объекта,
+    если значение не удаётся привести к типу, сохраняется исходная строка
+    """
+
+    __slots__ = ()
+
+    keys: Tuple[str, ...] = ()
+    int_keys: FrozenSet[str] = frozenset()
+    bool_keys: FrozenSet[str] = frozenset()
+    datetime_keys: FrozenSet[str] = frozenset()
+
+    _keys_set: FrozenSet[str] = frozenset()
+    _converters: Dict[str, Callable[[str], Any]] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._keys_set = frozenset(cls.keys)
+        cls._converters = {
+            **{k: int for k in cls.int_keys},
+            **{k: _to_bool for k in cls.bool_keys},
+            **{k: datetime.fromisoformat for k in cls.datetime_keys},
+        }
 
     @property
     @abstractmethod
     def id(self) -> str: ...
 
     def __init__(self, **kwargs):
-        self.__dict__.update((k, v) for k, v in kwargs.items() if k in self.keys)
+        keys_set = self._keys_set
+        converters = self._converters
+        for k, v in kwargs.items():
+            if k not in keys_set:
+                continue
+            converter = converters.get(k)
+            if converter is not None and isinstance(v, str):
+                if not v:
+                    v = None
+                else:
+                    try:
+                        v = converter(v)
+                    except (ValueError, KeyError):
+                        pass
+            setattr(self, k, v)
 
     def __eq__(self, other):
         result = True
@@ -26,100 +73,160 @@ class V8CModel(ABC):
 
 
 class V8CCluster(V8CModel):
-    @property
-    def id(self):
-        return self.cluster
-
-    @property
-    def keys(self):
-        return [
-            "cluster",
-            "host",
+    keys = (
+        "cluster",
+        "host",
+        "port",
+        "name",
+        "expiration_timeout",
+        "lifetime_limit",
+        "max_memory_size",
+        "max_memory_time_limit",
+        "security_level",
+        "session_fault_tolerance_level",
+        "load_balancing_mode",
+        "errors_count_threshold",
+        "kill_problem_processes",
+        "kill_by_memory_with_dump",
+    )
+    int_keys = frozenset(
+        {
             "port",
-            "name",
             "expiration_timeout",
             "lifetime_limit",
             "max_memory_size",
             "max_memory_time_limit",
             "security_level",
             "session_fault_tolerance_level",
-            "load_balancing_mode",
             "errors_count_threshold",
-            "kill_problem_processes",
-            "kill_by_memory_with_dump",
-        ]
+        }
+    )
+    bool_keys = frozenset({"kill_problem_processes", "kill_by_memory_with_dump"})
+    __slots__ = keys
 
-
-class V8CInfobaseShort(V8CModel):
     @property
     def id(self):
-        return self.infobase
+        return self.cluster
 
-    @property
-    def keys(self):
-        return [
-            "infobase",
-            "name",
-            "descr",
-        ]
 
+class V8CInfobaseShort(V8CModel):
+    keys = (
+        "infobase",
+        "name",
+        "descr",
+    )
+    __slots__ = keys
 
-class V8CInfobase(V8CInfobaseShort):
     @property
     def id(self):
         return self.infobase
 
-    @property
-    def keys(self):
-        return [
-            "infobase",
-            "name",
-            "dbms",
-            "db_server",
-            "db_name",
-            "db_user",
+
+class V8CInfobase(V8CInfobaseShort):
+    keys = (
+        "infobase",
+        "name",
+        "dbms",
+        "db_server",
+        "db_name",
+        "db_user",
+        "security_level",
+        "license_distribution",
+        "scheduled_jobs_deny",
+        "sessions_deny",
+        "denied_from",
+        "denied_message",
+        "denied_parameter",
+        "denied_to",
+        "permission_code",
+        "external_session_manager_connection_string",
+        "external_session_manager_required",
+        "security_profile_name",
+        "safe_mode_security_profile_name",
+        "reserve_working_processes",
+        "descr",
+        "disable_local_speech_to_text",
+        "configuration_unload_delay_by_working_process_without_active_users",
+        "minimum_scheduled_jobs_start_period_without_active_users",
+        "maximum_scheduled_jobs_start_shift_without_active_users",
+    )
+    int_keys = frozenset(
+        {
             "security_level",
-            "license_distribution",
+            "configuration_unload_delay_by_working_process_without_active_users",
+            "minimum_scheduled_jobs_start_period_without_active_users",
+            "maximum_scheduled_jobs_start_shift_without_active_users",
+        }
+    )
+    bool_keys = frozenset(
+        {
             "scheduled_jobs_deny",
             "sessions_deny",
-            "denied_from",
-            "denied_message",
-            "denied_parameter",
-            "denied_to",
-            "permission_code",
-            "external_session_manager_connection_string",
             "external_session_manager_required",
-            "security_profile_name",
-            "safe_mode_security_profile_name",
             "reserve_working_processes",
-            "descr",
             "disable_local_speech_to_text",
-            "configuration_unload_delay_by_working_process_without_active_users",
-            "minimum_scheduled_jobs_start_period_without_active_users",
-            "maximum_scheduled_jobs_start_shift_without_active_users",
-        ]
+        }
+    )
+    datetime_keys = frozenset({"denied_from", "denied_to"})
+    # Слоты полей V8CInfobaseShort уже объявлены в родительском классе
+    __slots__ = tuple(k for k in keys if k not in V8CInfobaseShort.keys)
 
 
 class V8CSession(V8CModel):
-    @property
-    def id(self):
-        return self.session
-
-    @property
-    def keys(self):
-        return [
-            "session",
+    keys = (
+        "session",
+        "session_id",
+        "infobase",
+        "connection",
+        "process",
+        "user_name",
+        "host",
+        "app_id",
+        "locale",
+        "started_at",
+        "last_active_at",
+        "hibernate",
+        "passive_session_hibernate_time",
+        "hibernate_session_terminate_time",
+        "blocked_by_dbms",
+        "blocked_by_ls",
+        "bytes_all",
+        "bytes_last_5min",
+        "calls_all",
+        "calls_last_5min",
+        "dbms_bytes_all",
+        "dbms_bytes_last_5min",
+        "db_proc_info",
+        "db_proc_took",
+        "db_proc_took_at",
+        "duration_all",
+        "duration_all_dbms",
+        "duration_current",
+        "duration_current_dbms",
+        "duration_last_5min",
+        "duration_last_5min_dbms",
+        "memory_current",
+        "memory_last_5min",
+        "memory_total",
+        "read_current",
+        "read_last_5min",
+        "read_total",
+        "write_current",
+        "write_last_5min",
+        "write_total",
+        "duration_current_service",
+        "duration_last_5min_service",
+        "duration_all_service",
+        "current_service_name",
+        "cpu_time_current",
+        "cpu_time_last_5min",
+        "cpu_time_total",
+        "data_separation",
+        "client_ip",
+    )
+    int_keys = frozenset(
+        {
             "session_id",
-            "infobase",
-            "connection",
-            "process",
-            "user_name",
-            "host",
-            "app_id",
-            "locale",
-            "started_at",
-            "last_active_at",
-            "hibernate",
             "passive_session_hibernate_time",
             "hibernate_session_terminate_time",
             "blocked_by_dbms",
@@ -130,9 +237,7 @@ class V8CSession(V8CModel):
             "calls_last_5min",
             "dbms_bytes_all",
             "dbms_bytes_last_5min",
-            "db_proc_info",
             "db_proc_took",
-            "db_proc_took_at",
             "duration_all",
             "duration_all_dbms",
             "duration_current",
@@ -151,10 +256,15 @@ class V8CSession(V8CModel):
             "duration_current_service",
             "duration_last_5min_service",
             "duration_all_service",
-            "current_service_name",
             "cpu_time_current",
             "cpu_time_last_5min",
             "cpu_time_total",
-            "data_separation",
-            "client_ip",
-        ]
+        }
+    )
+    bool_keys = frozenset({"hibernate"})
+    datetime_keys = frozenset({"started_at", "last_active_at", "db_proc_took_at"})
+    __slots__ = keys
+
+    @property
+    def id(self):
+        return self.session
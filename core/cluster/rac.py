@@ -1,19 +1,153 @@
+import asyncio
 import platform
 import subprocess
 import logging
+import time
 
-from typing import List, Type
+from typing import AsyncIterator, Iterable, Iterator, List, Optional, Type
 
 from conf import settings
 from core.exceptions import RACException
 from core.cluster.abc import ClusterControler
+from core.cluster.utils import BACKGROUND_JOB_APP_ID, SessionsSnapshot
 from core.cluster.models import V8CModel, V8CCluster, V8CInfobaseShort, V8CInfobase, V8CSession
-from core import utils
+from core import metrics, tracing, utils
+from utils.asyncio import initialize_semaphore
 
 log = logging.getLogger(__name__)
+log_prefix = "RAC"
+
+RAC_NOT_FOUND_MARKERS = ("not found", "не найден")
+
+
+class RACInventoryCache:
+    """
+    Кэш сведений о кластере и его информационных базах на время работы приложения.
+    Позволяет не вызывать `rac cluster list` и `rac infobase summary list` перед каждой операцией.
+    Время жизни записей определяется настройкой V8_RAC_INVENTORY_CACHE_TTL, значение 0 отключает кэш
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.spawns_avoided = 0
+        self.invalidate()
+
+    def _get_expiration(self) -> float:
+        return time.monotonic() + settings.V8_RAC_INVENTORY_CACHE_TTL
+
+    def _is_alive(self, expires_at: float) -> bool:
+        return time.monotonic() < expires_at
+
+    def _hit(self):
+        self.hits += 1
+        # Каждое попадание в кэш экономит один запуск rac
+        self.spawns_avoided += 1
+
+    def get_cluster(self) -> Optional[V8CCluster]:
+        if self._cluster is not None and self._is_alive(self._cluster_expires_at):
+            self._hit()
+            return self._cluster
+        self.misses += 1
+        return None
+
+    def set_cluster(self, cluster: V8CCluster):
+        self._cluster = cluster
+        self._cluster_expires_at = self._get_expiration()
+
+    def get_infobases(self) -> Optional[List[V8CInfobaseShort]]:
+        if self._infobases is not None and self._is_alive(self._infobases_expires_at):
+            self._hit()
+            return list(self._infobases.values())
+        self.misses += 1
+        return None
+
+    def set_infobases(self, infobases: List[V8CInfobaseShort]):
+        self._infobases = {ib.name.lower(): ib for ib in infobases}
+        self._infobases_expires_at = self._get_expiration()
+
+    def get_infobase(self, name: str) -> Optional[V8CInfobaseShort]:
+        """
+        Получает ИБ из кэша по имени без учёта регистра
+        :param name: имя информационной базы
+        :return: объект ИБ или None, если кэш пуст, устарел или ИБ в нём отсутствует
+        """
+        if self._infobases is not None and self._is_alive(self._infobases_expires_at):
+            infobase = self._infobases.get(name.lower())
+            if infobase is not None:
+                self._hit()
+                return infobase
+        self.misses += 1
+        return None
+
+    def invalidate(self):
+        self._cluster = None
+        self._cluster_expires_at = 0.0
+        self._infobases = None
+        self._infobases_expires_at = 0.0
+
+    def __str__(self):
+        return f"{self.hits} hits; {self.misses} misses; {self.spawns_avoided} rac spawns avoided"
+
+
+class RACOutputParser:
+    """
+    Инкрементальный разбор вывода rac. Объекты в выводе разделены пустой строкой,
+    каждая строка объекта имеет вид `ключ : значение`
+    """
+
+    def __init__(self, obj_class: Type[V8CModel]):
+        self.obj_class = obj_class
+        self._kw = dict()
+
+    def feed(self, line: str) -> Optional[V8CModel]:
+        """
+        Обрабатывает очередную строку вывода
+        :return: объект, если строка завершила его описание, иначе None
+        """
+        if not line.strip():
+            return self.finish()
+        key, value = line.split(":", maxsplit=1)
+        self._kw.setdefault(key.replace("-", "_").strip(), value.strip().strip('"'))
+        return None
+
+    def finish(self) -> Optional[V8CModel]:
+        """
+        Завершает описание текущего объекта. Вызывается также в конце вывода,
+        т.к. после последнего объекта может не быть пустой строки
+        """
+        if not self._kw:
+            return None
+        obj = self.obj_class(**self._kw)
+        self._kw = dict()
+        return obj
+
+    def parse(self, lines: Iterable[str]) -> Iterator[V8CModel]:
+        for line in lines:
+            obj = self.feed(line)
+            if obj is not None:
+                yield obj
+        obj = self.finish()
+        if obj is not None:
+            yield obj
 
 
 class ClusterRACControler(ClusterControler):
+    """
+    Управляет кластером через сервер администрирования (RAS) при помощи клиента `rac` из поставки платформы.
+    Каждая операция запускает отдельный процесс `rac`. Собственный клиент протокола RAS не реализован:
+    протокол закрытый и не документирован, поэтому накладные расходы снижаются кэшированием кластера, ИБ
+    и сеансов и ограниченным параллельным запуском `rac`
+    """
+
+    # Кэш общий для всех экземпляров т.к. контроллер создаётся заново для каждой операции
+    inventory = RACInventoryCache()
+    # Снимок сеансов кластера, ключ - идентификатор ИБ
+    sessions = SessionsSnapshot()
+    _rac_semaphore: asyncio.Semaphore = None
+    _rac_semaphore_loop: asyncio.AbstractEventLoop = None
+    _rac_exec_path: str = None
+
     def __init__(self):
         self.ras_host = settings.V8_RAS["address"]
         self.ras_port = settings.V8_RAS["port"]
@@ -22,90 +156,275 @@ class ClusterRACControler(ClusterControler):
         self.infobases_credentials = settings.V8_INFOBASES_CREDENTIALS
         if platform.system() == "Windows":
             self.shell_encoding = "cp866"
-        if platform.system() == "Linux":
+        else:
             self.shell_encoding = "utf-8"
 
-    def _get_rac_exec_path(self):
-        return f'"{utils.get_1cv8_service_full_path("rac")}"'
+    @classmethod
+    def _get_rac_exec_path(cls) -> str:
+        # Поиск последней версии платформы читает каталог V8_PLATFORM_PATH,
+        # поэтому путь к rac определяется один раз за время работы приложения
+        if cls._rac_exec_path is None:
+            cls._rac_exec_path = utils.get_1cv8_service_full_path("rac")
+        return cls._rac_exec_path
 
     def _rac_output_to_objects(self, output: str, obj_class: Type[V8CModel]) -> List[V8CModel]:
-        objects = []
-        lines = [line for line in output.splitlines()]
-        kw = dict()
-        for line in lines:
-            if not line.strip():
-                objects.append(obj_class(**kw))
-                kw.clear()
-                continue
-            key, value = line.split(":", maxsplit=1)
-            kw.setdefault(key.replace("-", "_").strip(), value.strip().strip('"'))
-        return objects
+        return list(RACOutputParser(obj_class).parse(output.splitlines()))
 
     def _rac_output_to_object(self, output: str, obj_class: Type[V8CModel]) -> V8CModel:
         return self._rac_output_to_objects(output, obj_class)[0]
 
-    def _rac_call(self, command: str) -> str:
-        call_str = f"{self._get_rac_exec_path()} {self.ras_host}:{self.ras_port} {command}"
-        log.debug(f"Created rac command [{call_str}]")
+    def _build_rac_args(self, command: List[str]) -> List[str]:
+        args = [self._get_rac_exec_path(), f"{self.ras_host}:{self.ras_port}", *command]
+        log.debug(f"Created rac command [{subprocess.list2cmdline(args)}]")
+        return args
+
+    def _rac_call(self, command: List[str], invalidate_on_not_found: bool = True) -> str:
+        args = self._build_rac_args(command)
+        metrics.count_process("rac")
         try:
-            out = subprocess.check_output(call_str, stderr=subprocess.STDOUT, shell=True, encoding=self.shell_encoding)
+            out = subprocess.check_output(args, stderr=subprocess.STDOUT, encoding=self.shell_encoding)
         except subprocess.CalledProcessError as e:
+            if invalidate_on_not_found:
+                self._invalidate_inventory_on_not_found(e.output)
             raise RACException() from e
         return out
 
+    @classmethod
+    def _get_rac_semaphore(cls) -> asyncio.Semaphore:
+        # Семафор привязан к событийному циклу, поэтому для нового цикла создаётся заново
+        loop = asyncio.get_running_loop()
+        if cls._rac_semaphore is None or cls._rac_semaphore_loop is not loop:
+            cls._rac_semaphore = initialize_semaphore(settings.V8_RAC_CONCURRENCY, log_prefix, "rac")
+            cls._rac_semaphore_loop = loop
+        return cls._rac_semaphore
+
+    async def _arac_call(self, command: List[str], invalidate_on_not_found: bool = True) -> str:
+        args = self._build_rac_args(command)
+        with tracing.span(f"rac {' '.join(command[:2])}", category="cluster"):
+            async with tracing.wait(self._get_rac_semaphore(), "rac wait"):
+                rac_process = await asyncio.create_subprocess_exec(
+                    *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT
+                )
+                metrics.count_process("rac")
+                stdout, _ = await rac_process.communicate()
+        out = stdout.decode(self.shell_encoding)
+        if rac_process.returncode != 0:
+            if invalidate_on_not_found:
+                self._invalidate_inventory_on_not_found(out)
+            raise RACException(out)
+        return out
+
+    async def _arac_stream(self, command: List[str], obj_class: Type[V8CModel]) -> AsyncIterator[V8CModel]:
+        """
+        Выполняет команду rac и возвращает объекты по мере чтения вывода, не дожидаясь завершения процесса.
+        Вывод не накапливается целиком, поэтому подходит для больших списков, например сеансов всего кластера
+        """
+        args = self._build_rac_args(command)
+        parser = RACOutputParser(obj_class)
+        async with self._get_rac_semaphore():
+            rac_process = await asyncio.create_subprocess_exec(
+                *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            )
+            metrics.count_process("rac")
+            # stderr читается одновременно с stdout, чтобы rac не заблокировался при переполнении буфера
+            stderr_task = asyncio.create_task(rac_process.stderr.read())
+            try:
+                async for line in rac_process.stdout:
+                    obj = parser.feed(line.decode(self.shell_encoding))
+                    if obj is not None:
+                        yield obj
+                await rac_process.wait()
+            finally:
+                if rac_process.returncode is None:
+                    rac_process.kill()
+                    await rac_process.wait()
+                stderr = (await stderr_task).decode(self.shell_encoding)
+        if rac_process.returncode != 0:
+            self._invalidate_inventory_on_not_found(stderr)
+            raise RACException(stderr)
+        obj = parser.finish()
+        if obj is not None:
+            yield obj
+
+    def _invalidate_inventory_on_not_found(self, output: str):
+        # Если кластер или ИБ не найдены, значит закэшированные идентификаторы устарели
+        if output and any(marker in output.lower() for marker in RAC_NOT_FOUND_MARKERS):
+            log.debug(f'<{log_prefix}> rac returned "not found", invalidating inventory cache')
+            self.inventory.invalidate()
+
+    @classmethod
+    def log_statistics(cls):
+        log.info(f"<{log_prefix}> Inventory cache: {cls.inventory}")
+
     def _get_clusters(self) -> List[V8CCluster]:
-        cmd = "cluster list"
-        output = self._rac_call(cmd)
+        output = self._rac_call(["cluster", "list"])
+        return self._rac_output_to_objects(output, V8CCluster)
+
+    async def _aget_clusters(self) -> List[V8CCluster]:
+        output = await self._arac_call(["cluster", "list"])
         return self._rac_output_to_objects(output, V8CCluster)
 
     def _get_cluster(self, name=None) -> V8CCluster:
-        return self._get_clusters()[0]
+        cluster = self.inventory.get_cluster()
+        if cluster is None:
+            cluster = self._get_clusters()[0]
+            self.inventory.set_cluster(cluster)
+        return cluster
+
+    async def _aget_cluster(self, name=None) -> V8CCluster:
+        cluster = self.inventory.get_cluster()
+        if cluster is None:
+            cluster = (await self._aget_clusters())[0]
+            self.inventory.set_cluster(cluster)
+        return cluster
 
-    def _with_cluster_auth(self) -> str:
-        cluster = self._get_cluster()
-        auth = f"--cluster={cluster.id}"
+    def _cluster_auth(self, cluster: V8CCluster) -> List[str]:
+        auth = [f"--cluster={cluster.id}"]
         if self.cluster_admin_name:
-            auth += f" --cluster-user={self.cluster_admin_name}"
+            auth.append(f"--cluster-user={self.cluster_admin_name}")
         if self.cluster_admin_pwd:
-            auth += f" --cluster-pwd={self.cluster_admin_pwd}"
+            auth.append(f"--cluster-pwd={self.cluster_admin_pwd}")
         return auth
 
-    def _with_infobase_auth(self, infobase: V8CInfobaseShort):
-        auth = f"--infobase={infobase.id}"
+    def _with_cluster_auth(self) -> List[str]:
+        return self._cluster_auth(self._get_cluster())
+
+    async def _awith_cluster_auth(self) -> List[str]:
+        return self._cluster_auth(await self._aget_cluster())
+
+    def _with_infobase_auth(self, infobase: V8CInfobaseShort) -> List[str]:
+        auth = [f"--infobase={infobase.id}"]
         default = self.infobases_credentials.get("default")
         creds = self.infobases_credentials.get(infobase.name, default)
         if creds[0]:
-            auth += f" --infobase-user={creds[0]}"
+            auth.append(f"--infobase-user={creds[0]}")
         if creds[1]:
-            auth += f" --infobase-pwd={creds[1]}"
+            auth.append(f"--infobase-pwd={creds[1]}")
         return auth
 
+    def _lock_info_base_args(self, permission_code: str, message: str) -> List[str]:
+        return [
+            "--sessions-deny=on",
+            "--scheduled-jobs-deny=on",
+            f"--permission-code={permission_code}",
+            f"--denied-message={message}",
+        ]
+
+    def _unlock_info_base_args(self) -> List[str]:
+        return ["--sessions-deny=off", "--scheduled-jobs-deny=off"]
+
     def _filter_infobase(self, infobases: List[V8CInfobaseShort], name: str):
         for ib in infobases:
             if ib.name.lower() == name.lower():
                 return ib
 
     def _get_infobase_short(self, infobase_name: str) -> V8CInfobaseShort:
-        return self._filter_infobase(self.get_cluster_info_bases(), infobase_name)
+        infobase = self.inventory.get_infobase(infobase_name)
+        if infobase is None:
+            infobase = self._filter_infobase(self._get_cluster_info_bases(), infobase_name)
+        return infobase
+
+    async def _aget_infobase_short(self, infobase_name: str) -> V8CInfobaseShort:
+        infobase = self.inventory.get_infobase(infobase_name)
+        if infobase is None:
+            infobase = self._filter_infobase(await self._aget_cluster_info_bases(), infobase_name)
+        return infobase
 
     def _get_infobase_sessions(self, infobase: V8CInfobaseShort) -> List[V8CSession]:
-        cmd = f"session list {self._with_cluster_auth()} --infobase={infobase.id}"
-        output = self._rac_call(cmd)
-        return self._rac_output_to_objects(output, V8CSession)
+        """
+        Получает сеансы ИБ из снимка сеансов всего кластера.
+        Снимок обновляется одним вызовом `rac session list` без указания ИБ, если он устарел
+        """
+        sessions = self.sessions.take(infobase.id)
+        if sessions is None:
+            started_at = self.sessions.start_update()
+            output = self._rac_call(["session", "list", *self._with_cluster_auth()])
+            self.sessions.update(
+                self._rac_output_to_objects(output, V8CSession), key=lambda s: s.infobase, started_at=started_at
+            )
+            sessions = self.sessions.take(infobase.id)
+        return sessions
+
+    async def _aiter_infobase_sessions(
+        self, infobase: V8CInfobaseShort, cluster_auth: List[str]
+    ) -> AsyncIterator[V8CSession]:
+        """
+        Возвращает сеансы ИБ из снимка сеансов всего кластера.
+        Если снимок устарел, сеансы ИБ возвращаются по мере чтения вывода `rac session list`,
+        а снимок обновляется после завершения rac
+        """
+        sessions = self.sessions.take(infobase.id)
+        if sessions is not None:
+            for session in sessions:
+                yield session
+            return
+        cluster_sessions = []
+        # Пока выводится список сеансов, другие ИБ могут быть заблокированы,
+        # для них снимок считается полученным до блокировки
+        started_at = self.sessions.start_update()
+        async for session in self._arac_stream(["session", "list", *cluster_auth], V8CSession):
+            cluster_sessions.append(session)
+            if session.infobase == infobase.id:
+                yield session
+        self.sessions.update(cluster_sessions, key=lambda s: s.infobase, started_at=started_at)
+        # Сеансы этой ИБ уже возвращены и будут завершены
+        self.sessions.take(infobase.id)
+
+    def _terminate_session(self, session: V8CSession, cluster_auth: List[str]) -> bool:
+        try:
+            # Сеанс мог завершиться самостоятельно после получения снимка,
+            # это не означает, что закэшированные кластер или ИБ устарели
+            self._rac_call(
+                ["session", "terminate", *cluster_auth, f"--session={session.id}"], invalidate_on_not_found=False
+            )
+        except RACException as e:
+            log.debug(f"<{log_prefix}> Session {session.id} was not terminated: {e}")
+            return False
+        return True
+
+    async def _aterminate_session(self, session: V8CSession, cluster_auth: List[str]) -> bool:
+        try:
+            await self._arac_call(
+                ["session", "terminate", *cluster_auth, f"--session={session.id}"], invalidate_on_not_found=False
+            )
+        except RACException as e:
+            log.debug(f"<{log_prefix}> Session {session.id} was not terminated: {e}")
+            return False
+        return True
 
-    def _terminate_session(self, session: V8CSession):
-        cmd = f"session terminate {self._with_cluster_auth()} --session={session.id}"
-        self._rac_call(cmd)
+    def _get_cluster_info_bases(self) -> List[V8CInfobaseShort]:
+        output = self._rac_call(["infobase", "summary", "list", *self._with_cluster_auth()])
+        infobases = self._rac_output_to_objects(output, V8CInfobaseShort)
+        self.inventory.set_infobases(infobases)
+        return infobases
+
+    async def _aget_cluster_info_bases(self) -> List[V8CInfobaseShort]:
+        output = await self._arac_call(["infobase", "summary", "list", *(await self._awith_cluster_auth())])
+        infobases = self._rac_output_to_objects(output, V8CInfobaseShort)
+        self.inventory.set_infobases(infobases)
+        return infobases
 
     def get_cluster_info_bases(self) -> List[V8CInfobaseShort]:
         """
         Получает список всех ИБ из кластера
         """
-        cmd = f"infobase summary list {self._with_cluster_auth()} "
-        output = self._rac_call(cmd)
-        return self._rac_output_to_objects(output, V8CInfobaseShort)
+        infobases = self.inventory.get_infobases()
+        if infobases is None:
+            infobases = self._get_cluster_info_bases()
+        return infobases
+
+    async def aget_cluster_info_bases(self) -> List[V8CInfobaseShort]:
+        infobases = self.inventory.get_infobases()
+        if infobases is None:
+            infobases = await self._aget_cluster_info_bases()
+        return infobases
 
-    def lock_info_base(self, infobase: str, permission_code: str, message: str):
+    def lock_info_base(
+        self,
+        infobase: str,
+        permission_code: str = "0000",
+        message: str = "Выполняется обслуживание ИБ",
+    ):
         """
         Блокирует фоновые задания и новые сеансы информационной базы
         :param infobase: имя информационной базы
@@ -113,8 +432,34 @@ class ClusterRACControler(ClusterControler):
         :param message: Сообщение будет выводиться при попытке установить сеанс с ИБ
         """
         ib = self._get_infobase_short(infobase)
-        cmd = f"infobase update {self._with_cluster_auth()} {self._with_infobase_auth(ib)} --sessions-deny=on --scheduled-jobs-deny=on --permission-code={permission_code} --denied-message={message}"
-        self._rac_call(cmd)
+        self._rac_call(
+            [
+                "infobase",
+                "update",
+                *self._with_cluster_auth(),
+                *self._with_infobase_auth(ib),
+                *self._lock_info_base_args(permission_code, message),
+            ]
+        )
+        self.sessions.mark_locked(ib.id)
+
+    async def alock_info_base(
+        self,
+        infobase: str,
+        permission_code: str = "0000",
+        message: str = "Выполняется обслуживание ИБ",
+    ):
+        ib = await self._aget_infobase_short(infobase)
+        await self._arac_call(
+            [
+                "infobase",
+                "update",
+                *(await self._awith_cluster_auth()),
+                *self._with_infobase_auth(ib),
+                *self._lock_info_base_args(permission_code, message),
+            ]
+        )
+        self.sessions.mark_locked(ib.id)
 
     def unlock_info_base(self, infobase: str):
         """
@@ -122,18 +467,77 @@ class ClusterRACControler(ClusterControler):
         :param infobase: имя информационной базы
         """
         ib = self._get_infobase_short(infobase)
-        cmd = f"infobase update {self._with_cluster_auth()} {self._with_infobase_auth(ib)} --sessions-deny=off --scheduled-jobs-deny=off"
-        self._rac_call(cmd)
+        self._rac_call(
+            [
+                "infobase",
+                "update",
+                *self._with_cluster_auth(),
+                *self._with_infobase_auth(ib),
+                *self._unlock_info_base_args(),
+            ]
+        )
+
+    async def aunlock_info_base(self, infobase: str):
+        ib = await self._aget_infobase_short(infobase)
+        await self._arac_call(
+            [
+                "infobase",
+                "update",
+                *(await self._awith_cluster_auth()),
+                *self._with_infobase_auth(ib),
+                *self._unlock_info_base_args(),
+            ]
+        )
+
+    def _log_terminated_sessions(self, infobase: str, terminated: int, total: int, time_start: float):
+        log.info(f"<{infobase}> Terminated {terminated} of {total} sessions in {time.monotonic() - time_start:.2f}s")
 
     def terminate_info_base_sessions(self, infobase: str):
         """
         Принудительно завершает текущие сеансы информационной базы
         :param infobase: имя информационной базы
+        :return: количество завершенных сеансов
         """
+        time_start = time.monotonic()
         ib = self._get_infobase_short(infobase)
         sessions = self._get_infobase_sessions(ib)
-        for s in sessions:
-            self._terminate_session(s)
+        cluster_auth = self._with_cluster_auth()
+        terminated = sum(self._terminate_session(s, cluster_auth) for s in sessions)
+        self._log_terminated_sessions(infobase, terminated, len(sessions), time_start)
+        return terminated
+
+    async def aterminate_info_base_sessions(self, infobase: str):
+        # Сеансы завершаются одновременно, число параллельных процессов rac ограничено V8_RAC_CONCURRENCY
+        time_start = time.monotonic()
+        ib = await self._aget_infobase_short(infobase)
+        cluster_auth = await self._awith_cluster_auth()
+        # Завершение сеанса начинается сразу после его получения, не дожидаясь окончания списка сеансов
+        tasks = [
+            asyncio.create_task(self._aterminate_session(s, cluster_auth))
+            async for s in self._aiter_infobase_sessions(ib, cluster_auth)
+        ]
+        terminated = sum(await asyncio.gather(*tasks))
+        self._log_terminated_sessions(infobase, terminated, len(tasks), time_start)
+        return terminated
+
+    def _count_background_jobs(self, infobase: V8CInfobaseShort, output: str) -> int:
+        sessions = self._rac_output_to_objects(output, V8CSession)
+        return sum(1 for s in sessions if s.infobase == infobase.id and s.app_id == BACKGROUND_JOB_APP_ID)
+
+    def get_info_base_background_jobs_count(self, infobase: str) -> int:
+        """
+        Получает количество выполняющихся фоновых заданий информационной базы.
+        Сеансы запрашиваются у кластера каждый раз, минуя снимок сеансов, т.к. нужно актуальное состояние
+        :param infobase: имя информационной базы
+        """
+        ib = self._get_infobase_short(infobase)
+        output = self._rac_call(["session", "list", *self._with_cluster_auth(), f"--infobase={ib.id}"])
+        return self._count_background_jobs(ib, output)
+
+    async def aget_info_base_background_jobs_count(self, infobase: str) -> int:
+        ib = await self._aget_infobase_short(infobase)
+        output = await self._arac_call(["session", "list", *(await self._awith_cluster_auth()), f"--infobase={ib.id}"])
+        return self._count_background_jobs(ib, output)
 
     def get_info_base(self, infobase: str) -> V8CInfobase:
         """
@@ -141,6 +545,12 @@ class ClusterRACControler(ClusterControler):
         :param infobase: имя информационной базы
         """
         ib = self._get_infobase_short(infobase)
-        cmd = f"infobase info {self._with_cluster_auth()} {self._with_infobase_auth(ib)}"
-        output = self._rac_call(cmd)
+        output = self._rac_call(["infobase", "info", *self._with_cluster_auth(), *self._with_infobase_auth(ib)])
+        return self._rac_output_to_object(output, V8CInfobase)
+
+    async def aget_info_base(self, infobase: str) -> V8CInfobase:
+        ib = await self._aget_infobase_short(infobase)
+        output = await self._arac_call(
+            ["infobase", "info", *(await self._awith_cluster_auth()), *self._with_infobase_auth(ib)]
+        )
         return self._rac_output_to_object(output, V8CInfobase)
@@ -1,6 +1,6 @@
 import random
 import re
-from unittest.mock import Mock, PropertyMock
+from unittest.mock import AsyncMock, Mock, PropertyMock
 
 import pytest
 from pytest_mock import MockerFixture
@@ -83,13 +83,29 @@ def mock_connect_agent(mock_win32com_client_dispatch, mock_infobases_com_obj):
     type(agent_connection_mock.return_value).Authenticate = Mock()
     type(agent_connection_mock.return_value).GetClusters = Mock(return_value=["test_cluster01", "test_cluster02"])
 
-    working_process_mock = Mock()
-    type(working_process_mock).MainPort = random.randint(1000, 2000)
-    type(agent_connection_mock.return_value).GetWorkingProcesses = Mock(return_value=[working_process_mock])
-
-    type(agent_connection_mock.return_value).GetInfoBaseSessions = Mock(
-        side_effect=lambda cluster, info_base_short: [f"test_{info_base_short.Name}_session_{i}" for i in range(1, 5)]
-    )
+    working_processes = []
+    for main_port, running, available_performance, connections in (
+        (1560, 1, 100, 20),
+        (1561, 1, 150, 30),
+        (1562, 0, 300, 0),
+        (1563, 1, 150, 10),
+    ):
+        working_process_mock = Mock()
+        type(working_process_mock).MainPort = main_port
+        type(working_process_mock).Running = running
+        type(working_process_mock).AvailablePerformance = available_performance
+        type(working_process_mock).Connections = connections
+        working_processes.append(working_process_mock)
+    type(agent_connection_mock.return_value).GetWorkingProcesses = Mock(return_value=working_processes)
+
+    sessions = []
+    for infobase_com_obj in mock_infobases_com_obj.return_value:
+        for i in range(1, 5):
+            session_mock = Mock()
+            type(session_mock).SessionID = i
+            type(session_mock).infoBase = infobase_com_obj
+            sessions.append(session_mock)
+    type(agent_connection_mock.return_value).GetSessions = Mock(return_value=sessions)
 
     type(mock_win32com_client_dispatch.return_value).ConnectAgent = agent_connection_mock
     return agent_connection_mock
@@ -119,3 +135,118 @@ def mock_external_connection(mock_win32com_client_dispatch, mock_infobase_versio
     external_connection_mock = Mock(side_effect=external_connection_mock_side_effect)
     type(mock_win32com_client_dispatch.return_value).Connect = external_connection_mock
     return external_connection_mock
+
+
+@pytest.fixture(autouse=True)
+def reset_rac_inventory_cache():
+    from core.cluster.rac import ClusterRACControler, RACInventoryCache
+
+    from core.cluster.comcntr import ClusterCOMControler, COMConnectionPool, COMWorker
+    from core.cluster.utils import SessionsSnapshot
+
+    ClusterRACControler.inventory = RACInventoryCache()
+    ClusterRACControler.sessions = SessionsSnapshot()
+    ClusterCOMControler.connections = COMConnectionPool()
+    ClusterRACControler._rac_exec_path = None
+    yield ClusterRACControler.inventory
+    ClusterRACControler._rac_exec_path = None
+    COMWorker.shutdown()
+
+
+@pytest.fixture
+def mock_rac_cluster_output():
+    return (
+        "cluster                       : ceef02b4-da53-41bb-8332-fdc8fa7db83a\n"
+        "host                          : 1c01\n"
+        "port                          : 1541\n"
+        'name                          : "Главный кластер"\n'
+        "\n"
+    )
+
+
+@pytest.fixture
+def mock_rac_infobases_output(infobases):
+    return "".join(f"infobase : {random.randint(1000, 9999)}-{ib}\nname     : {ib}\ndescr    :\n\n" for ib in infobases)
+
+
+@pytest.fixture
+def mock_rac_sessions_output(mock_rac_infobases_output):
+    infobases_ids = re.findall(r"^infobase : (\S+)$", mock_rac_infobases_output, flags=re.MULTILINE)
+    return "".join(
+        f"session  : {ib_id[:4]}-session-{i}\nsession-id : {i}\ninfobase : {ib_id}\napp-id   : 1CV8C\n\n"
+        for ib_id in infobases_ids
+        for i in range(1, 4)
+    )
+
+
+@pytest.fixture
+def mock_rac_check_output(
+    mocker: MockerFixture,
+    mock_get_1cv8_service_full_path,
+    mock_rac_cluster_output,
+    mock_rac_infobases_output,
+    mock_rac_sessions_output,
+):
+    def check_output_side_effect(call_args, *args, **kwargs):
+        call_str = " ".join(call_args)
+        if "cluster list" in call_str:
+            return mock_rac_cluster_output
+        if "infobase summary list" in call_str:
+            return mock_rac_infobases_output
+        if "session list" in call_str:
+            return mock_rac_sessions_output
+        return ""
+
+    return mocker.patch("subprocess.check_output", side_effect=check_output_side_effect)
+
+
+def mock_rac_process(output: bytes, returncode: int = 0):
+    """
+    Процесс rac, запущенный через `asyncio.create_subprocess_exec`.
+    Вывод доступен как через `communicate`, так и построчно через `stdout`.
+    При ненулевом коде возврата построчный вывод пуст, а сообщение об ошибке попадает в `stderr`
+    """
+    rac_process_mock = AsyncMock()
+    rac_process_mock.returncode = returncode
+    rac_process_mock.communicate.return_value = (output, None)
+    rac_process_mock.wait.return_value = returncode
+    rac_process_mock.kill = Mock()
+
+    async def stdout():
+        for line in output.splitlines(keepends=True) if not returncode else []:
+            yield line
+
+    rac_process_mock.stdout = stdout()
+    rac_process_mock.stderr.read.return_value = output if returncode else b""
+    return rac_process_mock
+
+
+@pytest.fixture
+def mock_rac_subprocess_exec(
+    mocker: MockerFixture,
+    mock_get_1cv8_service_full_path,
+    mock_rac_cluster_output,
+    mock_rac_infobases_output,
+    mock_rac_sessions_output,
+):
+    def create_subprocess_exec_side_effect(*args, **kwargs):
+        call_str = " ".join(args)
+        if "cluster list" in call_str:
+            output = mock_rac_cluster_output
+        elif "infobase summary list" in call_str:
+            output = mock_rac_infobases_output
+        elif "infobase info" in call_str:
+            output = mock_rac_infobases_output.split("\n\n")[0] + "\n\n"
+        elif "session list" in call_str:
+            output = mock_rac_sessions_output
+        else:
+            output = ""
+        return mock_rac_process(output.encode("utf-8"))
+
+    return mocker.patch("asyncio.create_subprocess_exec", side_effect=create_subprocess_exec_side_effect)
+
+
+@pytest.fixture
+def mock_rac_subprocess_exec_failed(mocker: MockerFixture, mock_get_1cv8_service_full_path):
+    rac_process_mock = mock_rac_process("Информационная база не найдена".encode("utf-8"), returncode=1)
+    return mocker.patch("asyncio.create_subprocess_exec", return_value=rac_process_mock)
@@ -17,6 +17,7 @@ from core import models as core_models
 from core.cluster.comcntr import ClusterCOMControler
 from core.cluster.rac import ClusterRACControler
 from core.cluster.utils import (
+    SessionsSnapshot,
     com_func_wrapper,
     get_cluster_controller,
     get_cluster_controller_class,
@@ -103,3 +104,41 @@ async def test_com_func_wrapper_handle_v8_exception(infobase, mock_connect_agent
     result = await com_func_wrapper(coroutine_mock, infobase)
     assert result.infobase_name == infobase
     assert result.succeeded is False
+
+
+def test_sessions_snapshot_is_not_reused_after_infobase_lock():
+    """
+    Sessions of infobase are not taken from snapshot which was taken before infobase lock
+    """
+    snapshot = SessionsSnapshot()
+    snapshot.update(["a1", "b1"], key=lambda s: s[0], started_at=snapshot.start_update())
+    assert snapshot.take("a") == ["a1"]
+    snapshot.mark_locked("b")
+    assert snapshot.take("b") is None
+    snapshot.update(["b1", "b2"], key=lambda s: s[0], started_at=snapshot.start_update())
+    assert snapshot.take("b") == ["b1", "b2"]
+
+
+def test_sessions_snapshot_taken_after_lock_is_shared_by_locked_infobases():
+    """
+    Snapshot taken after locks of several infobases is used for all of them
+    """
+    snapshot = SessionsSnapshot()
+    snapshot.mark_locked("a")
+    snapshot.mark_locked("b")
+    snapshot.update(["a1", "b1"], key=lambda s: s[0], started_at=snapshot.start_update())
+    assert snapshot.take("a") == ["a1"]
+    assert snapshot.take("b") == ["b1"]
+
+
+def test_sessions_snapshot_started_before_lock_is_not_used_for_locked_infobase():
+    """
+    Sessions of infobase are not taken from snapshot which was requested before infobase lock
+    and received after it
+    """
+    snapshot = SessionsSnapshot()
+    started_at = snapshot.start_update()
+    snapshot.mark_locked("b")
+    snapshot.update(["a1", "b1"], key=lambda s: s[0], started_at=started_at)
+    assert snapshot.take("a") == ["a1"]
+    assert snapshot.take("b") is None
@@ -1,9 +1,11 @@
-from unittest.mock import PropertyMock
+import threading
+from unittest.mock import Mock, PropertyMock
 
+import pytest
 from pytest_mock import MockerFixture
 
 from conf import settings
-from core.cluster.comcntr import ClusterCOMControler
+from core.cluster.comcntr import ClusterCOMControler, COMWorker
 from core.cluster.utils import get_server_agent_address, get_server_agent_port
 
 
@@ -33,9 +35,18 @@ def test_get_server_agent_port_is_str():
 
 def test_cluster_com_control_interface_initialization(mock_win32com_client_dispatch):
     """
-    ClusterCOMControler instance is initialized sucessfully
+    ClusterCOMControler instance is initialized sucessfully without creating COMConnector
     """
     ClusterCOMControler()
+    mock_win32com_client_dispatch.assert_not_called()
+
+
+def test_cluster_com_control_interface_creates_com_connector_once(mock_win32com_client_dispatch):
+    """
+    COMConnector is created once on first access
+    """
+    cci = ClusterCOMControler()
+    assert cci.V8COMConnector is cci.V8COMConnector
     mock_win32com_client_dispatch.assert_called_once()
 
 
@@ -254,13 +265,71 @@ def test_cluster_com_control_interface_unlock_info_base_set_scheduled_jobs_denie
     assert infobase_com_obj.ScheduledJobsDenied is False
 
 
-def test_cluster_com_control_interface_terminate_info_base_sessions_get_infobase_session(infobase, mock_connect_agent):
+def test_cluster_com_control_interface_terminate_info_base_sessions_get_sessions(infobase, mock_connect_agent):
     """
-    `terminate_info_base_sessions` calls `IServerAgentConnection.GetInfoBaseSessions`
+    `terminate_info_base_sessions` calls `IServerAgentConnection.GetSessions`
     """
     cci = ClusterCOMControler()
     cci.terminate_info_base_sessions(infobase)
-    mock_connect_agent.return_value.GetInfoBaseSessions.assert_called()
+    mock_connect_agent.return_value.GetSessions.assert_called()
+
+
+def test_cluster_com_control_interface_terminate_info_base_sessions_reuses_snapshot(infobases, mock_connect_agent):
+    """
+    `terminate_info_base_sessions` takes sessions snapshot once for all infobases
+    """
+    for infobase in infobases:
+        ClusterCOMControler().terminate_info_base_sessions(infobase)
+    mock_connect_agent.return_value.GetSessions.assert_called_once()
+
+
+def test_cluster_com_control_interface_terminate_info_base_sessions_refreshes_snapshot_after_lock(
+    infobases, mock_connect_agent, mock_connect_working_process
+):
+    """
+    `terminate_info_base_sessions` refreshes sessions snapshot when infobase was locked after the snapshot
+    """
+    ClusterCOMControler().terminate_info_base_sessions(infobases[0])
+    ClusterCOMControler().lock_info_base(infobases[1])
+    ClusterCOMControler().terminate_info_base_sessions(infobases[1])
+    assert mock_connect_agent.return_value.GetSessions.call_count == 2
+
+
+def test_cluster_com_control_interface_terminate_info_base_sessions_refreshes_snapshot_on_retry(
+    infobase, mock_connect_agent
+):
+    """
+    `terminate_info_base_sessions` refreshes sessions snapshot when called for the same infobase again
+    """
+    cci = ClusterCOMControler()
+    cci.terminate_info_base_sessions(infobase)
+    cci.terminate_info_base_sessions(infobase)
+    assert mock_connect_agent.return_value.GetSessions.call_count == 2
+
+
+def test_cluster_com_control_interface_terminate_info_base_sessions_terminates_only_infobase_sessions(
+    infobase, mock_connect_agent
+):
+    """
+    `terminate_info_base_sessions` terminates sessions of exact infobase only
+    """
+    cci = ClusterCOMControler()
+    result = cci.terminate_info_base_sessions(infobase)
+    terminate_calls = mock_connect_agent.return_value.TerminateSession.call_args_list
+    assert result == len(terminate_calls)
+    assert all(c.args[1].infoBase.Name == infobase for c in terminate_calls)
+
+
+def test_cluster_com_control_interface_terminate_info_base_sessions_ignores_finished_sessions(
+    infobase, mock_connect_agent
+):
+    """
+    `terminate_info_base_sessions` does not fail when session is already finished
+    """
+    mock_connect_agent.return_value.TerminateSession.side_effect = [Exception("session not found"), None, None, None]
+    cci = ClusterCOMControler()
+    result = cci.terminate_info_base_sessions(infobase)
+    assert result == 3
 
 
 def test_cluster_com_control_interface_terminate_info_base_sessions_terminate_session(infobase, mock_connect_agent):
@@ -303,3 +372,191 @@ def test_get_info_bases_returns_exact_only_infobases(
     cci = ClusterCOMControler()
     result = cci.get_info_bases()
     assert all(infobase in mock_only_infobases for infobase in result)
+
+
+@pytest.mark.asyncio
+async def test_cluster_com_control_interface_async_calls_run_in_com_worker_thread(
+    mocker: MockerFixture, infobase, mock_connect_agent, mock_connect_working_process
+):
+    """
+    Async methods make COM calls in COM worker thread instead of event loop thread
+    """
+    com_threads = set()
+    get_info_bases_mock = mock_connect_working_process.return_value.GetInfoBases
+    infobases_com_obj = get_info_bases_mock.return_value
+
+    def get_info_bases():
+        com_threads.add(threading.current_thread())
+        return infobases_com_obj
+
+    get_info_bases_mock.side_effect = get_info_bases
+    await ClusterCOMControler().aget_info_base(infobase)
+    await ClusterCOMControler().aunlock_info_base(infobase)
+    assert len(com_threads) == 1
+    assert threading.current_thread() not in com_threads
+
+
+@pytest.mark.asyncio
+async def test_cluster_com_control_interface_async_calls_share_agent_connection(
+    infobase, mock_connect_agent, mock_connect_working_process
+):
+    """
+    COM worker keeps COMConnector and agent connection between calls
+    """
+    await ClusterCOMControler().aterminate_info_base_sessions(infobase)
+    await ClusterCOMControler().aterminate_info_base_sessions(infobase)
+    mock_connect_agent.assert_called_once()
+
+
+def _connection_lost_error() -> Exception:
+    # RPC_E_DISCONNECTED, pywintypes.com_error holds HRESULT as a signed integer
+    return Exception(-2147417848, "connection lost", None, None)
+
+
+@pytest.mark.asyncio
+async def test_cluster_com_control_interface_async_call_reconnects_on_com_error(
+    infobase, mock_connect_agent, mock_connect_working_process
+):
+    """
+    COM worker reconnects and repeats call once when COM call fails
+    """
+    await ClusterCOMControler().aget_info_base(infobase)
+    get_info_bases_mock = mock_connect_working_process.return_value.GetInfoBases
+    get_info_bases_mock.side_effect = [_connection_lost_error(), get_info_bases_mock.return_value]
+    result = await ClusterCOMControler().aget_info_base(infobase)
+    assert result.name == infobase
+    assert mock_connect_agent.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_cluster_com_control_interface_async_call_raises_when_reconnect_fails(
+    infobase, mock_connect_agent, mock_connect_working_process
+):
+    """
+    COM worker raises COM error when repeated call fails too
+    """
+    mock_connect_working_process.return_value.GetInfoBases.side_effect = _connection_lost_error()
+    with pytest.raises(Exception, match="connection lost"):
+        await ClusterCOMControler().aget_info_base(infobase)
+    assert COMWorker.get_instance()._controler is not None
+
+
+@pytest.mark.asyncio
+async def test_cluster_com_control_interface_async_call_does_not_repeat_application_error(
+    infobase, mock_connect_agent, mock_connect_working_process
+):
+    """
+    COM worker does not reconnect and does not repeat call when COM call returns application error
+    """
+    get_info_bases_mock = mock_connect_working_process.return_value.GetInfoBases
+    # DISP_E_EXCEPTION
+    get_info_bases_mock.side_effect = Exception(-2147352567, "Exception occurred.", None, None)
+    with pytest.raises(Exception, match="Exception occurred"):
+        await ClusterCOMControler().aget_info_base(infobase)
+    get_info_bases_mock.assert_called_once()
+    mock_connect_agent.assert_called_once()
+
+
+def test_com_worker_shutdown_releases_com_objects_in_worker_thread(mocker: MockerFixture):
+    """
+    `COMWorker.shutdown` releases COM objects and uninitializes COM in worker thread
+    """
+    threads = []
+    mocker.patch(
+        "core.cluster.comcntr.pythoncom.CoUninitialize", side_effect=lambda: threads.append(threading.current_thread())
+    )
+    worker = COMWorker.get_instance()
+    worker._get_controler()
+    ClusterCOMControler.shutdown()
+    assert worker._controler is None
+    assert len(threads) == 1
+    assert threads[0].name.startswith("com-worker")
+    assert COMWorker._instance is None
+
+
+def test_cluster_com_control_interface_connects_to_least_loaded_working_process(
+    mock_win32com_client_dispatch, mock_connect_agent, mock_connect_working_process
+):
+    """
+    `get_working_process_connection` connects to running working process with max available performance
+    and min connections count
+    """
+    cci = ClusterCOMControler()
+    cci.get_working_process_connection()
+    mock_connect_working_process.assert_called_once_with(f"tcp://{cci.server}:1563")
+
+
+def test_cluster_com_control_interface_reuses_working_process_connection(
+    infobase, mock_connect_agent, mock_connect_working_process
+):
+    """
+    Working process connection with infobases auth is created once for all controller instances
+    """
+    ClusterCOMControler().lock_info_base(infobase)
+    ClusterCOMControler().unlock_info_base(infobase)
+    mock_connect_working_process.assert_called_once()
+    mock_connect_working_process.return_value.AuthenticateAdmin.assert_called_once()
+
+
+def test_cluster_com_control_interface_reuses_agent_connection(infobase, mock_connect_agent):
+    """
+    Agent connection is created once for all controller instances
+    """
+    ClusterCOMControler().terminate_info_base_sessions(infobase)
+    ClusterCOMControler().terminate_info_base_sessions(infobase)
+    mock_connect_agent.assert_called_once()
+    mock_connect_agent.return_value.Authenticate.assert_called_once()
+
+
+def test_cluster_com_control_interface_reconnects_when_health_check_fails(
+    mocker: MockerFixture, infobase, mock_connect_agent, mock_connect_working_process
+):
+    """
+    Broken pooled connections are recreated when health check fails
+    """
+    mocker.patch("conf.settings.V8_COM_CONNECTION_CHECK_INTERVAL", new_callable=PropertyMock(return_value=0))
+    ClusterCOMControler().unlock_info_base(infobase)
+    mock_connect_working_process.return_value.GetInfoBases.side_effect = [
+        Exception("connection lost"),
+        *[mock_connect_working_process.return_value.GetInfoBases.return_value] * 2,
+    ]
+    ClusterCOMControler().unlock_info_base(infobase)
+    assert mock_connect_working_process.call_count == 2
+
+
+def test_cluster_com_control_interface_keeps_connection_when_health_check_passes(
+    mocker: MockerFixture, infobase, mock_connect_agent, mock_connect_working_process
+):
+    """
+    Pooled connections are reused when health check passes
+    """
+    mocker.patch("conf.settings.V8_COM_CONNECTION_CHECK_INTERVAL", new_callable=PropertyMock(return_value=0))
+    ClusterCOMControler().unlock_info_base(infobase)
+    ClusterCOMControler().unlock_info_base(infobase)
+    mock_connect_working_process.assert_called_once()
+    mock_connect_agent.assert_called_once()
+
+
+def test_cluster_com_control_interface_background_jobs_count(infobase, mock_connect_agent):
+    """
+    `get_info_base_background_jobs_count` counts sessions of background jobs
+    """
+    sessions = []
+    for app_id in ("BackgroundJob", "1CV8C", "BackgroundJob"):
+        session_mock = Mock()
+        type(session_mock).AppID = app_id
+        sessions.append(session_mock)
+    type(mock_connect_agent.return_value).GetInfoBaseSessions = Mock(return_value=sessions)
+    cci = ClusterCOMControler()
+    assert cci.get_info_base_background_jobs_count(infobase) == 2
+
+
+def test_cluster_com_control_interface_sessions_snapshot_is_not_shared_between_threads(infobases, mock_connect_agent):
+    """
+    Sessions snapshot taken in one thread is not used in another thread, because COM objects belong to the thread
+    """
+    ClusterCOMControler().terminate_info_base_sessions(infobases[0])
+    thread = threading.Thread(target=ClusterCOMControler().terminate_info_base_sessions, args=(infobases[1],))
+    thread.start()
+    thread.join()
+    assert mock_connect_agent.return_value.GetSessions.call_count == 2
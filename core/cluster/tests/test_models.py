@@ -0,0 +1,63 @@
+from datetime import datetime
+
+from core.cluster.models import V8CInfobase, V8CSession
+
+
+def test_v8c_model_coerces_int_values():
+    """
+    Int fields are converted from strings to int
+    """
+    session = V8CSession(session_id="12", memory_total="1024")
+    assert session.session_id == 12
+    assert session.memory_total == 1024
+
+
+def test_v8c_model_coerces_bool_values():
+    """
+    Bool fields are converted from `on`/`off` and `yes`/`no` strings to bool
+    """
+    infobase = V8CInfobase(sessions_deny="on", scheduled_jobs_deny="off", external_session_manager_required="no")
+    assert infobase.sessions_deny is True
+    assert infobase.scheduled_jobs_deny is False
+    assert infobase.external_session_manager_required is False
+
+
+def test_v8c_model_coerces_datetime_values():
+    """
+    Datetime fields are converted from ISO strings to datetime
+    """
+    session = V8CSession(started_at="2023-05-16T10:12:03")
+    assert session.started_at == datetime(2023, 5, 16, 10, 12, 3)
+
+
+def test_v8c_model_converts_empty_typed_values_to_none():
+    """
+    Empty strings of typed fields are converted to None
+    """
+    infobase = V8CInfobase(denied_from="", denied_message="")
+    assert infobase.denied_from is None
+    assert infobase.denied_message == ""
+
+
+def test_v8c_model_keeps_raw_value_when_coercion_fails():
+    """
+    Raw string is kept when value can not be converted
+    """
+    session = V8CSession(hibernate="maybe", session_id="abc")
+    assert session.hibernate == "maybe"
+    assert session.session_id == "abc"
+
+
+def test_v8c_model_ignores_unknown_keys():
+    """
+    Keys which are not declared in model are ignored
+    """
+    session = V8CSession(session="1", unknown_key="value")
+    assert not hasattr(session, "unknown_key")
+
+
+def test_v8c_model_uses_slots():
+    """
+    Model instances have no `__dict__`
+    """
+    assert not hasattr(V8CInfobase(name="test"), "__dict__")
@@ -1,6 +1,14 @@
+import asyncio
+import subprocess
 import textwrap
-from core.cluster.models import V8CCluster, V8CInfobase
+from unittest.mock import AsyncMock, PropertyMock
+
+import pytest
+from pytest_mock import MockerFixture
+
+from core.cluster.models import V8CCluster, V8CInfobase, V8CInfobaseShort
 from core.cluster.rac import ClusterRACControler
+from core.exceptions import RACException
 
 
 def test_cluster_rac_control_interface_parse_cluster():
@@ -125,3 +133,375 @@ def test_cluster_rac_control_interface_parse_infobase():
     )
     constructed_object = ClusterRACControler()._rac_output_to_object(cluster_output, V8CInfobase)
     assert constructed_object == reference_object
+
+
+def test_cluster_rac_control_interface_caches_cluster(mock_rac_check_output):
+    """
+    `_get_cluster` calls `rac cluster list` only once while inventory cache is alive
+    """
+    rac = ClusterRACControler()
+    rac._get_cluster()
+    rac._get_cluster()
+    assert mock_rac_check_output.call_count == 1
+
+
+def test_cluster_rac_control_interface_caches_cluster_between_instances(mock_rac_check_output):
+    """
+    Inventory cache is shared between `ClusterRACControler` instances
+    """
+    ClusterRACControler()._get_cluster()
+    ClusterRACControler()._get_cluster()
+    assert mock_rac_check_output.call_count == 1
+
+
+def test_cluster_rac_control_interface_caches_infobases(infobase, mock_rac_check_output):
+    """
+    `_get_infobase_short` does not call `rac infobase summary list` again while inventory cache is alive
+    """
+    rac = ClusterRACControler()
+    rac._get_infobase_short(infobase)
+    calls_count = mock_rac_check_output.call_count
+    infobase_obj = rac._get_infobase_short(infobase.upper())
+    assert mock_rac_check_output.call_count == calls_count
+    assert infobase_obj.name == infobase
+
+
+def test_cluster_rac_control_interface_does_not_cache_when_ttl_is_zero(mocker: MockerFixture, mock_rac_check_output):
+    """
+    Inventory cache is disabled when `V8_RAC_INVENTORY_CACHE_TTL` is 0
+    """
+    mocker.patch("conf.settings.V8_RAC_INVENTORY_CACHE_TTL", new_callable=PropertyMock(return_value=0))
+    rac = ClusterRACControler()
+    rac._get_cluster()
+    rac._get_cluster()
+    assert mock_rac_check_output.call_count == 2
+
+
+def test_cluster_rac_control_interface_invalidates_cache_when_not_found(
+    mocker: MockerFixture, infobase, mock_rac_check_output
+):
+    """
+    Inventory cache is invalidated when rac returns "not found"
+    """
+    rac = ClusterRACControler()
+    rac._get_infobase_short(infobase)
+    mocker.patch(
+        "subprocess.check_output",
+        side_effect=subprocess.CalledProcessError(1, "rac", output="Информационная база не найдена"),
+    )
+    with pytest.raises(RACException):
+        rac.get_info_base(infobase)
+    assert rac.inventory.get_cluster() is None
+
+
+def test_cluster_rac_control_interface_counts_cache_statistics(infobase, mock_rac_check_output):
+    """
+    Inventory cache counts hits, misses and avoided rac spawns
+    """
+    rac = ClusterRACControler()
+    rac._get_cluster()
+    rac._get_cluster()
+    assert rac.inventory.misses == 1
+    assert rac.inventory.hits == 1
+    assert rac.inventory.spawns_avoided == 1
+
+
+def _rac_exec_calls(mock_rac_subprocess_exec):
+    return [" ".join(c.args) for c in mock_rac_subprocess_exec.call_args_list]
+
+
+@pytest.mark.asyncio
+async def test_cluster_rac_control_interface_async_get_cluster_info_bases(infobases, mock_rac_subprocess_exec):
+    """
+    `aget_cluster_info_bases` returns infobases parsed from async rac call
+    """
+    result = await ClusterRACControler().aget_cluster_info_bases()
+    assert [ib.name for ib in result] == infobases
+
+
+@pytest.mark.asyncio
+async def test_cluster_rac_control_interface_async_lock_info_base(infobase, mock_rac_subprocess_exec):
+    """
+    `alock_info_base` calls `rac infobase update` with sessions and scheduled jobs denied
+    """
+    await ClusterRACControler().alock_info_base(infobase, "1234")
+    update_call = _rac_exec_calls(mock_rac_subprocess_exec)[-1]
+    assert "infobase update" in update_call
+    assert "--sessions-deny=on" in update_call
+    assert "--scheduled-jobs-deny=on" in update_call
+    assert "--permission-code=1234" in update_call
+
+
+@pytest.mark.asyncio
+async def test_cluster_rac_control_interface_async_lock_info_base_passes_message_as_single_argument(
+    infobase, mock_rac_subprocess_exec
+):
+    """
+    `alock_info_base` passes denied message with spaces as single rac argument
+    """
+    message = "test denied message"
+    await ClusterRACControler().alock_info_base(infobase, "1234", message)
+    assert f"--denied-message={message}" in mock_rac_subprocess_exec.call_args_list[-1].args
+
+
+@pytest.mark.asyncio
+async def test_cluster_rac_control_interface_async_unlock_info_base(infobase, mock_rac_subprocess_exec):
+    """
+    `aunlock_info_base` calls `rac infobase update` with sessions and scheduled jobs allowed
+    """
+    await ClusterRACControler().aunlock_info_base(infobase)
+    update_call = _rac_exec_calls(mock_rac_subprocess_exec)[-1]
+    assert "infobase update" in update_call
+    assert "--sessions-deny=off" in update_call
+    assert "--scheduled-jobs-deny=off" in update_call
+
+
+@pytest.mark.asyncio
+async def test_cluster_rac_control_interface_async_get_info_base(infobase, mock_rac_subprocess_exec):
+    """
+    `aget_info_base` calls `rac infobase info`
+    """
+    await ClusterRACControler().aget_info_base(infobase)
+    assert "infobase info" in _rac_exec_calls(mock_rac_subprocess_exec)[-1]
+
+
+@pytest.mark.asyncio
+async def test_cluster_rac_control_interface_async_call_raises_when_failed(infobase, mock_rac_subprocess_exec_failed):
+    """
+    `_arac_call` raises `RACException` when rac returns non-zero return code
+    """
+    with pytest.raises(RACException):
+        await ClusterRACControler()._arac_call(["cluster", "list"])
+
+
+@pytest.mark.asyncio
+async def test_cluster_rac_control_interface_async_call_is_bounded_by_semaphore(
+    mocker: MockerFixture, mock_rac_subprocess_exec
+):
+    """
+    Concurrent rac processes are bounded by `V8_RAC_CONCURRENCY`
+    """
+    mocker.patch("conf.settings.V8_RAC_CONCURRENCY", new_callable=PropertyMock(return_value=2))
+    running = 0
+    max_running = 0
+
+    async def communicate():
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return b"", None
+
+    rac_process_mock = AsyncMock()
+    rac_process_mock.returncode = 0
+    rac_process_mock.communicate.side_effect = communicate
+    mock_rac_subprocess_exec.side_effect = None
+    mock_rac_subprocess_exec.return_value = rac_process_mock
+    rac = ClusterRACControler()
+    await asyncio.gather(*[rac._arac_call(["cluster", "list"]) for _ in range(5)])
+    assert max_running == 2
+
+
+@pytest.mark.asyncio
+async def test_cluster_rac_control_interface_resolves_rac_path_once(
+    infobase, mock_get_1cv8_service_full_path, mock_rac_subprocess_exec
+):
+    """
+    Path to rac executable is resolved only once for all rac calls
+    """
+    await ClusterRACControler().aget_info_base(infobase)
+    await ClusterRACControler().aunlock_info_base(infobase)
+    mock_get_1cv8_service_full_path.assert_called_once_with("rac")
+
+
+@pytest.mark.asyncio
+async def test_cluster_rac_control_interface_async_terminate_sessions_lists_cluster_sessions_once(
+    infobases, mock_rac_subprocess_exec
+):
+    """
+    `aterminate_info_base_sessions` lists sessions of whole cluster once for all infobases
+    """
+    for infobase in infobases:
+        await ClusterRACControler().aterminate_info_base_sessions(infobase)
+    session_list_calls = [c for c in _rac_exec_calls(mock_rac_subprocess_exec) if "session list" in c]
+    assert len(session_list_calls) == 1
+    assert "--infobase" not in session_list_calls[0]
+
+
+@pytest.mark.asyncio
+async def test_cluster_rac_control_interface_async_terminate_sessions_relists_sessions_after_lock(
+    infobases, mock_rac_subprocess_exec
+):
+    """
+    `aterminate_info_base_sessions` lists sessions again when infobase was locked after sessions snapshot
+    """
+    await ClusterRACControler().aterminate_info_base_sessions(infobases[0])
+    await ClusterRACControler().alock_info_base(infobases[1])
+    await ClusterRACControler().aterminate_info_base_sessions(infobases[1])
+    session_list_calls = [c for c in _rac_exec_calls(mock_rac_subprocess_exec) if "session list" in c]
+    assert len(session_list_calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_cluster_rac_control_interface_async_terminate_sessions_terminates_only_infobase_sessions(
+    infobase, mock_rac_subprocess_exec
+):
+    """
+    `aterminate_info_base_sessions` terminates sessions of exact infobase only
+    """
+    rac = ClusterRACControler()
+    ib = await rac._aget_infobase_short(infobase)
+    result = await rac.aterminate_info_base_sessions(infobase)
+    terminate_calls = [c for c in _rac_exec_calls(mock_rac_subprocess_exec) if "session terminate" in c]
+    assert result == len(terminate_calls) == 3
+    assert all(f"--session={ib.id[:4]}-session-" in c for c in terminate_calls)
+
+
+@pytest.mark.asyncio
+async def test_cluster_rac_control_interface_async_terminate_sessions_refreshes_snapshot_on_retry(
+    infobase, mock_rac_subprocess_exec
+):
+    """
+    `aterminate_info_base_sessions` refreshes sessions snapshot when called for the same infobase again
+    """
+    rac = ClusterRACControler()
+    await rac.aterminate_info_base_sessions(infobase)
+    await rac.aterminate_info_base_sessions(infobase)
+    session_list_calls = [c for c in _rac_exec_calls(mock_rac_subprocess_exec) if "session list" in c]
+    assert len(session_list_calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_cluster_rac_control_interface_async_terminate_sessions_ignores_finished_sessions(
+    infobase, mock_rac_subprocess_exec
+):
+    """
+    `aterminate_info_base_sessions` ignores sessions which are already finished and keeps inventory cache
+    """
+    create_subprocess_exec_side_effect = mock_rac_subprocess_exec.side_effect
+
+    def side_effect(*args, **kwargs):
+        rac_process_mock = create_subprocess_exec_side_effect(*args, **kwargs)
+        if "session terminate" in " ".join(args):
+            rac_process_mock.returncode = 1
+            rac_process_mock.communicate.return_value = ("Сеанс не найден".encode("utf-8"), None)
+        return rac_process_mock
+
+    mock_rac_subprocess_exec.side_effect = side_effect
+    rac = ClusterRACControler()
+    result = await rac.aterminate_info_base_sessions(infobase)
+    assert result == 0
+    assert rac.inventory.get_cluster() is not None
+
+
+def test_cluster_rac_control_interface_terminate_sessions(infobase, mock_rac_check_output):
+    """
+    `terminate_info_base_sessions` terminates infobase sessions from cluster sessions snapshot
+    """
+    result = ClusterRACControler().terminate_info_base_sessions(infobase)
+    calls = [" ".join(c.args[0]) for c in mock_rac_check_output.call_args_list]
+    assert result == len([c for c in calls if "session terminate" in c]) == 3
+
+
+def test_cluster_rac_control_interface_parse_output_without_trailing_blank_line(infobases, mock_rac_infobases_output):
+    """
+    `_rac_output_to_objects` does not lose the last object when output has no trailing blank line
+    """
+    result = ClusterRACControler()._rac_output_to_objects(mock_rac_infobases_output.rstrip(), V8CInfobaseShort)
+    assert [ib.name for ib in result] == infobases
+
+
+def test_cluster_rac_control_interface_parse_output_skips_extra_blank_lines(infobases, mock_rac_infobases_output):
+    """
+    `_rac_output_to_objects` does not create empty objects for consecutive blank lines
+    """
+    output = mock_rac_infobases_output.replace("\n\n", "\n\n\n")
+    result = ClusterRACControler()._rac_output_to_objects(output, V8CInfobaseShort)
+    assert len(result) == len(infobases)
+
+
+@pytest.mark.asyncio
+async def test_cluster_rac_control_interface_async_stream_yields_objects(infobases, mock_rac_subprocess_exec):
+    """
+    `_arac_stream` yields objects parsed from rac stdout
+    """
+    rac = ClusterRACControler()
+    result = [ib async for ib in rac._arac_stream(["infobase", "summary", "list"], V8CInfobaseShort)]
+    assert [ib.name for ib in result] == infobases
+
+
+@pytest.mark.asyncio
+async def test_cluster_rac_control_interface_async_stream_raises_when_failed(mock_rac_subprocess_exec_failed):
+    """
+    `_arac_stream` raises `RACException` with stderr when rac returns non-zero return code
+    """
+    rac = ClusterRACControler()
+    with pytest.raises(RACException, match="не найдена"):
+        [ib async for ib in rac._arac_stream(["infobase", "summary", "list"], V8CInfobaseShort)]
+
+
+@pytest.mark.asyncio
+async def test_cluster_rac_control_interface_async_terminate_sessions_starts_before_rac_exits(
+    infobase, mock_rac_subprocess_exec, mock_rac_sessions_output
+):
+    """
+    `aterminate_info_base_sessions` starts terminating sessions while `rac session list` is still running
+    """
+    rac = ClusterRACControler()
+    session_list_finished = False
+    terminated_before_finish = []
+    create_subprocess_exec_side_effect = mock_rac_subprocess_exec.side_effect
+
+    async def stdout():
+        nonlocal session_list_finished
+        for line in mock_rac_sessions_output.splitlines(keepends=True):
+            yield line.encode("utf-8")
+            await asyncio.sleep(0)
+        session_list_finished = True
+
+    def side_effect(*args, **kwargs):
+        rac_process_mock = create_subprocess_exec_side_effect(*args, **kwargs)
+        call_str = " ".join(args)
+        if "session list" in call_str:
+            rac_process_mock.stdout = stdout()
+        if "session terminate" in call_str:
+            terminated_before_finish.append(not session_list_finished)
+        return rac_process_mock
+
+    mock_rac_subprocess_exec.side_effect = side_effect
+    result = await rac.aterminate_info_base_sessions(infobase)
+    assert result == 3
+    assert all(terminated_before_finish)
+
+
+@pytest.mark.asyncio
+async def test_cluster_rac_control_interface_async_background_jobs_count(
+    mocker: MockerFixture, infobase, mock_rac_subprocess_exec
+):
+    """
+    `aget_info_base_background_jobs_count` counts background job sessions of exact infobase
+    """
+    rac = ClusterRACControler()
+    ib = await rac._aget_infobase_short(infobase)
+    output = (
+        f"session : 1\ninfobase : {ib.id}\napp-id : BackgroundJob\n\n"
+        f"session : 2\ninfobase : {ib.id}\napp-id : 1CV8C\n\n"
+        f"session : 3\ninfobase : other\napp-id : BackgroundJob\n\n"
+    )
+    arac_call_mock = mocker.patch.object(rac, "_arac_call", AsyncMock(return_value=output))
+    assert await rac.aget_info_base_background_jobs_count(infobase) == 1
+    assert f"--infobase={ib.id}" in arac_call_mock.call_args.args[0]
+
+
+def test_cluster_rac_control_interface_background_jobs_count_bypasses_sessions_snapshot(
+    infobase, mock_rac_check_output
+):
+    """
+    `get_info_base_background_jobs_count` lists sessions every time instead of using sessions snapshot
+    """
+    rac = ClusterRACControler()
+    assert rac.get_info_base_background_jobs_count(infobase) == 0
+    rac.get_info_base_background_jobs_count(infobase)
+    calls = [" ".join(c.args[0]) for c in mock_rac_check_output.call_args_list]
+    assert len([c for c in calls if "session list" in c]) == 2
@@ -9,6 +9,9 @@ except ImportError:
     pywintypes.com_error = Exception
 
 import logging
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, Iterable, List, Optional
 
 import core.models as core_models
 from conf import settings
@@ -18,6 +21,84 @@ log = logging.getLogger(__name__)
 
 RAC_CLUSTER_CONTROL_MODE = "rac"
 COM_CLUSTER_CONTROL_MODE = "com"
+# Идентификатор приложения сеанса фонового задания
+BACKGROUND_JOB_APP_ID = "BackgroundJob"
+
+
+class SessionsSnapshot:
+    """
+    Снимок сеансов всего кластера, сгруппированных по информационным базам.
+    Один снимок используется для всех ИБ в течение V8_SESSIONS_SNAPSHOT_TTL секунд,
+    чтобы не запрашивать список сеансов отдельно для каждой ИБ.
+    Для заблокированной ИБ используется только снимок, получение которого начато после блокировки: сеансы,
+    подключившиеся к ИБ после начала получения более старого снимка, иначе остались бы незавершёнными
+    """
+
+    def __init__(self):
+        # Счётчик событий: начала получения снимка и блокировки ИБ.
+        # По нему определяется, начато ли получение снимка после блокировки ИБ
+        self._clock = 0
+        # Отметка начала получения текущего снимка
+        self._started_at = 0
+        # Ключ ИБ - отметка блокировки ИБ
+        self._locked_at: Dict[str, int] = dict()
+        self.invalidate()
+
+    def _tick(self) -> int:
+        self._clock += 1
+        return self._clock
+
+    def is_alive(self) -> bool:
+        return self._sessions is not None and time.monotonic() < self._expires_at
+
+    def start_update(self) -> int:
+        """
+        Отмечает начало получения списка сеансов. Вызывается перед запросом сеансов кластера
+        :return: отметка, которая передаётся в `update` вместе с полученными сеансами
+        """
+        return self._tick()
+
+    def update(self, sessions: Iterable[Any], key: Callable[[Any], str], started_at: int):
+        """
+        Заменяет снимок новым списком сеансов
+        :param sessions: сеансы всего кластера
+        :param key: функция, возвращающая ключ ИБ для сеанса
+        :param started_at: отметка из `start_update`, полученная перед запросом сеансов
+        """
+        self._sessions = defaultdict(list)
+        for session in sessions:
+            self._sessions[key(session)].append(session)
+        self._taken = set()
+        self._expires_at = time.monotonic() + settings.V8_SESSIONS_SNAPSHOT_TTL
+        self._started_at = started_at
+
+    def mark_locked(self, infobase_key: str):
+        """
+        Отмечает, что ИБ заблокирована. Сеансы этой ИБ из снимков, получение которых начато до блокировки,
+        больше не выдаются
+        :param infobase_key: ключ ИБ
+        """
+        self._locked_at[infobase_key] = self._tick()
+
+    def take(self, infobase_key: str) -> Optional[List[Any]]:
+        """
+        Забирает из снимка сеансы информационной базы, т.к. после этого они будут завершены
+        :param infobase_key: ключ ИБ
+        :return: список сеансов ИБ, или None, если снимок устарел, его получение начато до блокировки ИБ
+        или сеансы этой ИБ из него уже забирали.
+        Повторное обращение означает повторную попытку выполнения операции, и снимок необходимо обновить
+        """
+        if not self.is_alive() or infobase_key in self._taken:
+            return None
+        if self._started_at <= self._locked_at.get(infobase_key, 0):
+            return None
+        self._taken.add(infobase_key)
+        return self._sessions.pop(infobase_key, [])
+
+    def invalidate(self):
+        self._sessions: Dict[str, List[Any]] = None
+        self._taken = set()
+        self._expires_at = 0.0
 
 
 def get_cluster_controller_class():
@@ -66,7 +147,7 @@ async def com_func_wrapper(func, ib_name: str, **kwargs) -> core_models.InfoBase
         # Если произошла ошибка, пытаемся снять блокировку ИБ
         try:
             cci = get_cluster_controller_class()()
-            cci.unlock_info_base(ib_name)
+            await cci.aunlock_info_base(ib_name)
         except pywintypes.com_error:
             log.exception(f"<{ib_name}> COM Error occured during handling another COM Error")
         # После разблокировки возвращаем неуспешный результат
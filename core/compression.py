@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Optional
+
+import core.models as core_models
+from conf import settings
+from core import utils
+from utils.common import sizeof_fmt
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    # Сжатие необязательно, зависимость устанавливается вместе с extra `zstd`
+    zstandard = None
+
+log = logging.getLogger(__name__)
+
+COMPRESSED_FILE_EXTENSION = "zst"
+COMPRESSION_READ_SIZE = 4 * 1024 * 1024
+# Копии pg_dump в форматах custom и directory уже сжаты самим pg_dump
+PRECOMPRESSED_FILE_EXTENSIONS = ("pgdump", "pgdump.tar")
+# Перед сжатием всего файла пробно сжимается несколько фрагментов, равномерно распределённых по файлу
+COMPRESSION_SAMPLE_SIZE = 1024 * 1024
+COMPRESSION_SAMPLE_COUNT = 8
+COMPRESSION_SAMPLE_MIN_RATIO = 1.05
+
+
+def is_compression_available() -> bool:
+    return zstandard is not None
+
+
+def is_precompressed(backup_filename: str) -> bool:
+    return backup_filename.endswith(tuple(f".{extension}" for extension in PRECOMPRESSED_FILE_EXTENSIONS))
+
+
+def _estimate_compression_ratio(source_filename: str) -> float:
+    compressor = zstandard.ZstdCompressor(level=settings.BACKUP_COMPRESSION_LEVEL)
+    file_size = os.path.getsize(source_filename)
+    sample_count = max(1, min(COMPRESSION_SAMPLE_COUNT, file_size // COMPRESSION_SAMPLE_SIZE))
+    original_size = compressed_size = 0
+    with open(source_filename, "rb") as src:
+        for i in range(sample_count):
+            src.seek(file_size // sample_count * i)
+            sample = src.read(COMPRESSION_SAMPLE_SIZE)
+            original_size += len(sample)
+            compressed_size += len(compressor.compress(sample))
+    return original_size / (compressed_size or 1)
+
+
+def _compress_file(source_filename: str, compressed_filename: str):
+    compressor = zstandard.ZstdCompressor(
+        level=settings.BACKUP_COMPRESSION_LEVEL,
+        threads=settings.BACKUP_COMPRESSION_THREADS,
+        write_content_size=True,
+    )
+    with open(source_filename, "rb") as src, open(compressed_filename, "wb") as dst:
+        compressor.copy_stream(src, dst, size=os.path.getsize(source_filename), read_size=COMPRESSION_READ_SIZE)
+
+
+async def compress_backup(ib_name: str, backup_filename: str) -> Optional[core_models.BackupCompressionResult]:
+    """
+    Сжимает резервную копию в файл `*.zst` алгоритмом zstd и удаляет исходный файл.
+    Копии, уже сжатые pg_dump, и копии, пробные фрагменты которых сжимаются плохо, не сжимаются.
+    Если сжатый файл получился не меньше исходного, он удаляется, а исходный файл остаётся как есть
+    :param ib_name: имя ИБ
+    :param backup_filename: полный путь к резервной копии
+    :return: результат сжатия, или None, если резервная копия не сжата
+    """
+    if is_precompressed(backup_filename):
+        log.info(f"<{ib_name}> Backup is already compressed by pg_dump, keeping {backup_filename}")
+        return None
+    compressed_filename = utils.append_file_extension_to_string(backup_filename, COMPRESSED_FILE_EXTENSION)
+    datetime_start = datetime.now()
+    try:
+        estimated_ratio = await asyncio.to_thread(_estimate_compression_ratio, backup_filename)
+    except Exception:
+        log.exception(f"<{ib_name}> Unable to estimate compression ratio of {backup_filename}")
+        return None
+    if estimated_ratio < COMPRESSION_SAMPLE_MIN_RATIO:
+        log.info(
+            f"<{ib_name}> Backup samples compress with ratio {estimated_ratio:.2f}, keeping {backup_filename} as is"
+        )
+        return None
+    log.info(f"<{ib_name}> Compressing {backup_filename}")
+    try:
+        # Сжатие выполняется потоками zstd, которые не удерживают GIL
+        await asyncio.to_thread(_compress_file, backup_filename, compressed_filename)
+    except Exception:
+        log.exception(f"<{ib_name}> Unable to compress {backup_filename}")
+        if os.path.exists(compressed_filename):
+            os.remove(compressed_filename)
+        return None
+    duration = (datetime.now() - datetime_start).total_seconds()
+    result = core_models.BackupCompressionResult(
+        compressed_filename, os.path.getsize(backup_filename), os.path.getsize(compressed_filename), duration
+    )
+    if result.compressed_size >= result.original_size:
+        log.info(f"<{ib_name}> Backup does not shrink when compressed, keeping {backup_filename}")
+        os.remove(compressed_filename)
+        return None
+    os.remove(backup_filename)
+    log.info(
+        f"<{ib_name}> Compressed {sizeof_fmt(result.original_size)} to {sizeof_fmt(result.compressed_size)} "
+        f"(ratio {result.ratio:.2f}) in {duration:.1f}s. Avg. speed {sizeof_fmt(result.throughput)}/s"
+    )
+    return result
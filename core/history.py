@@ -0,0 +1,280 @@
+import contextlib
+import logging
+import os
+import sqlite3
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import core.models as core_models
+from conf import settings
+
+log = logging.getLogger(__name__)
+log_prefix = "History"
+
+PHASE_BACKUP = "backup"
+PHASE_COMPRESSION = "compression"
+PHASE_UPLOAD = "upload"
+PHASE_REPLICATION = "replication"
+PHASE_MAINTENANCE = "maintenance"
+PHASE_UPDATE = "update"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    infobase TEXT NOT NULL,
+    phase TEXT NOT NULL,
+    succeeded INTEGER NOT NULL,
+    duration REAL,
+    size INTEGER,
+    recorded_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_infobase_phase_recorded_at ON runs (infobase, phase, recorded_at);
+"""
+
+
+class RunRecord(NamedTuple):
+    infobase: str
+    phase: str
+    succeeded: bool
+    # Длительность этапа в секундах, или None, если длительность неизвестна
+    duration: Optional[float]
+    # Размер результата этапа в байтах, или None, если у этапа нет результата
+    size: Optional[int]
+
+
+class PhaseStatistics(NamedTuple):
+    infobase: str
+    phase: str
+    count: int
+    failed: int
+    p50: float
+    p95: float
+    # Медиана размера результата в байтах, или None, если размер не записывался
+    size_p50: Optional[float]
+
+
+class Regression(NamedTuple):
+    infobase: str
+    phase: str
+    duration: float
+    # Медиана длительности предыдущих успешных запусков
+    baseline: float
+
+    @property
+    def increase(self) -> float:
+        """
+        Рост длительности относительно медианы предыдущих запусков в процентах
+        """
+        return (self.duration / self.baseline - 1) * 100
+
+
+def percentile(values: List[float], q: float) -> float:
+    """
+    Перцентиль с линейной интерполяцией между соседними значениями
+    :param q: перцентиль от 0 до 100
+    """
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def _get_file_size(filename: str) -> Optional[int]:
+    try:
+        return os.path.getsize(filename) if filename else None
+    except OSError:
+        return None
+
+
+def iter_backup_records(resultset: Iterable[core_models.InfoBaseBackupTaskResult]) -> Iterable[RunRecord]:
+    for result in resultset:
+        yield RunRecord(
+            result.infobase_name,
+            PHASE_BACKUP,
+            result.succeeded,
+            result.duration,
+            _get_file_size(result.backup_filename),
+        )
+        if result.compression is not None:
+            yield RunRecord(
+                result.infobase_name,
+                PHASE_COMPRESSION,
+                result.succeeded,
+                result.compression.duration,
+                result.compression.compressed_size,
+            )
+
+
+def iter_upload_records(resultset: Iterable[core_models.InfoBaseAWSUploadTaskResult]) -> Iterable[RunRecord]:
+    for result in resultset:
+        yield RunRecord(
+            result.infobase_name,
+            PHASE_UPLOAD,
+            result.succeeded,
+            result.duration,
+            result.upload_size if result.succeeded else None,
+        )
+
+
+def iter_task_records(resultset: Iterable[core_models.InfoBaseTaskResultBase], phase: str) -> Iterable[RunRecord]:
+    for result in resultset:
+        yield RunRecord(result.infobase_name, phase, result.succeeded, result.duration, None)
+        # Отдельные этапы задачи, например, vacuumdb при обслуживании, записываются как самостоятельные этапы
+        for phase_name, duration in result.phase_durations.items():
+            yield RunRecord(result.infobase_name, phase_name, result.succeeded, duration, None)
+
+
+class RunHistory:
+    """
+    История запусков в базе SQLite: длительность, размер результата и успешность каждого этапа работы с ИБ.
+    По истории вычисляются перцентили длительности и находятся ИБ, работа с которыми заметно замедлилась
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def add_records(self, records: Iterable[RunRecord], recorded_at: datetime = None) -> int:
+        """
+        Записывает результаты этапов в историю
+        :return: количество записанных результатов
+        """
+        timestamp = (recorded_at or datetime.now()).timestamp()
+        with self.connection:
+            cursor = self.connection.executemany(
+                "INSERT INTO runs (infobase, phase, succeeded, duration, size, recorded_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [(r.infobase, r.phase, int(r.succeeded), r.duration, r.size, timestamp) for r in records],
+            )
+        return cursor.rowcount
+
+    def _get_durations(
+        self, phase: str = None, infobase: str = None, since: datetime = None
+    ) -> List[Tuple[str, str, int, Optional[float], Optional[int]]]:
+        conditions = ["1"]
+        params = []
+        if phase is not None:
+            conditions.append("phase = ?")
+            params.append(phase)
+        if infobase is not None:
+            conditions.append("infobase = ?")
+            params.append(infobase)
+        if since is not None:
+            conditions.append("recorded_at >= ?")
+            params.append(since.timestamp())
+        return self.connection.execute(
+            f"""
+            SELECT infobase, phase, succeeded, duration, size FROM runs
+            WHERE {" AND ".join(conditions)}
+            ORDER BY infobase, phase, recorded_at
+            """,
+            params,
+        ).fetchall()
+
+    def get_statistics(self, phase: str = None, infobase: str = None, days: int = None) -> List[PhaseStatistics]:
+        """
+        Медиана и 95-й перцентиль длительности успешных запусков каждого этапа каждой ИБ
+        :param days: за сколько последних дней учитывается история, по умолчанию вся история
+        """
+        since = datetime.now() - timedelta(days=days) if days is not None else None
+        groups = dict()
+        for ib_name, phase_name, succeeded, duration, size in self._get_durations(phase, infobase, since):
+            group = groups.setdefault((ib_name, phase_name), dict(durations=[], sizes=[], failed=0))
+            if not succeeded:
+                group["failed"] += 1
+                continue
+            if duration is not None:
+                group["durations"].append(duration)
+            if size is not None:
+                group["sizes"].append(size)
+        statistics = []
+        for (ib_name, phase_name), group in groups.items():
+            durations = group["durations"]
+            if not durations:
+                continue
+            statistics.append(
+                PhaseStatistics(
+                    ib_name,
+                    phase_name,
+                    len(durations),
+                    group["failed"],
+                    percentile(durations, 50),
+                    percentile(durations, 95),
+                    percentile(group["sizes"], 50) if group["sizes"] else None,
+                )
+            )
+        return statistics
+
+    def find_regressions(
+        self, phase: str, threshold: float, window: int, infobases: List[str] = None
+    ) -> List[Regression]:
+        """
+        Находит ИБ, у которых длительность последнего успешного запуска этапа больше медианы
+        предыдущих `window` успешных запусков более чем на `threshold` процентов
+        """
+        history = dict()
+        for ib_name, _, succeeded, duration, _ in self._get_durations(phase):
+            if succeeded and duration is not None:
+                history.setdefault(ib_name, []).append(duration)
+        regressions = []
+        for ib_name, durations in history.items():
+            if infobases is not None and ib_name not in infobases:
+                continue
+            # Для сравнения нужен хотя бы один предыдущий запуск
+            if len(durations) < 2:
+                continue
+            *previous, last = durations[-(window + 1) :]
+            baseline = percentile(previous, 50)
+            if baseline > 0 and last > baseline * (1 + threshold / 100):
+                regressions.append(Regression(ib_name, phase, last, baseline))
+        return regressions
+
+    def get_average_durations(self, infobases: List[str], phase: str, last: int) -> Dict[str, float]:
+        """
+        Средняя длительность последних успешных запусков этапа указанных ИБ
+        :param last: сколько последних успешных запусков каждой ИБ учитывается
+        :return: словарь имя ИБ - средняя длительность в секундах, ИБ без истории в словарь не попадают
+        """
+        history = dict()
+        for ib_name, _, succeeded, duration, _ in self._get_durations(phase):
+            if succeeded and duration is not None and ib_name in infobases:
+                history.setdefault(ib_name, []).append(duration)
+        return {ib_name: sum(durations[-last:]) / len(durations[-last:]) for ib_name, durations in history.items()}
+
+
+@contextlib.contextmanager
+def open_history(filename: str = None):
+    history = RunHistory(filename or settings.HISTORY_PATH)
+    try:
+        yield history
+    finally:
+        history.close()
+
+
+def record_run(records: Iterable[RunRecord], regression_phase: str = None):
+    """
+    Записывает результаты этапов в историю запусков, если она включена, и предупреждает о замедлении
+    этапа `regression_phase` у ИБ из результатов. Ошибка записи истории не прерывает работу
+    """
+    if not settings.HISTORY_ENABLED:
+        return
+    try:
+        records = list(records)
+        with open_history() as history:
+            history.add_records(records)
+            if regression_phase is None:
+                return
+            infobases = [r.infobase for r in records if r.phase == regression_phase]
+            for regression in history.find_regressions(
+                regression_phase, settings.HISTORY_REGRESSION_THRESHOLD, settings.HISTORY_REGRESSION_WINDOW, infobases
+            ):
+                log.warning(
+                    f"<{regression.infobase}> {regression.phase.capitalize()} took {regression.duration:.1f}s, "
+                    f"{regression.increase:.0f}% longer than median {regression.baseline:.1f}s"
+                )
+    except Exception:
+        log.exception(f"<{log_prefix}> Unable to record run history")
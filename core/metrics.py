@@ -0,0 +1,223 @@
+import collections
+import logging
+import os
+from typing import Dict, Iterable, List, Tuple
+
+import core.models as core_models
+from conf import settings
+
+log = logging.getLogger(__name__)
+log_prefix = "Metrics"
+
+METRICS_PREFIX = "onec_mgmt"
+TEXTFILE_EXTENSION = "prom"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Название метрики - тип и описание
+METRICS = {
+    "phase_duration_seconds": ("histogram", "Duration of infobase task phase"),
+    "phase_bytes": ("gauge", "Bytes processed by infobase task phase"),
+    "tasks": ("gauge", "Number of infobase tasks by result"),
+    "last_success_timestamp_seconds": ("gauge", "Time of the last successful infobase task phase"),
+    "s3_upload_throughput_bytes_per_second": ("gauge", "Average S3 upload speed of infobase backup"),
+    "s3_upload_retries": ("gauge", "Number of S3 upload retries of infobase backup"),
+    "semaphore_wait_seconds": ("gauge", "Time spent waiting for concurrency semaphore before infobase task"),
+    "processes_spawned": ("gauge", "Number of external processes spawned during the run"),
+}
+
+# Количество запущенных внешних процессов по имени программы за время работы
+spawned_processes = collections.Counter()
+_registry = None
+
+
+class MetricsRegistry:
+    """
+    Значения метрик одного запуска сценария. Выводятся в текстовом формате Prometheus,
+    который читает textfile collector node_exporter
+    """
+
+    def __init__(self, job: str):
+        self.job = job
+        self.samples: Dict[str, Dict[Tuple, float]] = collections.defaultdict(dict)
+        self.observations: Dict[str, Dict[Tuple, List[float]]] = collections.defaultdict(dict)
+
+    def set(self, name: str, value: float, **labels):
+        self.samples[name][tuple(labels.items())] = value
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = tuple(labels.items())
+        self.samples[name][key] = self.samples[name].get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        self.observations[name].setdefault(tuple(labels.items()), []).append(value)
+
+    def _format_labels(self, labels: Iterable[Tuple[str, str]]) -> str:
+        labels = [("job", self.job), *labels]
+        return ",".join(f'{k}="{_escape_label_value(str(v))}"' for k, v in labels)
+
+    def render(self) -> str:
+        lines = []
+        for name, (metric_type, description) in METRICS.items():
+            full_name = f"{METRICS_PREFIX}_{name}"
+            samples = self.samples.get(name)
+            observations = self.observations.get(name)
+            if not samples and not observations:
+                continue
+            lines.append(f"# HELP {full_name} {description}")
+            lines.append(f"# TYPE {full_name} {metric_type}")
+            for labels, value in (samples or dict()).items():
+                lines.append(f"{full_name}{{{self._format_labels(labels)}}} {value}")
+            for labels, values in (observations or dict()).items():
+                for bucket in settings.METRICS_DURATION_BUCKETS:
+                    count = sum(1 for v in values if v <= bucket)
+                    lines.append(f"{full_name}_bucket{{{self._format_labels([*labels, ('le', bucket)])}}} {count}")
+                lines.append(f"{full_name}_bucket{{{self._format_labels([*labels, ('le', '+Inf')])}}} {len(values)}")
+                lines.append(f"{full_name}_sum{{{self._format_labels(labels)}}} {sum(values)}")
+                lines.append(f"{full_name}_count{{{self._format_labels(labels)}}} {len(values)}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def count_process(name: str):
+    spawned_processes[name] += 1
+
+
+def start_run(job: str):
+    """
+    Начинает сбор метрик запуска сценария, если включен METRICS_ENABLED
+    :param job: имя сценария, выводится в метку `job` и в имя файла
+    """
+    global _registry
+    spawned_processes.clear()
+    _registry = MetricsRegistry(job.lower()) if settings.METRICS_ENABLED else None
+
+
+def collect_records(records: Iterable, workload: List[str] = None, phase: str = None, timestamp: float = None):
+    """
+    Добавляет в метрики длительность, размер и результат этапов работы с ИБ
+    :param records: результаты этапов `core.history.RunRecord`
+    :param workload: имена ИБ, которые должны были быть обработаны на этапе `phase`, для подсчёта пропущенных
+    :param timestamp: время окончания этапов, для метрики времени последнего успешного выполнения
+    """
+    registry = _registry
+    if registry is None:
+        return
+    processed = set()
+    for record in records:
+        if record.phase == phase:
+            processed.add(record.infobase)
+        result = "succeeded" if record.succeeded else "failed"
+        registry.inc("tasks", phase=record.phase, result=result)
+        if not record.succeeded:
+            continue
+        if record.duration is not None:
+            registry.observe("phase_duration_seconds", record.duration, infobase=record.infobase, phase=record.phase)
+        if record.size is not None:
+            registry.set("phase_bytes", record.size, infobase=record.infobase, phase=record.phase)
+        if timestamp is not None:
+            registry.set("last_success_timestamp_seconds", timestamp, infobase=record.infobase, phase=record.phase)
+    if workload is not None:
+        registry.set("tasks", len(set(workload) - processed), phase=phase, result="missed")
+
+
+def collect_task_results(resultset: Iterable[core_models.InfoBaseTaskResultBase], phase: str):
+    """
+    Добавляет в метрики время ожидания семафора перед задачами
+    """
+    registry = _registry
+    if registry is None:
+        return
+    for result in resultset:
+        if result.wait_duration is not None:
+            registry.set("semaphore_wait_seconds", result.wait_duration, infobase=result.infobase_name, phase=phase)
+
+
+def collect_replication_results(resultset: Iterable[core_models.InfoBaseBackupTaskResult], phase: str):
+    """
+    Добавляет в метрики объём реплицированных данных: размер резервной копии, умноженный на количество реплик
+    """
+    registry = _registry
+    if registry is None:
+        return
+    for result in resultset:
+        if not result.replicas or not result.backup_filename:
+            continue
+        try:
+            size = os.path.getsize(result.backup_filename)
+        except OSError:
+            continue
+        registry.set("phase_bytes", size * len(result.replicas), infobase=result.infobase_name, phase=phase)
+
+
+def collect_upload_results(resultset: Iterable[core_models.InfoBaseAWSUploadTaskResult]):
+    """
+    Добавляет в метрики скорость загрузки в S3 и количество повторных попыток
+    """
+    registry = _registry
+    if registry is None:
+        return
+    for result in resultset:
+        registry.set("s3_upload_retries", result.retries, infobase=result.infobase_name)
+        if result.succeeded and result.duration:
+            registry.set(
+                "s3_upload_throughput_bytes_per_second",
+                result.upload_size / result.duration,
+                infobase=result.infobase_name,
+            )
+
+
+def get_textfile_filename(job: str) -> str:
+    return os.path.join(settings.METRICS_PATH, f"{METRICS_PREFIX}_{job}.{TEXTFILE_EXTENSION}")
+
+
+def write_textfile() -> str:
+    """
+    Записывает метрики запуска в файл для textfile collector node_exporter и заканчивает сбор.
+    Файл заменяется атомарно, чтобы node_exporter не прочитал его частично
+    :return: полный путь к файлу метрик или None, если метрики выключены или не записаны
+    """
+    global _registry
+    registry, _registry = _registry, None
+    if registry is None:
+        return None
+    for name, count in spawned_processes.items():
+        registry.set("processes_spawned", count, process=name)
+    filename = get_textfile_filename(registry.job)
+    tmp_filename = f"{filename}.tmp"
+    try:
+        os.makedirs(settings.METRICS_PATH, exist_ok=True)
+        with open(tmp_filename, "w", encoding="utf-8", newline="\n") as f:
+            f.write(registry.render())
+        os.replace(tmp_filename, filename)
+    except Exception:
+        log.exception(f"<{log_prefix}> Unable to write metrics to {filename}")
+        return None
+    log.info(f"<{log_prefix}> Metrics written to {filename}")
+    return filename
+
+
+def read_textfiles(path: str = None) -> str:
+    """
+    Объединяет файлы метрик всех сценариев, для отдачи по HTTP. Значения одной метрики из разных файлов
+    собираются под одним описанием, потому что Prometheus не принимает повторное описание метрики
+    """
+    path = path or settings.METRICS_PATH
+    # Название метрики - строки описания и строки значений
+    families: Dict[str, Tuple[List[str], List[str]]] = dict()
+    for filename in sorted(os.listdir(path)):
+        if not filename.endswith(f".{TEXTFILE_EXTENSION}"):
+            continue
+        family = None
+        with open(os.path.join(path, filename), encoding="utf-8") as f:
+            for line in f.read().splitlines():
+                if line.startswith(("# HELP ", "# TYPE ")):
+                    family = line.split(" ", 3)[2]
+                    headers, _ = families.setdefault(family, ([], []))
+                    if line not in headers:
+                        headers.append(line)
+                elif line and family is not None:
+                    families[family][1].append(line)
+    return "".join("\n".join(headers + samples) + "\n" for headers, samples in families.values())
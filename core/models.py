@@ -1,20 +1,59 @@
 class InfoBaseTaskResultBase:
     infobase_name: str = None
     succeeded: bool = None
+    duration: float = None
+    wait_duration: float = None
+    phase_durations: dict = None
     extras: dict = None
 
-    def __init__(self, infobase_name, succeeded, **kwargs):
+    def __init__(self, infobase_name, succeeded, duration=None, wait_duration=None, **kwargs):
         self.infobase_name = infobase_name
         self.succeeded = succeeded
+        # Длительность выполнения задачи в секундах
+        self.duration = duration
+        # Время ожидания места в семафоре перед выполнением задачи в секундах
+        self.wait_duration = wait_duration
+        # Длительность отдельных этапов задачи в секундах, название этапа - длительность
+        self.phase_durations = dict()
         self.extras = kwargs
 
 
+class BackupCompressionResult:
+    compressed_filename: str = None
+    original_size: int = None
+    compressed_size: int = None
+    duration: float = None
+
+    def __init__(self, compressed_filename, original_size, compressed_size, duration):
+        self.compressed_filename = compressed_filename
+        self.original_size = original_size
+        self.compressed_size = compressed_size
+        self.duration = duration
+
+    @property
+    def ratio(self) -> float:
+        return self.original_size / (self.compressed_size or 1)
+
+    @property
+    def throughput(self) -> float:
+        return self.original_size / (self.duration or 1)
+
+
 class InfoBaseBackupTaskResult(InfoBaseTaskResultBase):
     backup_filename: str = None
+    aws_result: "InfoBaseAWSUploadTaskResult" = None
+    compression: BackupCompressionResult = None
+    replicas: list = None
 
-    def __init__(self, infobase_name, succeeded, backup_filename="", **kwargs):
+    def __init__(self, infobase_name, succeeded, backup_filename="", aws_result=None, compression=None, **kwargs):
         super().__init__(infobase_name, succeeded, **kwargs)
         self.backup_filename = backup_filename
+        # Результат загрузки в S3, если резервная копия загружалась одновременно с созданием
+        self.aws_result = aws_result
+        # Результат сжатия, если резервная копия сжата
+        self.compression = compression
+        # Полные пути к успешно созданным репликам резервной копии
+        self.replicas = []
 
 
 class InfoBaseV8TaskResult(InfoBaseTaskResultBase):
@@ -34,7 +73,13 @@ class InfoBaseUpdateTaskResult(InfoBaseTaskResultBase):
 
 class InfoBaseAWSUploadTaskResult(InfoBaseTaskResultBase):
     upload_size: int = None
+    s3_key: str = None
+    retries: int = None
 
-    def __init__(self, infobase_name, succeeded, upload_size=0, **kwargs):
+    def __init__(self, infobase_name, succeeded, upload_size=0, s3_key=None, **kwargs):
         super().__init__(infobase_name, succeeded, **kwargs)
         self.upload_size = upload_size
+        # Ключ загруженного объекта в бакете
+        self.s3_key = s3_key
+        # Количество повторных попыток загрузки
+        self.retries = 0
@@ -1,9 +1,10 @@
 import asyncio
 import logging
-from typing import Type
+import time
+from typing import Any, Awaitable, Callable, Type
 
 from conf import settings
-from core import utils
+from core import metrics, tracing, utils
 from core.cluster import utils as cluster_utils
 from core.exceptions import SubprocessException, V8Exception
 
@@ -58,6 +59,48 @@ async def _wait_for_subprocess(subprocess: asyncio.subprocess.Process, timeout:
         await _kill_process_emergency(pid)
 
 
+# Сколько опросов подряд не должно быть фоновых заданий, чтобы считать, что они завершились.
+# Фоновые задания могут запуститься спустя несколько секунд после включения блокировки
+LOCK_QUIET_POLLS = 2
+
+
+async def _wait_for_background_jobs(cci, ib_name: str) -> float:
+    """
+    Ожидает завершения фоновых заданий ИБ после включения блокировки, опрашивая кластер
+    каждые V8_LOCK_INFO_BASE_POLL_INTERVAL секунд, но не дольше V8_LOCK_INFO_BASE_PAUSE_MAX секунд.
+    Если V8_LOCK_INFO_BASE_PAUSE_MAX равен 0 или кластер не удалось опросить, ожидает V8_LOCK_INFO_BASE_PAUSE секунд
+    :return: фактическое время ожидания в секундах
+    """
+    time_start = time.monotonic()
+    pause_max = settings.V8_LOCK_INFO_BASE_PAUSE_MAX
+    if not pause_max:
+        pause = settings.V8_LOCK_INFO_BASE_PAUSE
+        log.debug(f"<{ib_name}> Infobase locked. Wait for {pause} seconds")
+        await asyncio.sleep(pause)
+        return time.monotonic() - time_start
+    poll_interval = settings.V8_LOCK_INFO_BASE_POLL_INTERVAL
+    quiet_polls = 0
+    while True:
+        try:
+            jobs_count = await cci.aget_info_base_background_jobs_count(ib_name)
+        except Exception as e:
+            pause = max(settings.V8_LOCK_INFO_BASE_PAUSE - (time.monotonic() - time_start), 0)
+            log.warning(f"<{ib_name}> Unable to get background jobs: {e}. Wait for {pause:.2f} seconds")
+            await asyncio.sleep(pause)
+            break
+        quiet_polls = 0 if jobs_count else quiet_polls + 1
+        if quiet_polls >= LOCK_QUIET_POLLS:
+            break
+        if time.monotonic() - time_start + poll_interval > pause_max:
+            if jobs_count:
+                log.warning(f"<{ib_name}> {jobs_count} background jobs are still running after {pause_max} seconds")
+            break
+        await asyncio.sleep(poll_interval)
+    waited = time.monotonic() - time_start
+    log.info(f"<{ib_name}> Waited {waited:.2f}s for background jobs after infobase lock")
+    return waited
+
+
 async def execute_v8_command(
     ib_name: str,
     v8_command: str,
@@ -80,30 +123,35 @@ async def execute_v8_command(
     :param log_output_on_success: Выводить в консоль лог внешнего процесса в случае его успешного завершения
     :param create_subprocess_pause: Пауза перед запуском внешнего процесса
     """
-    # Теоретически можно пользоваться одним объектом на целый поток т.к. все функции отрабатывают последовательно.
-    # Но проблема в том, что через некоторые промежутки времени кластер может закрыть соединение, что приведет к
-    # исключению. Накладные расходы на создание новых объектов малы, поэтому этот вариант оптимален
+    # Контроллер создаётся для каждой команды, но сам по себе соединений не открывает: в режиме 'com' вызовы
+    # выполняются в потоке COMWorker через соединения из пула этого потока, которые проверяются перед повторным
+    # использованием и создаются заново, если кластер их закрыл. В режиме 'rac' используется общий кэш кластера и ИБ
     cci = cluster_utils.get_cluster_controller()
     if permission_code:
         # Блокирует фоновые задания и новые сеансы
-        cci.lock_info_base(ib_name, permission_code)
-        # Перед завершением сеансов следует взять паузу,
-        # потому что фоновые задания всё ещё могут быть запущены спустя несколько секунд
+        with tracing.span("lock infobase", ib_name, category="cluster"):
+            await cci.alock_info_base(ib_name, permission_code)
+        # Перед завершением сеансов следует дождаться завершения фоновых заданий,
+        # потому что они всё ещё могут быть запущены спустя несколько секунд
         # после включения блокировки регламентных заданий
-        pause = settings.V8_LOCK_INFO_BASE_PAUSE
-        log.debug(f"<{ib_name}> Infobase locked. Wait for {pause} seconds")
-        await asyncio.sleep(pause)
+        with tracing.span("lock pause", ib_name, category="wait"):
+            await _wait_for_background_jobs(cci, ib_name)
     # Принудительно завершает текущие сеансы
-    cci.terminate_info_base_sessions(ib_name)
+    with tracing.span("terminate sessions", ib_name, category="cluster"):
+        await cci.aterminate_info_base_sessions(ib_name)
     if create_subprocess_pause:
         log.debug(f"<{ib_name}> Pause before creating process. Wait for {create_subprocess_pause:.2f} seconds")
-        await asyncio.sleep(create_subprocess_pause)
-    v8_process = await asyncio.create_subprocess_shell(v8_command)
-    log.debug(f"<{ib_name}> 1cv8 PID is {v8_process.pid}")
-    await _wait_for_subprocess(v8_process, timeout)
+        with tracing.span("subprocess pause", ib_name, category="wait"):
+            await asyncio.sleep(create_subprocess_pause)
+    with tracing.span("1cv8", ib_name, category="subprocess"):
+        v8_process = await asyncio.create_subprocess_shell(v8_command)
+        metrics.count_process("1cv8")
+        log.debug(f"<{ib_name}> 1cv8 PID is {v8_process.pid}")
+        await _wait_for_subprocess(v8_process, timeout)
     if permission_code:
         # Снимает блокировку фоновых заданий и сеансов
-        cci.unlock_info_base(ib_name)
+        with tracing.span("unlock infobase", ib_name, category="cluster"):
+            await cci.aunlock_info_base(ib_name)
     _check_subprocess_return_code(
         ib_name,
         v8_process,
@@ -127,9 +175,11 @@ async def execute_subprocess_command(
         if env is not None
         else asyncio.create_subprocess_shell(subprocess_command)
     )
-    subprocess = await subprc_coro
-    log.debug(f"<{ib_name}> Subprocess PID is {subprocess.pid}")
-    await _wait_for_subprocess(subprocess, timeout)
+    with tracing.span("subprocess", ib_name):
+        subprocess = await subprc_coro
+        metrics.count_process("subprocess")
+        log.debug(f"<{ib_name}> Subprocess PID is {subprocess.pid}")
+        await _wait_for_subprocess(subprocess, timeout)
     _check_subprocess_return_code(
         ib_name,
         subprocess,
@@ -138,3 +188,45 @@ async def execute_subprocess_command(
         SubprocessException,
         log_output_on_success,
     )
+
+
+async def execute_subprocess_command_streaming(
+    ib_name: str,
+    subprocess_command: str,
+    log_filename: str,
+    stdout_consumer: Callable[[asyncio.StreamReader, Callable[[], Awaitable[None]]], Awaitable[Any]],
+    env: dict = None,
+) -> Any:
+    """
+    Запускает внешний процесс и передаёт поток его stdout потребителю.
+    Потребитель вызывается с двумя аргументами: потоком stdout и корутинной функцией, которая дожидается завершения
+    процесса и выбрасывает исключение, если код возврата отличен от 0. Если потребитель завершился раньше процесса,
+    процесс принудительно завершается
+    :param ib_name: Имя информационной базы
+    :param subprocess_command: Команда запуска процесса. Вывод stderr должен быть перенаправлен в лог-файл
+    :param log_filename: Полный путь к лог-файлу процесса
+    :param stdout_consumer: Корутинная функция, читающая stdout процесса
+    :param env: Переменные окружения процесса
+    :return: Результат потребителя
+    """
+    kwargs = dict(stdout=asyncio.subprocess.PIPE)
+    if env is not None:
+        kwargs["env"] = env
+    subprocess = await asyncio.create_subprocess_shell(subprocess_command, **kwargs)
+    metrics.count_process("subprocess")
+    log.debug(f"<{ib_name}> Subprocess PID is {subprocess.pid}")
+
+    async def wait_subprocess():
+        await subprocess.wait()
+        _check_subprocess_return_code(ib_name, subprocess, log_filename, "utf-8", SubprocessException)
+
+    try:
+        with tracing.span("subprocess", ib_name):
+            return await stdout_consumer(subprocess.stdout, wait_subprocess)
+    finally:
+        if subprocess.returncode is None:
+            try:
+                subprocess.kill()
+            except ProcessLookupError:
+                pass
+            await subprocess.wait()
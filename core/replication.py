@@ -0,0 +1,219 @@
+import asyncio
+import contextlib
+import errno
+import logging
+import os
+import sys
+from typing import Callable, Dict, List, Optional, Tuple
+
+import aiofiles
+
+from conf import settings
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+# _IOW(0x94, 9, int) из linux/fs.h: создаёт в файле ссылки на блоки другого файла (reflink), без копирования данных
+FICLONE = 0x40049409
+# Ошибки, означающие, что способ копирования не поддерживается для этой пары файлов
+ZERO_COPY_UNSUPPORTED_ERRNOS = frozenset(
+    {errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EINVAL, errno.ENOTTY, errno.EBADF}
+)
+
+
+def _reflink(src_fd: int, dst_fd: int, size: int):
+    fcntl.ioctl(dst_fd, FICLONE, src_fd)
+
+
+def _copy_file_range(src_fd: int, dst_fd: int, size: int):
+    offset = 0
+    while offset < size:
+        copied = os.copy_file_range(src_fd, dst_fd, size - offset, offset, offset)
+        if copied == 0:
+            break
+        offset += copied
+
+
+def _sendfile(src_fd: int, dst_fd: int, size: int):
+    offset = 0
+    while offset < size:
+        sent = os.sendfile(dst_fd, src_fd, offset, size - offset)
+        if sent == 0:
+            break
+        offset += sent
+
+
+def _get_zero_copy_strategies() -> List[Tuple[str, Callable[[int, int, int], None]]]:
+    """
+    Способы копирования силами ядра в порядке предпочтения. Доступны только в Linux
+    """
+    strategies = []
+    if sys.platform != "linux":
+        return strategies
+    if fcntl is not None:
+        strategies.append(("reflink", _reflink))
+    if hasattr(os, "copy_file_range"):
+        strategies.append(("copy_file_range", _copy_file_range))
+    if hasattr(os, "sendfile"):
+        strategies.append(("sendfile", _sendfile))
+    return strategies
+
+
+ZERO_COPY_STRATEGIES = _get_zero_copy_strategies()
+
+
+def _zero_copy_file(source: str, destination: str) -> Optional[str]:
+    """
+    Копирует файл силами ядра, не передавая данные через память процесса.
+    Способы перебираются по порядку, пока один из них не сработает
+    :return: название сработавшего способа, или None, если ни один способ не поддерживается
+    """
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        size = os.fstat(src.fileno()).st_size
+        for name, strategy in ZERO_COPY_STRATEGIES:
+            try:
+                strategy(src.fileno(), dst.fileno(), size)
+                return name
+            except OSError as e:
+                if e.errno not in ZERO_COPY_UNSUPPORTED_ERRNOS:
+                    raise
+                # Способ мог успеть скопировать часть данных
+                os.ftruncate(dst.fileno(), 0)
+    return None
+
+
+def _is_same_device(source: str, destination: str) -> bool:
+    """
+    Проверяет, что файл будет создан на том же устройстве, что и источник.
+    Только для таких файлов копирование силами ядра не читает источник повторно: reflink не копирует данные,
+    а copy_file_range копирует их внутри файловой системы. На другое устройство, в том числе в сетевой каталог,
+    ядро копирует данные, заново читая источник для каждого файла
+    """
+    try:
+        return os.stat(source).st_dev == os.stat(os.path.dirname(os.path.abspath(destination))).st_dev
+    except OSError:
+        return False
+
+
+# Помещается в очередь отключенного файла, чтобы он перестал ждать блоки из общего чтения
+_DETACHED = object()
+
+
+class _FanOutTarget:
+    """
+    Файл, в который копируются блоки, прочитанные из источника.
+    Блоки передаются через ограниченную очередь. Если очередь остаётся заполненной дольше `lag_timeout` секунд,
+    файл отключается от общего чтения и дочитывает источник самостоятельно, не задерживая остальные файлы
+    """
+
+    def __init__(self, source: str, destination: str, block_size: int, queue_size: int, lag_timeout: float):
+        self.source = source
+        self.destination = destination
+        self.block_size = block_size
+        self.lag_timeout = lag_timeout
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.detached = False
+        self.written = 0
+        self.task: asyncio.Task = None
+
+    @property
+    def alive(self) -> bool:
+        return not self.detached and not self.task.done()
+
+    async def offer(self, block: Optional[bytes]):
+        """
+        Передаёт блок в очередь, ожидая освобождения места не дольше `lag_timeout` секунд.
+        `None` означает окончание источника
+        """
+        try:
+            await asyncio.wait_for(self.queue.put(block), self.lag_timeout)
+        except asyncio.TimeoutError:
+            log.debug(f"Replication to {self.destination} is lagging behind, reading source separately")
+            self.detached = True
+            # Если запись успела освободить место в очереди, она может уже ждать следующий блок
+            with contextlib.suppress(asyncio.QueueFull):
+                self.queue.put_nowait(_DETACHED)
+
+    async def run(self):
+        async with aiofiles.open(self.destination, "wb") as dst:
+            while not (self.detached and self.queue.empty()):
+                block = await self.queue.get()
+                if block is None:
+                    return
+                if block is _DETACHED:
+                    break
+                await dst.write(block)
+                self.written += len(block)
+            # Отключенный файл продолжает копирование с места, до которого дошла запись
+            async with aiofiles.open(self.source, "rb") as src:
+                await src.seek(self.written)
+                while block := await src.read(self.block_size):
+                    await dst.write(block)
+                    self.written += len(block)
+
+
+async def fan_out_copy(source: str, destinations: List[str]) -> Dict[str, Optional[BaseException]]:
+    """
+    Копирует файл сразу в несколько файлов, читая каждый блок источника один раз.
+    Блоки размером BACKUP_REPLICATION_BLOCK_SIZE записываются во все файлы одновременно,
+    для каждого файла в очереди ожидают записи не более BACKUP_REPLICATION_QUEUE_SIZE блоков.
+    Чтение ждёт, пока в очередях появится место. Файл, очередь которого остаётся заполненной
+    дольше BACKUP_REPLICATION_LAG_TIMEOUT секунд, дочитывает источник самостоятельно
+    :param source: полный путь к исходному файлу
+    :param destinations: полные пути к файлам, в которые копируется источник
+    :return: словарь путь к файлу - исключение, возникшее при копировании в этот файл, или None
+    """
+    block_size = settings.BACKUP_REPLICATION_BLOCK_SIZE
+    queue_size = max(settings.BACKUP_REPLICATION_QUEUE_SIZE, 1)
+    lag_timeout = settings.BACKUP_REPLICATION_LAG_TIMEOUT
+    targets = [_FanOutTarget(source, d, block_size, queue_size, lag_timeout) for d in destinations]
+    for target in targets:
+        target.task = asyncio.create_task(target.run())
+    try:
+        async with aiofiles.open(source, "rb") as src:
+            while any(t.alive for t in targets):
+                block = await src.read(block_size)
+                await asyncio.gather(*[t.offer(block or None) for t in targets if t.alive])
+                if not block:
+                    break
+    except BaseException:
+        for target in targets:
+            target.task.cancel()
+        await asyncio.gather(*[t.task for t in targets], return_exceptions=True)
+        raise
+    results = await asyncio.gather(*[t.task for t in targets], return_exceptions=True)
+    return {target.destination: result for target, result in zip(targets, results, strict=True)}
+
+
+async def replicate_file(source: str, destinations: List[str]) -> Dict[str, Optional[BaseException]]:
+    """
+    Копирует файл в несколько файлов. Если включен BACKUP_REPLICATION_ZERO_COPY, в файлы на том же устройстве,
+    что и источник, сначала пробует скопировать силами ядра (reflink, copy_file_range, sendfile).
+    Остальные файлы копируются через `fan_out_copy`, который читает источник один раз для всех файлов
+    :param source: полный путь к исходному файлу
+    :param destinations: полные пути к файлам, в которые копируется источник
+    :return: словарь путь к файлу - исключение, возникшее при копировании в этот файл, или None
+    """
+    results = dict()
+    fan_out_destinations = list(destinations)
+    if settings.BACKUP_REPLICATION_ZERO_COPY and ZERO_COPY_STRATEGIES:
+        zero_copy_destinations = [d for d in destinations if _is_same_device(source, d)]
+        fan_out_destinations = [d for d in destinations if d not in zero_copy_destinations]
+        zero_copy_results = await asyncio.gather(
+            *[asyncio.to_thread(_zero_copy_file, source, d) for d in zero_copy_destinations], return_exceptions=True
+        )
+        for destination, result in zip(zero_copy_destinations, zero_copy_results, strict=True):
+            if result is None:
+                fan_out_destinations.append(destination)
+            elif isinstance(result, BaseException):
+                results[destination] = result
+            else:
+                log.debug(f"Replicated {source} to {destination} using {result}")
+                results[destination] = None
+    if fan_out_destinations:
+        results.update(await fan_out_copy(source, fan_out_destinations))
+    return results
@@ -0,0 +1,139 @@
+import heapq
+import logging
+from datetime import datetime, time, timedelta
+from typing import Dict, List, NamedTuple, Optional
+
+from conf import settings
+
+log = logging.getLogger(__name__)
+
+DEADLINE_FORMAT = "%H:%M"
+
+
+class BackupSchedule(NamedTuple):
+    # Имена ИБ в порядке запуска резервного копирования
+    infobases: List[str]
+    # Прогнозируемое время окончания резервного копирования каждой ИБ
+    predicted_finish: Dict[str, datetime]
+    # Прогнозируемая длительность резервного копирования всех ИБ, или None, если истории нет ни для одной ИБ
+    predicted_makespan: Optional[timedelta]
+    # Время, к которому должно закончиться резервное копирование ИБ, для которых указано ограничение
+    deadlines: Dict[str, datetime]
+
+
+def _find_setting_value(values: Dict, ib_name: str, default=None):
+    # Имена ИБ в настройках сравниваются без учёта регистра, как в V8_INFOBASES_ONLY
+    for name, value in values.items():
+        if name.lower() == ib_name.lower():
+            return value
+    return default
+
+
+def _get_priority(ib_name: str) -> float:
+    # Неправильный приоритет не должен останавливать резервное копирование, такая ИБ получает приоритет по умолчанию
+    priority = _find_setting_value(settings.BACKUP_SCHEDULE_PRIORITY, ib_name, 0)
+    if isinstance(priority, bool) or not isinstance(priority, (int, float)):
+        log.warning(f"<{ib_name}> Invalid backup priority {priority!r} in BACKUP_SCHEDULE_PRIORITY, ignored")
+        return 0
+    return priority
+
+
+def _get_deadline(ib_name: str, start: datetime) -> Optional[datetime]:
+    deadline = _find_setting_value(settings.BACKUP_SCHEDULE_DEADLINES, ib_name)
+    if deadline is None:
+        return None
+    try:
+        deadline_time: time = datetime.strptime(deadline, DEADLINE_FORMAT).time()
+    except (TypeError, ValueError):
+        # Неправильное ограничение не должно останавливать резервное копирование
+        log.warning(
+            f"<{ib_name}> Invalid backup deadline {deadline!r} in BACKUP_SCHEDULE_DEADLINES, "
+            f"expected format {DEADLINE_FORMAT}, ignored"
+        )
+        return None
+    deadline_datetime = datetime.combine(start.date(), deadline_time)
+    # Ограничение относится к ближайшему такому времени после запуска, например, к 06:00 следующего утра
+    if deadline_datetime <= start:
+        deadline_datetime += timedelta(days=1)
+    return deadline_datetime
+
+
+def _simulate(
+    infobases: List[str], durations: Dict[str, float], concurrency: int, start: datetime
+) -> Dict[str, datetime]:
+    """
+    Прогнозирует время окончания резервного копирования каждой ИБ: ИБ запускаются по порядку,
+    как только освобождается одно из `concurrency` мест
+    """
+    slots = [0.0] * max(concurrency, 1)
+    finish = dict()
+    for ib_name in infobases:
+        slot_start = heapq.heappop(slots)
+        slot_finish = slot_start + durations[ib_name]
+        heapq.heappush(slots, slot_finish)
+        finish[ib_name] = start + timedelta(seconds=slot_finish)
+    return finish
+
+
+def plan_backups(
+    infobases: List[str], durations: Dict[str, float], concurrency: int, start: datetime = None
+) -> BackupSchedule:
+    """
+    Определяет порядок резервного копирования ИБ, при котором все копии создаются за минимальное время.
+    ИБ упорядочиваются по приоритету из BACKUP_SCHEDULE_PRIORITY (больше - раньше), затем ИБ с ограничением
+    из BACKUP_SCHEDULE_DEADLINES по возрастанию времени ограничения, затем остальные ИБ от самой долгой
+    к самой быстрой, чтобы долгие копии не запускались последними и не растягивали общее время работы
+    :param infobases: имена ИБ
+    :param durations: словарь имя ИБ - длительность резервного копирования по истории, в секундах.
+        Для ИБ без истории используется средняя длительность остальных ИБ
+    :param concurrency: сколько резервных копий может создаваться одновременно
+    :param start: время начала резервного копирования
+    """
+    start = start or datetime.now()
+    known_durations = [durations[ib_name] for ib_name in infobases if ib_name in durations]
+    default_duration = sum(known_durations) / len(known_durations) if known_durations else 0.0
+    planned_durations = {ib_name: durations.get(ib_name, default_duration) for ib_name in infobases}
+    deadlines = {ib_name: d for ib_name in infobases if (d := _get_deadline(ib_name, start)) is not None}
+    priorities = {ib_name: _get_priority(ib_name) for ib_name in infobases}
+    order = sorted(
+        infobases,
+        key=lambda ib_name: (
+            -priorities[ib_name],
+            deadlines.get(ib_name, datetime.max),
+            -planned_durations[ib_name],
+        ),
+    )
+    predicted_finish = _simulate(order, planned_durations, concurrency, start)
+    predicted_makespan = None
+    if known_durations:
+        predicted_makespan = max(predicted_finish.values(), default=start) - start
+    return BackupSchedule(order, predicted_finish, predicted_makespan, deadlines)
+
+
+def log_schedule(schedule: BackupSchedule, log_prefix: str):
+    log.info(f"<{log_prefix}> Backup order: {', '.join(schedule.infobases)}")
+    if schedule.predicted_makespan is None:
+        log.info(f"<{log_prefix}> No backup history, makespan can not be predicted")
+        return
+    log.info(f"<{log_prefix}> Predicted makespan {schedule.predicted_makespan}")
+    for ib_name, deadline in schedule.deadlines.items():
+        if schedule.predicted_finish[ib_name] > deadline:
+            log.warning(
+                f"<{ib_name}> Backup is predicted to finish at {schedule.predicted_finish[ib_name]:%H:%M}, "
+                f"after deadline {deadline:%H:%M}"
+            )
+
+
+def log_schedule_result(schedule: BackupSchedule, actual_finish: Dict[str, datetime], start: datetime, log_prefix: str):
+    """
+    Сравнивает прогноз с фактической длительностью резервного копирования и проверяет ограничения по времени
+    """
+    actual_makespan = max(actual_finish.values(), default=start) - start
+    if schedule.predicted_makespan is not None:
+        log.info(f"<{log_prefix}> Predicted makespan {schedule.predicted_makespan}, actual {actual_makespan}")
+    else:
+        log.info(f"<{log_prefix}> Actual makespan {actual_makespan}")
+    for ib_name, deadline in schedule.deadlines.items():
+        finish = actual_finish.get(ib_name)
+        if finish is not None and finish > deadline:
+            log.warning(f"<{ib_name}> Backup finished at {finish:%H:%M}, after deadline {deadline:%H:%M}")
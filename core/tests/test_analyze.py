@@ -1,6 +1,8 @@
 import logging
 from datetime import datetime, timedelta
 
+import core.models as core_models
+
 from core.analyze import (
     analyze_backup_result,
     analyze_maintenance_result,
@@ -119,3 +121,17 @@ def test_analyze_result_aws_upload(caplog, infobases, success_aws_result):
     with caplog.at_level(logging.INFO):
         analyze_s3_result(success_aws_result, infobases, datetime_start, datetime_finish)
     assert "Uploaded" in caplog.text
+
+
+def test_analyze_backup_result_logs_compression_ratio(caplog, infobase):
+    """
+    Analyze backup result logs compression ratio and speed of compressed backups
+    """
+    datetime_start = datetime.now()
+    datetime_finish = datetime_start + timedelta(minutes=5)
+    compression = core_models.BackupCompressionResult("test.dt.zst", 1000, 250, 2.0)
+    resultset = [core_models.InfoBaseBackupTaskResult(infobase, True, "test.dt.zst", compression=compression)]
+    with caplog.at_level(logging.INFO):
+        analyze_backup_result(resultset, [infobase], datetime_start, datetime_finish)
+    assert f"[{infobase}] Compression ratio 4.00" in caplog.text
+    assert "Avg. speed 500.0B/s" in caplog.text
@@ -1,16 +1,27 @@
 import asyncio
+import json
+import logging
+import os
+from datetime import datetime, timedelta, timezone
 from functools import reduce
-from unittest.mock import AsyncMock, PropertyMock
+from unittest.mock import AsyncMock, Mock, PropertyMock
 
 import pytest
+from botocore.exceptions import ClientError
 from pytest_mock import MockerFixture
 
 from conf import settings
+from core import delta
+from core.exceptions import SubprocessException
 from core.aws import (
     _get_aws_endpoint_url_parameter,
     _get_aws_region_parameter,
-    _remove_old_infobase_backups_from_s3,
+    _get_upload_state_filename,
     _upload_infobase_to_s3,
+    remove_old_backups_from_s3,
+    remove_unreferenced_chunks_from_s3,
+    s3_client,
+    upload_stream_to_s3,
     upload_infobase_to_s3,
     upload_to_s3,
 )
@@ -159,6 +170,19 @@ async def test_upload_infobase_to_s3_make_retries(
     assert mock_upload_infobase_to_s3_connection_error.call_count == settings.AWS_RETRIES + 1
 
 
+@pytest.mark.asyncio
+async def test_upload_infobase_to_s3_counts_retries(
+    infobase, success_backup_result, mock_upload_infobase_to_s3_connection_error
+):
+    """
+    AWS upload result contains number of retries and semaphore wait time
+    """
+    aws_semaphore = asyncio.Semaphore(1)
+    result = await upload_infobase_to_s3(infobase, success_backup_result[0].backup_filename, aws_semaphore)
+    assert result.retries == settings.AWS_RETRIES
+    assert result.wait_duration is not None
+
+
 @pytest.mark.asyncio
 async def test_internal_upload_infobase_to_s3_call(
     mocker: MockerFixture,
@@ -170,37 +194,534 @@ async def test_internal_upload_infobase_to_s3_call(
     """
     boto3.Session.client.upload_file inside should be called when uploading files to AWS
     """
-    mocker.patch("core.aws._remove_old_infobase_backups_from_s3", AsyncMock())
     await _upload_infobase_to_s3(infobase, success_backup_result[0].backup_filename)
     mock_aioboto3_session.return_value.client.return_value.__aenter__.return_value.upload_file.assert_awaited_once()
 
 
 @pytest.mark.asyncio
-async def test_old_infobase_backups_from_s3_are_removed(mock_aioboto3_session, mock_aioboto3_bucket_objects_old):
+async def test_upload_to_s3(mocker: MockerFixture, mock_upload_infobase_to_s3, mixed_backup_result):
     """
-    Backups older than `settings.AWS_RETENTION_DAYS` are removed from S3
+    When uploading infobases backups to s3 `upload_infobase_to_s3` should be called for every successful backup result
     """
-    await _remove_old_infobase_backups_from_s3("", mock_aioboto3_session)
-    mock_aioboto3_bucket_objects_old.delete.assert_awaited()
+    mocker.patch("core.analyze._analyze_result")
+    mocker.patch("core.aws.remove_old_backups_from_s3")
+    mocker.patch("conf.settings.AWS_ENABLED", new_callable=PropertyMock(return_value=True))
+    await upload_to_s3(mixed_backup_result)
+    assert mock_upload_infobase_to_s3.await_count == reduce(
+        lambda prev, curr: prev + int(curr.succeeded), mixed_backup_result, 0
+    )
+
+
+@pytest.fixture
+def multipart_backup_file(mocker: MockerFixture, tmp_path):
+    mocker.patch("conf.settings.AWS_MULTIPART_CHUNK_SIZE", new_callable=PropertyMock(return_value=10))
+    mocker.patch("conf.settings.AWS_MULTIPART_CONCURRENCY", new_callable=PropertyMock(return_value=2))
+    mocker.patch("conf.settings.AWS_MAX_INFLIGHT_BYTES", new_callable=PropertyMock(return_value=100))
+    backup_file = tmp_path / "test_infobase_2024-01-01_00-00-00.dt"
+    backup_file.write_bytes(bytes(range(45)))
+    return str(backup_file)
+
+
+@pytest.fixture
+def mock_s3_multipart_client(mock_aioboto3_session):
+    s3c = mock_aioboto3_session.return_value.client.return_value.__aenter__.return_value
+    s3c.create_multipart_upload = AsyncMock(return_value={"UploadId": "test_upload_id"})
+    s3c.upload_part = AsyncMock(side_effect=lambda **kwargs: {"ETag": f"etag{kwargs['PartNumber']}"})
+    s3c.complete_multipart_upload = AsyncMock()
+    s3c.list_parts = AsyncMock(return_value={"Parts": [], "IsTruncated": False})
+    s3c.upload_file = AsyncMock()
+    return s3c
 
 
 @pytest.mark.asyncio
-async def test_new_infobase_backups_from_s3_are_not_removed(mock_aioboto3_session, mock_aioboto3_bucket_objects_new):
+async def test_internal_upload_infobase_to_s3_uploads_large_file_by_parts(
+    mocker: MockerFixture, infobase, multipart_backup_file, mock_s3_multipart_client
+):
     """
-    Backups newer than `settings.AWS_RETENTION_DAYS` are not removed from S3
+    Files larger than `AWS_MULTIPART_CHUNK_SIZE` are uploaded by parts
     """
-    await _remove_old_infobase_backups_from_s3("", mock_aioboto3_session)
-    mock_aioboto3_bucket_objects_new.delete.assert_not_awaited()
+    await _upload_infobase_to_s3(infobase, multipart_backup_file)
+    mock_s3_multipart_client.upload_file.assert_not_awaited()
+    assert mock_s3_multipart_client.upload_part.await_count == 5
+    uploaded = b"".join(
+        c.kwargs["Body"]
+        for c in sorted(mock_s3_multipart_client.upload_part.call_args_list, key=lambda c: c.kwargs["PartNumber"])
+    )
+    assert uploaded == bytes(range(45))
+    parts = mock_s3_multipart_client.complete_multipart_upload.call_args.kwargs["MultipartUpload"]["Parts"]
+    assert parts == [dict(ETag=f"etag{n}", PartNumber=n) for n in range(1, 6)]
 
 
 @pytest.mark.asyncio
-async def test_upload_to_s3(mocker: MockerFixture, mock_upload_infobase_to_s3, mixed_backup_result):
+async def test_internal_upload_infobase_to_s3_removes_upload_state_when_completed(
+    mocker: MockerFixture, infobase, multipart_backup_file, mock_s3_multipart_client
+):
     """
-    When uploading infobases backups to s3 `upload_infobase_to_s3` should be called for every successful backup result
+    Multipart upload state file is removed when upload is completed
+    """
+    await _upload_infobase_to_s3(infobase, multipart_backup_file)
+    assert not os.path.exists(_get_upload_state_filename(multipart_backup_file))
+
+
+@pytest.mark.asyncio
+async def test_internal_upload_infobase_to_s3_saves_upload_state_when_failed(
+    mocker: MockerFixture, infobase, multipart_backup_file, mock_s3_multipart_client
+):
+    """
+    Uploaded parts are saved to state file when multipart upload fails
+    """
+    mocker.patch("conf.settings.AWS_MULTIPART_CONCURRENCY", new_callable=PropertyMock(return_value=1))
+
+    def upload_part(**kwargs):
+        if kwargs["PartNumber"] == 3:
+            raise TimeoutError()
+        return {"ETag": f"etag{kwargs['PartNumber']}"}
+
+    mock_s3_multipart_client.upload_part.side_effect = upload_part
+    with pytest.raises(TimeoutError):
+        await _upload_infobase_to_s3(infobase, multipart_backup_file)
+    with open(_get_upload_state_filename(multipart_backup_file)) as f:
+        state = json.load(f)
+    assert state["upload_id"] == "test_upload_id"
+    assert state["parts"] == {"1": "etag1", "2": "etag2"}
+
+
+@pytest.mark.asyncio
+async def test_internal_upload_infobase_to_s3_resumes_multipart_upload(
+    mocker: MockerFixture, infobase, multipart_backup_file, mock_s3_multipart_client
+):
+    """
+    Multipart upload is resumed from state file and only missing parts are uploaded
+    """
+    mock_s3_multipart_client.upload_part.side_effect = [{"ETag": "etag1"}, {"ETag": "etag2"}, TimeoutError()]
+    mocker.patch("conf.settings.AWS_MULTIPART_CONCURRENCY", new_callable=PropertyMock(return_value=1))
+    with pytest.raises(TimeoutError):
+        await _upload_infobase_to_s3(infobase, multipart_backup_file)
+    mock_s3_multipart_client.list_parts.return_value = {
+        "Parts": [{"PartNumber": 1, "ETag": "etag1"}, {"PartNumber": 2, "ETag": "etag2"}],
+        "IsTruncated": False,
+    }
+    mock_s3_multipart_client.upload_part.reset_mock()
+    mock_s3_multipart_client.upload_part.side_effect = lambda **kwargs: {"ETag": f"etag{kwargs['PartNumber']}"}
+    await _upload_infobase_to_s3(infobase, multipart_backup_file)
+    mock_s3_multipart_client.create_multipart_upload.assert_awaited_once()
+    assert sorted(c.kwargs["PartNumber"] for c in mock_s3_multipart_client.upload_part.call_args_list) == [3, 4, 5]
+
+
+@pytest.mark.asyncio
+async def test_upload_infobase_to_s3_aborts_multipart_upload_when_retries_exceeded(
+    mocker: MockerFixture, infobase, multipart_backup_file, mock_s3_multipart_client
+):
+    """
+    Multipart upload is aborted and its state file is removed when all upload retries failed
+    """
+    mocker.patch("conf.settings.AWS_RETRIES", new_callable=PropertyMock(return_value=1))
+    mock_s3_multipart_client.upload_part.side_effect = TimeoutError()
+    mock_s3_multipart_client.abort_multipart_upload = AsyncMock()
+    result = await upload_infobase_to_s3(infobase, multipart_backup_file, asyncio.Semaphore(1))
+    assert result.succeeded is False
+    mock_s3_multipart_client.abort_multipart_upload.assert_awaited_once_with(
+        Bucket=settings.AWS_BUCKET_NAME, Key=os.path.basename(multipart_backup_file), UploadId="test_upload_id"
+    )
+    assert not os.path.exists(_get_upload_state_filename(multipart_backup_file))
+
+
+@pytest.mark.asyncio
+async def test_upload_infobase_to_s3_does_not_abort_completed_upload(
+    infobase, multipart_backup_file, mock_s3_multipart_client
+):
+    """
+    Completed multipart upload is not aborted
+    """
+    mock_s3_multipart_client.abort_multipart_upload = AsyncMock()
+    result = await upload_infobase_to_s3(infobase, multipart_backup_file, asyncio.Semaphore(1))
+    assert result.succeeded is True
+    mock_s3_multipart_client.abort_multipart_upload.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_internal_upload_infobase_to_s3_restarts_when_upload_not_found(
+    mocker: MockerFixture, infobase, multipart_backup_file, mock_s3_multipart_client
+):
+    """
+    Multipart upload is started again when saved upload is not found in S3
+    """
+    with open(_get_upload_state_filename(multipart_backup_file), "w") as f:
+        json.dump(
+            dict(
+                bucket=settings.AWS_BUCKET_NAME,
+                key=os.path.basename(multipart_backup_file),
+                upload_id="expired_upload_id",
+                size=45,
+                mtime=os.stat(multipart_backup_file).st_mtime,
+                part_size=10,
+                parts={"1": "etag1"},
+            ),
+            f,
+        )
+    mock_s3_multipart_client.list_parts.side_effect = ClientError({"Error": {"Code": "NoSuchUpload"}}, "ListParts")
+    await _upload_infobase_to_s3(infobase, multipart_backup_file)
+    mock_s3_multipart_client.create_multipart_upload.assert_awaited_once()
+    assert mock_s3_multipart_client.upload_part.await_count == 5
+
+
+@pytest.mark.asyncio
+async def test_internal_upload_infobase_to_s3_bounds_parts_concurrency(
+    mocker: MockerFixture, infobase, multipart_backup_file, mock_s3_multipart_client
+):
+    """
+    Parts of one file are uploaded with `AWS_MULTIPART_CONCURRENCY` concurrency
+    """
+    running = 0
+    max_running = 0
+
+    async def upload_part(**kwargs):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return {"ETag": f"etag{kwargs['PartNumber']}"}
+
+    mock_s3_multipart_client.upload_part.side_effect = upload_part
+    await _upload_infobase_to_s3(infobase, multipart_backup_file)
+    assert max_running == 2
+
+
+def create_stream(data: bytes) -> asyncio.StreamReader:
+    stream = asyncio.StreamReader()
+    stream.feed_data(data)
+    stream.feed_eof()
+    return stream
+
+
+@pytest.mark.asyncio
+async def test_upload_stream_to_s3_uploads_stream_by_parts(infobase, multipart_backup_file, mock_s3_multipart_client):
+    """
+    Stream is uploaded by parts of `AWS_MULTIPART_CHUNK_SIZE`
+    """
+    result = await upload_stream_to_s3(
+        infobase, create_stream(bytes(range(45))), "test.pgdump", mock_s3_multipart_client
+    )
+    assert result.succeeded
+    assert result.upload_size == 45
+    uploaded = b"".join(
+        c.kwargs["Body"]
+        for c in sorted(mock_s3_multipart_client.upload_part.call_args_list, key=lambda c: c.kwargs["PartNumber"])
+    )
+    assert uploaded == bytes(range(45))
+    parts = mock_s3_multipart_client.complete_multipart_upload.call_args.kwargs["MultipartUpload"]["Parts"]
+    assert [p["PartNumber"] for p in parts] == [1, 2, 3, 4, 5]
+
+
+@pytest.mark.asyncio
+async def test_upload_stream_to_s3_writes_tee_file(infobase, tmp_path, multipart_backup_file, mock_s3_multipart_client):
+    """
+    Stream is also written to tee file when it is set
+    """
+    tee_filename = tmp_path / "test.pgdump"
+    await upload_stream_to_s3(
+        infobase, create_stream(bytes(range(45))), "test.pgdump", mock_s3_multipart_client, str(tee_filename)
+    )
+    assert tee_filename.read_bytes() == bytes(range(45))
+
+
+@pytest.mark.asyncio
+async def test_upload_stream_to_s3_aborts_upload_when_source_failed(
+    infobase, tmp_path, multipart_backup_file, mock_s3_multipart_client
+):
+    """
+    Upload is aborted and tee file is removed when `before_complete` raises
+    """
+    mock_s3_multipart_client.abort_multipart_upload = AsyncMock()
+    tee_filename = tmp_path / "test.pgdump"
+    before_complete = AsyncMock(side_effect=SubprocessException)
+    with pytest.raises(SubprocessException):
+        await upload_stream_to_s3(
+            infobase,
+            create_stream(bytes(range(45))),
+            "test.pgdump",
+            mock_s3_multipart_client,
+            str(tee_filename),
+            before_complete,
+        )
+    mock_s3_multipart_client.complete_multipart_upload.assert_not_awaited()
+    mock_s3_multipart_client.abort_multipart_upload.assert_awaited_once()
+    assert not tee_filename.exists()
+
+
+@pytest.mark.asyncio
+async def test_upload_stream_to_s3_stops_reading_when_part_failed(
+    infobase, multipart_backup_file, mock_s3_multipart_client
+):
+    """
+    Stream is not read further after upload of a part failed
+    """
+    mock_s3_multipart_client.abort_multipart_upload = AsyncMock()
+    mock_s3_multipart_client.upload_part.side_effect = ClientError({}, "UploadPart")
+    stream = create_stream(bytes(range(45)))
+    with pytest.raises(ClientError):
+        await upload_stream_to_s3(infobase, stream, "test.pgdump", mock_s3_multipart_client)
+    assert not stream.at_eof()
+    mock_s3_multipart_client.abort_multipart_upload.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_upload_to_s3_removes_old_backups_of_uploaded_infobases(
+    mocker: MockerFixture, mock_aioboto3_session, mock_upload_infobase_to_s3, mixed_backup_result
+):
+    """
+    After uploading, old backups are removed from S3 once for all successfully uploaded infobases
     """
     mocker.patch("core.analyze._analyze_result")
+    remove_old_backups_mock = mocker.patch("core.aws.remove_old_backups_from_s3")
     mocker.patch("conf.settings.AWS_ENABLED", new_callable=PropertyMock(return_value=True))
+    s3c = mock_aioboto3_session.return_value.client.return_value.__aenter__.return_value
     await upload_to_s3(mixed_backup_result)
-    assert mock_upload_infobase_to_s3.await_count == reduce(
-        lambda prev, curr: prev + int(curr.succeeded), mixed_backup_result, 0
+    remove_old_backups_mock.assert_awaited_once_with([r.infobase_name for r in mixed_backup_result if r.succeeded], s3c)
+
+
+@pytest.mark.asyncio
+async def test_upload_to_s3_shares_one_client_between_uploads(
+    mocker: MockerFixture, mock_aioboto3_session, mock_upload_infobase_to_s3, mixed_backup_result
+):
+    """
+    All uploads of a single run use the same S3 client
+    """
+    mocker.patch("core.analyze._analyze_result")
+    mocker.patch("core.aws.remove_old_backups_from_s3")
+    mocker.patch("conf.settings.AWS_ENABLED", new_callable=PropertyMock(return_value=True))
+    s3c = mock_aioboto3_session.return_value.client.return_value.__aenter__.return_value
+    await upload_to_s3(mixed_backup_result)
+    mock_aioboto3_session.assert_called_once()
+    mock_aioboto3_session.return_value.client.assert_called_once()
+    assert all(c.args[2] is s3c for c in mock_upload_infobase_to_s3.call_args_list)
+
+
+@pytest.mark.asyncio
+async def test_s3_client_uses_max_pool_connections_setting(mocker: MockerFixture, mock_aioboto3_session):
+    """
+    S3 client connection pool is sized by `AWS_MAX_POOL_CONNECTIONS`
+    """
+    mocker.patch("conf.settings.AWS_MAX_POOL_CONNECTIONS", new_callable=PropertyMock(return_value=7))
+    async with s3_client():
+        pass
+    config = mock_aioboto3_session.return_value.client.call_args.kwargs["config"]
+    assert config.max_pool_connections == 7
+
+
+@pytest.mark.asyncio
+async def test_s3_client_pool_defaults_to_upload_concurrency(mocker: MockerFixture, mock_aioboto3_session):
+    """
+    When `AWS_MAX_POOL_CONNECTIONS` is not set, pool fits all concurrently uploaded parts
+    """
+    mocker.patch("conf.settings.AWS_MAX_POOL_CONNECTIONS", new_callable=PropertyMock(return_value=None))
+    mocker.patch("conf.settings.AWS_CONCURRENCY", new_callable=PropertyMock(return_value=3))
+    mocker.patch("conf.settings.AWS_MULTIPART_CONCURRENCY", new_callable=PropertyMock(return_value=5))
+    async with s3_client():
+        pass
+    config = mock_aioboto3_session.return_value.client.call_args.kwargs["config"]
+    assert config.max_pool_connections == 15
+
+
+@pytest.mark.asyncio
+async def test_upload_infobase_to_s3_uses_passed_client(mock_aioboto3_session, mock_os_stat):
+    """
+    When S3 client is passed, upload does not create a new one
+    """
+    s3c = AsyncMock()
+    semaphore = asyncio.Semaphore(1)
+    result = await upload_infobase_to_s3("test_ib", "test_ib.dt", semaphore, s3c)
+    assert result.succeeded
+    s3c.upload_file.assert_awaited_once()
+    mock_aioboto3_session.assert_not_called()
+
+
+def create_s3_object(key: str, days_old: int, size: int = 100):
+    return dict(Key=key, LastModified=datetime.now(tz=timezone.utc) - timedelta(days=days_old), Size=size)
+
+
+@pytest.fixture
+def mock_s3_bucket_listing(mock_aioboto3_session):
+    s3c = mock_aioboto3_session.return_value.client.return_value.__aenter__.return_value
+    pages = []
+
+    async def paginate(**kwargs):
+        for page in pages:
+            yield page
+
+    paginator = Mock()
+    paginator.paginate = Mock(side_effect=paginate)
+    s3c.get_paginator = Mock(return_value=paginator)
+    s3c.delete_objects = AsyncMock(return_value=dict())
+    return s3c, pages
+
+
+def _deleted_keys(s3c):
+    return [o["Key"] for c in s3c.delete_objects.call_args_list for o in c.kwargs["Delete"]["Objects"]]
+
+
+@pytest.mark.asyncio
+async def test_remove_old_backups_from_s3_removes_only_old_backups(mock_s3_bucket_listing):
+    """
+    Backups older than `settings.AWS_RETENTION_DAYS` are removed from S3, newer backups are kept
+    """
+    s3c, pages = mock_s3_bucket_listing
+    retention_days = settings.AWS_RETENTION_DAYS
+    pages.append(
+        dict(
+            Contents=[
+                create_s3_object("infobase_2020-01-01.dt", retention_days + 2),
+                create_s3_object("infobase_2099-01-01.dt", 0),
+            ]
+        )
+    )
+    await remove_old_backups_from_s3(["infobase"])
+    assert _deleted_keys(s3c) == ["infobase_2020-01-01.dt"]
+
+
+@pytest.mark.asyncio
+async def test_remove_old_backups_from_s3_removes_cataloged_and_uncataloged_objects(mock_s3_bucket_listing, infobase):
+    """
+    Old backups found with catalog query and with bucket listing are removed once and removed from catalog
+    """
+    s3c, pages = mock_s3_bucket_listing
+    retention_days = settings.AWS_RETENTION_DAYS
+    cataloged_key = f"{infobase}_2020-01-01.dt"
+    uncataloged_key = f"{infobase}_2020-01-02.dt"
+    pages.append(
+        dict(
+            Contents=[
+                create_s3_object(cataloged_key, retention_days + 1),
+                create_s3_object(uncataloged_key, retention_days + 1),
+            ]
+        )
+    )
+    backup_catalog = Mock()
+    backup_catalog.get_expired_s3_objects.return_value = [dict(Key=cataloged_key, Size=1)]
+    await remove_old_backups_from_s3([infobase], catalog=backup_catalog)
+    assert _deleted_keys(s3c) == [cataloged_key, uncataloged_key]
+    backup_catalog.forget_s3_objects.assert_called_with(settings.AWS_BUCKET_NAME, [cataloged_key, uncataloged_key])
+
+
+@pytest.mark.asyncio
+async def test_remove_old_backups_from_s3_lists_bucket_once(mock_s3_bucket_listing, infobases):
+    """
+    Bucket is listed once for all infobases
+    """
+    s3c, pages = mock_s3_bucket_listing
+    pages.append(dict(Contents=[create_s3_object(f"{ib}_2020-01-01.dt", 1000) for ib in infobases]))
+    await remove_old_backups_from_s3(infobases)
+    s3c.get_paginator.return_value.paginate.assert_called_once()
+    assert sorted(_deleted_keys(s3c)) == sorted(f"{ib}_2020-01-01.dt" for ib in infobases)
+
+
+@pytest.mark.asyncio
+async def test_remove_old_backups_from_s3_keeps_backups_of_other_infobases(mock_s3_bucket_listing):
+    """
+    Backups of infobases with names starting with infobase name, but without separator, are not removed
+    """
+    s3c, pages = mock_s3_bucket_listing
+    pages.append(
+        dict(
+            Contents=[
+                create_s3_object("infobase_2020-01-01.dt", 1000),
+                create_s3_object("infobase2_2020-01-01.dt", 1000),
+            ]
+        )
+    )
+    await remove_old_backups_from_s3(["infobase"])
+    assert _deleted_keys(s3c) == ["infobase_2020-01-01.dt"]
+
+
+@pytest.mark.asyncio
+async def test_remove_old_backups_from_s3_deletes_in_batches(mock_s3_bucket_listing):
+    """
+    Objects are deleted in batches of up to 1000 keys
+    """
+    s3c, pages = mock_s3_bucket_listing
+    pages.append(dict(Contents=[create_s3_object(f"infobase_{i}.dt", 1000) for i in range(1000)]))
+    pages.append(dict(Contents=[create_s3_object(f"infobase_{i}.dt", 1000) for i in range(1000, 1500)]))
+    await remove_old_backups_from_s3(["infobase"])
+    assert [len(c.kwargs["Delete"]["Objects"]) for c in s3c.delete_objects.call_args_list] == [1000, 500]
+
+
+@pytest.mark.asyncio
+async def test_remove_old_backups_from_s3_logs_freed_space(caplog, mock_s3_bucket_listing):
+    """
+    Number of removed objects and freed space is logged, objects which failed to delete are not counted
+    """
+    s3c, pages = mock_s3_bucket_listing
+    pages.append(dict(Contents=[create_s3_object(f"infobase_{i}.dt", 1000, 1024) for i in range(3)]))
+    s3c.delete_objects.return_value = dict(Errors=[dict(Key="infobase_0.dt", Message="AccessDenied")])
+    with caplog.at_level(logging.INFO):
+        await remove_old_backups_from_s3(["infobase"])
+    assert "Removed 2 objects from S3, 2.0KiB freed" in caplog.text
+
+
+@pytest.fixture
+def mock_delta_upload(mocker: MockerFixture, tmp_path, mock_aioboto3_session):
+    mocker.patch("conf.settings.BACKUP_DELTA_ENABLED", new_callable=PropertyMock(return_value=True))
+    mocker.patch("conf.settings.BACKUP_DELTA_CHUNK_SIZE", new_callable=PropertyMock(return_value=4096))
+    mocker.patch("conf.settings.BACKUP_DELTA_INDEX_PATH", new_callable=PropertyMock(return_value=str(tmp_path / "idx")))
+    s3c = mock_aioboto3_session.return_value.client.return_value.__aenter__.return_value
+    s3c.put_object = AsyncMock()
+    backup_file = tmp_path / "infobase_2024-01-01-00-00-00.dt"
+    backup_file.write_bytes(os.urandom(4096 * 16))
+    return s3c, str(backup_file)
+
+
+def _put_keys(s3c):
+    return [c.kwargs["Key"] for c in s3c.put_object.call_args_list]
+
+
+@pytest.mark.asyncio
+async def test_internal_upload_infobase_to_s3_uploads_delta_chunks_and_manifest(infobase, mock_delta_upload):
+    """
+    `*.dt` backup is uploaded as chunks and manifest when delta is enabled, manifest is uploaded last
+    """
+    s3c, backup_file = mock_delta_upload
+    result = await _upload_infobase_to_s3(infobase, backup_file)
+    keys = _put_keys(s3c)
+    assert keys[-1] == "infobase_2024-01-01-00-00-00.dt.manifest"
+    assert all(k.startswith("chunks/") for k in keys[:-1])
+    assert result.s3_key == "infobase_2024-01-01-00-00-00.dt.manifest"
+
+
+@pytest.mark.asyncio
+async def test_internal_upload_infobase_to_s3_skips_chunks_already_in_bucket(infobase, mock_delta_upload):
+    """
+    Chunks which are in local chunk index are not uploaded again
+    """
+    s3c, backup_file = mock_delta_upload
+    await _upload_infobase_to_s3(infobase, backup_file)
+    s3c.put_object.reset_mock()
+    await _upload_infobase_to_s3(infobase, backup_file)
+    assert _put_keys(s3c) == ["infobase_2024-01-01-00-00-00.dt.manifest"]
+
+
+@pytest.mark.asyncio
+async def test_remove_unreferenced_chunks_from_s3_keeps_referenced_chunks(
+    mocker: MockerFixture, tmp_path, mock_s3_bucket_listing
+):
+    """
+    Chunks which are not referenced by any manifest in the bucket are removed
+    """
+    mocker.patch("conf.settings.BACKUP_DELTA_INDEX_PATH", new_callable=PropertyMock(return_value=str(tmp_path)))
+    s3c, pages = mock_s3_bucket_listing
+    referenced, unreferenced = "a" * 64, "b" * 64
+    manifest = dict(chunks=[[referenced, 0, 1]])
+    pages.append(
+        dict(
+            Contents=[
+                create_s3_object("infobase_2024-01-01-00-00-00.dt.manifest", 0),
+                create_s3_object(delta.get_chunk_relative_path(referenced), 0),
+                create_s3_object(delta.get_chunk_relative_path(unreferenced), 0),
+            ]
+        )
     )
+    body = AsyncMock()
+    body.__aenter__.return_value.read = AsyncMock(return_value=json.dumps(manifest).encode())
+    s3c.get_object = AsyncMock(return_value=dict(Body=body))
+    await remove_unreferenced_chunks_from_s3()
+    assert _deleted_keys(s3c) == [delta.get_chunk_relative_path(unreferenced)]
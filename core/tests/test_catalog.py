@@ -0,0 +1,221 @@
+import hashlib
+import os
+from datetime import datetime, timedelta
+from unittest.mock import PropertyMock
+
+import pytest
+from pytest_mock import MockerFixture
+
+import core.models as core_models
+from conf import settings
+from core.catalog import BackupCatalog, parse_backup_filename, record_backup, scan_backup_files
+
+
+def _backup_filename(ib_name: str, ext: str = "dt", created_at: datetime = None) -> str:
+    created_at = created_at or datetime.now()
+    return f"{ib_name}{settings.FILENAME_SEPARATOR}{created_at.strftime(settings.DATETIME_FORMAT)}.{ext}"
+
+
+@pytest.fixture
+def backup_catalog(tmp_path):
+    backup_catalog = BackupCatalog(str(tmp_path / "catalog.sqlite3"))
+    yield backup_catalog
+    backup_catalog.close()
+
+
+@pytest.fixture
+def catalog_backup_file(tmp_path, infobase):
+    backup_file = tmp_path / _backup_filename(infobase)
+    backup_file.write_bytes(b"backup")
+    return str(backup_file)
+
+
+def test_parse_backup_filename_parses_infobase_type_and_date(infobase):
+    """
+    `parse_backup_filename` gets infobase name, backup type and creation date from backup filename
+    """
+    created_at = datetime(2024, 1, 2, 3, 4, 5)
+    result = parse_backup_filename(_backup_filename(f"{infobase}_copy", "pgdump.tar.zst", created_at))
+    assert result == (f"{infobase}_copy", "pgdump", created_at)
+
+
+@pytest.mark.parametrize("ext", ["dt", "dt.zst", "dt.manifest", "pgdump.tar"])
+def test_parse_backup_filename_parses_infobase_with_dots(ext):
+    """
+    `parse_backup_filename` gets infobase name which contains dots
+    """
+    created_at = datetime(2024, 1, 2, 3, 4, 5)
+    result = parse_backup_filename(_backup_filename("company.accounting", ext, created_at))
+    assert result == ("company.accounting", ext.split(".")[0], created_at)
+
+
+@pytest.mark.parametrize(
+    "filename",
+    [
+        "infobase_2024-01-02-03-04-05.log",
+        "infobase_copy.dt",
+        "infobase.dt",
+        "infobase_2024-01-02-03-04-05.dt.log",
+        "infobase_2024-01-02-03-04-05.zst",
+    ],
+)
+def test_parse_backup_filename_skips_other_files(filename):
+    """
+    `parse_backup_filename` returns None for files which are not backups
+    """
+    assert parse_backup_filename(filename) is None
+
+
+def test_record_backup_result_records_artifact_replicas_and_s3_object(
+    backup_catalog, catalog_backup_file, tmp_path, infobase
+):
+    """
+    Backup result is recorded to catalog with its replicas and S3 object
+    """
+    backup_result = core_models.InfoBaseBackupTaskResult(infobase, True, catalog_backup_file, duration=10)
+    backup_result.replicas = [str(tmp_path / "replica" / "backup.dt")]
+    key = os.path.basename(catalog_backup_file)
+    aws_result = core_models.InfoBaseAWSUploadTaskResult(infobase, True, 6, key)
+    backup_catalog.record_backup_result(backup_result, aws_result, "checksum")
+    artifact = backup_catalog.connection.execute(
+        "SELECT infobase, backup_type, path, size, checksum, duration FROM artifacts"
+    ).fetchall()
+    assert artifact == [(infobase, "dt", catalog_backup_file, 6, "checksum", 10)]
+    assert backup_catalog.connection.execute("SELECT path FROM replicas").fetchall() == [
+        (str(tmp_path / "replica" / "backup.dt"),)
+    ]
+    assert backup_catalog.connection.execute("SELECT key, size FROM s3_objects").fetchall() == [(key, 6)]
+
+
+def test_record_backup_result_records_streamed_backup_without_local_file(backup_catalog, infobase):
+    """
+    Backup streamed to S3 without local copy is recorded by its S3 key
+    """
+    key = _backup_filename(infobase, "pgdump")
+    backup_result = core_models.InfoBaseBackupTaskResult(infobase, True, "")
+    aws_result = core_models.InfoBaseAWSUploadTaskResult(infobase, True, 100, key)
+    backup_catalog.record_backup_result(backup_result, aws_result)
+    assert backup_catalog.connection.execute("SELECT filename, path FROM artifacts").fetchall() == [(key, None)]
+
+
+def test_record_backup_result_skips_failed_backup(backup_catalog, infobase):
+    """
+    Failed backup is not recorded to catalog
+    """
+    assert backup_catalog.record_backup_result(core_models.InfoBaseBackupTaskResult(infobase, False)) is None
+    assert backup_catalog.connection.execute("SELECT COUNT(*) FROM artifacts").fetchone()[0] == 0
+
+
+def test_get_expired_files_returns_old_files_and_replicas(backup_catalog, infobases):
+    """
+    `get_expired_files` returns old backups and replicas of requested infobases only
+    """
+    old = (datetime.now() - timedelta(days=10)).timestamp()
+    for ib in infobases:
+        artifact_id = backup_catalog.add_artifact(ib, "dt", f"{ib}_old.dt", old, path=f"/backup/{ib}_old.dt")
+        backup_catalog.add_replica(artifact_id, f"/replica/{ib}_old.dt")
+        backup_catalog.add_artifact(ib, "dt", f"{ib}_new.dt", datetime.now().timestamp(), path=f"/backup/{ib}_new.dt")
+    result = backup_catalog.get_expired_files([infobases[0]], datetime.now() - timedelta(days=5))
+    assert sorted(result) == sorted([f"/backup/{infobases[0]}_old.dt", f"/replica/{infobases[0]}_old.dt"])
+
+
+def test_forget_files_removes_artifact_without_any_copies(backup_catalog, infobase):
+    """
+    Artifact is removed from catalog when its file and all replicas are removed
+    """
+    artifact_id = backup_catalog.add_artifact(infobase, "dt", "backup.dt", 0, path="/backup/backup.dt")
+    backup_catalog.add_replica(artifact_id, "/replica/backup.dt")
+    backup_catalog.forget_files(["/backup/backup.dt"])
+    assert backup_catalog.connection.execute("SELECT path FROM artifacts").fetchall() == [(None,)]
+    backup_catalog.forget_files(["/replica/backup.dt"])
+    assert backup_catalog.connection.execute("SELECT COUNT(*) FROM artifacts").fetchone()[0] == 0
+
+
+def test_get_average_durations_uses_last_backups(backup_catalog, infobases):
+    """
+    Average duration is calculated by the last backups of every infobase
+    """
+    for i, duration in enumerate([1000, 10, 20]):
+        backup_catalog.add_artifact(infobases[0], "dt", f"{i}.dt", i, duration=duration)
+    backup_catalog.add_artifact(infobases[1], "dt", "other.dt", 0)
+    assert backup_catalog.get_average_durations(infobases, 2) == {infobases[0]: 15}
+
+
+def test_get_expired_s3_objects_returns_old_objects_of_bucket(backup_catalog, infobase):
+    """
+    `get_expired_s3_objects` returns old objects of requested bucket only
+    """
+    old = (datetime.now() - timedelta(days=10)).timestamp()
+    artifact_id = backup_catalog.add_artifact(infobase, "dt", "backup.dt", old)
+    backup_catalog.add_s3_object(artifact_id, infobase, "bucket", "backup.dt", 100, old)
+    backup_catalog.add_s3_object(artifact_id, infobase, "other-bucket", "backup.dt", 100, old)
+    result = backup_catalog.get_expired_s3_objects([infobase], "bucket", datetime.now() - timedelta(days=5))
+    assert result == [dict(Key="backup.dt", Size=100)]
+
+
+def test_reconcile_rebuilds_catalog_from_files(backup_catalog, tmp_path, infobase):
+    """
+    `reconcile` rebuilds catalog from existing files and keeps known checksums
+    """
+    filename = _backup_filename(infobase)
+    backup_catalog.add_artifact(infobase, "dt", filename, 0, path=f"/backup/{filename}", checksum="checksum")
+    backup_catalog.add_artifact(infobase, "dt", "removed.dt", 0, path="/backup/removed.dt")
+    count = backup_catalog.reconcile(
+        [(f"/backup/{filename}", 100, 6)],
+        [(f"/replica/{filename}", 100, 6)],
+        [("bucket", filename, 100, 6)],
+    )
+    assert count == 1
+    assert backup_catalog.connection.execute("SELECT filename, checksum FROM artifacts").fetchall() == [
+        (filename, "checksum")
+    ]
+    assert backup_catalog.get_summary()[0][4:] == (1, 1)
+
+
+def test_scan_backup_files_finds_only_backups(tmp_path, catalog_backup_file):
+    """
+    `scan_backup_files` finds backup files and skips other files
+    """
+    (tmp_path / "catalog.log").write_text("log")
+    assert [f[0] for f in scan_backup_files(str(tmp_path))] == [catalog_backup_file]
+
+
+@pytest.mark.asyncio
+async def test_record_backup_calculates_checksum_when_enabled(
+    mocker: MockerFixture, backup_catalog, catalog_backup_file, infobase
+):
+    """
+    `record_backup` records SHA-256 checksum of backup when `BACKUP_CATALOG_CHECKSUMS` is enabled
+    """
+    mocker.patch("conf.settings.BACKUP_CATALOG_CHECKSUMS", new_callable=PropertyMock(return_value=True))
+    assert await record_backup(
+        backup_catalog, core_models.InfoBaseBackupTaskResult(infobase, True, catalog_backup_file)
+    )
+    checksum = backup_catalog.connection.execute("SELECT checksum FROM artifacts").fetchone()[0]
+    assert checksum == hashlib.sha256(b"backup").hexdigest()
+
+
+@pytest.mark.asyncio
+async def test_record_backup_does_not_read_backup_by_default(
+    mocker: MockerFixture, backup_catalog, catalog_backup_file, infobase
+):
+    """
+    `record_backup` does not read backup again to calculate checksum by default
+    """
+    calculate_checksum_mock = mocker.patch("core.catalog.calculate_checksum")
+    assert await record_backup(
+        backup_catalog, core_models.InfoBaseBackupTaskResult(infobase, True, catalog_backup_file)
+    )
+    calculate_checksum_mock.assert_not_called()
+    assert backup_catalog.connection.execute("SELECT checksum FROM artifacts").fetchone()[0] is None
+
+
+@pytest.mark.asyncio
+async def test_record_backup_skips_failed_upload(backup_catalog, catalog_backup_file, infobase):
+    """
+    `record_backup` records backup without S3 object when upload failed
+    """
+    backup_result = core_models.InfoBaseBackupTaskResult(infobase, True, catalog_backup_file)
+    aws_result = core_models.InfoBaseAWSUploadTaskResult(infobase, False, s3_key="key")
+    assert await record_backup(backup_catalog, backup_result, aws_result)
+    assert backup_catalog.connection.execute("SELECT COUNT(*) FROM s3_objects").fetchone()[0] == 0
@@ -0,0 +1,117 @@
+import os
+
+import pytest
+from pytest_mock import MockerFixture
+
+from core.compression import _estimate_compression_ratio, compress_backup
+
+zstandard = pytest.importorskip("zstandard")
+
+
+@pytest.fixture
+def compressible_backup_file(tmp_path, infobase):
+    backup_file = tmp_path / f"{infobase}_2024-01-01_00-00-00.dt"
+    backup_file.write_bytes(b"test backup data " * 10000)
+    return str(backup_file)
+
+
+@pytest.fixture
+def incompressible_backup_file(tmp_path, infobase):
+    backup_file = tmp_path / f"{infobase}_2024-01-01_00-00-00.dt"
+    backup_file.write_bytes(os.urandom(100000))
+    return str(backup_file)
+
+
+@pytest.mark.asyncio
+async def test_compress_backup_creates_zst_file(infobase, compressible_backup_file):
+    """
+    `compress_backup` writes `*.zst` file which decompresses to original data and removes original file
+    """
+    with open(compressible_backup_file, "rb") as f:
+        data = f.read()
+    result = await compress_backup(infobase, compressible_backup_file)
+    assert result.compressed_filename == f"{compressible_backup_file}.zst"
+    assert not os.path.exists(compressible_backup_file)
+    with open(result.compressed_filename, "rb") as f:
+        assert zstandard.ZstdDecompressor().decompress(f.read()) == data
+
+
+@pytest.mark.asyncio
+async def test_compress_backup_returns_sizes(infobase, compressible_backup_file):
+    """
+    `compress_backup` result contains original and compressed sizes
+    """
+    original_size = os.path.getsize(compressible_backup_file)
+    result = await compress_backup(infobase, compressible_backup_file)
+    assert result.original_size == original_size
+    assert result.compressed_size == os.path.getsize(result.compressed_filename)
+    assert result.ratio > 1
+
+
+@pytest.mark.asyncio
+async def test_compress_backup_keeps_original_when_does_not_shrink(
+    mocker: MockerFixture, infobase, incompressible_backup_file
+):
+    """
+    `compress_backup` keeps original file when compressed file is not smaller
+    """
+    mocker.patch("core.compression._estimate_compression_ratio", return_value=2.0)
+    result = await compress_backup(infobase, incompressible_backup_file)
+    assert result is None
+    assert os.path.exists(incompressible_backup_file)
+    assert not os.path.exists(f"{incompressible_backup_file}.zst")
+
+
+@pytest.mark.asyncio
+async def test_compress_backup_keeps_original_when_failed(mocker: MockerFixture, infobase, compressible_backup_file):
+    """
+    `compress_backup` keeps original file and removes partial compressed file when compression failed
+    """
+    mocker.patch("core.compression._compress_file", side_effect=OSError)
+    result = await compress_backup(infobase, compressible_backup_file)
+    assert result is None
+    assert os.path.exists(compressible_backup_file)
+    assert not os.path.exists(f"{compressible_backup_file}.zst")
+
+
+@pytest.mark.asyncio
+async def test_compress_backup_skips_file_when_samples_do_not_shrink(
+    mocker: MockerFixture, infobase, incompressible_backup_file
+):
+    """
+    `compress_backup` does not compress whole file when its samples do not shrink
+    """
+    compress_file_mock = mocker.patch("core.compression._compress_file")
+    result = await compress_backup(infobase, incompressible_backup_file)
+    assert result is None
+    compress_file_mock.assert_not_called()
+    assert os.path.exists(incompressible_backup_file)
+
+
+@pytest.mark.parametrize("extension", ["pgdump", "pgdump.tar"])
+@pytest.mark.asyncio
+async def test_compress_backup_skips_pgdump(mocker: MockerFixture, tmp_path, infobase, extension):
+    """
+    `compress_backup` does not compress backups which are already compressed by pg_dump
+    """
+    backup_file = tmp_path / f"{infobase}_2024-01-01_00-00-00.{extension}"
+    backup_file.write_bytes(b"test backup data " * 10000)
+    estimate_mock = mocker.patch("core.compression._estimate_compression_ratio")
+    compress_file_mock = mocker.patch("core.compression._compress_file")
+    result = await compress_backup(infobase, str(backup_file))
+    assert result is None
+    estimate_mock.assert_not_called()
+    compress_file_mock.assert_not_called()
+    assert backup_file.exists()
+
+
+def test_estimate_compression_ratio_samples_whole_file(mocker: MockerFixture, tmp_path):
+    """
+    `_estimate_compression_ratio` compresses samples from the beginning and the end of file
+    """
+    mocker.patch("core.compression.COMPRESSION_SAMPLE_SIZE", 1000)
+    backup_file = tmp_path / "backup.dt"
+    # Only the second half of the file is compressible
+    backup_file.write_bytes(os.urandom(4000) + b"0" * 4000)
+    ratio = _estimate_compression_ratio(str(backup_file))
+    assert 1.5 < ratio < 2.5
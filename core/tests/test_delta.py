@@ -0,0 +1,152 @@
+import io
+import os
+import random
+from unittest.mock import PropertyMock
+
+import pytest
+from pytest_mock import MockerFixture
+
+from core import delta
+
+CHUNK_SIZE = 4096
+
+
+@pytest.fixture
+def mock_delta_settings(mocker: MockerFixture, tmp_path):
+    mocker.patch("conf.settings.BACKUP_DELTA_ENABLED", new_callable=PropertyMock(return_value=True))
+    mocker.patch("conf.settings.BACKUP_DELTA_CHUNK_SIZE", new_callable=PropertyMock(return_value=CHUNK_SIZE))
+    mocker.patch("conf.settings.BACKUP_DELTA_INDEX_PATH", new_callable=PropertyMock(return_value=str(tmp_path / "idx")))
+
+
+def _random_bytes(size: int, seed: int = 0) -> bytes:
+    return random.Random(seed).randbytes(size)
+
+
+@pytest.fixture
+def delta_backup_file(tmp_path):
+    backup_file = tmp_path / "infobase_2024-01-01-00-00-00.dt"
+    backup_file.write_bytes(_random_bytes(CHUNK_SIZE * 64))
+    return str(backup_file)
+
+
+def test_iter_chunks_splits_stream_within_size_limits():
+    """
+    `iter_chunks` splits stream into consecutive chunks within size limits
+    """
+    data = _random_bytes(CHUNK_SIZE * 64)
+    chunks = list(delta.iter_chunks(io.BytesIO(data), CHUNK_SIZE))
+    assert b"".join(c for _, c in chunks) == data
+    assert [o for o, _ in chunks] == [sum(len(c) for _, c in chunks[:i]) for i in range(len(chunks))]
+    assert all(CHUNK_SIZE // 4 <= len(c) <= CHUNK_SIZE * 4 for _, c in chunks[:-1])
+
+
+def test_iter_chunks_boundaries_follow_content_when_data_is_inserted():
+    """
+    Data inserted at the beginning of stream changes only the first chunks
+    """
+    data = _random_bytes(CHUNK_SIZE * 64)
+    chunks = {c for _, c in delta.iter_chunks(io.BytesIO(data), CHUNK_SIZE)}
+    shifted_chunks = {c for _, c in delta.iter_chunks(io.BytesIO(b"inserted" + data), CHUNK_SIZE)}
+    assert len(chunks - shifted_chunks) <= 2
+
+
+def test_is_delta_candidate_accepts_only_uncompressed_dt(mock_delta_settings):
+    """
+    Delta replication is used for uncompressed `*.dt` backups only
+    """
+    assert delta.is_delta_candidate("infobase.dt") is True
+    assert delta.is_delta_candidate("infobase.dt.zst") is False
+    assert delta.is_delta_candidate("infobase.pgdump") is False
+
+
+@pytest.mark.asyncio
+async def test_replicate_file_delta_writes_manifest_and_restores(mock_delta_settings, tmp_path, delta_backup_file):
+    """
+    Delta replica is restored from manifest to the same file
+    """
+    replication_path = str(tmp_path / "replica")
+    os.makedirs(replication_path)
+    result = await delta.replicate_file_delta(delta_backup_file, [replication_path])
+    manifest_filename = result[replication_path]
+    assert manifest_filename == os.path.join(replication_path, "infobase_2024-01-01-00-00-00.dt.manifest")
+    delta.restore_file(manifest_filename, str(tmp_path / "restored.dt"))
+    with open(delta_backup_file, "rb") as original, open(tmp_path / "restored.dt", "rb") as restored:
+        assert original.read() == restored.read()
+
+
+@pytest.mark.asyncio
+async def test_replicate_file_delta_writes_only_new_chunks(
+    mocker: MockerFixture, mock_delta_settings, tmp_path, delta_backup_file
+):
+    """
+    Only chunks changed since previous backup are written to replica
+    """
+    replication_path = str(tmp_path / "replica")
+    os.makedirs(replication_path)
+    await delta.replicate_file_delta(delta_backup_file, [replication_path])
+    chunks_count = len(delta._scan_local_chunks(replication_path))
+    next_backup_file = tmp_path / "infobase_2024-01-02-00-00-00.dt"
+    data = bytearray(open(delta_backup_file, "rb").read())
+    data[CHUNK_SIZE * 32 : CHUNK_SIZE * 32 + 8] = b"changed!"
+    next_backup_file.write_bytes(bytes(data))
+    write_spy = mocker.spy(delta, "_write_file_atomically")
+    await delta.replicate_file_delta(str(next_backup_file), [replication_path])
+    # One or two changed chunks and manifest
+    assert write_spy.call_count <= 3
+    assert len(delta._scan_local_chunks(replication_path)) <= chunks_count + 2
+
+
+@pytest.mark.asyncio
+async def test_replicate_file_delta_returns_exception_for_failed_path(mock_delta_settings, tmp_path, delta_backup_file):
+    """
+    Replication error of one path is returned and does not stop replication to other paths
+    """
+    replication_path = str(tmp_path / "replica")
+    os.makedirs(replication_path)
+    file_path = str(tmp_path / "file")
+    (tmp_path / "file").write_bytes(b"")
+    result = await delta.replicate_file_delta(delta_backup_file, [file_path, replication_path])
+    assert isinstance(result[file_path], OSError)
+    assert os.path.exists(result[replication_path])
+
+
+def test_restore_file_raises_when_chunk_is_corrupted(mock_delta_settings, tmp_path, delta_backup_file):
+    """
+    Restore checks chunk checksums
+    """
+    replication_path = str(tmp_path / "replica")
+    os.makedirs(replication_path)
+    manifest_filename, _ = delta._replicate_delta(
+        delta_backup_file, delta.build_manifest(delta_backup_file), replication_path
+    )
+    digest = delta.read_manifest(manifest_filename)["chunks"][0][0]
+    with open(os.path.join(replication_path, *delta.get_chunk_relative_path(digest).split("/")), "wb") as f:
+        f.write(b"corrupted")
+    with pytest.raises(ValueError):
+        delta.restore_file(manifest_filename, str(tmp_path / "restored.dt"))
+
+
+def test_collect_garbage_removes_unreferenced_chunks(mock_delta_settings, tmp_path, delta_backup_file):
+    """
+    Chunks which are not referenced by any manifest are removed and removed from chunk index
+    """
+    replication_path = str(tmp_path / "replica")
+    os.makedirs(replication_path)
+    manifest_filename, _ = delta._replicate_delta(
+        delta_backup_file, delta.build_manifest(delta_backup_file), replication_path
+    )
+    os.remove(manifest_filename)
+    removed_count, _ = delta.collect_garbage(replication_path)
+    assert removed_count > 0
+    assert delta._scan_local_chunks(replication_path) == set()
+    assert delta.get_chunk_index(replication_path).digests == set()
+
+
+def test_get_chunk_index_loads_saved_index(mock_delta_settings, tmp_path):
+    """
+    Chunk index is saved locally and loaded on next run
+    """
+    index = delta.get_chunk_index("s3://bucket", local=False)
+    index.add(["digest"])
+    delta._chunk_indexes.clear()
+    assert "digest" in delta.get_chunk_index("s3://bucket", local=False)
@@ -0,0 +1,160 @@
+import logging
+from datetime import datetime, timedelta
+from unittest.mock import PropertyMock
+
+import pytest
+from pytest_mock import MockerFixture
+
+import core.models as core_models
+from core import history
+from core.analyze import analyze_backup_result, analyze_maintenance_result
+
+
+@pytest.fixture
+def run_history(tmp_path):
+    run_history = history.RunHistory(str(tmp_path / "history.sqlite3"))
+    yield run_history
+    run_history.close()
+
+
+@pytest.fixture
+def mock_history_settings(mocker: MockerFixture, tmp_path):
+    mocker.patch("conf.settings.HISTORY_ENABLED", new_callable=PropertyMock(return_value=True))
+    mocker.patch("conf.settings.HISTORY_PATH", new_callable=PropertyMock(return_value=str(tmp_path / "h.sqlite3")))
+    mocker.patch("conf.settings.HISTORY_REGRESSION_THRESHOLD", new_callable=PropertyMock(return_value=50))
+    mocker.patch("conf.settings.HISTORY_REGRESSION_WINDOW", new_callable=PropertyMock(return_value=10))
+
+
+def _add_durations(run_history, infobase, durations, phase=history.PHASE_BACKUP):
+    start = datetime.now() - timedelta(days=len(durations))
+    for i, duration in enumerate(durations):
+        run_history.add_records(
+            [history.RunRecord(infobase, phase, True, duration, 100)], recorded_at=start + timedelta(days=i)
+        )
+
+
+def test_percentile_interpolates_between_values():
+    """
+    Percentile is linearly interpolated between neighbouring values
+    """
+    assert history.percentile([4, 1, 3, 2], 50) == 2.5
+    assert history.percentile([1, 2, 3, 4, 5], 95) == pytest.approx(4.8)
+    assert history.percentile([7], 95) == 7
+
+
+def test_get_statistics_calculates_percentiles_of_succeeded_runs(run_history, infobase):
+    """
+    Percentiles are calculated by succeeded runs, failed runs are counted separately
+    """
+    _add_durations(run_history, infobase, [10, 20, 30])
+    run_history.add_records([history.RunRecord(infobase, history.PHASE_BACKUP, False, 1000, None)])
+    assert run_history.get_statistics() == [
+        history.PhaseStatistics(infobase, history.PHASE_BACKUP, 3, 1, 20, pytest.approx(29), 100)
+    ]
+
+
+def test_get_statistics_filters_by_phase_infobase_and_days(run_history, infobases):
+    """
+    Statistics are filtered by phase, infobase and number of last days
+    """
+    _add_durations(run_history, infobases[0], [1000, 10, 20])
+    _add_durations(run_history, infobases[0], [5], history.PHASE_UPLOAD)
+    _add_durations(run_history, infobases[1], [30])
+    result = run_history.get_statistics(history.PHASE_BACKUP, infobases[0], days=2)
+    assert [(s.infobase, s.phase, s.p50) for s in result] == [(infobases[0], history.PHASE_BACKUP, 20)]
+
+
+def test_find_regressions_compares_last_run_with_median(run_history, infobases):
+    """
+    Regression is found when the last run is longer than median of previous runs over threshold
+    """
+    _add_durations(run_history, infobases[0], [100, 110, 90, 200])
+    _add_durations(run_history, infobases[1], [100, 110, 90, 120])
+    assert run_history.find_regressions(history.PHASE_BACKUP, 50, 10) == [
+        history.Regression(infobases[0], history.PHASE_BACKUP, 200, 100)
+    ]
+
+
+def test_find_regressions_uses_window(run_history, infobase):
+    """
+    Only `window` previous runs are used as baseline
+    """
+    _add_durations(run_history, infobase, [10, 10, 10, 100, 100, 140])
+    assert run_history.find_regressions(history.PHASE_BACKUP, 50, 2) == []
+    assert len(run_history.find_regressions(history.PHASE_BACKUP, 50, 10)) == 1
+
+
+def test_get_average_durations_uses_last_succeeded_runs(run_history, infobases):
+    """
+    Average duration is calculated over the last succeeded runs of requested infobases only
+    """
+    _add_durations(run_history, infobases[0], [1000, 10, 20])
+    _add_durations(run_history, infobases[1], [30])
+    run_history.add_records([history.RunRecord(infobases[0], history.PHASE_BACKUP, False, 5000, None)])
+    durations = run_history.get_average_durations(infobases[:1], history.PHASE_BACKUP, 2)
+    assert durations == {infobases[0]: 15}
+
+
+def test_iter_task_records_adds_phase_durations(infobase):
+    """
+    Durations of task phases are recorded as separate phases
+    """
+    result = core_models.InfoBaseMaintenanceTaskResult(infobase, True, duration=30)
+    result.phase_durations = dict(vacuumdb=20)
+    assert list(history.iter_task_records([result], history.PHASE_MAINTENANCE)) == [
+        history.RunRecord(infobase, history.PHASE_MAINTENANCE, True, 30, None),
+        history.RunRecord(infobase, "vacuumdb", True, 20, None),
+    ]
+
+
+def test_analyze_backup_result_records_history(mock_history_settings, tmp_path, infobase):
+    """
+    Backup analysis records durations and sizes of backup and compression
+    """
+    backup_file = tmp_path / "backup.dt.zst"
+    backup_file.write_bytes(b"backup")
+    result = core_models.InfoBaseBackupTaskResult(
+        infobase,
+        True,
+        str(backup_file),
+        compression=core_models.BackupCompressionResult("backup.dt", 60, 6, 2),
+        duration=10,
+    )
+    analyze_backup_result([result], [infobase], datetime.now(), datetime.now())
+    with history.open_history() as run_history:
+        rows = run_history.connection.execute("SELECT phase, succeeded, duration, size FROM runs").fetchall()
+    assert rows == [(history.PHASE_BACKUP, 1, 10, 6), (history.PHASE_COMPRESSION, 1, 2, 6)]
+
+
+def test_analyze_backup_result_warns_about_regression(mock_history_settings, caplog, infobase):
+    """
+    Backup analysis logs warning when backup of infobase became much longer
+    """
+    with history.open_history() as run_history:
+        _add_durations(run_history, infobase, [100, 100])
+    result = core_models.InfoBaseBackupTaskResult(infobase, True, duration=300)
+    with caplog.at_level(logging.WARNING):
+        analyze_backup_result([result], [infobase], datetime.now(), datetime.now())
+    assert f"<{infobase}> Backup took 300.0s, 200% longer than median 100.0s" in caplog.text
+
+
+def test_analyze_result_does_not_record_history_when_disabled(mocker: MockerFixture, infobase):
+    """
+    History is not opened when it is disabled
+    """
+    mocker.patch("conf.settings.HISTORY_ENABLED", new_callable=PropertyMock(return_value=False))
+    open_mock = mocker.patch("core.history.open_history")
+    analyze_maintenance_result(
+        [core_models.InfoBaseMaintenanceTaskResult(infobase, True)], [infobase], datetime.now(), datetime.now()
+    )
+    open_mock.assert_not_called()
+
+
+def test_record_run_logs_history_errors(mocker: MockerFixture, mock_history_settings, caplog, infobase):
+    """
+    History error is logged and does not break analysis
+    """
+    mocker.patch("core.history.open_history", side_effect=OSError("disk full"))
+    with caplog.at_level(logging.ERROR):
+        history.record_run([history.RunRecord(infobase, history.PHASE_UPDATE, True, 1, None)])
+    assert "Unable to record run history" in caplog.text
@@ -0,0 +1,118 @@
+from datetime import datetime
+from unittest.mock import PropertyMock
+
+import pytest
+from pytest_mock import MockerFixture
+
+import core.models as core_models
+from core import metrics
+from core.analyze import analyze_backup_result, analyze_s3_result
+
+
+@pytest.fixture
+def mock_metrics_settings(mocker: MockerFixture, tmp_path):
+    mocker.patch("conf.settings.METRICS_ENABLED", new_callable=PropertyMock(return_value=True))
+    mocker.patch("conf.settings.METRICS_PATH", new_callable=PropertyMock(return_value=str(tmp_path / "metrics")))
+    mocker.patch("conf.settings.METRICS_DURATION_BUCKETS", new_callable=PropertyMock(return_value=[10, 100]))
+    metrics.start_run("Backup")
+    yield
+    metrics._registry = None
+
+
+def _read_metrics() -> str:
+    filename = metrics.write_textfile()
+    with open(filename, encoding="utf-8") as f:
+        return f.read()
+
+
+def test_write_textfile_does_nothing_when_metrics_are_disabled(mocker: MockerFixture):
+    """
+    Metrics file is not written when metrics are disabled
+    """
+    mocker.patch("conf.settings.METRICS_ENABLED", new_callable=PropertyMock(return_value=False))
+    metrics.start_run("Backup")
+    assert metrics.write_textfile() is None
+
+
+def test_registry_renders_histogram():
+    """
+    Histogram is rendered with cumulative buckets, sum and count
+    """
+    registry = metrics.MetricsRegistry("backup")
+    for value in [5, 50, 500]:
+        registry.observe("phase_duration_seconds", value, infobase="ib", phase="backup")
+    text = registry.render()
+    assert "# TYPE onec_mgmt_phase_duration_seconds histogram" in text
+    labels = 'job="backup",infobase="ib",phase="backup"'
+    assert f'onec_mgmt_phase_duration_seconds_bucket{{{labels},le="10"}} 1' in text
+    assert f'onec_mgmt_phase_duration_seconds_bucket{{{labels},le="+Inf"}} 3' in text
+    assert f"onec_mgmt_phase_duration_seconds_sum{{{labels}}} 555" in text
+    assert f"onec_mgmt_phase_duration_seconds_count{{{labels}}} 3" in text
+
+
+def test_registry_escapes_label_values():
+    """
+    Quotes and backslashes in label values are escaped
+    """
+    registry = metrics.MetricsRegistry("backup")
+    registry.set("tasks", 1, phase='a"b\\c')
+    assert 'phase="a\\"b\\\\c"' in registry.render()
+
+
+def test_analyze_backup_result_collects_metrics(mock_metrics_settings, tmp_path, infobases):
+    """
+    Backup analysis collects durations, bytes, semaphore waits and missed tasks
+    """
+    backup_file = tmp_path / "backup.dt"
+    backup_file.write_bytes(b"backup")
+    result = core_models.InfoBaseBackupTaskResult(infobases[0], True, str(backup_file), duration=50, wait_duration=3)
+    result.replicas = ["replica1", "replica2"]
+    analyze_backup_result([result], infobases[:2], datetime.now(), datetime.now())
+    text = _read_metrics()
+    labels = f'job="backup",infobase="{infobases[0]}",phase="backup"'
+    assert f'onec_mgmt_phase_duration_seconds_bucket{{{labels},le="10"}} 0' in text
+    assert f'onec_mgmt_phase_duration_seconds_bucket{{{labels},le="100"}} 1' in text
+    assert f"onec_mgmt_phase_bytes{{{labels}}} 6" in text
+    assert f'onec_mgmt_phase_bytes{{job="backup",infobase="{infobases[0]}",phase="replication"}} 12' in text
+    assert f"onec_mgmt_semaphore_wait_seconds{{{labels}}} 3" in text
+    assert 'onec_mgmt_tasks{job="backup",phase="backup",result="succeeded"} 1' in text
+    assert 'onec_mgmt_tasks{job="backup",phase="backup",result="missed"} 1' in text
+
+
+def test_analyze_s3_result_collects_throughput_and_retries(mock_metrics_settings, infobase):
+    """
+    S3 analysis collects upload throughput and retry count
+    """
+    result = core_models.InfoBaseAWSUploadTaskResult(infobase, True, 1000, duration=10)
+    result.retries = 2
+    analyze_s3_result([result], [infobase], datetime.now(), datetime.now())
+    text = _read_metrics()
+    assert f'onec_mgmt_s3_upload_throughput_bytes_per_second{{job="backup",infobase="{infobase}"}} 100.0' in text
+    assert f'onec_mgmt_s3_upload_retries{{job="backup",infobase="{infobase}"}} 2' in text
+
+
+def test_write_textfile_writes_spawned_processes(mock_metrics_settings):
+    """
+    Number of spawned processes is written to metrics file
+    """
+    metrics.count_process("rac")
+    metrics.count_process("rac")
+    metrics.count_process("1cv8")
+    text = _read_metrics()
+    assert 'onec_mgmt_processes_spawned{job="backup",process="rac"} 2' in text
+    assert 'onec_mgmt_processes_spawned{job="backup",process="1cv8"} 1' in text
+
+
+def test_read_textfiles_joins_metrics_of_all_jobs(mock_metrics_settings):
+    """
+    Metrics files of all jobs are joined for HTTP endpoint
+    """
+    metrics.count_process("rac")
+    metrics.write_textfile()
+    metrics.start_run("Maintenance")
+    metrics.count_process("1cv8")
+    metrics.write_textfile()
+    text = metrics.read_textfiles()
+    assert text.count("# TYPE onec_mgmt_processes_spawned gauge") == 1
+    assert 'onec_mgmt_processes_spawned{job="backup",process="rac"} 1' in text
+    assert 'onec_mgmt_processes_spawned{job="maintenance",process="1cv8"} 1' in text
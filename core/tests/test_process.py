@@ -1,7 +1,8 @@
+import asyncio
 import logging
 import random
 from asyncio import TimeoutError
-from unittest.mock import ANY, Mock
+from unittest.mock import ANY, AsyncMock, Mock, PropertyMock
 
 import pytest
 from pytest_mock import MockerFixture
@@ -10,7 +11,9 @@ from core.exceptions import SubprocessException, V8Exception
 from core.process import (
     _check_subprocess_return_code,
     _kill_process_emergency,
+    _wait_for_background_jobs,
     execute_subprocess_command,
+    execute_subprocess_command_streaming,
     execute_v8_command,
 )
 
@@ -241,7 +244,7 @@ async def test_execute_v8_command_locks_infobase_if_code_passed(
     permission_code = "test_permission_code"
     mocker.patch("core.utils.read_file_content", return_value=message)
     await execute_v8_command(infobase, command, "", permission_code)
-    mock_cluster_com_controller.return_value.lock_info_base.assert_called_once()
+    mock_cluster_com_controller.return_value.alock_info_base.assert_awaited_once()
 
 
 @pytest.mark.asyncio
@@ -259,7 +262,7 @@ async def test_execute_v8_command_unlocks_infobase_if_code_passed(
     permission_code = "test_permission_code"
     mocker.patch("core.utils.read_file_content", return_value=message)
     await execute_v8_command(infobase, command, "", permission_code)
-    mock_cluster_com_controller.return_value.unlock_info_base.assert_called_once()
+    mock_cluster_com_controller.return_value.aunlock_info_base.assert_awaited_once()
 
 
 @pytest.mark.asyncio
@@ -276,7 +279,7 @@ async def test_execute_v8_command_does_not_lock_infobase_if_code_is_none(
     command = "test_command"
     mocker.patch("core.utils.read_file_content", return_value=message)
     await execute_v8_command(infobase, command, "")
-    mock_cluster_com_controller.return_value.lock_info_base.assert_not_called()
+    mock_cluster_com_controller.return_value.alock_info_base.assert_not_awaited()
 
 
 @pytest.mark.asyncio
@@ -293,7 +296,7 @@ async def test_execute_v8_command_does_not_unlock_infobase_if_code_is_none(
     command = "test_command"
     mocker.patch("core.utils.read_file_content", return_value=message)
     await execute_v8_command(infobase, command, "")
-    mock_cluster_com_controller.return_value.unlock_info_base.assert_not_called()
+    mock_cluster_com_controller.return_value.aunlock_info_base.assert_not_awaited()
 
 
 @pytest.mark.asyncio
@@ -310,7 +313,7 @@ async def test_execute_v8_command_terminates_infobase_sessions(
     command = "test_command"
     mocker.patch("core.utils.read_file_content", return_value=message)
     await execute_v8_command(infobase, command, "")
-    mock_cluster_com_controller.return_value.terminate_info_base_sessions.assert_called_once()
+    mock_cluster_com_controller.return_value.aterminate_info_base_sessions.assert_awaited_once()
 
 
 @pytest.mark.asyncio
@@ -332,6 +335,82 @@ async def test_execute_v8_sleeps_before_create_subprocess_if_parameter_passed(
     aiosleep_mock.assert_called_with(pause)
 
 
+@pytest.fixture
+def mock_lock_clock(mocker: MockerFixture):
+    """
+    Fake monotonic clock which is advanced by `asyncio.sleep`
+    """
+    clock = dict(now=0.0)
+
+    async def sleep(delay):
+        clock["now"] += delay
+
+    mocker.patch("core.process.time.monotonic", side_effect=lambda: clock["now"])
+    mocker.patch("conf.settings.V8_LOCK_INFO_BASE_PAUSE_MAX", new_callable=PropertyMock(return_value=10))
+    mocker.patch("conf.settings.V8_LOCK_INFO_BASE_POLL_INTERVAL", new_callable=PropertyMock(return_value=1))
+    return mocker.patch("asyncio.sleep", side_effect=sleep)
+
+
+@pytest.mark.asyncio
+async def test_wait_for_background_jobs_returns_when_there_are_no_jobs(mock_lock_clock, infobase):
+    """
+    Wait finishes after two polls without background jobs
+    """
+    cci = Mock()
+    cci.aget_info_base_background_jobs_count = AsyncMock(return_value=0)
+    assert await _wait_for_background_jobs(cci, infobase) == 1
+    assert cci.aget_info_base_background_jobs_count.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_wait_for_background_jobs_waits_until_jobs_are_finished(mock_lock_clock, caplog, infobase):
+    """
+    Wait continues while background jobs are running and logs actual wait time
+    """
+    cci = Mock()
+    cci.aget_info_base_background_jobs_count = AsyncMock(side_effect=[2, 1, 0, 0])
+    with caplog.at_level(logging.INFO):
+        assert await _wait_for_background_jobs(cci, infobase) == 3
+    assert f"<{infobase}> Waited 3.00s for background jobs" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_wait_for_background_jobs_stops_at_maximum_wait(mock_lock_clock, caplog, infobase):
+    """
+    Wait stops after maximum wait time even if background jobs are still running
+    """
+    cci = Mock()
+    cci.aget_info_base_background_jobs_count = AsyncMock(return_value=1)
+    with caplog.at_level(logging.WARNING):
+        assert await _wait_for_background_jobs(cci, infobase) == 10
+    assert "1 background jobs are still running after 10 seconds" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_wait_for_background_jobs_falls_back_to_fixed_pause(mocker: MockerFixture, mock_lock_clock, infobase):
+    """
+    Fixed pause is used when background jobs can not be polled
+    """
+    mocker.patch("conf.settings.V8_LOCK_INFO_BASE_PAUSE", new_callable=PropertyMock(return_value=5))
+    cci = Mock()
+    cci.aget_info_base_background_jobs_count = AsyncMock(side_effect=Exception("rac failed"))
+    assert await _wait_for_background_jobs(cci, infobase) == 5
+
+
+@pytest.mark.asyncio
+async def test_wait_for_background_jobs_uses_fixed_pause_when_disabled(
+    mocker: MockerFixture, mock_lock_clock, infobase
+):
+    """
+    Cluster is not polled when adaptive wait is disabled
+    """
+    mocker.patch("conf.settings.V8_LOCK_INFO_BASE_PAUSE_MAX", new_callable=PropertyMock(return_value=0))
+    mocker.patch("conf.settings.V8_LOCK_INFO_BASE_PAUSE", new_callable=PropertyMock(return_value=5))
+    cci = Mock()
+    assert await _wait_for_background_jobs(cci, infobase) == 5
+    cci.aget_info_base_background_jobs_count.assert_not_called()
+
+
 @pytest.mark.asyncio
 async def test_execute_subprocess_command_pass_command_to_subprocess(
     mocker: MockerFixture, infobase, mock_asyncio_subprocess_succeeded
@@ -437,3 +516,56 @@ async def test_execute_subprocess_command_calls_emergency_on_communication_error
     mock_kill_process_emergency = mocker.patch("core.process._kill_process_emergency")
     await execute_subprocess_command(infobase, command, "")
     mock_kill_process_emergency.assert_awaited()
+
+
+@pytest.mark.asyncio
+async def test_execute_subprocess_command_streaming_passes_stdout_to_consumer(
+    mocker: MockerFixture, infobase, mock_asyncio_subprocess_succeeded
+):
+    """
+    `execute_subprocess_command_streaming` passes subprocess stdout to consumer and returns its result
+    """
+    mocker.patch("core.utils.read_file_content", return_value="test_message")
+
+    async def consumer(stdout, wait_subprocess):
+        await wait_subprocess()
+        return stdout
+
+    result = await execute_subprocess_command_streaming(infobase, "test_command", "", consumer)
+    assert result is mock_asyncio_subprocess_succeeded.return_value.stdout
+    mock_asyncio_subprocess_succeeded.assert_awaited_with("test_command", stdout=asyncio.subprocess.PIPE)
+
+
+@pytest.mark.asyncio
+async def test_execute_subprocess_command_streaming_raises_if_nonzero_return_code(
+    mocker: MockerFixture, infobase, mock_asyncio_subprocess_failed
+):
+    """
+    Wait function passed to consumer raises exception if subprocess returns non-zero return code
+    """
+    mocker.patch("core.utils.read_file_content", return_value="test_message")
+
+    async def consumer(stdout, wait_subprocess):
+        await wait_subprocess()
+
+    with pytest.raises(SubprocessException):
+        await execute_subprocess_command_streaming(infobase, "test_command", "", consumer)
+
+
+@pytest.mark.asyncio
+async def test_execute_subprocess_command_streaming_kills_subprocess_when_consumer_failed(
+    infobase, mock_asyncio_subprocess_succeeded
+):
+    """
+    `execute_subprocess_command_streaming` kills subprocess when consumer exits before subprocess finished
+    """
+    subprocess_mock = mock_asyncio_subprocess_succeeded.return_value
+    subprocess_mock.returncode = None
+    subprocess_mock.kill = Mock()
+
+    async def consumer(stdout, wait_subprocess):
+        raise ValueError
+
+    with pytest.raises(ValueError):
+        await execute_subprocess_command_streaming(infobase, "test_command", "", consumer)
+    subprocess_mock.kill.assert_called_once()
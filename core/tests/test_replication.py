@@ -0,0 +1,260 @@
+import asyncio
+import errno
+import os
+import sys
+from contextlib import asynccontextmanager
+from unittest.mock import PropertyMock
+
+import aiofiles
+import pytest
+from pytest_mock import MockerFixture
+
+from core.replication import _is_same_device, _zero_copy_file, fan_out_copy, replicate_file
+
+
+@pytest.fixture
+def fan_out_source(mocker: MockerFixture, tmp_path):
+    mocker.patch("conf.settings.BACKUP_REPLICATION_BLOCK_SIZE", new_callable=PropertyMock(return_value=1000))
+    mocker.patch("conf.settings.BACKUP_REPLICATION_QUEUE_SIZE", new_callable=PropertyMock(return_value=2))
+    source = tmp_path / "source.dt"
+    source.write_bytes(bytes(range(256)) * 100)
+    return str(source)
+
+
+@pytest.fixture
+def mock_slow_destination(mocker: MockerFixture):
+    slow_destinations = []
+    writes = []
+    source_opens = []
+    aiofiles_open = aiofiles.open
+
+    class SlowFile:
+        def __init__(self, path, f):
+            self.path = path
+            self.f = f
+
+        async def write(self, data):
+            if self.path in slow_destinations:
+                await asyncio.sleep(0.05)
+            writes.append(self.path)
+            return await self.f.write(data)
+
+    @asynccontextmanager
+    async def open_file(path, mode="r", *args, **kwargs):
+        async with aiofiles_open(path, mode, *args, **kwargs) as f:
+            if "w" in mode:
+                yield SlowFile(path, f)
+            else:
+                source_opens.append(path)
+                yield f
+
+    mocker.patch("aiofiles.open", side_effect=open_file)
+    return slow_destinations, writes, source_opens
+
+
+@pytest.mark.asyncio
+async def test_fan_out_copy_copies_to_every_destination(tmp_path, fan_out_source):
+    """
+    Source is copied to every destination
+    """
+    destinations = [str(tmp_path / f"copy_{i}.dt") for i in range(3)]
+    results = await fan_out_copy(fan_out_source, destinations)
+    assert all(e is None for e in results.values())
+    with open(fan_out_source, "rb") as f:
+        data = f.read()
+    for destination in destinations:
+        with open(destination, "rb") as f:
+            assert f.read() == data
+
+
+@pytest.mark.asyncio
+async def test_fan_out_copy_reads_source_once(tmp_path, fan_out_source, mock_slow_destination):
+    """
+    Source is read once for all destinations
+    """
+    _, _, source_opens = mock_slow_destination
+    destinations = [str(tmp_path / f"copy_{i}.dt") for i in range(3)]
+    await fan_out_copy(fan_out_source, destinations)
+    assert source_opens == [fan_out_source]
+
+
+@pytest.mark.asyncio
+async def test_fan_out_copy_waits_for_destinations_keeping_up(
+    mocker: MockerFixture, tmp_path, fan_out_source, mock_slow_destination
+):
+    """
+    Source is read once when destinations write at normal speed, even if their queues are full for a moment
+    """
+    mocker.patch("conf.settings.BACKUP_REPLICATION_BLOCK_SIZE", new_callable=PropertyMock(return_value=100))
+    mocker.patch("conf.settings.BACKUP_REPLICATION_QUEUE_SIZE", new_callable=PropertyMock(return_value=1))
+    _, _, source_opens = mock_slow_destination
+    destinations = [str(tmp_path / f"copy_{i}.dt") for i in range(3)]
+    results = await fan_out_copy(fan_out_source, destinations)
+    assert all(e is None for e in results.values())
+    assert source_opens == [fan_out_source]
+    for destination in destinations:
+        assert _read(destination) == _read(fan_out_source)
+
+
+@pytest.mark.asyncio
+async def test_fan_out_copy_slow_destination_does_not_delay_others(
+    mocker: MockerFixture, tmp_path, fan_out_source, mock_slow_destination
+):
+    """
+    Destination lagging longer than lag timeout reads source separately and does not delay other destinations
+    """
+    mocker.patch("conf.settings.BACKUP_REPLICATION_BLOCK_SIZE", new_callable=PropertyMock(return_value=5000))
+    mocker.patch("conf.settings.BACKUP_REPLICATION_LAG_TIMEOUT", new_callable=PropertyMock(return_value=0.02))
+    slow_destinations, writes, source_opens = mock_slow_destination
+    fast_destination = str(tmp_path / "fast.dt")
+    slow_destination = str(tmp_path / "slow.dt")
+    slow_destinations.append(slow_destination)
+    results = await fan_out_copy(fan_out_source, [fast_destination, slow_destination])
+    assert all(e is None for e in results.values())
+    assert source_opens == [fan_out_source, fan_out_source]
+    last_fast_write = max(i for i, path in enumerate(writes) if path == fast_destination)
+    last_slow_write = max(i for i, path in enumerate(writes) if path == slow_destination)
+    assert last_fast_write < last_slow_write
+    with open(fan_out_source, "rb") as f:
+        data = f.read()
+    with open(slow_destination, "rb") as f:
+        assert f.read() == data
+
+
+@pytest.mark.asyncio
+async def test_fan_out_copy_failed_destination_does_not_affect_others(tmp_path, fan_out_source):
+    """
+    Failure of one destination is returned in result and does not affect other destinations
+    """
+    failed_destination = str(tmp_path / "not_exists" / "copy.dt")
+    destination = str(tmp_path / "copy.dt")
+    results = await fan_out_copy(fan_out_source, [failed_destination, destination])
+    assert isinstance(results[failed_destination], OSError)
+    assert results[destination] is None
+    with open(fan_out_source, "rb") as f, open(destination, "rb") as g:
+        assert f.read() == g.read()
+
+
+def _read(filename: str) -> bytes:
+    with open(filename, "rb") as f:
+        return f.read()
+
+
+def _unsupported_strategy(src_fd: int, dst_fd: int, size: int):
+    raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+
+def _failed_strategy(src_fd: int, dst_fd: int, size: int):
+    raise OSError(errno.ENOSPC, "No space left on device")
+
+
+def _copy_strategy(src_fd: int, dst_fd: int, size: int):
+    os.write(dst_fd, os.pread(src_fd, size, 0))
+
+
+@pytest.mark.skipif(sys.platform != "linux", reason="zero-copy replication is available on Linux only")
+@pytest.mark.asyncio
+async def test_replicate_file_uses_zero_copy(mocker: MockerFixture, tmp_path, fan_out_source):
+    """
+    `replicate_file` copies with kernel and does not read source in process when zero-copy is supported
+    """
+    fan_out_copy_mock = mocker.patch("core.replication.fan_out_copy")
+    destinations = [str(tmp_path / f"copy_{i}.dt") for i in range(2)]
+    results = await replicate_file(fan_out_source, destinations)
+    assert all(e is None for e in results.values())
+    fan_out_copy_mock.assert_not_awaited()
+    for destination in destinations:
+        assert _read(destination) == _read(fan_out_source)
+
+
+@pytest.mark.asyncio
+async def test_replicate_file_falls_back_to_fan_out_copy(mocker: MockerFixture, tmp_path, fan_out_source):
+    """
+    `replicate_file` copies with `fan_out_copy` when zero-copy is not supported
+    """
+    mocker.patch("core.replication.ZERO_COPY_STRATEGIES", [("unsupported", _unsupported_strategy)])
+    fan_out_copy_spy = mocker.spy(sys.modules["core.replication"], "fan_out_copy")
+    destinations = [str(tmp_path / f"copy_{i}.dt") for i in range(2)]
+    results = await replicate_file(fan_out_source, destinations)
+    assert all(e is None for e in results.values())
+    assert fan_out_copy_spy.call_args.args[1] == destinations
+    for destination in destinations:
+        assert _read(destination) == _read(fan_out_source)
+
+
+@pytest.mark.asyncio
+async def test_replicate_file_uses_fan_out_copy_for_other_devices(mocker: MockerFixture, tmp_path, fan_out_source):
+    """
+    `replicate_file` copies with `fan_out_copy` to destinations on other devices, even if zero-copy is supported
+    """
+    same_device_destination = str(tmp_path / "same" / "copy.dt")
+    other_device_destination = str(tmp_path / "other" / "copy.dt")
+    mocker.patch("core.replication._is_same_device", side_effect=lambda source, destination: "same" in destination)
+    mocker.patch("core.replication.ZERO_COPY_STRATEGIES", [("copy", _copy_strategy)])
+    zero_copy_spy = mocker.spy(sys.modules["core.replication"], "_zero_copy_file")
+    fan_out_copy_spy = mocker.spy(sys.modules["core.replication"], "fan_out_copy")
+    (tmp_path / "same").mkdir()
+    (tmp_path / "other").mkdir()
+    results = await replicate_file(fan_out_source, [same_device_destination, other_device_destination])
+    assert all(e is None for e in results.values())
+    zero_copy_spy.assert_called_once_with(fan_out_source, same_device_destination)
+    assert fan_out_copy_spy.call_args.args[1] == [other_device_destination]
+    assert _read(other_device_destination) == _read(fan_out_source)
+
+
+def test_is_same_device(tmp_path, fan_out_source):
+    """
+    `_is_same_device` compares device of source with device of destination directory
+    """
+    assert _is_same_device(fan_out_source, str(tmp_path / "copy.dt"))
+    assert not _is_same_device(fan_out_source, str(tmp_path / "missing" / "copy.dt"))
+
+
+@pytest.mark.asyncio
+async def test_replicate_file_does_not_use_zero_copy_when_disabled(mocker: MockerFixture, tmp_path, fan_out_source):
+    """
+    `replicate_file` copies with `fan_out_copy` when `BACKUP_REPLICATION_ZERO_COPY` is disabled
+    """
+    mocker.patch("conf.settings.BACKUP_REPLICATION_ZERO_COPY", new_callable=PropertyMock(return_value=False))
+    zero_copy_mock = mocker.patch("core.replication._zero_copy_file")
+    destination = str(tmp_path / "copy.dt")
+    await replicate_file(fan_out_source, [destination])
+    zero_copy_mock.assert_not_called()
+    assert _read(destination) == _read(fan_out_source)
+
+
+@pytest.mark.asyncio
+async def test_replicate_file_returns_zero_copy_error(mocker: MockerFixture, tmp_path, fan_out_source):
+    """
+    `replicate_file` returns error of zero-copy when error does not mean that zero-copy is unsupported
+    """
+    mocker.patch("core.replication.ZERO_COPY_STRATEGIES", [("failed", _failed_strategy)])
+    destination = str(tmp_path / "copy.dt")
+    results = await replicate_file(fan_out_source, [destination])
+    assert results[destination].errno == errno.ENOSPC
+
+
+def test_zero_copy_file_tries_next_strategy_when_unsupported(mocker: MockerFixture, tmp_path, fan_out_source):
+    """
+    `_zero_copy_file` tries next strategy when previous one is not supported
+    """
+
+    def copy_strategy(src_fd: int, dst_fd: int, size: int):
+        with open(fan_out_source, "rb") as f:
+            os.write(dst_fd, f.read())
+
+    mocker.patch(
+        "core.replication.ZERO_COPY_STRATEGIES",
+        [("unsupported", _unsupported_strategy), ("copy", copy_strategy)],
+    )
+    destination = str(tmp_path / "copy.dt")
+    assert _zero_copy_file(fan_out_source, destination) == "copy"
+    assert _read(destination) == _read(fan_out_source)
+
+
+def test_zero_copy_file_returns_none_when_unsupported(mocker: MockerFixture, tmp_path, fan_out_source):
+    """
+    `_zero_copy_file` returns None when no strategy is supported
+    """
+    mocker.patch("core.replication.ZERO_COPY_STRATEGIES", [("unsupported", _unsupported_strategy)])
+    assert _zero_copy_file(fan_out_source, str(tmp_path / "copy.dt")) is None
@@ -0,0 +1,116 @@
+import logging
+from datetime import datetime, timedelta
+from unittest.mock import PropertyMock
+
+from pytest_mock import MockerFixture
+
+from core.scheduling import log_schedule_result, plan_backups
+
+START = datetime(2024, 1, 1, 22, 0)
+
+
+def test_plan_backups_starts_longest_backups_first():
+    """
+    Infobases are ordered from the longest backup to the shortest one
+    """
+    schedule = plan_backups(["small", "large", "medium"], dict(small=60, large=3600, medium=600), 2, START)
+    assert schedule.infobases == ["large", "medium", "small"]
+
+
+def test_plan_backups_predicts_makespan():
+    """
+    Makespan is predicted by list scheduling with given concurrency
+    """
+    schedule = plan_backups(["a", "b", "c"], dict(a=100, b=60, c=50), 2, START)
+    assert schedule.predicted_makespan == timedelta(seconds=110)
+    assert schedule.predicted_finish["c"] == START + timedelta(seconds=110)
+
+
+def test_plan_backups_uses_average_duration_for_infobases_without_history():
+    """
+    Infobase without history is planned with average duration of other infobases
+    """
+    schedule = plan_backups(["new", "large", "small"], dict(large=300, small=100), 1, START)
+    assert schedule.infobases == ["large", "new", "small"]
+
+
+def test_plan_backups_keeps_cluster_order_without_history():
+    """
+    Infobases keep cluster order when there is no history, makespan is not predicted
+    """
+    schedule = plan_backups(["b", "a", "c"], dict(), 2, START)
+    assert schedule.infobases == ["b", "a", "c"]
+    assert schedule.predicted_makespan is None
+
+
+def test_plan_backups_starts_infobases_by_priority(mocker: MockerFixture):
+    """
+    Infobases with higher priority start first regardless of duration
+    """
+    mocker.patch("conf.settings.BACKUP_SCHEDULE_PRIORITY", new_callable=PropertyMock(return_value={"Small": 1}))
+    schedule = plan_backups(["large", "small"], dict(large=3600, small=60), 1, START)
+    assert schedule.infobases == ["small", "large"]
+
+
+def test_plan_backups_starts_infobases_with_deadline_first(mocker: MockerFixture):
+    """
+    Infobases with deadline start before other infobases, deadline refers to the next morning
+    """
+    mocker.patch(
+        "conf.settings.BACKUP_SCHEDULE_DEADLINES",
+        new_callable=PropertyMock(return_value={"late": "06:00", "early": "05:00"}),
+    )
+    schedule = plan_backups(["large", "late", "early"], dict(large=3600, late=60, early=60), 1, START)
+    assert schedule.infobases == ["early", "late", "large"]
+    assert schedule.deadlines["early"] == datetime(2024, 1, 2, 5, 0)
+
+
+def test_log_schedule_result_logs_predicted_and_actual_makespan(caplog):
+    """
+    Predicted and actual makespan are logged at the end of the run
+    """
+    schedule = plan_backups(["a"], dict(a=60), 1, START)
+    with caplog.at_level(logging.INFO):
+        log_schedule_result(schedule, dict(a=START + timedelta(seconds=90)), START, "Backup")
+    assert "Predicted makespan 0:01:00, actual 0:01:30" in caplog.text
+
+
+def test_log_schedule_result_warns_about_missed_deadline(mocker: MockerFixture, caplog):
+    """
+    Missed deadline is logged as warning
+    """
+    mocker.patch("conf.settings.BACKUP_SCHEDULE_DEADLINES", new_callable=PropertyMock(return_value={"a": "23:00"}))
+    schedule = plan_backups(["a"], dict(a=60), 1, START)
+    with caplog.at_level(logging.WARNING):
+        log_schedule_result(schedule, dict(a=START + timedelta(hours=2)), START, "Backup")
+    assert "after deadline 23:00" in caplog.text
+
+
+def test_plan_backups_ignores_invalid_deadline(mocker: MockerFixture, caplog):
+    """
+    Malformed deadline is logged and ignored instead of stopping backups
+    """
+    mocker.patch(
+        "conf.settings.BACKUP_SCHEDULE_DEADLINES",
+        new_callable=PropertyMock(return_value={"small": "6 am", "medium": None, "tiny": 600}),
+    )
+    with caplog.at_level(logging.WARNING):
+        schedule = plan_backups(["small", "large", "tiny"], dict(small=60, large=3600, tiny=1), 1, START)
+    assert schedule.infobases == ["large", "small", "tiny"]
+    assert schedule.deadlines == dict()
+    assert "<small> Invalid backup deadline '6 am'" in caplog.text
+    assert "<tiny> Invalid backup deadline 600" in caplog.text
+
+
+def test_plan_backups_ignores_invalid_priority(mocker: MockerFixture, caplog):
+    """
+    Non-numeric priority is logged and ignored instead of stopping backups
+    """
+    mocker.patch(
+        "conf.settings.BACKUP_SCHEDULE_PRIORITY",
+        new_callable=PropertyMock(return_value={"small": "high", "medium": 1}),
+    )
+    with caplog.at_level(logging.WARNING):
+        schedule = plan_backups(["small", "large", "medium"], dict(small=60, large=3600, medium=600), 1, START)
+    assert schedule.infobases == ["medium", "large", "small"]
+    assert "<small> Invalid backup priority 'high'" in caplog.text
@@ -0,0 +1,126 @@
+import asyncio
+import json
+from unittest.mock import PropertyMock
+
+import pytest
+from pytest_mock import MockerFixture
+
+from core import tracing
+from core.process import execute_v8_command
+
+
+@pytest.fixture
+def tracer(mocker: MockerFixture, tmp_path):
+    mocker.patch("conf.settings.TRACE_ENABLED", new_callable=PropertyMock(return_value=True))
+    mocker.patch("conf.settings.TRACE_PATH", new_callable=PropertyMock(return_value=str(tmp_path / "trace")))
+    yield tracing.start_tracing()
+    tracing._tracer = None
+
+
+def _spans(tracer):
+    tracks = {tid: track for track, tid in tracer.tracks.items()}
+    return [(e["name"], tracks[e["tid"]]) for e in tracer.events if e["ph"] == "X"]
+
+
+def test_span_does_nothing_when_tracing_is_disabled(mocker: MockerFixture):
+    """
+    Span is not recorded when tracing is disabled
+    """
+    mocker.patch("conf.settings.TRACE_ENABLED", new_callable=PropertyMock(return_value=False))
+    assert tracing.start_tracing() is None
+    with tracing.span("backup", "infobase"):
+        pass
+    assert tracing.write_trace("Backup") is None
+
+
+def test_nested_span_inherits_infobase_track(tracer, infobase):
+    """
+    Span without infobase is recorded to the track of enclosing infobase span
+    """
+    with tracing.span("backup", infobase):
+        with tracing.span("compression"):
+            pass
+    with tracing.span("rac"):
+        pass
+    assert _spans(tracer) == [
+        ("compression", (infobase, "backup")),
+        ("backup", (infobase, "backup")),
+        ("rac", tracing.MAIN_TRACK),
+    ]
+
+
+def test_span_records_error(tracer, infobase):
+    """
+    Exception type is recorded to span arguments
+    """
+    with pytest.raises(ValueError):
+        with tracing.span("backup", infobase):
+            raise ValueError()
+    assert tracer.events[-1]["args"] == dict(infobase=infobase, phase="backup", error="ValueError")
+
+
+@pytest.mark.asyncio
+async def test_concurrent_phases_of_infobase_are_recorded_to_different_tracks(tracer, infobase):
+    """
+    Replication and upload of the same infobase running concurrently are recorded to different tracks
+    """
+
+    async def phase(name):
+        with tracing.span(name, infobase):
+            with tracing.span("work"):
+                await asyncio.sleep(0)
+
+    await asyncio.gather(phase("replication"), phase("upload"))
+    assert sorted(_spans(tracer)) == [
+        ("replication", (infobase, "replication")),
+        ("upload", (infobase, "upload")),
+        ("work", (infobase, "replication")),
+        ("work", (infobase, "upload")),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_wait_records_semaphore_wait(tracer, infobase):
+    """
+    Time spent waiting for semaphore is recorded as separate span
+    """
+    semaphore = asyncio.Semaphore(1)
+    with tracing.span("backup", infobase):
+        async with tracing.wait(semaphore):
+            assert semaphore.locked()
+    assert not semaphore.locked()
+    assert _spans(tracer)[0] == ("semaphore wait", (infobase, "backup"))
+    assert tracer.events[-2]["cat"] == "wait"
+
+
+@pytest.mark.asyncio
+async def test_execute_v8_command_records_lock_pause(
+    mocker: MockerFixture, tracer, infobase, mock_asyncio_subprocess_succeeded, mock_cluster_com_controller
+):
+    """
+    `execute_v8_command` records lock, lock pause, sessions termination and 1cv8 spans
+    """
+    mocker.patch("core.utils.read_file_content", return_value="")
+    mocker.patch("conf.settings.V8_LOCK_INFO_BASE_PAUSE", new_callable=PropertyMock(return_value=0))
+    await execute_v8_command(infobase, "command", "", "permission_code")
+    assert [name for name, _ in _spans(tracer)] == [
+        "lock infobase",
+        "lock pause",
+        "terminate sessions",
+        "1cv8",
+        "unlock infobase",
+    ]
+
+
+def test_write_trace_writes_chrome_trace(tracer, infobase):
+    """
+    Trace is written as Chrome trace JSON with named infobase tracks
+    """
+    with tracing.span("backup", infobase):
+        pass
+    filename = tracing.write_trace("Backup")
+    with open(filename, encoding="utf-8") as f:
+        events = json.load(f)["traceEvents"]
+    assert dict(name="thread_name", ph="M", pid=1, tid=0, args=dict(name=f"{infobase} | backup")) in events
+    assert [e["name"] for e in events if e["ph"] == "X"] == ["backup"]
+    assert tracing.write_trace("Backup") is None
@@ -1,3 +1,7 @@
+import asyncio
+import fnmatch
+import logging
+import os
 from datetime import datetime, timedelta
 from unittest.mock import AsyncMock, mock_open
 
@@ -24,10 +28,14 @@ from core.utils import (
     get_ib_name_with_separator,
     get_info_base_credentials,
     get_info_bases,
+    get_infobase_by_filename,
     get_infobase_glob_pattern,
+    get_infobases_prefixes,
     get_1cv8_service_full_path,
+    index_old_files_by_infobase,
     path_leaf,
     read_file_content,
+    remove_files,
     remove_old_files_by_pattern,
 )
 
@@ -284,6 +292,107 @@ async def test_remove_old_files_by_pattern_not_removes_new_files(mocker: MockerF
     aioremove_mock.assert_not_awaited()
 
 
+def test_get_infobases_prefixes_sorted_by_length():
+    """
+    `get_infobases_prefixes` returns longest prefixes first
+    """
+    result = get_infobases_prefixes(["infobase", "infobase_copy"])
+    assert [ib_name for _, ib_name in result] == ["infobase_copy", "infobase"]
+
+
+def test_get_infobase_by_filename_returns_infobase_with_longest_prefix():
+    """
+    File is attributed to infobase with the longest matching name
+    """
+    prefixes = get_infobases_prefixes(["infobase", "infobase_copy"])
+    assert get_infobase_by_filename("infobase_copy_2020-01-01.dt", prefixes) == "infobase_copy"
+    assert get_infobase_by_filename("infobase_2020-01-01.dt", prefixes) == "infobase"
+    assert get_infobase_by_filename("other_2020-01-01.dt", prefixes) is None
+
+
+def test_get_infobase_by_filename_recognises_compressed_backups():
+    """
+    Compressed backups are attributed to infobase like uncompressed ones
+    """
+    prefixes = get_infobases_prefixes(["infobase"])
+    assert get_infobase_by_filename("infobase_2020-01-01.dt.zst", prefixes) == "infobase"
+
+
+def _create_file(path, days_old: int):
+    path.write_bytes(b"test")
+    mtime = (datetime.now() - timedelta(days=days_old)).timestamp()
+    os.utime(path, (mtime, mtime))
+
+
+def test_index_old_files_by_infobase_groups_old_files(tmp_path):
+    """
+    `index_old_files_by_infobase` groups old files by infobase and skips new and foreign files
+    """
+    _create_file(tmp_path / "infobase_2020-01-01.dt", 10)
+    _create_file(tmp_path / "infobase_2020-01-02.dt.zst", 10)
+    _create_file(tmp_path / "infobase_copy_2020-01-01.dt", 10)
+    _create_file(tmp_path / "infobase_2020-01-03.dt", 0)
+    _create_file(tmp_path / "other_2020-01-01.dt", 10)
+    (tmp_path / "infobase_pgdump").mkdir()
+    prefixes = get_infobases_prefixes(["infobase", "infobase_copy"])
+    result = index_old_files_by_infobase(str(tmp_path), prefixes, 1)
+    assert sorted(result["infobase"]) == [
+        str(tmp_path / "infobase_2020-01-01.dt"),
+        str(tmp_path / "infobase_2020-01-02.dt.zst"),
+    ]
+    assert result["infobase_copy"] == [str(tmp_path / "infobase_copy_2020-01-01.dt")]
+
+
+def test_index_old_files_by_infobase_scans_directory_once(mocker: MockerFixture, tmp_path):
+    """
+    `index_old_files_by_infobase` scans directory once for all infobases
+    """
+    scandir_spy = mocker.spy(os, "scandir")
+    index_old_files_by_infobase(str(tmp_path), get_infobases_prefixes(["infobase_1", "infobase_2"]), 1)
+    assert scandir_spy.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_remove_files_bounds_concurrency(mocker: MockerFixture):
+    """
+    `remove_files` removes files with bounded concurrency
+    """
+    running = 0
+    max_running = 0
+
+    async def remove(filename):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    remove_mock = mocker.patch("aiofiles.os.remove", side_effect=remove)
+    await remove_files([f"test_file{i}" for i in range(5)], 2)
+    assert remove_mock.await_count == 5
+    assert max_running == 2
+
+
+@pytest.mark.asyncio
+async def test_remove_files_continues_when_failed(mocker: MockerFixture, caplog):
+    """
+    `remove_files` logs error and removes other files when one file can not be removed
+    """
+    remove_mock = mocker.patch("aiofiles.os.remove", side_effect=[OSError("test"), None])
+    with caplog.at_level(logging.ERROR):
+        await remove_files(["test_file1", "test_file2"], 2)
+    assert remove_mock.await_count == 2
+    assert "Unable to remove test_file1" in caplog.text
+
+
+def test_get_infobase_glob_pattern_matches_compressed_backups(infobase):
+    """
+    `get_infobase_glob_pattern` matches compressed backups
+    """
+    result = get_infobase_glob_pattern(infobase)
+    assert fnmatch.fnmatch(f"{infobase}_2020-01-01.dt.zst", result)
+
+
 def test_get_infobase_glob_pattern_contains_infobase_name(infobase):
     """
     `get_infobase_glob_pattern` result contains infobase name
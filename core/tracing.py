@@ -0,0 +1,164 @@
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from conf import settings
+
+log = logging.getLogger(__name__)
+log_prefix = "Tracing"
+
+MAIN_TRACK = (None, "main")
+
+# Дорожка трассировки текущей задачи: имя ИБ и этап, с которого началась работа с ИБ в этой задаче.
+# Каждая задача asyncio получает копию контекста, поэтому параллельные этапы одной ИБ, например,
+# репликация и загрузка в S3, попадают на разные дорожки
+_current_track: contextvars.ContextVar[Optional[Tuple[Optional[str], str]]] = contextvars.ContextVar(
+    "trace_track", default=None
+)
+_tracer = None
+
+
+class Tracer:
+    """
+    Собирает интервалы работы в формате Chrome trace (https://ui.perfetto.dev, chrome://tracing).
+    Каждая пара ИБ - этап отображается отдельной дорожкой, поэтому весь запуск виден как диаграмма Ганта
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.started_at = datetime.now()
+        self.events: List[Dict] = []
+        self.tracks: Dict[Tuple[Optional[str], str], int] = dict()
+        # Интервалы могут записываться и из рабочих потоков
+        self.lock = threading.Lock()
+
+    def _get_tid(self, track: Tuple[Optional[str], str]) -> int:
+        tid = self.tracks.get(track)
+        if tid is None:
+            tid = self.tracks[track] = len(self.tracks)
+            ib_name, phase = track
+            track_name = f"{ib_name} | {phase}" if ib_name else phase
+            self.events.append(dict(name="thread_name", ph="M", pid=1, tid=tid, args=dict(name=track_name)))
+            self.events.append(dict(name="thread_sort_index", ph="M", pid=1, tid=tid, args=dict(sort_index=tid)))
+        return tid
+
+    def add_span(
+        self, name: str, category: str, track: Tuple[Optional[str], str], start: float, finish: float, args: Dict
+    ):
+        with self.lock:
+            self.events.append(
+                dict(
+                    name=name,
+                    cat=category,
+                    ph="X",
+                    pid=1,
+                    tid=self._get_tid(track),
+                    ts=(start - self.origin) * 1_000_000,
+                    dur=(finish - start) * 1_000_000,
+                    args=args,
+                )
+            )
+
+    def dump(self, filename: str):
+        with self.lock:
+            events = list(self.events)
+        with open(filename, "w", encoding="utf-8") as f:
+            json.dump(dict(traceEvents=events, displayTimeUnit="ms"), f, ensure_ascii=False)
+
+
+def start_tracing() -> Optional[Tracer]:
+    """
+    Начинает сбор интервалов, если включен TRACE_ENABLED
+    """
+    global _tracer
+    _tracer = Tracer() if settings.TRACE_ENABLED else None
+    return _tracer
+
+
+def get_trace_filename(name: str, started_at: datetime) -> str:
+    return os.path.join(
+        settings.TRACE_PATH,
+        f"{name.lower()}{settings.FILENAME_SEPARATOR}{started_at.strftime(settings.DATETIME_FORMAT)}.trace.json",
+    )
+
+
+def write_trace(name: str) -> Optional[str]:
+    """
+    Записывает собранные интервалы в файл в каталоге TRACE_PATH и заканчивает сбор
+    :param name: имя сценария, с него начинается имя файла
+    :return: полный путь к файлу трассировки или None, если трассировка выключена или не записана
+    """
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is None:
+        return None
+    filename = get_trace_filename(name, tracer.started_at)
+    try:
+        os.makedirs(settings.TRACE_PATH, exist_ok=True)
+        tracer.dump(filename)
+    except Exception:
+        log.exception(f"<{log_prefix}> Unable to write trace to {filename}")
+        return None
+    log.info(f"<{log_prefix}> Trace written to {filename}")
+    return filename
+
+
+@contextlib.contextmanager
+def span(name: str, ib_name: str = None, category: str = None, **args):
+    """
+    Записывает интервал выполнения блока кода. Интервал без имени ИБ попадает на дорожку объемлющего интервала.
+    Если трассировка выключена, ничего не делает
+    :param name: название этапа
+    :param ib_name: имя ИБ
+    :param category: категория интервала, по умолчанию совпадает с названием этапа
+    :param args: дополнительные атрибуты интервала
+    """
+    tracer = _tracer
+    if tracer is None:
+        yield
+        return
+    track = _current_track.get()
+    token = None
+    if ib_name is not None and (track is None or track[0] != ib_name):
+        track = (ib_name, name)
+        token = _current_track.set(track)
+    track = track or MAIN_TRACK
+    args = dict(args, infobase=track[0], phase=track[1])
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        args["error"] = type(e).__name__
+        raise
+    finally:
+        tracer.add_span(name, category or name, track, start, time.perf_counter(), args)
+        if token is not None:
+            _current_track.reset(token)
+
+
+class SemaphoreWait:
+    # Время ожидания семафора в секундах
+    duration: float = 0.0
+
+
+@contextlib.asynccontextmanager
+async def wait(semaphore, name: str = "semaphore wait"):
+    """
+    Захватывает семафор и записывает время ожидания как отдельный интервал
+    :return: объект с временем ожидания семафора
+    """
+    waited = SemaphoreWait()
+    start = time.perf_counter()
+    with span(name, category="wait"):
+        await semaphore.acquire()
+    waited.duration = time.perf_counter() - start
+    try:
+        yield waited
+    finally:
+        semaphore.release()
@@ -1,10 +1,11 @@
+import asyncio
 import glob
 import logging
 import ntpath
 import os
 import platform
 from datetime import date, datetime, timedelta
-from typing import List, Tuple, Union
+from typing import Dict, List, Optional, Tuple, Union
 
 import aiofiles.os
 
@@ -46,6 +47,35 @@ def get_infobase_glob_pattern(ib_name: str, file_extension: str = "*"):
     return f"*{get_ib_name_with_separator(ib_name)}*.{file_extension}"
 
 
+def get_infobases_prefixes(infobases: List[str]) -> List[Tuple[str, str]]:
+    """
+    Формирует префиксы имён файлов резервных копий для поиска файлов указанных ИБ
+    :return: пары префикс - имя ИБ, отсортированные по убыванию длины префикса,
+    чтобы файлы ИБ `infobase_2` не были отнесены к ИБ `infobase`
+    """
+    # Имена файлов обязательно должны быть в формате ИмяИБ_ДатаСоздания
+    # `get_ib_name_with_separator` используется вместо имени ИБ, чтобы по ошибке не получить файлы от другой ИБ
+    # при наличии имён вида infobase и infobase2
+    return sorted(
+        ((get_ib_name_with_separator(ib_name), ib_name) for ib_name in infobases),
+        key=lambda p: len(p[0]),
+        reverse=True,
+    )
+
+
+def get_infobase_by_filename(filename: str, infobases_prefixes: List[Tuple[str, str]]) -> Optional[str]:
+    """
+    Определяет ИБ, которой принадлежит файл резервной копии или объект в бакете
+    :param filename: имя файла или ключ объекта в бакете
+    :param infobases_prefixes: пары префикс - имя ИБ из `get_infobases_prefixes`
+    :return: имя ИБ или None, если файл не принадлежит ни одной ИБ
+    """
+    for prefix, ib_name in infobases_prefixes:
+        if filename.startswith(prefix):
+            return ib_name
+    return None
+
+
 def get_ib_and_time_string(ib_name: str) -> str:
     return f"{get_ib_name_with_separator(ib_name)}{get_formatted_current_datetime()}"
 
@@ -66,6 +96,12 @@ def get_info_bases() -> List[str]:
     return info_bases
 
 
+async def aget_info_bases() -> List[str]:
+    cci = cluster_utils.get_cluster_controller()
+    info_bases = await cci.aget_info_bases()
+    return info_bases
+
+
 def get_info_base_credentials(ib_name) -> Tuple[str, str]:
     """
     Получает имя пользователя и пароль для инфомационной базы. Поиск производится в настройках.
@@ -109,3 +145,53 @@ async def remove_old_files_by_pattern(pattern: str, retention_days: int):
     files_to_remove = [b for b in files if ts - os.path.getmtime(b) > 0]
     for f in files_to_remove:
         await aiofiles.os.remove(f)
+
+
+def index_old_files_by_infobase(
+    path: str, infobases_prefixes: List[Tuple[str, str]], retention_days: int
+) -> Dict[str, List[str]]:
+    """
+    Находит файлы резервных копий указанных ИБ, дата изменения которых более чем <retention_days> назад.
+    Каталог просматривается один раз для всех ИБ
+    :param path: каталог с резервными копиями
+    :param infobases_prefixes: пары префикс - имя ИБ из `get_infobases_prefixes`
+    :param retention_days: определяет, насколько старые файлы будут найдены
+    :return: словарь имя ИБ - полные пути к старым файлам
+    """
+    ts = (datetime.now() - timedelta(days=retention_days)).timestamp()
+    index = dict()
+    with os.scandir(path) as entries:
+        for entry in entries:
+            # Резервные копии всегда имеют расширение
+            if "." not in entry.name or not entry.is_file():
+                continue
+            ib_name = get_infobase_by_filename(entry.name, infobases_prefixes)
+            if ib_name is None:
+                continue
+            # В Windows дата изменения получается вместе со списком файлов, без отдельного обращения к файлу
+            if ts - entry.stat().st_mtime > 0:
+                index.setdefault(ib_name, []).append(entry.path)
+    return index
+
+
+async def remove_files(files: List[str], concurrency: int) -> List[str]:
+    """
+    Удаляет файлы, одновременно удаляется не более <concurrency> файлов.
+    Ошибка удаления одного файла не прерывает удаление остальных
+    :return: файлы, которых больше нет на диске
+    """
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+    async def remove(filename: str) -> bool:
+        async with semaphore:
+            try:
+                await aiofiles.os.remove(filename)
+            except FileNotFoundError:
+                log.debug(f"{filename} is already removed")
+            except OSError as e:
+                log.error(f"Unable to remove {filename}: {e}")
+                return False
+            return True
+
+    removed = await asyncio.gather(*[remove(f) for f in files])
+    return [f for f, r in zip(files, removed, strict=True) if r]
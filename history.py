@@ -0,0 +1,65 @@
+import argparse
+import logging
+
+from conf import settings
+from core import history as core_history
+from utils.common import sizeof_fmt
+from utils.log import configure_logging
+
+log = logging.getLogger(__name__)
+log_prefix = "History"
+
+
+def percentiles(run_history: core_history.RunHistory, phase: str = None, infobase: str = None, days: int = None):
+    """
+    Выводит медиану и 95-й перцентиль длительности этапов для каждой ИБ
+    """
+    for s in run_history.get_statistics(phase, infobase, days):
+        size = f", size p50 {sizeof_fmt(s.size_p50)}" if s.size_p50 is not None else ""
+        print(
+            f"{s.infobase} {s.phase}: p50 {s.p50:.1f}s, p95 {s.p95:.1f}s{size}, {s.count} succeeded, {s.failed} failed"
+        )
+
+
+def regressions(run_history: core_history.RunHistory, phase: str, threshold: float, window: int):
+    """
+    Выводит ИБ, у которых последний запуск этапа дольше медианы предыдущих запусков более чем на `threshold` процентов
+    """
+    found = run_history.find_regressions(phase, threshold, window)
+    for r in found:
+        print(f"{r.infobase} {r.phase}: {r.duration:.1f}s, median {r.baseline:.1f}s, +{r.increase:.0f}%")
+    if not found:
+        print(f"No {phase} regressions over {threshold}%")
+
+
+def main(args: argparse.Namespace):
+    try:
+        with core_history.open_history() as run_history:
+            if args.command == "percentiles":
+                percentiles(run_history, args.phase, args.infobase, args.days)
+            elif args.command == "regressions":
+                regressions(run_history, args.phase, args.threshold, args.window)
+    except Exception:
+        log.exception(f"<{log_prefix}> Unknown exception occurred")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="История запусков")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    percentiles_parser = subparsers.add_parser("percentiles", help="перцентили длительности этапов по ИБ")
+    percentiles_parser.add_argument("--phase", default=None, help="этап, например `backup`, по умолчанию все этапы")
+    percentiles_parser.add_argument("--infobase", default=None, help="имя ИБ, по умолчанию все ИБ")
+    percentiles_parser.add_argument(
+        "--days", type=int, default=None, help="за сколько последних дней, по умолчанию вся история"
+    )
+    regressions_parser = subparsers.add_parser("regressions", help="ИБ, работа с которыми замедлилась")
+    regressions_parser.add_argument("--phase", default=core_history.PHASE_BACKUP, help="этап, по умолчанию `backup`")
+    regressions_parser.add_argument(
+        "--threshold", type=float, default=settings.HISTORY_REGRESSION_THRESHOLD, help="порог замедления в процентах"
+    )
+    regressions_parser.add_argument(
+        "--window", type=int, default=settings.HISTORY_REGRESSION_WINDOW, help="по скольким предыдущим запускам"
+    )
+    args = parser.parse_args()
+    configure_logging(settings.LOG_LEVEL)
+    main(args)
@@ -6,7 +6,7 @@ from typing import List
 
 import core.models as core_models
 from conf import settings
-from core import utils
+from core import metrics, tracing, utils
 from core.analyze import analyze_maintenance_result
 from core.cluster import utils as cluster_utils
 from core.exceptions import SubprocessException, V8Exception
@@ -89,22 +89,38 @@ async def maintenance_info_base(
     ib_name: str, semaphore: asyncio.Semaphore
 ) -> core_models.InfoBaseMaintenanceTaskResult:
     cci = cluster_utils.get_cluster_controller_class()()
-    ib_info = cci.get_info_base(ib_name)
-    async with semaphore:
-        try:
-            succeeded = True
-            if settings.MAINTENANCE_V8:
-                result_v8 = await cluster_utils.com_func_wrapper(_maintenance_v8, ib_name)
-                succeeded &= result_v8.succeeded
-            if settings.MAINTENANCE_PG and postgres.dbms_is_postgres(ib_info.dbms):
-                result_pg = await _maintenance_vacuumdb(ib_name, ib_info.db_server, ib_info.db_name, ib_info.db_user)
-                succeeded &= result_pg.succeeded
-            result_logs = await rotate_logs(ib_name)
-            succeeded &= result_logs.succeeded
-            return core_models.InfoBaseMaintenanceTaskResult(ib_name, succeeded)
-        except Exception:
-            log.exception(f"<{ib_name}> Unknown exception occurred in coroutine")
-            return core_models.InfoBaseMaintenanceTaskResult(ib_name, False)
+    ib_info = await cci.aget_info_base(ib_name)
+    with tracing.span("maintenance", ib_name):
+        async with tracing.wait(semaphore) as waited:
+            try:
+                succeeded = True
+                phase_durations = dict()
+                datetime_start = datetime.now()
+                if settings.MAINTENANCE_V8:
+                    phase_start = datetime.now()
+                    result_v8 = await cluster_utils.com_func_wrapper(_maintenance_v8, ib_name)
+                    phase_durations["v8"] = (datetime.now() - phase_start).total_seconds()
+                    succeeded &= result_v8.succeeded
+                if settings.MAINTENANCE_PG and postgres.dbms_is_postgres(ib_info.dbms):
+                    phase_start = datetime.now()
+                    result_pg = await _maintenance_vacuumdb(
+                        ib_name, ib_info.db_server, ib_info.db_name, ib_info.db_user
+                    )
+                    phase_durations["vacuumdb"] = (datetime.now() - phase_start).total_seconds()
+                    succeeded &= result_pg.succeeded
+                result_logs = await rotate_logs(ib_name)
+                succeeded &= result_logs.succeeded
+                result = core_models.InfoBaseMaintenanceTaskResult(
+                    ib_name,
+                    succeeded,
+                    duration=(datetime.now() - datetime_start).total_seconds(),
+                    wait_duration=waited.duration,
+                )
+                result.phase_durations = phase_durations
+                return result
+            except Exception:
+                log.exception(f"<{ib_name}> Unknown exception occurred in coroutine")
+                return core_models.InfoBaseMaintenanceTaskResult(ib_name, False, wait_duration=waited.duration)
 
 
 def analyze_results(
@@ -117,8 +133,10 @@ def analyze_results(
 
 
 async def main():
+    tracing.start_tracing()
+    metrics.start_run(log_prefix)
     try:
-        info_bases = utils.get_info_bases()
+        info_bases = await utils.aget_info_bases()
         maintenance_semaphore = initialize_semaphore(settings.MAINTENANCE_CONCURRENCY, log_prefix, "maintenance")
 
         maintenance_datetime_start = datetime.now()
@@ -134,9 +152,15 @@ async def main():
             maintenance_datetime_finish,
         )
 
+        cluster_utils.get_cluster_controller_class().log_statistics()
+
         log.info(f"<{log_prefix}> Done")
     except Exception:
         log.exception(f"<{log_prefix}> Unknown exception occured in main coroutine")
+    finally:
+        cluster_utils.get_cluster_controller_class().shutdown()
+        tracing.write_trace(log_prefix)
+        metrics.write_textfile()
 
 
 if __name__ == "__main__":
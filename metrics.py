@@ -0,0 +1,55 @@
+import argparse
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from conf import settings
+from core import metrics as core_metrics
+from utils.log import configure_logging
+
+log = logging.getLogger(__name__)
+log_prefix = "Metrics"
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """
+    Отдаёт по адресу `/metrics` метрики из файлов, записанных сценариями в METRICS_PATH
+    """
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        try:
+            body = core_metrics.read_textfiles().encode("utf-8")
+        except OSError as e:
+            log.error(f"<{log_prefix}> Unable to read metrics: {e}")
+            self.send_error(500)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", core_metrics.CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug(f"<{log_prefix}> {self.address_string()} {format % args}")
+
+
+def serve(port: int):
+    server = ThreadingHTTPServer(("", port), MetricsRequestHandler)
+    log.info(f"<{log_prefix}> Serving metrics from {settings.METRICS_PATH} on port {port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Метрики для Prometheus")
+    parser.add_argument("command", choices=["serve"])
+    parser.add_argument("--port", type=int, default=settings.METRICS_HTTP_PORT, help="порт HTTP-сервера")
+    args = parser.parse_args()
+    configure_logging(settings.LOG_LEVEL)
+    serve(args.port)
@@ -0,0 +1,30 @@
+import argparse
+import logging
+
+from conf import settings
+from core import delta
+from utils.log import configure_logging
+
+log = logging.getLogger(__name__)
+log_prefix = "Restore"
+
+
+def main(manifest_filename: str, destination: str, chunks_root: str = None):
+    try:
+        log.info(f"<{log_prefix}> Restoring {destination} from {manifest_filename}")
+        delta.restore_file(manifest_filename, destination, chunks_root)
+        log.info(f"<{log_prefix}> Done")
+    except Exception:
+        log.exception(f"<{log_prefix}> Unable to restore {destination} from {manifest_filename}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Восстановление разностной копии по манифесту")
+    parser.add_argument("manifest", help="полный путь к манифесту `*.manifest`")
+    parser.add_argument("destination", help="полный путь к восстанавливаемому файлу")
+    parser.add_argument(
+        "--chunks-root", default=None, help="каталог с каталогом блоков, по умолчанию каталог манифеста"
+    )
+    args = parser.parse_args()
+    configure_logging(settings.LOG_LEVEL)
+    main(args.manifest, args.destination, args.chunks_root)
@@ -13,6 +13,14 @@ V8_INFOBASES_CREDENTIALS = {
 }
 V8_INFOBASES_EXCLUDE = ["accounting_for_tests", "trade_copy"]
 V8_INFOBASES_ONLY = ["accounting_production", "trade_production"]
+# Ожидание завершения фоновых заданий после блокировки ИБ: кластер опрашивается каждые
+# V8_LOCK_INFO_BASE_POLL_INTERVAL секунд, но не дольше V8_LOCK_INFO_BASE_PAUSE_MAX секунд.
+# При V8_LOCK_INFO_BASE_PAUSE_MAX = 0 выполняется фиксированная пауза V8_LOCK_INFO_BASE_PAUSE
+V8_LOCK_INFO_BASE_PAUSE = 5
+V8_LOCK_INFO_BASE_PAUSE_MAX = 60
+V8_LOCK_INFO_BASE_POLL_INTERVAL = 1
+V8_RAC_CONCURRENCY = 4
+V8_RAC_INVENTORY_CACHE_TTL = 300
 V8_RAS = {
     "address": "localhost",
     "port": "1545",
@@ -21,6 +29,8 @@ V8_SERVER_AGENT = {
     "address": "localhost",
     "port": "1540",
 }
+V8_SESSIONS_SNAPSHOT_TTL = 30
+V8_COM_CONNECTION_CHECK_INTERVAL = 60
 V8_PERMISSION_CODE = "0000"
 V8_PLATFORM_PATH = join("C:\\", "Program Files", "1cv8")
 
@@ -30,13 +40,36 @@ V8_PLATFORM_PATH = join("C:\\", "Program Files", "1cv8")
 
 BACKUP_CONCURRENCY = 3
 BACKUP_PATH = join(".", "backup")
+BACKUP_CATALOG_ENABLED = False
+BACKUP_CATALOG_PATH = join(".", "catalog.sqlite3")
+BACKUP_CATALOG_CHECKSUMS = False
 BACKUP_PG = False
+BACKUP_PG_FORMAT = "custom"
+BACKUP_PG_JOBS = 4
+BACKUP_PG_JOBS_BUDGET = 8
+BACKUP_PG_STREAM_TO_S3 = False
+BACKUP_PG_STREAM_KEEP_LOCAL = True
+BACKUP_COMPRESSION = False
+BACKUP_COMPRESSION_LEVEL = 3
+BACKUP_COMPRESSION_THREADS = -1
+BACKUP_COMPRESSION_CONCURRENCY = 1
 BACKUP_RETENTION_DAYS = 30
+BACKUP_ROTATION_CONCURRENCY = 8
 BACKUP_REPLICATION = False
 BACKUP_REPLICATION_CONCURRENCY = 3
 BACKUP_REPLICATION_PATHS = [
     join("\\\\192.168.1.2", "backup", "1cv8"),
 ]
+BACKUP_REPLICATION_BLOCK_SIZE = 8 * 1024 * 1024
+BACKUP_REPLICATION_QUEUE_SIZE = 8
+BACKUP_REPLICATION_LAG_TIMEOUT = 10
+BACKUP_REPLICATION_ZERO_COPY = True
+BACKUP_DELTA_ENABLED = False
+BACKUP_DELTA_CHUNK_SIZE = 1024 * 1024
+BACKUP_DELTA_INDEX_PATH = join(".", "delta")
+BACKUP_SCHEDULE_HISTORY_SIZE = 5
+BACKUP_SCHEDULE_PRIORITY = {}
+BACKUP_SCHEDULE_DEADLINES = {}
 BACKUP_RETRIES_V8 = 1
 BACKUP_RETRIES_PG = 1
 BACKUP_TIMEOUT_V8 = 1200
@@ -72,6 +105,10 @@ AWS_REGION_NAME = ""
 AWS_BUCKET_NAME = ""
 AWS_RETENTION_DAYS = 90
 AWS_RETRIES = 1
+AWS_MULTIPART_CHUNK_SIZE = 64 * 1024 * 1024
+AWS_MULTIPART_CONCURRENCY = 4
+AWS_MAX_INFLIGHT_BYTES = 1024 * 1024 * 1024
+AWS_MAX_POOL_CONNECTIONS = None
 
 ## ---------- ##
 ## PostgreSQL ##
@@ -100,6 +137,31 @@ NOTIFY_EMAIL_TO = [
     "",
 ]
 
+## ------- ##
+## History ##
+## ------- ##
+
+HISTORY_ENABLED = False
+HISTORY_PATH = join(".", "history.sqlite3")
+HISTORY_REGRESSION_THRESHOLD = 50
+HISTORY_REGRESSION_WINDOW = 10
+
+## ------- ##
+## Tracing ##
+## ------- ##
+
+TRACE_ENABLED = False
+TRACE_PATH = join(".", "trace")
+
+## ------- ##
+## Metrics ##
+## ------- ##
+
+METRICS_ENABLED = False
+METRICS_PATH = join(".", "metrics")
+METRICS_DURATION_BUCKETS = [10, 30, 60, 300, 900, 1800, 3600, 7200, 14400]
+METRICS_HTTP_PORT = 9184
+
 ## ------- ##
 ## Logging ##
 ## ------- ##
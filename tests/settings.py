@@ -5,6 +5,8 @@ AWS_RETRY_PAUSE = 0
 
 V8_LOCK_INFO_BASE_PAUSE = 0
 
+V8_LOCK_INFO_BASE_PAUSE_MAX = 0
+
 V8_RAS = {
     "address": "ras",
     "port": "1545",
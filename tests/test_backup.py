@@ -1,40 +1,98 @@
 import asyncio
 import logging
+import os
+import pathlib
 from datetime import datetime, timedelta
-from unittest.mock import AsyncMock, PropertyMock
+from unittest.mock import AsyncMock, Mock, PropertyMock
 
 import pytest
+from botocore.exceptions import ClientError
 from pytest_mock import MockerFixture
 
 import core.models as core_models
 from backup import (
+    BackupJob,
     _backup_info_base,
     _backup_pgdump,
     _backup_v8,
+    _pack_directory,
     analyze_results,
+    backup_and_compress_info_base,
     backup_info_base,
+    compress_info_base,
+    plan_backups,
+    preflight_backups,
+    record_to_catalog,
     create_aws_upload_task,
     create_backup_replication_task,
     replicate_backup,
     replicate_info_base,
+    resolve_backup_job,
     rotate_backups,
     send_email_notification,
 )
 from conf import settings
+from core import history
+from core import utils as core_utils
 from core.exceptions import SubprocessException, V8Exception
 
 
+@pytest.fixture
+def replication_backup_file(tmp_path):
+    backup_file = tmp_path / "backup.filename"
+    backup_file.write_bytes(bytes(range(256)) * 100)
+    return str(backup_file)
+
+
+@pytest.fixture
+def v8_backup_job(infobase):
+    return BackupJob(infobase, v8_service_path="", info_base_user="user", info_base_pwd="pwd")
+
+
+@pytest.fixture
+def pgdump_backup_job(infobase):
+    return BackupJob(
+        infobase,
+        use_pgdump=True,
+        db_host="test_db_host",
+        db_port="5432",
+        db_name="test_db_name",
+        db_user="test_db_user",
+        db_pwd="test_db_pwd",
+    )
+
+
 @pytest.mark.asyncio
-async def test_replicate_backup_replicate_to_every_path(mocker: MockerFixture):
+async def test_replicate_backup_replicate_to_every_path(tmp_path, replication_backup_file):
     """
     Backup replicates to every replication path
     """
-    backup_file_path = "test/backup.filename"
-    replication_paths = ["test/replication/path/01", "test/replication/path/02"]
-    mocker.patch("pathlib.Path")
-    aiocopyfile_mock = mocker.patch("aioshutil.copyfile", return_value=AsyncMock())
-    await replicate_backup(backup_file_path, replication_paths)
-    assert aiocopyfile_mock.await_count == len(replication_paths)
+    replication_paths = [str(tmp_path / "replication" / "01"), str(tmp_path / "replication" / "02")]
+    replicas = await replicate_backup(replication_backup_file, replication_paths)
+    with open(replication_backup_file, "rb") as f:
+        data = f.read()
+    assert sorted(replicas) == sorted(os.path.join(p, "backup.filename") for p in replication_paths)
+    for path in replication_paths:
+        with open(os.path.join(path, "backup.filename"), "rb") as f:
+            assert f.read() == data
+
+
+@pytest.mark.asyncio
+async def test_replicate_backup_replicates_dt_by_delta_when_enabled(mocker: MockerFixture, tmp_path):
+    """
+    `*.dt` backup is replicated by delta when BACKUP_DELTA_ENABLED is True
+    """
+    mocker.patch("conf.settings.BACKUP_DELTA_ENABLED", new_callable=PropertyMock(return_value=True))
+    replication_paths = [str(tmp_path / "replication" / "01")]
+    manifest = os.path.join(replication_paths[0], "backup.dt.manifest")
+    replicate_file_delta_mock = mocker.patch(
+        "core.delta.replicate_file_delta", return_value={replication_paths[0]: manifest}
+    )
+    replicate_file_mock = mocker.patch("core.replication.replicate_file")
+    replicas = await replicate_backup(str(tmp_path / "backup.dt"), replication_paths)
+    replicate_file_delta_mock.assert_awaited_once()
+    replicate_file_mock.assert_not_awaited()
+    assert replicas == [manifest]
 
 
 @pytest.mark.asyncio
@@ -44,8 +102,11 @@ async def test_replicate_backup_replicate_log_exception_when_failed(mocker: Mock
     """
     backup_file_path = "test/backup.filename"
     replication_paths = ["test/replication/path/01", "test/replication/path/02"]
-    mocker.patch("pathlib.Path")
-    mocker.patch("aioshutil.copyfile", side_effect=Exception)
+    mocker.patch("pathlib.Path.mkdir")
+    mocker.patch(
+        "core.replication.replicate_file",
+        return_value={os.path.join(p, "backup.filename"): OSError() for p in replication_paths},
+    )
     with caplog.at_level(logging.ERROR):
         await replicate_backup(backup_file_path, replication_paths)
     assert "Problems while replicating" in caplog.text
@@ -58,50 +119,116 @@ async def test_replicate_backup_does_nothing_when_empty_paths(mocker: MockerFixt
     """
     backup_file_path = "test/backup.filename"
     replication_paths = []
-    mocker.patch("pathlib.Path")
-    aiocopyfile_mock = mocker.patch("aioshutil.copyfile", return_value=AsyncMock())
+    replicate_file_mock = mocker.patch("core.replication.replicate_file")
     await replicate_backup(backup_file_path, replication_paths)
-    aiocopyfile_mock.assert_not_awaited()
+    replicate_file_mock.assert_not_awaited()
+
+
+def _create_backup_file(path, days_old: int):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"test")
+    mtime = (datetime.now() - timedelta(days=days_old)).timestamp()
+    os.utime(path, (mtime, mtime))
 
 
 @pytest.mark.asyncio
-async def test_rotate_backups_calls_old_file_remover(mocker: MockerFixture, infobase):
+async def test_rotate_backups_removes_old_backups(mocker: MockerFixture, tmp_path, infobases):
     """
-    Backup rotation calls `remove_old_files_by_pattern` function
+    Backup rotation removes old backups of every infobase and keeps new ones
     """
-    remove_old_mock = mocker.patch("core.utils.remove_old_files_by_pattern", return_value=AsyncMock())
-    await rotate_backups(infobase)
-    remove_old_mock.assert_awaited()
+    mocker.patch("conf.settings.BACKUP_PATH", new_callable=PropertyMock(return_value=str(tmp_path)))
+    retention_days = settings.BACKUP_RETENTION_DAYS
+    for ib in infobases:
+        _create_backup_file(tmp_path / f"{ib}_old.dt", retention_days + 1)
+        _create_backup_file(tmp_path / f"{ib}_new.dt", 0)
+    await rotate_backups(infobases)
+    assert sorted(os.listdir(tmp_path)) == sorted(f"{ib}_new.dt" for ib in infobases)
 
 
 @pytest.mark.asyncio
-async def test_rotate_backups_calls_old_file_remover_for_replication_paths(mocker: MockerFixture, infobase):
+async def test_rotate_backups_scans_every_path_once(mocker: MockerFixture, tmp_path, infobases):
     """
-    Backup rotation calls `remove_old_files_by_pattern` function for every replication path
+    Backup rotation scans backup path and every replication path once for all infobases
     """
-    replication_paths = ["test/replication/path/01", "test/replication/path/02"]
+    replication_paths = [str(tmp_path / "replication" / "01"), str(tmp_path / "replication" / "02")]
+    mocker.patch("conf.settings.BACKUP_PATH", new_callable=PropertyMock(return_value=str(tmp_path)))
     mocker.patch("conf.settings.BACKUP_REPLICATION", new_callable=PropertyMock(return_value=True))
     mocker.patch(
         "conf.settings.BACKUP_REPLICATION_PATHS",
         new_callable=PropertyMock(return_value=replication_paths),
     )
-    remove_old_mock = mocker.patch("core.utils.remove_old_files_by_pattern", return_value=AsyncMock())
-    await rotate_backups(infobase)
-    assert remove_old_mock.await_count == len(replication_paths) + 1  # plus one for initial backup place
+    for path in replication_paths:
+        _create_backup_file(pathlib.Path(path) / f"{infobases[0]}_old.dt", settings.BACKUP_RETENTION_DAYS + 1)
+    index_spy = mocker.spy(core_utils, "index_old_files_by_infobase")
+    await rotate_backups(infobases)
+    assert sorted(c.args[0] for c in index_spy.call_args_list) == sorted([str(tmp_path)] + replication_paths)
+    for path in replication_paths:
+        assert os.listdir(path) == []
+
+
+@pytest.mark.asyncio
+async def test_rotate_backups_removes_cataloged_and_uncataloged_backups(mocker: MockerFixture, tmp_path, infobase):
+    """
+    Backup rotation with catalog removes old backups found by catalog query and by scan,
+    and removes them from catalog
+    """
+    backup_path = tmp_path / "backup"
+    mocker.patch("conf.settings.BACKUP_PATH", new_callable=PropertyMock(return_value=str(backup_path)))
+    retention_days = settings.BACKUP_RETENTION_DAYS
+    # Replica in a path which is no longer configured
+    cataloged_backup = tmp_path / "old_replication" / f"{infobase}_cataloged.dt"
+    _create_backup_file(cataloged_backup, retention_days + 1)
+    uncataloged_backup = backup_path / f"{infobase}_uncataloged.dt"
+    _create_backup_file(uncataloged_backup, retention_days + 1)
+    backup_catalog = Mock()
+    backup_catalog.get_expired_files.return_value = [str(cataloged_backup)]
+    await rotate_backups([infobase], backup_catalog)
+    assert not cataloged_backup.exists()
+    assert not uncataloged_backup.exists()
+    assert sorted(backup_catalog.forget_files.call_args.args[0]) == sorted(
+        [str(cataloged_backup), str(uncataloged_backup)]
+    )
+
+
+@pytest.mark.asyncio
+async def test_rotate_backups_removes_backup_found_by_catalog_and_scan_once(mocker: MockerFixture, tmp_path, infobase):
+    """
+    Backup rotation removes backup found both by catalog query and by scan once
+    """
+    mocker.patch("conf.settings.BACKUP_PATH", new_callable=PropertyMock(return_value=str(tmp_path)))
+    old_backup = tmp_path / f"{infobase}_old.dt"
+    _create_backup_file(old_backup, settings.BACKUP_RETENTION_DAYS + 1)
+    backup_catalog = Mock()
+    backup_catalog.get_expired_files.return_value = [str(old_backup)]
+    remove_files_spy = mocker.spy(core_utils, "remove_files")
+    await rotate_backups([infobase], backup_catalog)
+    assert remove_files_spy.call_args.args[0] == [str(old_backup)]
+    assert not old_backup.exists()
 
 
 @pytest.mark.asyncio
-async def test_backup_v8_calls_execute_v8_command(mocker: MockerFixture, infobase, mock_get_1cv8_service_full_path):
+async def test_rotate_backups_skips_unavailable_path(mocker: MockerFixture, tmp_path, caplog, infobase):
+    """
+    Backup rotation logs error and continues when path can not be scanned
+    """
+    mocker.patch("conf.settings.BACKUP_PATH", new_callable=PropertyMock(return_value=str(tmp_path / "not_exists")))
+    with caplog.at_level(logging.ERROR):
+        await rotate_backups([infobase])
+    assert "Unable to scan" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_backup_v8_calls_execute_v8_command(mocker: MockerFixture, infobase, v8_backup_job):
     """
     Backup with 1cv8 tools calls `execute_v8_command`
     """
-    execute_v8_mock = mocker.patch("backup.execute_v8_command", return_value=AsyncMock())
-    await _backup_v8(infobase)
+    execute_v8_mock = mocker.patch("backup.execute_v8_command", new_callable=AsyncMock)
+    await _backup_v8(infobase, v8_backup_job)
     execute_v8_mock.assert_awaited()
 
 
 @pytest.mark.asyncio
-async def test_backup_v8_makes_retries(mocker: MockerFixture, infobase, mock_get_1cv8_service_full_path):
+async def test_backup_v8_makes_retries(mocker: MockerFixture, infobase, v8_backup_job):
     """
     Backup with 1cv8 tools makes retries according to retry policy
     """
@@ -111,79 +238,75 @@ async def test_backup_v8_makes_retries(mocker: MockerFixture, infobase, mock_get
         new_callable=PropertyMock(return_value=backup_retries),
     )
     execute_v8_mock = mocker.patch("backup.execute_v8_command", side_effect=V8Exception)
-    await _backup_v8(infobase)
+    await _backup_v8(infobase, v8_backup_job)
     assert execute_v8_mock.await_count == backup_retries + 1  # plus one for initial call
 
 
 @pytest.mark.asyncio
 async def test_backup_v8_return_backup_result_type_object_when_succeeded(
-    mocker: MockerFixture, infobase, mock_get_1cv8_service_full_path
+    mocker: MockerFixture, infobase, v8_backup_job
 ):
     """
     Backup with 1cv8 tools returns object of type `InfoBaseBackupTaskResult` when succeeded
     """
-    mocker.patch("backup.execute_v8_command", return_value=AsyncMock())
-    result = await _backup_v8(infobase)
+    mocker.patch("backup.execute_v8_command", new_callable=AsyncMock)
+    result = await _backup_v8(infobase, v8_backup_job)
     assert isinstance(result, core_models.InfoBaseBackupTaskResult)
 
 
 @pytest.mark.asyncio
-async def test_backup_v8_return_backup_result_type_object_when_failed(
-    mocker: MockerFixture, infobase, mock_get_1cv8_service_full_path
-):
+async def test_backup_v8_return_backup_result_type_object_when_failed(mocker: MockerFixture, infobase, v8_backup_job):
     """
     Backup with 1cv8 tools returns object of type `InfoBaseBackupTaskResult` when failed
     """
     mocker.patch("backup.execute_v8_command", side_effect=V8Exception)
-    result = await _backup_v8(infobase)
+    result = await _backup_v8(infobase, v8_backup_job)
     assert isinstance(result, core_models.InfoBaseBackupTaskResult)
 
 
 @pytest.mark.asyncio
 async def test_backup_v8_return_result_for_exact_infobase_when_succeeded(
-    mocker: MockerFixture, infobase, mock_get_1cv8_service_full_path
+    mocker: MockerFixture, infobase, v8_backup_job
 ):
     """
     Backup with 1cv8 tools returns object for exact infobase which was provided when succeeded
     """
-    mocker.patch("backup.execute_v8_command", return_value=AsyncMock())
-    result = await _backup_v8(infobase)
+    mocker.patch("backup.execute_v8_command", new_callable=AsyncMock)
+    result = await _backup_v8(infobase, v8_backup_job)
     assert result.infobase_name == infobase
 
 
 @pytest.mark.asyncio
 async def test_backup_v8_return_backup_result_succeeded_true_when_succeeded(
-    mocker: MockerFixture, infobase, mock_get_1cv8_service_full_path
+    mocker: MockerFixture, infobase, v8_backup_job
 ):
     """
     Backup with 1cv8 tools returns object with succeeded is True when succeeded
     """
-    mocker.patch("backup.execute_v8_command", return_value=AsyncMock())
-    result = await _backup_v8(infobase)
+    mocker.patch("backup.execute_v8_command", new_callable=AsyncMock)
+    result = await _backup_v8(infobase, v8_backup_job)
     assert result.succeeded is True
 
 
 @pytest.mark.asyncio
-async def test_backup_v8_return_result_for_exact_infobase_when_failed(
-    mocker: MockerFixture, infobase, mock_get_1cv8_service_full_path
-):
+async def test_backup_v8_return_result_for_exact_infobase_when_failed(mocker: MockerFixture, infobase, v8_backup_job):
     """
     Backup with 1cv8 tools returns object for exact infobase which was provided when faild
     """
     mocker.patch("backup.execute_v8_command", side_effect=V8Exception)
-    result = await _backup_v8(infobase)
+    result = await _backup_v8(infobase, v8_backup_job)
     assert result.infobase_name == infobase
 
 
 @pytest.mark.asyncio
 async def test_backup_v8_return_backup_result_succeeded_false_when_failed(
-    mocker: MockerFixture, infobase, mock_get_1cv8_service_full_path
+    mocker: MockerFixture, infobase, v8_backup_job
 ):
     """
     Backup with 1cv8 tools returns object with succeeded is False when failed
     """
     mocker.patch("backup.execute_v8_command", side_effect=V8Exception)
-    result = await _backup_v8(infobase)
+    result = await _backup_v8(infobase, v8_backup_job)
     assert result.succeeded is False
 
 
@@ -191,14 +314,14 @@ async def test_backup_v8_return_backup_result_succeeded_false_when_failed(
 async def test_backup_pgdump_calls_execute_subprocess_command(
     mocker: MockerFixture,
     infobase,
-    mock_prepare_postgres_connection_vars,
+    pgdump_backup_job,
     mock_get_postgres_version_16,
 ):
     """
     Backup with pgdump calls `execute_subprocess_command`
     """
-    execute_subprocess_mock = mocker.patch("backup.execute_subprocess_command", return_value=AsyncMock())
-    await _backup_pgdump(infobase, "", "", "")
+    execute_subprocess_mock = mocker.patch("backup.execute_subprocess_command", new_callable=AsyncMock)
+    await _backup_pgdump(pgdump_backup_job)
     execute_subprocess_mock.assert_awaited()
 
 
@@ -206,8 +329,7 @@ async def test_backup_pgdump_calls_execute_subprocess_command(
 async def test_backup_pgdump_makes_retries(
     mocker: MockerFixture,
     infobase,
-    mock_get_1cv8_service_full_path,
-    mock_prepare_postgres_connection_vars,
+    pgdump_backup_job,
     mock_get_postgres_version_16,
 ):
     """
@@ -219,7 +341,7 @@ async def test_backup_pgdump_makes_retries(
         new_callable=PropertyMock(return_value=backup_retries),
     )
     execute_subprocess_mock = mocker.patch("backup.execute_subprocess_command", side_effect=SubprocessException)
-    await _backup_pgdump(infobase, "", "", "")
+    await _backup_pgdump(pgdump_backup_job)
     assert execute_subprocess_mock.await_count == backup_retries + 1  # plus one for initial call
 
 
@@ -227,15 +349,14 @@ async def test_backup_pgdump_makes_retries(
 async def test_backup_pgdump_return_backup_result_type_object_when_succeeded(
     mocker: MockerFixture,
     infobase,
-    mock_get_1cv8_service_full_path,
-    mock_prepare_postgres_connection_vars,
+    pgdump_backup_job,
     mock_get_postgres_version_16,
 ):
     """
     Backup with pgdump returns object of type `InfoBaseBackupTaskResult` when succeeded
     """
-    mocker.patch("backup.execute_subprocess_command", return_value=AsyncMock())
-    result = await _backup_pgdump(infobase, "", "", "")
+    mocker.patch("backup.execute_subprocess_command", new_callable=AsyncMock)
+    result = await _backup_pgdump(pgdump_backup_job)
     assert isinstance(result, core_models.InfoBaseBackupTaskResult)
 
 
@@ -243,15 +364,14 @@ async def test_backup_pgdump_return_backup_result_type_object_when_succeeded(
 async def test_backup_pgdump_return_backup_result_type_object_when_failed(
     mocker: MockerFixture,
     infobase,
-    mock_get_1cv8_service_full_path,
-    mock_prepare_postgres_connection_vars,
+    pgdump_backup_job,
     mock_get_postgres_version_16,
 ):
     """
     Backup with pgdump returns object of type `InfoBaseBackupTaskResult` when failed
     """
     mocker.patch("backup.execute_subprocess_command", side_effect=SubprocessException)
-    result = await _backup_pgdump(infobase, "", "", "")
+    result = await _backup_pgdump(pgdump_backup_job)
     assert isinstance(result, core_models.InfoBaseBackupTaskResult)
 
 
@@ -259,15 +379,14 @@ async def test_backup_pgdump_return_backup_result_type_object_when_failed(
 async def test_backup_pgdump_return_backup_result_succeeded_true_when_succeeded(
     mocker: MockerFixture,
     infobase,
-    mock_get_1cv8_service_full_path,
-    mock_prepare_postgres_connection_vars,
+    pgdump_backup_job,
     mock_get_postgres_version_16,
 ):
     """
     Backup with pgdump returns object with succeeded is True when succeeded
     """
-    mocker.patch("backup.execute_subprocess_command", return_value=AsyncMock())
-    result = await _backup_pgdump(infobase, "", "", "")
+    mocker.patch("backup.execute_subprocess_command", new_callable=AsyncMock)
+    result = await _backup_pgdump(pgdump_backup_job)
     assert result.succeeded is True
 
 
@@ -275,15 +394,14 @@ async def test_backup_pgdump_return_backup_result_succeeded_true_when_succeeded(
 async def test_backup_pgdump_return_backup_result_succeeded_false_when_failed(
     mocker: MockerFixture,
     infobase,
-    mock_get_1cv8_service_full_path,
-    mock_prepare_postgres_connection_vars,
+    pgdump_backup_job,
     mock_get_postgres_version_16,
 ):
     """
     Backup with pgdump returns object with succeeded is False when failed
     """
     mocker.patch("backup.execute_subprocess_command", side_effect=SubprocessException)
-    result = await _backup_pgdump(infobase, "", "", "")
+    result = await _backup_pgdump(pgdump_backup_job)
     assert result.succeeded is False
 
 
@@ -291,15 +409,14 @@ async def test_backup_pgdump_return_backup_result_succeeded_false_when_failed(
 async def test_backup_pgdump_return_result_for_exact_infobase_when_succeeded(
     mocker: MockerFixture,
     infobase,
-    mock_get_1cv8_service_full_path,
-    mock_prepare_postgres_connection_vars,
+    pgdump_backup_job,
     mock_get_postgres_version_16,
 ):
     """
     Backup with pgdump returns object for exact infobase which was provided when succeeded
     """
-    mocker.patch("backup.execute_subprocess_command", return_value=AsyncMock())
-    result = await _backup_pgdump(infobase, "", "", "")
+    mocker.patch("backup.execute_subprocess_command", new_callable=AsyncMock)
+    result = await _backup_pgdump(pgdump_backup_job)
     assert result.infobase_name == infobase
 
 
@@ -307,15 +424,14 @@ async def test_backup_pgdump_return_result_for_exact_infobase_when_succeeded(
 async def test_backup_pgdump_return_result_for_exact_infobase_when_failed(
     mocker: MockerFixture,
     infobase,
-    mock_get_1cv8_service_full_path,
-    mock_prepare_postgres_connection_vars,
+    pgdump_backup_job,
     mock_get_postgres_version_16,
 ):
     """
     Backup with pgdump returns object for exact infobase which was provided when failed
     """
     mocker.patch("backup.execute_subprocess_command", side_effect=SubprocessException)
-    result = await _backup_pgdump(infobase, "", "", "")
+    result = await _backup_pgdump(pgdump_backup_job)
     assert result.infobase_name == infobase
 
 
@@ -323,179 +439,301 @@ async def test_backup_pgdump_return_result_for_exact_infobase_when_failed(
 async def test_backup_pgdump_return_negative_result_when_failed(
     mocker: MockerFixture,
     infobase,
-    mock_get_1cv8_service_full_path,
-    mock_prepare_postgres_connection_vars,
+    pgdump_backup_job,
     mock_get_postgres_version_16,
 ):
     """
     Backup with pgdump returns object with `succeeded == False` when failed
     """
     mocker.patch("backup.execute_subprocess_command", side_effect=SubprocessException)
-    result = await _backup_pgdump(infobase, "", "", "")
+    result = await _backup_pgdump(pgdump_backup_job)
     assert result.succeeded is False
 
 
 @pytest.mark.asyncio
-async def test_backup_pgdump_return_result_for_exact_infobase_when_failed_to_find_creds(
-    mocker: MockerFixture,
-    infobase,
+async def test_resolve_backup_job_returns_v8_job_by_default(
+    mocker: MockerFixture, mock_cluster_com_controller, infobase
 ):
     """
-    Backup with pgdump returns object for exact infobase which was provided when failed to find db credentials
+    `resolve_backup_job` returns job with infobase credentials and does not query cluster when BACKUP_PG is False
     """
-    mocker.patch("utils.postgres.prepare_postgres_connection_vars", side_effect=KeyError)
-    result = await _backup_pgdump(infobase, "", "", "")
-    assert result.infobase_name == infobase
+    mocker.patch("core.utils.get_info_base_credentials", return_value=("user", "pwd"))
+    job = await resolve_backup_job(infobase)
+    assert job == BackupJob(infobase, info_base_user="user", info_base_pwd="pwd")
+    mock_cluster_com_controller.return_value.aget_info_base.assert_not_awaited()
 
 
 @pytest.mark.asyncio
-async def test_backup_pgdump_return_negative_result_when_failed_to_find_creds(
-    mocker: MockerFixture,
-    infobase,
+async def test_resolve_backup_job_returns_v8_job_when_pgbackup_is_enabled_and_dbms_is_not_postgres(
+    mocker: MockerFixture, infobase, mock_cluster_mssql_infobase
 ):
     """
-    Backup with pgdump returns object with `succeeded == False` when failed to find db credentials
+    `resolve_backup_job` returns 1cv8 job if BACKUP_PG is True, but infobase DBMS is not postgres
     """
-    mocker.patch("utils.postgres.prepare_postgres_connection_vars", side_effect=KeyError)
-    result = await _backup_pgdump(infobase, "", "", "")
-    assert result.succeeded is False
+    mocker.patch("conf.settings.BACKUP_PG", new_callable=PropertyMock(return_value=True))
+    job = await resolve_backup_job(infobase)
+    assert job.use_pgdump is False
 
 
 @pytest.mark.asyncio
-async def test_backup_info_base_run_v8_backup(mocker: MockerFixture, mock_cluster_com_controller, infobase):
+async def test_resolve_backup_job_returns_pgdump_job_when_pgbackup_is_enabled_and_dbms_is_postgres(
+    mocker: MockerFixture, infobase, mock_cluster_postgres_infobase, mock_prepare_postgres_connection_vars
+):
     """
-    `_backup_info_base` calls `_backup_v8` by default
+    `resolve_backup_job` returns pg_dump job with connection parameters if BACKUP_PG is True, and DBMS is postgres
     """
-    com_func_wrapper_mock = mocker.patch("core.cluster.utils.com_func_wrapper")
-    await _backup_info_base(infobase)
-    com_func_wrapper_mock.assert_awaited_with(_backup_v8, infobase)
+    db_server, db_name, db_user = mock_cluster_postgres_infobase
+    db_host, db_port, db_pwd = mock_prepare_postgres_connection_vars
+    mocker.patch("conf.settings.BACKUP_PG", new_callable=PropertyMock(return_value=True))
+    job = await resolve_backup_job(infobase)
+    assert job == BackupJob(
+        infobase,
+        use_pgdump=True,
+        db_host=db_host,
+        db_port=db_port,
+        db_name=db_name,
+        db_user=db_user,
+        db_pwd=db_pwd,
+    )
 
 
 @pytest.mark.asyncio
-async def test_backup_info_base_run_v8_backup_when_pgbackup_is_enabled_and_dbms_is_not_postgres(
-    mocker: MockerFixture, infobase, mock_cluster_mssql_infobase
+async def test_preflight_backups_resolves_jobs_in_infobases_order(
+    mocker: MockerFixture, infobases, mock_get_1cv8_service_full_path
 ):
     """
-    `_backup_info_base` calls `_backup_v8` if BACKUP_PG is True, but infobase DBMS is not postgres
+    `preflight_backups` returns jobs in order of infobases with path to 1cv8 found once
     """
-    mocker.patch("conf.settings.BACKUP_PG", new_callable=PropertyMock(return_value=True))
-    com_func_wrapper_mock = mocker.patch("core.cluster.utils.com_func_wrapper")
-    await _backup_info_base(infobase)
-    com_func_wrapper_mock.assert_awaited_with(_backup_v8, infobase)
+    mocker.patch("core.utils.get_info_base_credentials", return_value=("user", "pwd"))
+    jobs, rejected = await preflight_backups(infobases)
+    assert [job.ib_name for job in jobs] == infobases
+    assert all(job.v8_service_path == "" for job in jobs)
+    assert rejected == []
+    mock_get_1cv8_service_full_path.assert_called_once()
 
 
 @pytest.mark.asyncio
-async def test_backup_info_base_run_pgdump_backup_when_pgbackup_is_enabled_and_dbms_is_postgres(
-    mocker: MockerFixture, infobase, mock_cluster_postgres_infobase
+async def test_preflight_backups_rejects_infobase_without_db_credentials(
+    mocker: MockerFixture, caplog, infobase, mock_cluster_postgres_infobase, mock_get_1cv8_service_full_path
 ):
     """
-    `_backup_info_base` calls `_backup_pgdump` if BACKUP_PG is True, and infobase DBMS is postgres
+    `preflight_backups` rejects infobase when failed to find db credentials
     """
-    db_server, db_name, db_user = mock_cluster_postgres_infobase
     mocker.patch("conf.settings.BACKUP_PG", new_callable=PropertyMock(return_value=True))
-    backup_pgdump_mock = mocker.patch("backup._backup_pgdump")
-    await _backup_info_base(infobase)
-    backup_pgdump_mock.assert_awaited_with(infobase, db_server, db_name, db_user)
+    mocker.patch("utils.postgres.prepare_postgres_connection_vars", side_effect=KeyError("password not found"))
+    with caplog.at_level(logging.ERROR):
+        jobs, rejected = await preflight_backups([infobase])
+    assert jobs == []
+    assert [(r.infobase_name, r.succeeded) for r in rejected] == [(infobase, False)]
+    assert f"<{infobase}> Backup rejected by preflight check" in caplog.text
 
 
 @pytest.mark.asyncio
-async def test_backup_info_base_returns_value_from_v8_backup(
-    mocker: MockerFixture, mock_cluster_com_controller, infobase
+async def test_preflight_backups_rejects_v8_jobs_when_1cv8_is_not_found(
+    mocker: MockerFixture, infobases, mock_prepare_postgres_connection_vars
 ):
+    """
+    `preflight_backups` rejects only 1cv8 jobs when path to 1cv8 can not be found
+    """
+    mocker.patch("core.utils.get_1cv8_service_full_path", side_effect=FileNotFoundError)
+
+    async def resolve_backup_job(ib_name):
+        return BackupJob(ib_name, use_pgdump=ib_name == infobases[0])
+
+    mocker.patch("backup.resolve_backup_job", side_effect=resolve_backup_job)
+    jobs, rejected = await preflight_backups(infobases)
+    assert [job.ib_name for job in jobs] == infobases[:1]
+    assert [r.infobase_name for r in rejected] == infobases[1:]
+
+
+@pytest.mark.asyncio
+async def test_backup_info_base_run_v8_backup(mocker: MockerFixture, v8_backup_job):
+    """
+    `_backup_info_base` calls `_backup_v8` for 1cv8 job
+    """
+    com_func_wrapper_mock = mocker.patch("core.cluster.utils.com_func_wrapper")
+    await _backup_info_base(v8_backup_job)
+    com_func_wrapper_mock.assert_awaited_with(_backup_v8, v8_backup_job.ib_name, job=v8_backup_job)
+
+
+@pytest.mark.asyncio
+async def test_backup_info_base_run_pgdump_backup(mocker: MockerFixture, pgdump_backup_job):
+    """
+    `_backup_info_base` calls `_backup_pgdump` for pg_dump job
+    """
+    backup_pgdump_mock = mocker.patch("backup._backup_pgdump")
+    await _backup_info_base(pgdump_backup_job)
+    backup_pgdump_mock.assert_awaited_with(pgdump_backup_job, s3c=None)
+
+
+@pytest.mark.asyncio
+async def test_backup_info_base_returns_value_from_v8_backup(mocker: MockerFixture, infobase, v8_backup_job):
     """
     `_backup_info_base` returns value from underlying `com_func_wrapper` function
     """
     value = core_models.InfoBaseBackupTaskResult(infobase, True, "")
     mocker.patch("core.cluster.utils.com_func_wrapper", return_value=value)
-    result = await _backup_info_base(infobase)
+    result = await _backup_info_base(v8_backup_job)
     assert result == value
 
 
 @pytest.mark.asyncio
-async def test_backup_info_base_returns_value_from_pgdump_backup(
-    mocker: MockerFixture, infobase, mock_cluster_postgres_infobase
-):
+async def test_backup_info_base_returns_value_from_pgdump_backup(mocker: MockerFixture, infobase, pgdump_backup_job):
     """
     `_backup_info_base` returns value from underlying `_backup_pgdump` function
     """
     value = core_models.InfoBaseBackupTaskResult(infobase, True, "")
-    mocker.patch("conf.settings.BACKUP_PG", new_callable=PropertyMock(return_value=True))
     mocker.patch("backup._backup_pgdump", return_value=value)
-    result = await _backup_info_base(infobase)
+    result = await _backup_info_base(pgdump_backup_job)
     assert result == value
 
 
 @pytest.mark.asyncio
-async def test_backup_info_calls_inner_func(mocker: MockerFixture, infobase):
+async def test_backup_info_calls_inner_func(mocker: MockerFixture, infobase, v8_backup_job):
     """
     `backup_info_base` calls inner backup function
     """
-    mocker.patch("backup.rotate_backups")
     inner_func_mock = mocker.patch("backup._backup_info_base")
-    await backup_info_base(infobase, asyncio.Semaphore(1))
-    inner_func_mock.assert_awaited_with(infobase)
+    await backup_info_base(v8_backup_job, asyncio.Semaphore(1))
+    inner_func_mock.assert_awaited_with(v8_backup_job, None)
+
+
+@pytest.mark.asyncio
+async def test_compress_info_base_compresses_backup_when_compression_is_enabled(mocker: MockerFixture, infobase):
+    """
+    `compress_info_base` replaces backup filename with compressed one when `BACKUP_COMPRESSION` is enabled
+    """
+    mocker.patch("conf.settings.BACKUP_COMPRESSION", new_callable=PropertyMock(return_value=True))
+    compression_result = core_models.BackupCompressionResult("test/backup.dt.zst", 100, 10, 1.0)
+    compress_backup_mock = mocker.patch("core.compression.compress_backup", return_value=compression_result)
+    backup_result = core_models.InfoBaseBackupTaskResult(infobase, True, "test/backup.dt")
+    result = await compress_info_base(backup_result, asyncio.Semaphore(1))
+    compress_backup_mock.assert_awaited_with(infobase, "test/backup.dt")
+    assert result.backup_filename == "test/backup.dt.zst"
+    assert result.compression is compression_result
+
+
+@pytest.mark.asyncio
+async def test_compress_info_base_does_not_compress_backup_by_default(mocker: MockerFixture, infobase):
+    """
+    `compress_info_base` does not compress backup when `BACKUP_COMPRESSION` is disabled
+    """
+    compress_backup_mock = mocker.patch("core.compression.compress_backup")
+    backup_result = core_models.InfoBaseBackupTaskResult(infobase, True, "test/backup.dt")
+    result = await compress_info_base(backup_result, asyncio.Semaphore(1))
+    compress_backup_mock.assert_not_awaited()
+    assert result.backup_filename == "test/backup.dt"
 
 
 @pytest.mark.asyncio
-async def test_backup_info_calls_rotate_backups(mocker: MockerFixture, infobase):
+async def test_compress_info_base_does_not_compress_failed_backup(mocker: MockerFixture, infobase):
     """
-    `backup_info_base` calls `rotate_backups`
+    `compress_info_base` does not compress backup if backup failed
     """
-    mocker.patch("backup._backup_info_base")
-    rotate_backups_mock = mocker.patch("backup.rotate_backups")
-    await backup_info_base(infobase, asyncio.Semaphore(1))
-    rotate_backups_mock.assert_awaited_with(infobase)
+    mocker.patch("conf.settings.BACKUP_COMPRESSION", new_callable=PropertyMock(return_value=True))
+    compress_backup_mock = mocker.patch("core.compression.compress_backup")
+    await compress_info_base(core_models.InfoBaseBackupTaskResult(infobase, False), asyncio.Semaphore(1))
+    compress_backup_mock.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_compress_info_base_does_not_compress_backup_streamed_to_s3(mocker: MockerFixture, infobase):
+    """
+    `compress_info_base` does not compress backup which was uploaded to S3 uncompressed during creation
+    """
+    mocker.patch("conf.settings.BACKUP_COMPRESSION", new_callable=PropertyMock(return_value=True))
+    compress_backup_mock = mocker.patch("core.compression.compress_backup")
+    backup_result = core_models.InfoBaseBackupTaskResult(
+        infobase, True, "test/backup.pgdump", aws_result=core_models.InfoBaseAWSUploadTaskResult(infobase, True)
+    )
+    result = await compress_info_base(backup_result, asyncio.Semaphore(1))
+    compress_backup_mock.assert_not_awaited()
+    assert result.backup_filename == "test/backup.pgdump"
+
+
+@pytest.mark.asyncio
+async def test_backup_info_base_does_not_compress_backup(mocker: MockerFixture, infobase, v8_backup_job):
+    """
+    `backup_info_base` does not compress backup, so backup semaphore is not held during compression
+    """
+    mocker.patch("conf.settings.BACKUP_COMPRESSION", new_callable=PropertyMock(return_value=True))
+    mocker.patch(
+        "backup._backup_info_base",
+        return_value=core_models.InfoBaseBackupTaskResult(infobase, True, "test/backup.dt"),
+    )
+    compress_backup_mock = mocker.patch("core.compression.compress_backup")
+    result = await backup_info_base(v8_backup_job, asyncio.Semaphore(1))
+    compress_backup_mock.assert_not_awaited()
+    assert result.backup_filename == "test/backup.dt"
+
+
+@pytest.mark.asyncio
+async def test_backup_and_compress_info_base_releases_backup_semaphore_before_compression(
+    mocker: MockerFixture, infobase, v8_backup_job
+):
+    """
+    `backup_and_compress_info_base` releases backup semaphore before backup is compressed
+    """
+    mocker.patch("conf.settings.BACKUP_COMPRESSION", new_callable=PropertyMock(return_value=True))
+    mocker.patch(
+        "backup._backup_info_base",
+        return_value=core_models.InfoBaseBackupTaskResult(infobase, True, "test/backup.dt"),
+    )
+    backup_semaphore = asyncio.Semaphore(1)
+    semaphore_locked = []
+
+    async def compress_backup(*args):
+        semaphore_locked.append(backup_semaphore.locked())
+
+    mocker.patch("core.compression.compress_backup", side_effect=compress_backup)
+    await backup_and_compress_info_base(v8_backup_job, backup_semaphore, asyncio.Semaphore(1))
+    assert semaphore_locked == [False]
 
 
 @pytest.mark.asyncio
 async def test_backup_info_dont_calls_replicate_backup_if_replication_is_enabled_and_backup_failed(
-    mocker: MockerFixture, infobase
+    mocker: MockerFixture, infobase, v8_backup_job
 ):
     """
     `backup_info_base` don't calls `replicate_backup` if BACKUP_REPLICATION is True and backup failed
     """
     value = core_models.InfoBaseBackupTaskResult(infobase, False)
-    mocker.patch("backup.rotate_backups")
     mocker.patch("backup._backup_info_base", return_value=value)
     mocker.patch("conf.settings.BACKUP_REPLICATION", new_callable=PropertyMock(return_value=True))
     replicate_backup_mock = mocker.patch("backup.replicate_backup")
-    await backup_info_base(infobase, asyncio.Semaphore(1))
+    await backup_info_base(v8_backup_job, asyncio.Semaphore(1))
     replicate_backup_mock.assert_not_awaited()
 
 
 @pytest.mark.asyncio
-async def test_backup_info_returns_value_from_inner_func(mocker: MockerFixture, infobase):
+async def test_backup_info_returns_value_from_inner_func(mocker: MockerFixture, infobase, v8_backup_job):
     """
     `backup_info_base` returns value from inner backup function
     """
     value = core_models.InfoBaseBackupTaskResult(infobase, True, "test/backup.path")
     mocker.patch("backup._backup_info_base", return_value=value)
-    mocker.patch("backup.rotate_backups")
-    result = await backup_info_base(infobase, asyncio.Semaphore(1))
+    result = await backup_info_base(v8_backup_job, asyncio.Semaphore(1))
     assert result == value
 
 
 @pytest.mark.asyncio
-async def test_backup_info_returns_false_result_if_inner_func_fails(mocker: MockerFixture, infobase):
+async def test_backup_info_returns_false_result_if_inner_func_fails(mocker: MockerFixture, infobase, v8_backup_job):
     """
     `backup_info_base` returns succeeded is False result if inner backup function fails
     """
     mocker.patch("backup._backup_info_base", side_effect=Exception)
-    mocker.patch("backup.rotate_backups")
-    result = await backup_info_base(infobase, asyncio.Semaphore(1))
+    result = await backup_info_base(v8_backup_job, asyncio.Semaphore(1))
     assert result.succeeded is False
 
 
 @pytest.mark.asyncio
-async def test_backup_info_returns_value_from_inner_func_if_rotate_backups_fails(mocker: MockerFixture, infobase):
+async def test_backup_info_base_measures_duration(mocker: MockerFixture, infobase, v8_backup_job):
     """
-    `backup_info_base` returns value from inner backup function if `rotate_backups` fails
+    `backup_info_base` sets backup duration to result
     """
-    value = core_models.InfoBaseBackupTaskResult(infobase, True, "test/backup.path")
-    mocker.patch("backup._backup_info_base", return_value=value)
-    mocker.patch("backup.rotate_backups", side_effect=Exception)
-    result = await backup_info_base(infobase, asyncio.Semaphore(1))
-    assert result == value
+    mocker.patch("backup._backup_info_base", return_value=core_models.InfoBaseBackupTaskResult(infobase, True))
+    result = await backup_info_base(v8_backup_job, asyncio.Semaphore(1))
+    assert result.duration is not None
 
 
 @pytest.mark.asyncio
@@ -507,10 +745,11 @@ async def test_replicate_info_base_calls_replicate_backup_if_replication_is_enab
     """
     backup_path = "test/backup.path"
     value = core_models.InfoBaseBackupTaskResult(infobase, True, backup_path)
-    replicate_backup_mock = mocker.patch("backup.replicate_backup")
+    replicate_backup_mock = mocker.patch("backup.replicate_backup", return_value=["test/replica.path"])
     mocker.patch("conf.settings.BACKUP_REPLICATION", new_callable=PropertyMock(return_value=True))
     await replicate_info_base(value, asyncio.Semaphore(1))
     replicate_backup_mock.assert_awaited_with(value.backup_filename, settings.BACKUP_REPLICATION_PATHS)
+    assert value.replicas == ["test/replica.path"]
 
 
 @pytest.mark.asyncio
@@ -526,6 +765,42 @@ async def test_replicate_info_base_logs_exception_if_replicate_backup_fails(mock
     assert "exception occurred in `replicate_backup`" in caplog.text
 
 
+def test_plan_backups_uses_durations_from_catalog(mocker: MockerFixture, infobases):
+    """
+    Backup schedule is planned with durations from backup catalog
+    """
+    backup_catalog = Mock()
+    backup_catalog.get_average_durations.return_value = {infobases[0]: 60, infobases[-1]: 3600}
+    schedule = plan_backups(infobases, backup_catalog)
+    assert schedule.infobases[0] == infobases[-1]
+
+
+def test_plan_backups_prefers_durations_from_history(mocker: MockerFixture, tmp_path, infobases):
+    """
+    Backup schedule is planned with durations from run history when it is enabled
+    """
+    mocker.patch("conf.settings.HISTORY_ENABLED", new_callable=PropertyMock(return_value=True))
+    mocker.patch("conf.settings.HISTORY_PATH", new_callable=PropertyMock(return_value=str(tmp_path / "h.sqlite3")))
+    with history.open_history() as run_history:
+        run_history.add_records(
+            [
+                history.RunRecord(infobases[0], history.PHASE_BACKUP, True, 60, None),
+                history.RunRecord(infobases[-1], history.PHASE_BACKUP, True, 3600, None),
+            ]
+        )
+    backup_catalog = Mock()
+    schedule = plan_backups(infobases, backup_catalog)
+    assert schedule.infobases[0] == infobases[-1]
+    backup_catalog.get_average_durations.assert_not_called()
+
+
+def test_plan_backups_keeps_order_without_catalog(infobases):
+    """
+    Infobases keep cluster order when backup catalog is not used
+    """
+    assert plan_backups(infobases).infobases == infobases
+
+
 def test_analyze_results_calls_backup_analyze(mocker: MockerFixture, infobases, mixed_backup_result):
     """
     `analyze_results` calls `analyze_backup_result` by default
@@ -723,6 +998,33 @@ def test_create_aws_upload_task_creates_proper_task(mocker: MockerFixture, infob
     mock_upload_infobase_to_s3.assert_called_once()
 
 
+def test_create_aws_upload_task_passes_shared_client(mocker: MockerFixture, infobase):
+    """
+    `create_aws_upload_task` passes shared S3 client to upload coro
+    """
+    semaphore = asyncio.Semaphore(1)
+    s3c = Mock()
+    value = core_models.InfoBaseBackupTaskResult(infobase, True, "test/backup.path")
+    mocker.patch("conf.settings.AWS_ENABLED", new_callable=PropertyMock(return_value=True))
+    mocker.patch("asyncio.create_task")
+    mock_upload_infobase_to_s3 = mocker.patch("core.aws.upload_infobase_to_s3")
+    create_aws_upload_task(value, semaphore, s3c)
+    mock_upload_infobase_to_s3.assert_called_once_with(infobase, "test/backup.path", semaphore, s3c)
+
+
+def test_create_aws_upload_task_does_not_create_task_if_already_uploaded(mocker: MockerFixture, infobase):
+    """
+    `create_aws_upload_task` does not create task if backup was uploaded to S3 while being created
+    """
+    semaphore = asyncio.Semaphore(1)
+    aws_result = core_models.InfoBaseAWSUploadTaskResult(infobase, True, 1000)
+    value = core_models.InfoBaseBackupTaskResult(infobase, True, "", aws_result=aws_result)
+    mocker.patch("conf.settings.AWS_ENABLED", new_callable=PropertyMock(return_value=True))
+    mock_create_task = mocker.patch("asyncio.create_task")
+    create_aws_upload_task(value, semaphore)
+    mock_create_task.assert_not_called()
+
+
 def test_create_backup_replication_task_does_not_create_task_if_replication_not_enabled(
     mocker: MockerFixture, infobase
 ):
@@ -763,3 +1065,220 @@ def test_create_backup_replication_task_creates_proper_task(mocker: MockerFixtur
     mock_replicate_info_base = mocker.patch("backup.replicate_info_base")
     create_backup_replication_task(value, semaphore)
     mock_replicate_info_base.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_backup_pgdump_uses_custom_format_by_default(
+    mocker: MockerFixture,
+    infobase,
+    pgdump_backup_job,
+    mock_get_postgres_version_16,
+):
+    """
+    Backup with pgdump uses custom format by default
+    """
+    execute_subprocess_mock = mocker.patch("backup.execute_subprocess_command", new_callable=AsyncMock)
+    result = await _backup_pgdump(pgdump_backup_job)
+    assert "--format=custom" in execute_subprocess_mock.call_args.args[1]
+    assert "--jobs" not in execute_subprocess_mock.call_args.args[1]
+    assert result.backup_filename.endswith(".pgdump")
+
+
+@pytest.mark.asyncio
+async def test_backup_pgdump_uses_directory_format_with_jobs(
+    mocker: MockerFixture,
+    infobase,
+    pgdump_backup_job,
+    mock_get_postgres_version_16,
+):
+    """
+    Backup with pgdump in directory format runs pg_dump with jobs and packs directory to tar file
+    """
+    mocker.patch("conf.settings.BACKUP_PG_FORMAT", new_callable=PropertyMock(return_value="directory"))
+    mocker.patch("conf.settings.BACKUP_PG_JOBS", new_callable=PropertyMock(return_value=3))
+    mocker.patch("conf.settings.BACKUP_PG_JOBS_BUDGET", new_callable=PropertyMock(return_value=8))
+    execute_subprocess_mock = mocker.patch("backup.execute_subprocess_command", new_callable=AsyncMock)
+    pack_directory_mock = mocker.patch("backup._pack_directory")
+    result = await _backup_pgdump(pgdump_backup_job)
+    assert "--format=directory --jobs=3" in execute_subprocess_mock.call_args.args[1]
+    pack_directory_mock.assert_called_once()
+    assert result.backup_filename.endswith(".pgdump.tar")
+
+
+@pytest.mark.asyncio
+async def test_backup_pgdump_shares_jobs_budget(
+    mocker: MockerFixture,
+    infobases,
+    pgdump_backup_job,
+    mock_get_postgres_version_16,
+):
+    """
+    Concurrent backups with pgdump in directory format share jobs budget
+    """
+    mocker.patch("conf.settings.BACKUP_PG_FORMAT", new_callable=PropertyMock(return_value="directory"))
+    mocker.patch("conf.settings.BACKUP_PG_JOBS", new_callable=PropertyMock(return_value=3))
+    mocker.patch("conf.settings.BACKUP_PG_JOBS_BUDGET", new_callable=PropertyMock(return_value=4))
+    mocker.patch("backup._pack_directory")
+    in_use = 0
+    max_in_use = 0
+
+    async def execute_subprocess_command(ib_name, command, *args, **kwargs):
+        nonlocal in_use, max_in_use
+        jobs = int(command.split("--jobs=")[1].split()[0])
+        in_use += jobs
+        max_in_use = max(max_in_use, in_use)
+        await asyncio.sleep(0.01)
+        in_use -= jobs
+
+    mocker.patch("backup.execute_subprocess_command", side_effect=execute_subprocess_command)
+    await asyncio.gather(*[_backup_pgdump(pgdump_backup_job._replace(ib_name=ib)) for ib in infobases])
+    assert max_in_use == 4
+
+
+@pytest.fixture
+def mock_pgdump_streaming(mocker: MockerFixture, infobase):
+    mocker.patch("conf.settings.BACKUP_PG_STREAM_TO_S3", new_callable=PropertyMock(return_value=True))
+    aws_result = core_models.InfoBaseAWSUploadTaskResult(infobase, True, 1000)
+    upload_stream_mock = mocker.patch("core.aws.upload_stream_to_s3", return_value=aws_result)
+
+    async def execute_subprocess_command_streaming(ib_name, command, log_filename, stdout_consumer, **kwargs):
+        return await stdout_consumer(Mock(), AsyncMock())
+
+    execute_streaming_mock = mocker.patch(
+        "backup.execute_subprocess_command_streaming", side_effect=execute_subprocess_command_streaming
+    )
+    return execute_streaming_mock, upload_stream_mock
+
+
+@pytest.mark.asyncio
+async def test_backup_pgdump_streams_output_to_s3(
+    mocker: MockerFixture,
+    infobase,
+    pgdump_backup_job,
+    mock_get_postgres_version_16,
+    mock_pgdump_streaming,
+):
+    """
+    Backup with pgdump streams pg_dump output to S3 when `BACKUP_PG_STREAM_TO_S3` is enabled and S3 client is passed
+    """
+    execute_streaming_mock, upload_stream_mock = mock_pgdump_streaming
+    execute_subprocess_mock = mocker.patch("backup.execute_subprocess_command")
+    s3c = Mock()
+    result = await _backup_pgdump(pgdump_backup_job, s3c=s3c)
+    execute_subprocess_mock.assert_not_awaited()
+    assert "--file=" not in execute_streaming_mock.call_args.args[1]
+    assert upload_stream_mock.call_args.args[3] is s3c
+    assert result.succeeded
+    assert result.aws_result is upload_stream_mock.return_value
+    assert result.backup_filename.endswith(".pgdump")
+
+
+@pytest.mark.asyncio
+async def test_backup_pgdump_streaming_does_not_keep_local_copy_when_disabled(
+    mocker: MockerFixture,
+    infobase,
+    pgdump_backup_job,
+    mock_get_postgres_version_16,
+    mock_pgdump_streaming,
+):
+    """
+    Streamed backup is not written to disk when `BACKUP_PG_STREAM_KEEP_LOCAL` and replication are disabled
+    """
+    _, upload_stream_mock = mock_pgdump_streaming
+    mocker.patch("conf.settings.BACKUP_PG_STREAM_KEEP_LOCAL", new_callable=PropertyMock(return_value=False))
+    mocker.patch("conf.settings.BACKUP_REPLICATION", new_callable=PropertyMock(return_value=False))
+    result = await _backup_pgdump(pgdump_backup_job, s3c=Mock())
+    assert upload_stream_mock.call_args.args[4] is None
+    assert result.backup_filename == ""
+
+
+@pytest.mark.asyncio
+async def test_backup_pgdump_streaming_keeps_local_copy_for_replication(
+    mocker: MockerFixture,
+    infobase,
+    pgdump_backup_job,
+    mock_get_postgres_version_16,
+    mock_pgdump_streaming,
+):
+    """
+    Streamed backup is written to disk when replication is enabled
+    """
+    _, upload_stream_mock = mock_pgdump_streaming
+    mocker.patch("conf.settings.BACKUP_PG_STREAM_KEEP_LOCAL", new_callable=PropertyMock(return_value=False))
+    mocker.patch("conf.settings.BACKUP_REPLICATION", new_callable=PropertyMock(return_value=True))
+    result = await _backup_pgdump(pgdump_backup_job, s3c=Mock())
+    assert upload_stream_mock.call_args.args[4] == result.backup_filename
+    assert result.backup_filename.endswith(".pgdump")
+
+
+@pytest.mark.asyncio
+async def test_backup_pgdump_streaming_makes_retries_when_upload_failed(
+    mocker: MockerFixture,
+    infobase,
+    pgdump_backup_job,
+    mock_get_postgres_version_16,
+    mock_pgdump_streaming,
+):
+    """
+    Streamed backup is retried according to retry policy when upload failed
+    """
+    execute_streaming_mock, upload_stream_mock = mock_pgdump_streaming
+    mocker.patch("conf.settings.BACKUP_RETRIES_PG", new_callable=PropertyMock(return_value=1))
+    upload_stream_mock.side_effect = ClientError({}, "UploadPart")
+    result = await _backup_pgdump(pgdump_backup_job, s3c=Mock())
+    assert execute_streaming_mock.await_count == 2
+    assert result.succeeded is False
+
+
+def test_pack_directory_creates_tar_and_removes_directory(tmp_path):
+    """
+    `_pack_directory` packs directory to tar file and removes directory
+    """
+    dump_path = tmp_path / "test_pgdump"
+    dump_path.mkdir()
+    (dump_path / "toc.dat").write_bytes(b"test")
+    archive_filename = tmp_path / "test.pgdump.tar"
+    _pack_directory(str(dump_path), str(archive_filename))
+    assert archive_filename.exists()
+    assert not dump_path.exists()
+
+
+@pytest.mark.asyncio
+async def test_record_to_catalog_records_backup_after_upload_and_replication(mocker: MockerFixture, infobase):
+    """
+    `record_to_catalog` records backup with upload result as soon as its upload and replication are finished
+    """
+    record_backup_mock = mocker.patch("core.catalog.record_backup", new_callable=AsyncMock, return_value=True)
+    backup_result = core_models.InfoBaseBackupTaskResult(infobase, True, "test/backup.dt")
+    aws_result = core_models.InfoBaseAWSUploadTaskResult(infobase, True, 1000)
+    replicated = asyncio.Event()
+
+    async def upload():
+        return aws_result
+
+    async def replicate():
+        await asyncio.sleep(0)
+        replicated.set()
+
+    backup_catalog = Mock()
+    recorded = await record_to_catalog(
+        backup_catalog, backup_result, asyncio.create_task(upload()), asyncio.create_task(replicate())
+    )
+    assert recorded is True
+    assert replicated.is_set()
+    record_backup_mock.assert_awaited_once_with(backup_catalog, backup_result, aws_result)
+
+
+@pytest.mark.asyncio
+async def test_record_to_catalog_records_backup_when_upload_failed_with_exception(mocker: MockerFixture, infobase):
+    """
+    `record_to_catalog` records backup without upload result when upload task raised exception
+    """
+    record_backup_mock = mocker.patch("core.catalog.record_backup", new_callable=AsyncMock, return_value=True)
+    backup_result = core_models.InfoBaseBackupTaskResult(infobase, True, "test/backup.dt")
+
+    async def upload():
+        raise ClientError(dict(), "PutObject")
+
+    await record_to_catalog(Mock(), backup_result, asyncio.create_task(upload()))
+    assert record_backup_mock.await_args.args[2] is None
@@ -13,7 +13,7 @@ from packaging.version import Version
 
 import core.models as core_models
 from conf import settings
-from core import utils
+from core import metrics, tracing, utils
 from core.analyze import analyze_update_result
 from core.cluster import utils as cluster_utils
 from core.process import execute_v8_command
@@ -134,8 +134,7 @@ async def _update_info_base(ib_name, dry=False):
     cci = cluster_utils.get_cluster_controller_class()()
     try:
         # Получает тип конфигурации и её версию
-        # TODO: подумать, как сделать получение метаданных асинхронным
-        metadata = cci.get_info_base_metadata(ib_name, info_base_user, info_base_pwd)
+        metadata = await cci.aget_info_base_metadata(ib_name, info_base_user, info_base_pwd)
     except pywintypes.com_error as e:
         # Если начало сеанса с информационной базой запрещено, то можно снять блокировку и попробывать ещё раз
         if e.excepinfo[5] == -2147467259:
@@ -191,7 +190,7 @@ async def _update_info_base(ib_name, dry=False):
                 # и продолжает только в случае, если ИБ обновилась.
                 previous_version = current_version
                 try:
-                    metadata = cci.get_info_base_metadata(ib_name, info_base_user, info_base_pwd)
+                    metadata = await cci.aget_info_base_metadata(ib_name, info_base_user, info_base_pwd)
                 except pywintypes.com_error as e:
                     raise e
                 current_version = get_version_from_string(metadata[1])
@@ -207,12 +206,17 @@ async def _update_info_base(ib_name, dry=False):
 
 
 async def update_info_base(ib_name: str, semaphore: asyncio.Semaphore) -> core_models.InfoBaseUpdateTaskResult:
-    async with semaphore:
-        try:
-            return await cluster_utils.com_func_wrapper(_update_info_base, ib_name)
-        except Exception:
-            log.exception(f"<{ib_name}> Unknown exception occurred in coroutine")
-            return core_models.InfoBaseUpdateTaskResult(ib_name, False)
+    with tracing.span("update", ib_name):
+        async with tracing.wait(semaphore) as waited:
+            try:
+                datetime_start = datetime.now()
+                result = await cluster_utils.com_func_wrapper(_update_info_base, ib_name)
+                result.duration = (datetime.now() - datetime_start).total_seconds()
+                result.wait_duration = waited.duration
+                return result
+            except Exception:
+                log.exception(f"<{ib_name}> Unknown exception occurred in coroutine")
+                return core_models.InfoBaseUpdateTaskResult(ib_name, False, wait_duration=waited.duration)
 
 
 def analyze_results(
@@ -225,8 +229,10 @@ def analyze_results(
 
 
 async def main():
+    tracing.start_tracing()
+    metrics.start_run(log_prefix)
     try:
-        info_bases = utils.get_info_bases()
+        info_bases = await utils.aget_info_bases()
         update_semaphore = initialize_semaphore(settings.UPDATE_CONCURRENCY, log_prefix, "update")
 
         update_datetime_start = datetime.now()
@@ -240,9 +246,15 @@ async def main():
             update_datetime_finish,
         )
 
+        cluster_utils.get_cluster_controller_class().log_statistics()
+
         log.info(f"<{log_prefix}> Done")
     except Exception:
         log.exception(f"<{log_prefix}> Unknown exception occured in main coroutine")
+    finally:
+        cluster_utils.get_cluster_controller_class().shutdown()
+        tracing.write_trace(log_prefix)
+        metrics.write_textfile()
 
 
 if __name__ == "__main__":
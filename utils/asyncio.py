@@ -1,7 +1,8 @@
 import asyncio
 import logging
 import sys
-from typing import Awaitable
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable
 
 log = logging.getLogger(__name__)
 
@@ -21,3 +22,43 @@ def initialize_semaphore(concurrency: int, log_prefix: str, log_suffix: str = No
     log_mixin = f" {log_suffix}" if log_suffix else ""
     log.info(f"<{log_prefix}> Asyncio semaphore initialized: {concurrency}{log_mixin} concurrency")
     return semaphore
+
+
+class JobsBudget:
+    """
+    Общий бюджет параллельных заданий, который распределяется между одновременно выполняемыми операциями.
+    Операция получает столько заданий, сколько запросила, но не больше, чем осталось в бюджете, и не меньше одного.
+    Если бюджет исчерпан, операция ожидает, пока другие операции не вернут свои задания
+    """
+
+    def __init__(self, total: int, log_prefix: str, log_suffix: str = None):
+        self.total = max(total, 1)
+        self.available = self.total
+        self._condition = asyncio.Condition()
+        log_mixin = f" {log_suffix}" if log_suffix else ""
+        log.info(f"<{log_prefix}> Jobs budget initialized: {self.total}{log_mixin} jobs")
+
+    async def acquire(self, jobs: int) -> int:
+        """
+        Получает задания из бюджета
+        :param jobs: желаемое количество заданий
+        :return: выделенное количество заданий
+        """
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.available > 0)
+            granted = max(min(jobs, self.available), 1)
+            self.available -= granted
+            return granted
+
+    async def release(self, jobs: int):
+        async with self._condition:
+            self.available += jobs
+            self._condition.notify_all()
+
+    @asynccontextmanager
+    async def reserve(self, jobs: int) -> AsyncIterator[int]:
+        granted = await self.acquire(jobs)
+        try:
+            yield granted
+        finally:
+            await self.release(granted)
@@ -2,9 +2,10 @@ import asyncio
 import sys
 from unittest.mock import AsyncMock
 
+import pytest
 from pytest_mock import MockerFixture
 
-from utils.asyncio import initialize_event_loop, initialize_semaphore
+from utils.asyncio import JobsBudget, initialize_event_loop, initialize_semaphore
 
 
 def test_initialize_event_loop(mocker: MockerFixture):
@@ -42,3 +43,61 @@ def test_initialize_creates_semaphore_with_required_concurrency(mocker: MockerFi
     mock_semaphore = mocker.patch("asyncio.Semaphore")
     initialize_semaphore(concurrency, log_prefix)
     mock_semaphore.assert_called_with(concurrency)
+
+
+@pytest.mark.asyncio
+async def test_jobs_budget_grants_requested_jobs_when_available():
+    """
+    `JobsBudget` grants requested jobs when budget has enough jobs
+    """
+    budget = JobsBudget(8, "test_prefix")
+    async with budget.reserve(3) as jobs:
+        assert jobs == 3
+        assert budget.available == 5
+    assert budget.available == 8
+
+
+@pytest.mark.asyncio
+async def test_jobs_budget_grants_rest_of_budget():
+    """
+    `JobsBudget` grants only jobs left in budget
+    """
+    budget = JobsBudget(4, "test_prefix")
+    first = await budget.acquire(3)
+    second = await budget.acquire(3)
+    assert (first, second) == (3, 1)
+
+
+@pytest.mark.asyncio
+async def test_jobs_budget_waits_when_exhausted():
+    """
+    `JobsBudget` waits for released jobs when budget is exhausted
+    """
+    budget = JobsBudget(2, "test_prefix")
+    await budget.acquire(2)
+    waiter = asyncio.create_task(budget.acquire(2))
+    await asyncio.sleep(0)
+    assert not waiter.done()
+    await budget.release(2)
+    assert await waiter == 2
+
+
+@pytest.mark.asyncio
+async def test_jobs_budget_never_exceeds_total():
+    """
+    Concurrent operations never use more jobs than budget total
+    """
+    budget = JobsBudget(5, "test_prefix")
+    in_use = 0
+    max_in_use = 0
+
+    async def operation():
+        nonlocal in_use, max_in_use
+        async with budget.reserve(3) as jobs:
+            in_use += jobs
+            max_in_use = max(max_in_use, in_use)
+            await asyncio.sleep(0.01)
+            in_use -= jobs
+
+    await asyncio.gather(*[operation() for _ in range(4)])
+    assert max_in_use == 5